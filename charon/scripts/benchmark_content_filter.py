@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the Charon content filter.
+
+This script fills a temporary content filter database with synthetic
+domains and measures how fast domains are looked up.
+
+Usage:
+    python scripts/benchmark_content_filter.py [--domains N] [--lookups N]
+"""
+
+import os
+import sys
+import time
+import random
+import logging
+import argparse
+import sqlite3
+import tempfile
+
+# Add the parent directory to the path to ensure imports work
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from charon.src.core.content_filter import ContentFilter
+
+
+def make_domains(count, seed=1):
+    """Generate synthetic exact and wildcard domains."""
+    rng = random.Random(seed)
+    tlds = ['com', 'net', 'org', 'io', 'de']
+    domains = []
+    for i in range(count):
+        name = f"host{i}.zone{rng.randrange(5000)}.{rng.choice(tlds)}"
+        domains.append('*.' + name if i % 10 == 0 else name)
+    return domains
+
+
+def make_queries(domains, count, seed=2):
+    """Generate lookups: a third blocked names, a third wildcard hits, a third misses."""
+    rng = random.Random(seed)
+    exact = [d for d in domains if not d.startswith('*.')]
+    wildcard = [d[2:] for d in domains if d.startswith('*.')]
+    queries = []
+    for i in range(count):
+        kind = i % 3
+        if kind == 0:
+            queries.append(rng.choice(exact))
+        elif kind == 1:
+            queries.append(f"cdn{i}.{rng.choice(wildcard)}")
+        else:
+            queries.append(f"www{i}.miss{rng.randrange(10000)}.example.com")
+    return queries
+
+
+def bench_lookups(content_filter, queries):
+    """Time is_domain_blocked over the queries; returns lookups per second."""
+    content_filter.is_domain_blocked(queries[0])  # load the index
+    is_domain_blocked = content_filter.is_domain_blocked
+    started = time.perf_counter()
+    for query in queries:
+        is_domain_blocked(query)
+    return len(queries) / (time.perf_counter() - started)
+
+
+class UnpooledContentFilter(ContentFilter):
+    """Content filter opening a new connection for every call, as before pooling."""
+
+    def _get_connection(self):
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        return sqlite3.connect(self.db_path)
+
+
+def bench_connections(temp_dir, domains, writes):
+    """Compare add_domain, get_categories and is_domain_blocked with and without pooling."""
+    queries = make_queries(domains, 100000)
+    for label, cls in (('per-call connections', UnpooledContentFilter), ('pooled connections', ContentFilter)):
+        content_filter = cls(os.path.join(temp_dir, f"{cls.__name__}.db"))
+        content_filter.import_blocklist((d + '\n' for d in domains), 'ads')
+
+        started = time.perf_counter()
+        for i in range(writes):
+            content_filter.add_domain(f"added{i}.example.com", 'ads')
+        add_rate = writes / (time.perf_counter() - started)
+
+        started = time.perf_counter()
+        for _ in range(writes):
+            content_filter.get_categories()
+        read_rate = writes / (time.perf_counter() - started)
+
+        print(f"{label}:")
+        print(f"  add_domain:        {add_rate:>12,.0f} calls/s")
+        print(f"  get_categories:    {read_rate:>12,.0f} calls/s")
+        print(f"  is_domain_blocked: {bench_lookups(content_filter, queries):>12,.0f} lookups/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the content filter')
+    parser.add_argument('--domains', type=int, default=200000, help='Number of blocked domains')
+    parser.add_argument('--lookups', type=int, default=1000000, help='Number of lookups to time')
+    parser.add_argument('--writes', type=int, default=2000,
+                        help='Number of add_domain and get_categories calls to time')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    domains = make_domains(args.domains)
+    queries = make_queries(domains, args.lookups)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        content_filter = ContentFilter(os.path.join(temp_dir, 'benchmark.db'))
+
+        started = time.perf_counter()
+        content_filter.import_blocklist((d + '\n' for d in domains), 'ads')
+        print(f"import_blocklist:  {args.domains / (time.perf_counter() - started):>12,.0f} domains/s")
+
+        started = time.perf_counter()
+        content_filter.reload_index()
+        print(f"reload_index:      {time.perf_counter() - started:>12.3f} s")
+
+        print(f"is_domain_blocked: {bench_lookups(content_filter, queries):>12,.0f} lookups/s")
+
+        started = time.perf_counter()
+        content_filter.build_snapshot()
+        size = sum(entry.stat().st_size for entry in os.scandir(content_filter.snapshot_path))
+        print(f"build_snapshot:    {time.perf_counter() - started:>12.3f} s ({size / 2**20:.1f} MiB)")
+
+        snapshot_filter = ContentFilter(content_filter.db_path, use_snapshot=True)
+        print(f"  (snapshot):      {bench_lookups(snapshot_filter, queries):>12,.0f} lookups/s")
+
+        # Names that are not blocked, the common case for DNS queries
+        misses = queries[2::3]
+        print(f"  (misses only):   {bench_lookups(snapshot_filter, misses):>12,.0f} lookups/s")
+        prefiltered = ContentFilter(content_filter.db_path, use_snapshot=True, prefilter_fp_rate=0.01)
+        print(f"  (+ prefilter):   {bench_lookups(prefiltered, misses):>12,.0f} lookups/s")
+        stats = prefiltered.get_prefilter_stats()
+        print(f"prefilter:         {stats['bytes'] / 2**20:>12.1f} MiB, "
+              f"{stats['false_positives'] / max(stats['hits'] + stats['misses'], 1):.2%} false positives")
+
+        # Toggling a category only swaps shards, whatever its size
+        started = time.perf_counter()
+        for enabled in (False, True) * 5:
+            content_filter.enable_category('ads', enabled)
+        print(f"enable_category:   {(time.perf_counter() - started) / 10 * 1000:>12.2f} ms")
+
+        bench_connections(temp_dir, domains[:20000], args.writes)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the Charon DNS sinkhole.
+
+This script measures how many queries per second the sinkhole answers
+without an upstream (blocked and cached names), both in-process and over
+UDP on the loopback interface.
+
+Usage:
+    python scripts/benchmark_dns_sinkhole.py [--domains N] [--queries N]
+"""
+
+import os
+import sys
+import time
+import struct
+import asyncio
+import logging
+import argparse
+import tempfile
+
+# Add the parent directory to the path to ensure imports work
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from charon.src.core.content_filter import ContentFilter
+from charon.src.core.dns_sinkhole import DNSSinkhole, parse_question
+
+
+def make_query(name, query_id):
+    """Build a recursive A query for a name."""
+    question = b''.join(bytes([len(label)]) + label.encode() for label in name.split('.')) + b'\x00'
+    return struct.pack('!HHHHHH', query_id, 0x0100, 1, 0, 0, 0) + question + b'\x00\x01\x00\x01'
+
+
+def make_answer(query):
+    """Build an upstream answer with one A record for a query."""
+    _, question_end = parse_question(query)
+    record = b'\xc0\x0c' + struct.pack('!HHIH', 1, 1, 3600, 4) + bytes([192, 0, 2, 1])
+    return query[:2] + struct.pack('!HHHHH', 0x8180, 1, 1, 0, 0) + query[12:question_end] + record
+
+
+async def bench_udp(sinkhole, queries, window=64):
+    """Send queries over UDP, keeping `window` in flight; returns queries per second."""
+    loop = asyncio.get_running_loop()
+    address = await sinkhole.start('127.0.0.1', 0)
+    done = asyncio.Event()
+    state = {'received': 0, 'sent': 0}
+
+    class Client(asyncio.DatagramProtocol):
+        def connection_made(self, transport):
+            self.transport = transport
+
+        def datagram_received(self, data, addr):
+            state['received'] += 1
+            if state['sent'] < len(queries):
+                self.transport.sendto(queries[state['sent']])
+                state['sent'] += 1
+            elif state['received'] == len(queries):
+                done.set()
+
+    transport, _ = await loop.create_datagram_endpoint(Client, remote_addr=address)
+    started = time.perf_counter()
+    for query in queries[:window]:
+        transport.sendto(query)
+        state['sent'] += 1
+    try:
+        await asyncio.wait_for(done.wait(), 60)
+    except asyncio.TimeoutError:
+        print(f"  (lost {len(queries) - state['received']} of {len(queries)} answers)")
+    elapsed = time.perf_counter() - started
+    transport.close()
+    await sinkhole.close()
+    return state['received'] / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the DNS sinkhole')
+    parser.add_argument('--domains', type=int, default=100000, help='Number of blocked domains')
+    parser.add_argument('--queries', type=int, default=200000, help='Number of queries to time')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    blocked = [f"ads{i}.tracker{i % 997}.com" for i in range(args.domains)]
+    allowed = [f"www{i}.example{i}.org" for i in range(1000)]
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        content_filter = ContentFilter(os.path.join(temp_dir, 'benchmark.db'))
+        content_filter.import_blocklist((d + '\n' for d in blocked), 'ads')
+
+        sinkhole = DNSSinkhole(content_filter, [('127.0.0.1', 9)])
+        # Fill the cache as if the allowed names had been forwarded
+        now = time.monotonic()
+        for name in allowed:
+            query = make_query(name, 0)
+            sinkhole.cache.put(parse_question(query)[0], make_answer(query), now)
+
+        queries = [make_query(blocked[i % len(blocked)] if i % 2 else allowed[i % len(allowed)], i & 0xFFFF)
+                   for i in range(args.queries)]
+        resolve_local = sinkhole.resolve_local
+        started = time.perf_counter()
+        for query in queries:
+            resolve_local(query)
+        print(f"resolve_local:     {len(queries) / (time.perf_counter() - started):>12,.0f} queries/s "
+              f"(half blocked, half cached)")
+
+        print(f"UDP round trips:   {asyncio.run(bench_udp(sinkhole, queries)):>12,.0f} queries/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the Charon firewall log ingestion.
+
+This script measures how many firewall log events per second reach the
+FirewallLog table of a fresh SQLite database, through the parser alone,
+through the batched ingestor, and, for comparison, through Database.add_log.
+
+Usage:
+    python scripts/benchmark_log_ingest.py [--events N] [--batch-size N]
+"""
+
+import os
+import sys
+import time
+import random
+import logging
+import argparse
+import tempfile
+
+# Add the parent directory to the path to ensure imports work
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from charon.src.core.log_ingest import LogIngestor, LogParser
+from charon.src.db.database import Database
+
+
+def make_lines(count, rate):
+    """Build kernel LOG lines with varying addresses, ports and actions, `rate` per second of log time."""
+    lines = []
+    for i in range(count):
+        action = random.choice(('DROP', 'ACCEPT', 'REJECT'))
+        second = i // rate
+        lines.append(
+            f"Oct 17 05:{second // 60 % 60:02d}:{second % 60:02d} gw kernel: [{i}.000000] charon:{i % 50 + 1} {action} "
+            f"IN=eth0 OUT= MAC=00:11:22:33:44:55 SRC=203.0.{i % 256}.{i % 200 + 1} DST=192.168.1.10 "
+            f"LEN=60 TOS=0x00 PREC=0x00 TTL=52 ID={i % 65536} DF PROTO=TCP SPT={1024 + i % 60000} "
+            f"DPT={random.choice((22, 80, 443))} WINDOW=64240 RES=0x00 SYN URGP=0")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the firewall log ingestion')
+    parser.add_argument('--events', type=int, default=500000, help='Number of log lines to ingest')
+    parser.add_argument('--rate', type=int, default=50000, help='Log lines per second of log time')
+    parser.add_argument('--batch-size', type=int, default=5000, help='Rows per insert transaction')
+    parser.add_argument('--single', type=int, default=2000, help='Number of lines for Database.add_log')
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    lines = make_lines(args.events, args.rate)
+
+    started = time.perf_counter()
+    log_parser = LogParser()
+    for line in lines:
+        log_parser.parse(line)
+    print(f"parse only:      {args.events / (time.perf_counter() - started):>10,.0f} events/s")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db = Database(f"sqlite:///{os.path.join(temp_dir, 'logs.db')}")
+        db.connect()
+        db.create_tables()
+
+        ingestor = LogIngestor(db.connection_string, batch_size=args.batch_size)
+        ingestor.start()
+        started = time.perf_counter()
+        for i in range(0, len(lines), 1000):
+            ingestor.submit(lines[i:i + 1000], block=True)
+        ingestor.stop()
+        elapsed = time.perf_counter() - started
+        stats = ingestor.stats()
+        print(f"batched ingest:  {stats['inserted'] / elapsed:>10,.0f} events/s "
+              f"({stats['batches']} batches, {stats['dropped']} dropped)")
+
+        rows = [LogParser().parse(line) for line in lines[:args.single]]
+        started = time.perf_counter()
+        for row in rows:
+            db.add_log(row)
+        print(f"Database.add_log:{args.single / (time.perf_counter() - started):>10,.0f} events/s")
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the Charon firewall rule analyzer.
+
+This script measures how long RuleAnalyzer.report() takes on a large random
+ruleset, the way the rules page and /api/v1/rules/analysis run it. Rules
+are spread over the input and forward chains, 30% leave the addresses and
+40% the ports unrestricted, which makes many rules overlap.
+
+Usage:
+    python scripts/benchmark_rule_analyzer.py [--rules N] [--networks] [--seed N] [--repeat N]
+"""
+
+import os
+import sys
+import time
+import random
+import logging
+import argparse
+from types import SimpleNamespace
+
+# Add the parent directory to the path to ensure imports work
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from charon.src.core.rule_analyzer import RuleAnalyzer
+
+
+def make_rules(count, networks):
+    """Build random FirewallRule-like rows, with /8 to /32 networks if `networks`, else single hosts."""
+    def address():
+        if random.random() < 0.3:
+            return None
+        prefix = random.choice((8, 16, 24, 32)) if networks else 32
+        value = random.getrandbits(32) >> (32 - prefix) << (32 - prefix)
+        return f"{value >> 24}.{value >> 16 & 255}.{value >> 8 & 255}.{value & 255}/{prefix}"
+
+    def port():
+        if random.random() < 0.4:
+            return None
+        start = random.randint(1, 65000)
+        return f"{start}-{start + random.randint(0, 500)}" if random.random() < 0.3 else str(start)
+
+    return [SimpleNamespace(id=rule_id, chain=random.choice(('input', 'forward')),
+                            action=random.choice(('accept', 'drop')),
+                            protocol=random.choice(('tcp', 'udp', None)),
+                            src_ip=address(), dst_ip=address(), src_port=port(), dst_port=port(),
+                            enabled=True, description=None)
+            for rule_id in range(1, count + 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the firewall rule analyzer')
+    parser.add_argument('--rules', type=int, default=50000, help='Number of rules to analyze')
+    parser.add_argument('--networks', action='store_true', help='Use /8 to /32 networks instead of hosts')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random ruleset')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of runs, the fastest is reported')
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    random.seed(args.seed)
+    rules = make_rules(args.rules, args.networks)
+
+    timings = []
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        report = RuleAnalyzer().report(rules)
+        timings.append(time.perf_counter() - started)
+
+    print(f"rules:      {report['rules']:>10,}")
+    print(f"shadowed:   {len(report['shadowed']):>10,}")
+    print(f"redundant:  {len(report['redundant']):>10,}")
+    print(f"correlated: {len(report['correlated']):>10,}")
+    print(f"analysis:   {min(timings):>10.3f} s (fastest of {args.repeat}, slowest {max(timings):.3f} s)")
+
+
+if __name__ == '__main__':
+    main()
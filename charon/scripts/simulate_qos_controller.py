@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Simulation of the Charon adaptive QoS bandwidth controller.
+
+This script replays a trace of link capacity and offered load against the
+rate controller and prints how the shaped rate, throughput and latency
+evolve. Without a trace file, a synthetic trace is used in which the link
+drops from 100 to 50 Mbps for a while and then recovers.
+
+A trace is a CSV file with the columns time (s), capacity (Mbps), offered
+(Mbps) and base_rtt (ms), one row per sample.
+
+Usage:
+    python scripts/simulate_qos_controller.py [--trace FILE] [--max-rate MBPS] [--buffer-ms MS]
+"""
+
+import os
+import sys
+import argparse
+
+# Add the parent directory to the path to ensure imports work
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from charon.src.core.qos_controller import LinkModel, RateController, load_trace, simulate
+
+
+def synthetic_trace(seconds=900):
+    """A saturated 100 Mbps link that drops to 50 Mbps between 120 s and 400 s."""
+    return [{"time": float(t), "capacity": 50.0 if 120 <= t < 400 else 100.0,
+             "offered": 200.0, "base_rtt": 10.0} for t in range(seconds)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate the adaptive QoS bandwidth controller')
+    parser.add_argument('--trace', help='CSV trace with time, capacity, offered and base_rtt columns')
+    parser.add_argument('--max-rate', type=float, default=95.0, help='Highest shaped rate in Mbps')
+    parser.add_argument('--min-rate', type=float, default=5.0, help='Lowest shaped rate in Mbps')
+    parser.add_argument('--buffer-ms', type=float, default=500.0, help='Bottleneck buffer in milliseconds')
+    parser.add_argument('--every', type=int, default=30, help='Print every Nth sample')
+    args = parser.parse_args()
+
+    trace = load_trace(args.trace) if args.trace else synthetic_trace()
+    controller = RateController(args.max_rate, args.min_rate, args.max_rate)
+    results = simulate(controller, trace, LinkModel(args.buffer_ms))
+
+    print(f"{'time':>8} {'capacity':>9} {'rate':>8} {'throughput':>11} {'rtt':>8}")
+    for row, result in list(zip(trace, results))[::args.every]:
+        print(f"{result['time']:>8.0f} {row['capacity']:>9.1f} {result['rate']:>8.1f} "
+              f"{result['throughput']:>11.1f} {result['rtt']:>8.1f}")
+
+    utilization = sum(r['throughput'] for r in results) / sum(row['capacity'] for row in trace)
+    bloated = sum(1 for row, r in zip(trace, results) if r['rtt'] - row['base_rtt'] > controller.bloat_threshold)
+    print(f"\nrate changes: {controller.changes}, link utilization: {utilization:.1%}, "
+          f"bloated samples: {bloated} of {len(results)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -10,15 +10,21 @@ import os
 import json
 import hashlib
 import time
+import datetime
 from typing import Dict, List, Optional, Any, Tuple
 import jwt
 from flask import Flask, request, jsonify, g
 from functools import wraps
 
 from ..db.database import Database
+from ..db.log_store import ROLLUP_DIMENSIONS, ROLLUPS, decode_cursor
 from ..core.packet_filter import PacketFilter
+from ..core.ruleset_compiler import RulesetCompiler
+from ..core.rule_analyzer import shared_analysis
 from ..core.content_filter import ContentFilter
 from ..core.qos import QoS
+from ..core.qos_profiles import PROFILES, list_profiles
+from ..core.qos_stats import RESOLUTION_COARSE, RESOLUTION_FINE, QoSStatsCollector, shared_collector
 from ..scheduler.firewall_scheduler import FirewallScheduler
 from ..plugins.plugin_manager import PluginManager
 
@@ -179,6 +185,34 @@ def init_firewall():
         
     return g.firewall_components
 
+# Interface whose QoS statistics are collected, detected on first use
+qos_interface = None
+
+def get_qos_stats() -> QoSStatsCollector:
+    """Get the background collector of QoS class statistics, started on first use."""
+    global qos_interface
+    if qos_interface is None:
+        qos_interface = os.environ.get('CHARON_QOS_INTERFACE') or QoS().interface
+    return shared_collector(qos_interface)
+
+def sync_ruleset(components: Dict[str, Any]) -> bool:
+    """Apply the database rules to the firewall, changing only what differs."""
+    try:
+        success, _ = RulesetCompiler(optimize=True).sync(components['packet_filter'], components['db'].get_rules())
+        return success
+    except Exception as e:
+        logger.error(f"Error synchronizing firewall rules: {e}")
+        return False
+
+def _row_to_dict(row: Any) -> Dict[str, Any]:
+    """Convert a database row (a model object or a log row) to a JSON object."""
+    if hasattr(row, '_mapping'):
+        data = dict(row._mapping)
+    else:
+        data = {column.name: getattr(row, column.name) for column in row.__table__.columns}
+    return {key: value.isoformat() if isinstance(value, datetime.datetime) else value
+            for key, value in data.items()}
+
 # API routes
 @app.route('/api/v1/auth/token', methods=['POST'])
 @require_api_key
@@ -230,10 +264,19 @@ def get_rules():
             filter_criteria['action'] = request.args.get('action')
         if request.args.get('enabled') in ['true', 'false']:
             filter_criteria['enabled'] = request.args.get('enabled') == 'true'
+        
+        # Pages continue after the cursor returned with the previous one
+        if 'limit' in request.args or 'cursor' in request.args:
+            cursor = request.args.get('cursor')
+            if cursor and not cursor.isdigit():
+                return jsonify({'error': f"Invalid cursor: {cursor}"}), 400
+            rules, next_cursor = db.get_rules_page(filter_criteria, limit=request.args.get('limit', 100, type=int),
+                                                   cursor=cursor)
+            return jsonify({'rules': [_row_to_dict(rule) for rule in rules], 'next_cursor': next_cursor})
             
         rules = db.get_rules(filter_criteria)
         
-        return jsonify({'rules': rules})
+        return jsonify({'rules': [_row_to_dict(rule) for rule in rules]})
     except Exception as e:
         logger.error(f"Error getting firewall rules: {e}")
         return jsonify({'error': str(e)}), 500
@@ -246,7 +289,6 @@ def add_rule():
         # Initialize firewall components
         components = init_firewall()
         db = components['db']
-        packet_filter = components['packet_filter']
         
         # Get rule data from request
         rule_data = request.json
@@ -264,29 +306,27 @@ def add_rule():
             return jsonify({'error': "Failed to add rule to database"}), 500
             
         # Apply rule to firewall
-        chain = rule_data.get('chain')
-        action = rule_data.get('action')
-        protocol = rule_data.get('protocol')
-        src_ip = rule_data.get('src_ip')
-        dst_ip = rule_data.get('dst_ip')
-        src_port = rule_data.get('src_port')
-        dst_port = rule_data.get('dst_port')
-        
-        packet_filter.add_rule(
-            chain=chain,
-            action=action,
-            protocol=protocol,
-            src_ip=src_ip,
-            dst_ip=dst_ip,
-            src_port=src_port,
-            dst_port=dst_port
-        )
+        sync_ruleset(components)
         
         return jsonify({'success': True, 'id': rule_id})
     except Exception as e:
         logger.error(f"Error adding firewall rule: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/v1/rules/analysis', methods=['GET'])
+@require_auth_token
+def analyze_rules():
+    """Find shadowed, redundant and correlated firewall rules."""
+    try:
+        # Initialize firewall components
+        components = init_firewall()
+        db = components['db']
+
+        return jsonify(shared_analysis.report(db))
+    except Exception as e:
+        logger.error(f"Error analyzing firewall rules: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/v1/rules/<int:rule_id>', methods=['GET'])
 @require_auth_token
 def get_rule(rule_id):
@@ -315,7 +355,6 @@ def update_rule(rule_id):
         # Initialize firewall components
         components = init_firewall()
         db = components['db']
-        packet_filter = components['packet_filter']
         
         # Get rule data from request
         rule_data = request.json
@@ -326,7 +365,8 @@ def update_rule(rule_id):
         if not success:
             return jsonify({'error': f"Rule not found: {rule_id}"}), 404
             
-        # In a real application, you would update the rule in the firewall
+        # Replace the changed rule in the firewall
+        sync_ruleset(components)
         
         return jsonify({'success': True})
     except Exception as e:
@@ -341,7 +381,6 @@ def delete_rule(rule_id):
         # Initialize firewall components
         components = init_firewall()
         db = components['db']
-        packet_filter = components['packet_filter']
         
         # Get the rule before deleting it
         rules = db.get_rules({'id': rule_id})
@@ -355,7 +394,8 @@ def delete_rule(rule_id):
         if not success:
             return jsonify({'error': f"Failed to delete rule: {rule_id}"}), 500
             
-        # In a real application, you would delete the rule from the firewall
+        # Delete the rule from the firewall
+        sync_ruleset(components)
         
         return jsonify({'success': True})
     except Exception as e:
@@ -365,30 +405,75 @@ def delete_rule(rule_id):
 @app.route('/api/v1/logs', methods=['GET'])
 @require_auth_token
 def get_logs():
-    """Get firewall logs."""
+    """Get firewall logs, from the database and then the log archive."""
     try:
         # Initialize firewall components
         components = init_firewall()
         db = components['db']
         
-        # Get logs from database
+        # Get logs from database, continuing after the cursor of the previous page
         limit = int(request.args.get('limit', 100))
+        cursor = request.args.get('cursor')
+        try:
+            if cursor:
+                decode_cursor(cursor)
+            since = datetime.datetime.fromisoformat(request.args['since']) if request.args.get('since') else None
+            until = datetime.datetime.fromisoformat(request.args['until']) if request.args.get('until') else None
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         filter_criteria = {}
-        if request.args.get('action'):
-            filter_criteria['action'] = request.args.get('action')
-        if request.args.get('src_ip'):
-            filter_criteria['src_ip'] = request.args.get('src_ip')
-        if request.args.get('dst_ip'):
-            filter_criteria['dst_ip'] = request.args.get('dst_ip')
+        for name in ('action', 'protocol', 'src_ip', 'dst_ip', 'src_port', 'dst_port'):
+            if request.args.get(name):
+                filter_criteria[name] = request.args.get(name)
             
-        logs = db.get_logs(limit, filter_criteria)
+        logs, next_cursor = db.get_logs_page(filters=filter_criteria, limit=limit, cursor=cursor,
+                                             since=since, until=until)
         
-        return jsonify({'logs': logs})
+        return jsonify({'logs': [_row_to_dict(log) for log in logs], 'next_cursor': next_cursor})
     except Exception as e:
         logger.error(f"Error getting firewall logs: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/v1/logs/stats', methods=['GET'])
+@require_auth_token
+def get_log_stats():
+    """Get firewall log counts from the per-minute or per-hour rollups.
+    
+    Query parameters:
+        hours: Count the logs of this many past hours (default 24)
+        group_by: Comma-separated columns to count by (action, protocol, src_ip, dst_ip)
+        resolution: minute or hour (default)
+        by_bucket: Count per minute or hour instead of in total (true/false)
+        limit: Maximum number of groups
+        action, protocol, src_ip, dst_ip: Filter by these columns
+    """
+    try:
+        components = init_firewall()
+        db = components['db']
+        
+        resolution = request.args.get('resolution', 'hour')
+        if resolution not in ROLLUPS:
+            return jsonify({'error': f"Unknown resolution: {resolution}"}), 400
+        group_by = [name for name in request.args.get('group_by', 'action').split(',') if name]
+        unknown = [name for name in group_by if name not in ROLLUP_DIMENSIONS]
+        if unknown:
+            return jsonify({'error': f"Cannot group by: {', '.join(unknown)}"}), 400
+        
+        since = datetime.datetime.now() - datetime.timedelta(hours=request.args.get('hours', 24, type=float))
+        filters = {name: request.args[name] for name in ROLLUP_DIMENSIONS if name in request.args}
+        stats = db.get_log_stats(since=since, group_by=group_by, resolution=resolution, filters=filters,
+                                 by_bucket=request.args.get('by_bucket', 'false').lower() == 'true',
+                                 limit=request.args.get('limit', type=int))
+        for row in stats:
+            if 'bucket' in row:
+                row['bucket'] = row['bucket'].isoformat()
+        
+        return jsonify({'stats': stats})
+    except Exception as e:
+        logger.error(f"Error getting firewall log statistics: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/v1/content-filter/categories', methods=['GET'])
 @require_auth_token
 def get_categories():
@@ -458,6 +543,20 @@ def add_domain():
         logger.error(f"Error adding domain: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/v1/content-filter/prefilter', methods=['GET'])
+@require_auth_token
+def get_prefilter_stats():
+    """Get the Bloom filter counters saved by the processes doing lookups."""
+    try:
+        # Initialize firewall components
+        components = init_firewall()
+        content_filter = components['content_filter']
+        
+        return jsonify(content_filter.read_prefilter_stats())
+    except Exception as e:
+        logger.error(f"Error getting content filter prefilter statistics: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/v1/content-filter/apply', methods=['POST'])
 @require_auth_token
 @require_admin
@@ -483,14 +582,7 @@ def apply_content_filter():
 @require_auth_token
 def get_qos_profiles():
     """Get available QoS profiles."""
-    # This is a placeholder - in a real application, you would retrieve QoS profiles
-    return jsonify({
-        'profiles': [
-            {'id': 'default', 'name': 'Default Profile'},
-            {'id': 'gaming', 'name': 'Gaming Profile'},
-            {'id': 'streaming', 'name': 'Streaming Profile'}
-        ]
-    })
+    return jsonify({'profiles': list_profiles()})
 
 @app.route('/api/v1/qos/setup', methods=['POST'])
 @require_auth_token
@@ -506,13 +598,12 @@ def setup_qos():
         data = request.json
         profile = data.get('profile', 'default')
         
-        # Apply QoS profile
-        if profile == 'default':
-            success = qos.setup_default_profile()
-        else:
-            # In a real application, you would implement other profiles
+        if profile not in PROFILES:
             return jsonify({'error': f"Unknown profile: {profile}"}), 400
         
+        # Apply QoS profile; only the differences to the live setup are applied
+        success = qos.apply_profile(profile)
+        
         if not success:
             return jsonify({'error': f"Failed to apply QoS profile: {profile}"}), 500
             
@@ -521,6 +612,33 @@ def setup_qos():
         logger.error(f"Error setting up QoS: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/v1/qos/stats', methods=['GET'])
+@require_auth_token
+def get_qos_stats_route():
+    """Get live per-class QoS statistics from memory.
+    
+    Query parameters:
+        class: Also return the rate history of this class (e.g. 1:10)
+        resolution: History resolution, 1s (default) or 5m
+        since: Only return history rows at or after this Unix time
+    """
+    try:
+        collector = get_qos_stats()
+        result = {'interface': collector.interface, 'classes': collector.latest()}
+        
+        handle = request.args.get('class')
+        if handle:
+            resolution = request.args.get('resolution', RESOLUTION_FINE)
+            if resolution not in (RESOLUTION_FINE, RESOLUTION_COARSE):
+                return jsonify({'error': f"Unknown resolution: {resolution}"}), 400
+            since = request.args.get('since', type=float)
+            result['history'] = collector.history(handle, resolution, since)
+        
+        return jsonify(result)
+    except Exception as e:
+        logger.error(f"Error getting QoS statistics: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/v1/plugins', methods=['GET'])
 @require_auth_token
 def get_plugins():
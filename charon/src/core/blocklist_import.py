@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Blocklist Import Module for Charon Firewall
+
+This module parses public domain blocklists for the content filter. Three
+formats are understood, and may be mixed within one list:
+
+- hosts files: ``0.0.0.0 ads.example.com tracker.example.com``
+- AdBlock filters: ``||ads.example.com^`` (blocks the domain and its
+  subdomains; exceptions, cosmetic and path filters are skipped)
+- plain lists: one domain (or ``*.example.com`` wildcard) per line
+
+Lists are read line by line and normalized in batches, so memory use does
+not depend on the size of the list.
+"""
+
+import os
+import re
+from typing import BinaryIO, Iterable, Iterator, List, Optional, Set, TextIO, Tuple, Union
+
+BlocklistSource = Union[str, os.PathLike, TextIO, BinaryIO, Iterable[Union[str, bytes]]]
+
+DEFAULT_BATCH_SIZE = 10000
+
+DOMAIN_PATTERN = re.compile(r'^(\*\.)?(?:[a-z0-9_](?:[a-z0-9_-]{0,61}[a-z0-9_])?\.)+[a-z0-9-]{2,63}$')
+PROTOCOL_PATTERN = re.compile(r'^[a-z][a-z0-9+.-]*://')
+HOSTS_ADDRESS_PATTERN = re.compile(r'^(?:\d{1,3}(?:\.\d{1,3}){3}|[0-9a-f:]+:[0-9a-f:.%a-z]*)$')
+
+# Names found in the preamble of most hosts files that must never be blocked
+RESERVED_NAMES = frozenset((
+    "localhost", "localhost.localdomain", "local", "broadcasthost", "ip6-localhost",
+    "ip6-loopback", "ip6-localnet", "ip6-mcastprefix", "ip6-allnodes", "ip6-allrouters",
+    "ip6-allhosts", "0.0.0.0",
+))
+
+
+def normalize_domain(domain: str) -> str:
+    """Normalize a domain the way ContentFilter stores it.
+
+    The protocol, path and a leading "www." are removed and the name is
+    lowercased.
+    """
+    domain = PROTOCOL_PATTERN.sub('', domain.strip().lower())
+    domain = domain.split('/', 1)[0].rstrip('.')
+    if domain.startswith('www.'):
+        domain = domain[4:]
+    return domain
+
+
+def _line_domains(line: str) -> List[str]:
+    """Extract the domains named by one line of a blocklist."""
+    line = line.strip()
+    if not line or line[0] in '#!;[':
+        return []
+
+    if line.startswith('||'):
+        # AdBlock network filter: ||example.com^ or ||example.com^$options
+        rule = line[2:].split('$', 1)[0]
+        if rule.endswith('^') or rule.endswith('^|'):
+            rule = rule.rstrip('|')[:-1]
+        if not rule or any(char in rule for char in '/*^|'):
+            return []
+        return [rule, '*.' + rule]
+    if line.startswith('@@') or '##' in line or '#@#' in line or '#?#' in line:
+        return []
+
+    fields = line.split('#', 1)[0].split()
+    if not fields:
+        return []
+    if len(fields) > 1 and HOSTS_ADDRESS_PATTERN.match(fields[0].lower()):
+        # hosts file: address followed by one or more names
+        return fields[1:]
+    return fields[:1]
+
+
+def parse_lines(lines: Iterable[str]) -> Tuple[List[str], int]:
+    """Parse a batch of blocklist lines into normalized, unique domains.
+
+    Args:
+        lines: Raw lines of a blocklist in any supported format
+
+    Returns:
+        Tuple of the valid domains (first occurrence order) and the number
+        of names that were skipped as invalid or reserved
+    """
+    seen: Set[str] = set()
+    domains: List[str] = []
+    skipped = 0
+    for name in (normalize_domain(name) for line in lines for name in _line_domains(line)):
+        if name in seen:
+            continue
+        seen.add(name)
+        if name in RESERVED_NAMES or len(name) > 253 or not DOMAIN_PATTERN.match(name):
+            skipped += 1
+            continue
+        domains.append(name)
+    return domains, skipped
+
+
+def _open_lines(source: BlocklistSource) -> Tuple[Iterator[str], Optional[TextIO]]:
+    """Turn a path, stream or iterable into an iterator of text lines.
+
+    Returns:
+        Tuple of the line iterator and the file to close afterwards, if any
+    """
+    if isinstance(source, (str, os.PathLike)):
+        handle = open(source, 'r', encoding='utf-8', errors='replace')
+        return iter(handle), handle
+    # Binary streams (uploads, HTTP responses) yield bytes lines
+    return (line.decode('utf-8', 'replace') if isinstance(line, bytes) else line for line in source), None
+
+
+def iter_batches(source: BlocklistSource, batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[Tuple[List[str], int, int]]:
+    """Read a blocklist in batches.
+
+    Args:
+        source: A file path, a text or binary file object, or any iterable
+            of lines (str or bytes)
+        batch_size: Number of lines per batch
+
+    Yields:
+        Tuples of (domains, lines read, names skipped) for every batch
+    """
+    lines, handle = _open_lines(source)
+    try:
+        batch: List[str] = []
+        for line in lines:
+            batch.append(line)
+            if len(batch) >= batch_size:
+                domains, skipped = parse_lines(batch)
+                yield domains, len(batch), skipped
+                batch = []
+        if batch:
+            domains, skipped = parse_lines(batch)
+            yield domains, len(batch), skipped
+    finally:
+        if handle is not None:
+            handle.close()
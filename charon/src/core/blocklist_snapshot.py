@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Blocklist Snapshot Module for Charon Firewall
+
+This module stores the blocked domains of the enabled content filter
+categories in a compact, read-only file that processes memory-map for
+lookups. Every process maps the same file, so the operating system keeps a
+single copy of the block list in the page cache, however many web, API and
+DNS workers read it.
+
+File layout (native byte order, recorded in the header)::
+
+    header   magic "CHBL", version, byte order, key count, offsets position
+    keys     sorted keys, back to back
+    offsets  count + 1 unsigned 64-bit offsets of the keys
+
+A key is the domain with its labels reversed (``example.com`` becomes
+``com.example``) followed by a kind byte, 0x00 for an exact name and 0x01
+for a wildcard (``*.example.com``). Reversing the labels puts a domain next
+to its subdomains, so a name and the wildcards covering it are found by
+binary search over the offset table. Each process keeps every 256th key in
+a small list to narrow the search before touching the mapped pages.
+
+Snapshots are written to a temporary file and renamed over the previous
+one. Readers keep using the file they mapped, and pick up a new one with
+refresh(), so a rebuild never blocks or breaks a lookup.
+
+The content filter keeps one snapshot per category in a directory, next to
+a manifest naming the enabled categories (SnapshotShards). Enabling or
+disabling a category rewrites the manifest only, and a change to the
+domains of a category rewrites the snapshot of that category only.
+"""
+
+import bisect
+import logging
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import quote
+
+from .blocklist_import import normalize_domain
+
+logger = logging.getLogger('charon.blocklist_snapshot')
+
+MAGIC = b'CHBL'
+VERSION = 1
+HEADER = struct.Struct('=4sBBxxQQ')
+
+# Keys between two entries of the in-process fence list
+FENCE_STRIDE = 256
+
+EXACT = b'\x00'
+WILDCARD = b'\x01'
+
+# Names of the enabled categories, one per line, in a shard directory
+MANIFEST = 'enabled'
+
+
+def snapshot_key(domain: str) -> bytes:
+    """Get the sort key of a stored (normalized) domain or wildcard."""
+    if domain.startswith('*.'):
+        return '.'.join(reversed(domain[2:].split('.'))).encode() + WILDCARD
+    return '.'.join(reversed(domain.split('.'))).encode() + EXACT
+
+
+def write_snapshot(path: str, keys: Iterable[bytes]) -> int:
+    """Write a snapshot atomically.
+
+    Args:
+        path: Destination file; replaced by rename once complete
+        keys: Keys from snapshot_key() in ascending byte order; duplicates
+            are dropped
+
+    Returns:
+        int: The number of keys written
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix='.blocklist-', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, 0, 0, 0))
+            offsets = array('Q', [0])
+            position = 0
+            previous = None
+            for key in keys:
+                if key == previous:
+                    continue
+                if previous is not None and key < previous:
+                    raise ValueError("snapshot keys must be sorted")
+                f.write(key)
+                position += len(key)
+                offsets.append(position)
+                previous = key
+
+            # Align the offset table for the memoryview cast
+            padding = -(HEADER.size + position) % 8
+            f.write(b'\x00' * padding)
+            table = HEADER.size + position + padding
+            offsets.tofile(f)
+            f.seek(0)
+            byteorder = 1 if sys.byteorder == 'little' else 2
+            f.write(HEADER.pack(MAGIC, VERSION, byteorder, len(offsets) - 1, table))
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+        return len(offsets) - 1
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+
+
+class BlocklistSnapshot:
+    """Read-only, memory-mapped view of a blocklist snapshot file."""
+
+    def __init__(self, path: str):
+        """Map a snapshot file.
+
+        Raises:
+            OSError: If the file cannot be read
+            ValueError: If the file is not a valid snapshot
+        """
+        self.path = path
+        self._view = self._map(path)
+
+    @staticmethod
+    def _map(path: str) -> Tuple[mmap.mmap, memoryview, int, Tuple[int, int], List[bytes]]:
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, byteorder, count, table = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a blocklist snapshot")
+        if byteorder != (1 if sys.byteorder == 'little' else 2):
+            raise ValueError(f"{path} was written on a machine with a different byte order")
+        offsets = memoryview(data)[table:table + (count + 1) * 8].cast('Q')
+        base = HEADER.size
+        fence = [data[base + offsets[position]:base + offsets[position + 1]]
+                 for position in range(0, count, FENCE_STRIDE)]
+        return data, offsets, count, (stat.st_ino, stat.st_mtime_ns), fence
+
+    def __len__(self) -> int:
+        return self._view[2]
+
+    def refresh(self) -> bool:
+        """Map the snapshot file again if it was replaced since it was mapped.
+
+        Lookups running in other threads keep using the previous mapping,
+        which is unmapped once they no longer reference it.
+
+        Returns:
+            bool: True if a new snapshot was mapped
+        """
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return False
+        if (stat.st_ino, stat.st_mtime_ns) == self._view[3]:
+            return False
+        try:
+            self._view = self._map(self.path)
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to map blocklist snapshot {self.path}: {e}")
+            return False
+        return True
+
+    @staticmethod
+    def _contains(data: mmap.mmap, offsets: memoryview, count: int, fence: List[bytes], key: bytes) -> bool:
+        """Check whether the snapshot holds `key`."""
+        # The fence narrows the search to one stride of keys
+        stride = bisect.bisect_left(fence, key)
+        if stride < len(fence) and fence[stride] == key:
+            return True
+        lo = max(stride - 1, 0) * FENCE_STRIDE
+        hi = min(stride * FENCE_STRIDE, count)
+        base = HEADER.size
+        while lo < hi:
+            mid = (lo + hi) >> 1
+            if data[base + offsets[mid]:base + offsets[mid + 1]] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo < count and data[base + offsets[lo]:base + offsets[lo + 1]] == key
+
+    def is_blocked(self, domain: str, normalized: bool = False) -> bool:
+        """Check whether a domain is in the snapshot.
+
+        A name is blocked if it is listed, or one of its parent domains is
+        listed as a wildcard (``*.example.com`` blocks ``a.example.com``).
+
+        Args:
+            domain: The domain to check, normalized or not (e.g. a URL)
+            normalized: True if the caller already normalized the domain
+        """
+        if not normalized:
+            domain = normalize_domain(domain)
+        data, offsets, count, _, fence = self._view
+        if not count:
+            return False
+
+        reversed_name = '.'.join(reversed(domain.split('.'))).encode()
+        if self._contains(data, offsets, count, fence, reversed_name + EXACT):
+            return True
+        dot = reversed_name.rfind(b'.')
+        while dot > 0:
+            if self._contains(data, offsets, count, fence, reversed_name[:dot] + WILDCARD):
+                return True
+            dot = reversed_name.rfind(b'.', 0, dot)
+        return False
+
+    def domains(self) -> Iterable[str]:
+        """Iterate over the stored domains and wildcards in key order."""
+        data, offsets, count, _, _ = self._view
+        base = HEADER.size
+        for position in range(count):
+            key = data[base + offsets[position]:base + offsets[position + 1]]
+            name = '.'.join(reversed(key[:-1].decode().split('.')))
+            yield '*.' + name if key[-1:] == WILDCARD else name
+
+
+def open_snapshot(path: str) -> Optional[BlocklistSnapshot]:
+    """Map a snapshot file, or return None if it is missing or invalid."""
+    try:
+        return BlocklistSnapshot(path)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.error(f"Failed to map blocklist snapshot {path}: {e}")
+        return None
+
+
+def shard_path(directory: str, category: str) -> str:
+    """Get the snapshot file of a category in a shard directory."""
+    return os.path.join(directory, quote(category, safe='') + '.blocklist')
+
+
+def write_manifest(directory: str, categories: Iterable[str]) -> None:
+    """Write the names of the enabled categories atomically."""
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(prefix='.manifest-', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.writelines(category + '\n' for category in sorted(categories))
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, os.path.join(directory, MANIFEST))
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+
+
+class SnapshotShards:
+    """Memory-mapped snapshots of the enabled categories of a shard directory."""
+
+    def __init__(self, directory: str):
+        """Map the snapshots of the categories named in the manifest.
+
+        Raises:
+            OSError: If the manifest cannot be read
+        """
+        self.directory = directory
+        self.shards: Dict[str, BlocklistSnapshot] = {}
+        self._manifest: Optional[Tuple[int, int]] = None
+        self._active: Tuple[BlocklistSnapshot, ...] = ()
+        if not self.refresh() and self._manifest is None:
+            raise OSError(f"{directory} has no manifest")
+
+    def refresh(self) -> bool:
+        """Pick up a new manifest and snapshots rebuilt since the last refresh.
+
+        Returns:
+            bool: True if anything changed
+        """
+        path = os.path.join(self.directory, MANIFEST)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        changed = False
+        if (stat.st_ino, stat.st_mtime_ns) != self._manifest:
+            with open(path, encoding='utf-8') as f:
+                enabled = [line.rstrip('\n') for line in f if line.strip()]
+            shards = {}
+            for category in enabled:
+                shard = self.shards.get(category) or open_snapshot(shard_path(self.directory, category))
+                if shard is not None:
+                    shards[category] = shard
+            self.shards = shards
+            self._manifest = (stat.st_ino, stat.st_mtime_ns)
+            changed = True
+        for shard in self.shards.values():
+            changed |= shard.refresh()
+        if changed:
+            self._active = tuple(shard for shard in self.shards.values() if len(shard))
+        return changed
+
+    def is_blocked(self, domain: str, normalized: bool = False) -> bool:
+        """Check whether a domain is in the snapshot of an enabled category."""
+        if not normalized:
+            domain = normalize_domain(domain)
+        for shard in self._active:
+            if shard.is_blocked(domain, True):
+                return True
+        return False
+
+    def __len__(self) -> int:
+        return sum(len(shard) for shard in self._active)
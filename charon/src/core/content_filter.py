@@ -6,26 +6,52 @@ This module provides URL blocking and content filtering functionality.
 """
 
 import os
+import asyncio
 import logging
 import subprocess
 import re
 import platform
 import tempfile
-from typing import List, Dict, Optional, Set, Tuple, Union
+import threading
+import time
+from typing import Callable, Iterable, List, Dict, Optional, Set, Tuple, Union
 import sqlite3
 import ipaddress
+import json
+
+from .blocklist_import import DEFAULT_BATCH_SIZE, BlocklistSource, iter_batches, normalize_domain
+from .bloom_filter import BloomFilter
+from .blocklist_snapshot import SnapshotShards, shard_path, snapshot_key, write_manifest, write_snapshot
+from .domain_index import DomainIndex
+from .sqlite_pool import SQLitePool
 
 logger = logging.getLogger('charon.content_filter')
 
 class ContentFilter:
     """Content filtering for blocking unwanted websites and content."""
     
-    def __init__(self, db_path: Optional[str] = None):
+    # Seconds between checks for a snapshot or prefilter rebuilt by another process
+    REFRESH_INTERVAL = 1.0
+    
+    # Seconds a snapshot or Bloom filter change by add_domain or remove_domain
+    # waits for further changes before the files are rewritten
+    WRITE_DELAY = 1.0
+    
+    # Domains per element command when updating the blocked_domains set
+    NFT_ELEMENT_CHUNK = 1000
+    
+    def __init__(self, db_path: Optional[str] = None, use_snapshot: bool = False,
+                 prefilter_fp_rate: Optional[float] = None):
         """Initialize the content filter.
         
         Args:
             db_path: Path to the SQLite database for storing blocked domains.
                     If None, a platform-specific default path will be used.
+            use_snapshot: Answer lookups from the memory-mapped blocklist
+                    snapshot shared by all processes, instead of an index
+                    held in this process
+            prefilter_fp_rate: False-positive rate of the Bloom filter checked
+                    before every lookup, e.g. 0.01; None disables the filter
         """
         if db_path is None:
             # Use platform-specific default paths
@@ -37,11 +63,57 @@ class ContentFilter:
         else:
             self.db_path = db_path
             
+        # In-memory block list for lookups, built on first use
+        self._index: Optional[DomainIndex] = None
+        
+        # Memory-mapped block list shared between processes, one file per category
+        self.snapshot_path = os.path.splitext(self.db_path)[0] + '.blocklist.d'
+        self.use_snapshot = use_snapshot
+        self._snapshot: Optional[SnapshotShards] = None
+        self._snapshot_checked = 0.0
+        self._snapshot_lock = threading.Lock()
+        
+        # Categories whose snapshots, and domains whose Bloom filter keys,
+        # are written once WRITE_DELAY passes
+        self._pending_snapshots: Set[str] = set()
+        self._pending_prefilter: List[str] = []
+        self._pending_lock = threading.Lock()
+        self._pending_timer: Optional[threading.Timer] = None
+        
+        # Bloom filter rejecting most unblocked domains before a lookup
+        self.prefilter_path = os.path.splitext(self.db_path)[0] + '.bloom'
+        self.prefilter_fp_rate = prefilter_fp_rate
+        self._prefilter: Optional[BloomFilter] = None
+        self._prefilter_mtime: Optional[int] = None
+        self._prefilter_tlds = False
+        self._prefilter_checked = 0.0
+        self.prefilter_stats = {'hits': 0, 'misses': 0, 'false_positives': 0}
+        
+        # Counters saved by the processes that do lookups, one file per process
+        self.prefilter_stats_path = os.path.splitext(self.db_path)[0] + '.bloom-stats'
+        
+        # Pinned addresses of blocked domains, per nftables table
+        self._pinners: Dict[str, 'DomainPinner'] = {}
+        
+        # Domains last pushed to the nftables set, per table
+        self._nft_domains: Dict[str, Set[str]] = {}
+        
+        # Connections are kept per thread and reused by every call
+        self._pool = SQLitePool(self.db_path)
+        
         self._check_permissions()
         self._initialize_database()
-        # Create a connection for use in tests
-        self.conn = self._get_connection()
         
+    @property
+    def conn(self) -> Optional[sqlite3.Connection]:
+        """The database connection of the calling thread."""
+        return self._get_connection()
+    
+    def close(self) -> None:
+        """Write pending snapshot and Bloom filter changes and close the database connections of all threads."""
+        self.flush()
+        self._pool.close()
+    
     def _check_permissions(self) -> None:
         """Check if the current user has permissions to modify filter settings."""
         # Skip permission check on Windows as geteuid() is not available
@@ -70,11 +142,8 @@ class ContentFilter:
     def _initialize_database(self) -> None:
         """Initialize the SQLite database for storing block lists."""
         try:
-            # Ensure the directory exists
-            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
-            
             # Connect to the database and create tables if they don't exist
-            conn = sqlite3.connect(self.db_path)
+            conn = self._pool.connection()
             cursor = conn.cursor()
             
             # Create domains table
@@ -97,6 +166,13 @@ class ContentFilter:
                 )
             ''')
             
+            # Category lookups read the domains of a category from the index
+            # alone; domain lookups use the index of the UNIQUE constraint
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_domains_category
+                ON domains (category, domain)
+            ''')
+            
             # Add default categories if they don't exist
             default_categories = [
                 ("adult", "Adult content and pornography", 1),
@@ -112,7 +188,6 @@ class ContentFilter:
             ''', default_categories)
             
             conn.commit()
-            conn.close()
             
             logger.info("Content filter database initialized")
         except Exception as e:
@@ -161,21 +236,95 @@ class ContentFilter:
             # Normalize the domain (remove http://, www., etc.)
             domain = self._normalize_domain(domain)
             
-            # Add the domain
-            cursor.execute('''
-                INSERT OR REPLACE INTO domains (domain, category)
-                VALUES (?, ?)
-            ''', (domain, category))
+            # Add the domain, noting the category it moves out of
+            with conn:
+                cursor.execute('SELECT category FROM domains WHERE domain = ?', (domain,))
+                previous = cursor.fetchone()
+                cursor.execute('''
+                    INSERT OR REPLACE INTO domains (domain, category)
+                    VALUES (?, ?)
+                ''', (domain, category))
             
-            conn.commit()
-            conn.close()
+            if self._index is not None:
+                self._index.add(domain, category)
+            self._defer_snapshot({category, previous[0]} if previous else {category})
+            self._update_prefilter(domain)
             
             logger.info(f"Added domain {domain} to category {category}")
             return True
         except Exception as e:
             logger.error(f"Failed to add domain {domain}: {e}")
             return False
-    
+
+    def import_blocklist(self, source: BlocklistSource, category: str = "uncategorized",
+                         batch_size: int = DEFAULT_BATCH_SIZE,
+                         progress: Optional[Callable[[int, int], None]] = None) -> Dict[str, int]:
+        """Import a hosts, AdBlock or plain domain blocklist.
+
+        The list is streamed and written in batches with executemany inside a
+        single transaction, so a list with millions of entries neither loads
+        into memory nor pays for a commit per domain. Domains already in the
+        block list are moved to the given category.
+
+        Args:
+            source: A file path, a text or binary file object, or an iterable
+                    of lines
+            category: The category of the imported domains; created (enabled)
+                      if it does not exist
+            batch_size: Number of lines normalized and written per batch
+            progress: Called with (lines read, domains imported) after every batch;
+                      it runs inside the import transaction, so calls from it
+                      that need the database fail and leave the import intact
+
+        Returns:
+            Dict with the number of lines read, domains imported and names
+            skipped; all zero if the import failed
+        """
+        stats = {'lines': 0, 'imported': 0, 'skipped': 0}
+        if not self._get_connection():
+            return stats
+
+        try:
+            with self._pool.transaction() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    INSERT OR IGNORE INTO categories (name, description, enabled)
+                    VALUES (?, ?, 1)
+                ''', (category, f"Imported {category} blocklist"))
+                created = cursor.rowcount > 0
+
+                # Categories that lose domains to this one need new snapshots too
+                sizes = self._category_sizes(cursor) if self._snapshots_in_use() else {}
+                changes = conn.total_changes
+                for domains, lines, skipped in iter_batches(source, batch_size):
+                    cursor.executemany('''
+                        INSERT INTO domains (domain, category) VALUES (?, ?)
+                        ON CONFLICT(domain) DO UPDATE SET category = excluded.category
+                        WHERE category != excluded.category
+                    ''', ((domain, category) for domain in domains))
+                    stats['lines'] += lines
+                    stats['skipped'] += skipped
+                    stats['imported'] = conn.total_changes - changes
+                    if self._index is not None:
+                        self._index.add_many(domains, category)
+                    if progress:
+                        progress(stats['lines'], stats['imported'])
+
+                shrunk = {name for name, size in self._category_sizes(cursor).items()
+                          if size < sizes.get(name, 0)} if sizes else set()
+            if created and self._index is not None:
+                self._index.set_category_enabled(category, True)
+            self._update_snapshot(shrunk | {category})
+            self._update_prefilter()
+            logger.info(f"Imported {stats['imported']} domains into category {category} "
+                        f"({stats['lines']} lines, {stats['skipped']} skipped)")
+            return stats
+        except Exception as e:
+            # The index may hold domains of the rolled back batches
+            self._index = None
+            logger.error(f"Failed to import blocklist into category {category}: {e}")
+            return {'lines': 0, 'imported': 0, 'skipped': 0}
+
     def remove_domain(self, domain: str) -> bool:
         """Remove a domain from the block list.
         
@@ -195,13 +344,17 @@ class ContentFilter:
                 
             cursor = conn.cursor()
             
-            cursor.execute('DELETE FROM domains WHERE domain = ?', (domain,))
+            with conn:
+                cursor.execute('SELECT category FROM domains WHERE domain = ?', (domain,))
+                previous = cursor.fetchone()
+                cursor.execute('DELETE FROM domains WHERE domain = ?', (domain,))
             
             deleted = cursor.rowcount > 0
-            conn.commit()
-            conn.close()
             
             if deleted:
+                if self._index is not None:
+                    self._index.remove(domain)
+                self._defer_snapshot({previous[0]})
                 logger.info(f"Removed domain {domain} from block list")
             else:
                 logger.warning(f"Domain {domain} not found in block list")
@@ -214,60 +367,459 @@ class ContentFilter:
     def is_domain_blocked(self, domain: str) -> bool:
         """Check if a domain is blocked.
         
+        Lookups are answered from an in-memory index of the enabled
+        categories, loaded from the database on first use and kept in sync
+        by the methods of this class, or from the blocklist snapshot if
+        use_snapshot is set.
+        
         Args:
             domain: The domain to check
             
         Returns:
             bool: True if the domain is blocked, False otherwise
         """
+        normalized = False
+        if self.prefilter_fp_rate is not None:
+            domain = normalize_domain(domain)
+            normalized = True
+            if not self._prefilter_may_block(domain):
+                self.prefilter_stats['misses'] += 1
+                return False
+            self.prefilter_stats['hits'] += 1
+        
+        if self.use_snapshot:
+            if self._pending_snapshots:
+                self.flush()
+            snapshot = self._get_snapshot()
+            blocked = snapshot.is_blocked(domain, normalized) if snapshot is not None else False
+        else:
+            index = self._index
+            if index is None:
+                index = self.reload_index()
+            blocked = index.is_blocked(domain, normalized) if index is not None else False
+        
+        if normalized and not blocked:
+            self.prefilter_stats['false_positives'] += 1
+        return blocked
+    
+    def reload_index(self) -> Optional[DomainIndex]:
+        """Load the in-memory block list index from the database.
+        
+        Call this after the database was changed by another process.
+        
+        Returns:
+            DomainIndex: The new index, or None if the database could not be read
+        """
         try:
-            # Normalize the domain
-            domain = self._normalize_domain(domain)
-            
             conn = self._get_connection()
             if not conn:
-                return False
+                return None
                 
             cursor = conn.cursor()
-            
-            # Check for exact match
             cursor.execute('''
-                SELECT d.domain, c.enabled 
+                SELECT d.domain, d.category, c.enabled
                 FROM domains d
-                JOIN categories c ON d.category = c.name
-                WHERE d.domain = ?
-            ''', (domain,))
+                LEFT JOIN categories c ON d.category = c.name
+            ''')
+            self._index = DomainIndex.from_rows(cursor)
             
-            result = cursor.fetchone()
+            logger.info(f"Loaded {len(self._index)} blocked domains into the lookup index")
+            return self._index
+        except Exception as e:
+            logger.error(f"Failed to load block list index: {e}")
+            return None
+    
+    def build_snapshot(self, categories: Optional[Iterable[str]] = None) -> bool:
+        """Write the blocklist snapshots of categories and the list of enabled ones.
+        
+        Each category has its own snapshot file, so a change to one category
+        only rewrites its file, and enabling or disabling a category only
+        rewrites the manifest. The domains are sorted by SQLite, so memory
+        use does not grow with the size of the block list. New files replace
+        the previous ones by rename; processes mapping the old files keep
+        reading them until they refresh.
+        
+        Args:
+            categories: Categories whose snapshots are rewritten; None for all
             
-            if result and result[1]:
-                conn.close()
-                return True
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        try:
+            conn = self._get_connection()
+            if not conn:
+                return False
                 
-            # Check for wildcard match (e.g., *.example.com)
-            parts = domain.split('.')
-            for i in range(1, len(parts)):
-                wildcard = '*.' + '.'.join(parts[i:])
+            conn.create_function('snapshot_key', 1, snapshot_key, deterministic=True)
+            cursor = conn.cursor()
+            if categories is None:
+                cursor.execute('SELECT name FROM categories UNION SELECT DISTINCT category FROM domains')
+                categories = [row[0] for row in cursor.fetchall()]
+            
+            os.makedirs(self.snapshot_path, exist_ok=True)
+            # A rebuild that started later also finishes later, so the newest data wins
+            with self._snapshot_lock:
+                for category in categories:
+                    cursor.execute('''
+                        SELECT snapshot_key(domain) AS key
+                        FROM domains
+                        WHERE category = ?
+                        ORDER BY key
+                    ''', (category,))
+                    count = write_snapshot(shard_path(self.snapshot_path, category), (row[0] for row in cursor))
+                    logger.info(f"Wrote blocklist snapshot of category {category} with {count} domains")
                 
-                cursor.execute('''
-                    SELECT d.domain, c.enabled 
-                    FROM domains d
-                    JOIN categories c ON d.category = c.name
-                    WHERE d.domain = ?
-                ''', (wildcard,))
+                # Rewriting the manifest also makes readers map new category files
+                self._write_snapshot_manifest(cursor)
+            return True
+        except Exception as e:
+            logger.error(f"Failed to build blocklist snapshot: {e}")
+            return False
+    
+    def _write_snapshot_manifest(self, cursor: sqlite3.Cursor) -> None:
+        """Write the names of the enabled categories for snapshot readers."""
+        cursor.execute('SELECT name FROM categories WHERE enabled = 1')
+        write_manifest(self.snapshot_path, [row[0] for row in cursor.fetchall()])
+        if self._snapshot is not None:
+            self._snapshot.refresh()
+    
+    def _snapshots_in_use(self) -> bool:
+        return self.use_snapshot or os.path.exists(self.snapshot_path)
+    
+    def _update_snapshot(self, categories: Optional[Set[str]] = None) -> None:
+        """Update the blocklist snapshots after a change, if snapshots are in use.
+        
+        Args:
+            categories: Categories whose domains changed; an empty set if
+                    only the enabled categories changed
+        """
+        if not self._snapshots_in_use():
+            return
+        if categories:
+            self.build_snapshot(categories | self._take_pending_snapshots())
+            return
+        try:
+            conn = self._get_connection()
+            if conn:
+                self._write_snapshot_manifest(conn.cursor())
+        except Exception as e:
+            logger.error(f"Failed to update blocklist snapshot manifest: {e}")
+    
+    def _defer_snapshot(self, categories: Set[str]) -> None:
+        """Rewrite the snapshots of categories after WRITE_DELAY, together with later changes.
+        
+        Rewriting a category file costs the same for one changed domain as
+        for all of them, so a burst of single-domain changes is written once.
+        """
+        if not self._snapshots_in_use():
+            return
+        with self._pending_lock:
+            self._pending_snapshots |= categories
+            self._schedule_flush()
+    
+    def _schedule_flush(self) -> None:
+        """Start the timer of flush() unless it is running; call with _pending_lock held."""
+        if self._pending_timer is None:
+            self._pending_timer = threading.Timer(self.WRITE_DELAY, self.flush)
+            self._pending_timer.daemon = True
+            self._pending_timer.start()
+    
+    def _take_pending_snapshots(self) -> Set[str]:
+        """Get the categories waiting for a snapshot rewrite, which the caller now writes."""
+        with self._pending_lock:
+            categories, self._pending_snapshots = self._pending_snapshots, set()
+        return categories
+    
+    def flush(self) -> bool:
+        """Write the snapshot and Bloom filter changes of add_domain and remove_domain now.
+        
+        Other processes see these changes once they are written, at most
+        WRITE_DELAY after the change unless this is called.
+        
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        with self._pending_lock:
+            if self._pending_timer is not None:
+                self._pending_timer.cancel()
+                self._pending_timer = None
+            categories, self._pending_snapshots = self._pending_snapshots, set()
+            added, self._pending_prefilter = self._pending_prefilter, []
+        
+        success = True
+        if added:
+            try:
+                # Another process may have saved a newer filter since this one was loaded
+                bloom = self._load_prefilter()
+                if bloom is not None:
+                    for domain in added:
+                        for key in self._prefilter_keys(domain):
+                            bloom.add(key)
+                    self._save_prefilter(bloom)
+            except Exception as e:
+                logger.error(f"Failed to save Bloom filter: {e}")
+                success = False
+                with self._pending_lock:
+                    self._pending_prefilter[:0] = added
+        if categories and not self.build_snapshot(categories):
+            success = False
+            # Retried by the next change or flush
+            with self._pending_lock:
+                self._pending_snapshots |= categories
+        return success
+    
+    @staticmethod
+    def _category_sizes(cursor: sqlite3.Cursor) -> Dict[str, int]:
+        """Count the domains of each category, from the category index alone."""
+        cursor.execute('SELECT category, COUNT(*) FROM domains GROUP BY category')
+        return dict(cursor.fetchall())
+    
+    def _get_snapshot(self) -> Optional[SnapshotShards]:
+        """Get the mapped blocklist snapshots, building them if they do not exist."""
+        snapshot = self._snapshot
+        if snapshot is None:
+            try:
+                snapshot = SnapshotShards(self.snapshot_path)
+            except OSError:
+                if self.build_snapshot():
+                    snapshot = SnapshotShards(self.snapshot_path)
+            self._snapshot = snapshot
+            self._snapshot_checked = time.monotonic()
+        elif time.monotonic() - self._snapshot_checked > self.REFRESH_INTERVAL:
+            # Pick up snapshots rebuilt by other processes
+            self._snapshot_checked = time.monotonic()
+            snapshot.refresh()
+        return snapshot
+    
+    def build_prefilter(self, fp_rate: Optional[float] = None) -> bool:
+        """Build the Bloom filter of all categories and save it next to the database.
+        
+        Disabled categories are included, so enabling or disabling a
+        category does not require a rebuild; their domains only pass the
+        filter and are then found not to be blocked.
+        
+        Args:
+            fp_rate: False-positive rate; defaults to prefilter_fp_rate, or
+                    the rate of the saved filter
+            
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        try:
+            if fp_rate is None:
+                fp_rate = self.prefilter_fp_rate
+            if fp_rate is None:
+                fp_rate = BloomFilter.load(self.prefilter_path).fp_rate
                 
-                result = cursor.fetchone()
+            conn = self._get_connection()
+            if not conn:
+                return False
                 
-                if result and result[1]:
-                    conn.close()
-                    return True
-            
-            conn.close()
+            # The rebuild reads every domain added so far
+            with self._pending_lock:
+                self._pending_prefilter = []
+            cursor = conn.cursor()
+            cursor.execute('SELECT COUNT(*) FROM domains')
+            count = cursor.fetchone()[0]
+            # Two keys per domain, with room for domains added before the next rebuild
+            bloom = BloomFilter(2 * (count + max(1024, count // 10)), fp_rate)
+            cursor.execute('SELECT domain FROM domains')
+            for (domain,) in cursor:
+                for key in self._prefilter_keys(domain):
+                    bloom.add(key)
+            
+            self._save_prefilter(bloom)
+            logger.info(f"Built Bloom filter of {count} domains ({bloom.size // 8} bytes, "
+                        f"{bloom.hashes} hashes) at {self.prefilter_path}")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to build Bloom filter: {e}")
             return False
+    
+    def _update_prefilter(self, added: Optional[str] = None) -> None:
+        """Keep the saved Bloom filter free of false negatives after a change.
+        
+        A single added domain is inserted into the filter at once and saved
+        by flush(), after WRITE_DELAY; other changes rebuild it. Removed
+        domains stay in the filter until the next rebuild, which only costs
+        an occasional false positive.
+        """
+        if self.prefilter_fp_rate is None and not os.path.exists(self.prefilter_path):
+            return
+        if added is not None:
+            try:
+                bloom = self._prefilter if self._prefilter is not None else self._load_prefilter()
+                if bloom is None:
+                    return
+                for key in self._prefilter_keys(added):
+                    bloom.add(key)
+                self._prefilter_tlds = b'~*' in bloom
+                with self._pending_lock:
+                    self._pending_prefilter.append(added)
+                    self._schedule_flush()
+                return
+            except Exception as e:
+                logger.error(f"Failed to update Bloom filter: {e}")
+        self.build_prefilter()
+    
+    @staticmethod
+    def _prefilter_keys(domain: str) -> List[bytes]:
+        """Get the Bloom filter keys of a stored domain or wildcard.
+        
+        Besides the domain itself, its last two labels are added with a "~"
+        prefix. A lookup checks that key first, so a name is usually
+        rejected with one probe, whatever its number of labels. Wildcards of
+        a single label (*.com) add the "~*" marker, which turns this
+        shortcut off.
+        """
+        name = domain[2:] if domain.startswith('*.') else domain
+        dot = name.rfind('.')
+        if dot == -1 and name != domain:
+            return [domain.encode(), b'~*']
+        return [domain.encode(), ('~' + name[name.rfind('.', 0, dot) + 1:]).encode()]
+    
+    def _save_prefilter(self, bloom: BloomFilter) -> None:
+        """Save a Bloom filter and use it for lookups in this process."""
+        bloom.save(self.prefilter_path)
+        self._prefilter = bloom
+        self._prefilter_tlds = b'~*' in bloom
+        self._prefilter_mtime = os.stat(self.prefilter_path).st_mtime_ns
+        self._prefilter_checked = time.monotonic()
+    
+    def _prefilter_may_block(self, domain: str) -> bool:
+        """Check a normalized domain and its wildcards against the Bloom filter."""
+        bloom = self._prefilter
+        if bloom is None or time.monotonic() - self._prefilter_checked > self.REFRESH_INTERVAL:
+            bloom = self._load_prefilter()
+            if bloom is None:
+                return True
+        
+        if not self._prefilter_tlds:
+            dot = domain.rfind('.')
+            if ('~' + domain[domain.rfind('.', 0, dot) + 1:]).encode() not in bloom:
+                return False
+        if domain.encode() in bloom:
+            return True
+        dot = domain.find('.')
+        while dot != -1:
+            domain = domain[dot + 1:]
+            if ('*.' + domain).encode() in bloom:
+                return True
+            dot = domain.find('.')
+        return False
+    
+    def _load_prefilter(self) -> Optional[BloomFilter]:
+        """Load the saved Bloom filter if it changed, building it if there is none.
+        
+        A saved filter with a different false-positive rate is rebuilt. Domains
+        added by this ContentFilter but not saved yet are added to it again.
+        """
+        self._prefilter_checked = time.monotonic()
+        try:
+            mtime = os.stat(self.prefilter_path).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime is not None and self._prefilter is not None and mtime == self._prefilter_mtime:
+            return self._prefilter
+        
+        bloom = None
+        if mtime is not None:
+            try:
+                bloom = BloomFilter.load(self.prefilter_path)
+            except Exception as e:
+                logger.error(f"Failed to load Bloom filter {self.prefilter_path}: {e}")
+        # Writers without a configured rate keep the rate of the saved filter
+        if bloom is None or self.prefilter_fp_rate not in (None, bloom.fp_rate):
+            self._prefilter = None
+            self.build_prefilter()
+            return self._prefilter
+        
+        # Domains added here but not saved yet
+        for domain in list(self._pending_prefilter):
+            for key in self._prefilter_keys(domain):
+                bloom.add(key)
+        self._prefilter = bloom
+        self._prefilter_tlds = b'~*' in bloom
+        self._prefilter_mtime = mtime
+        return bloom
+    
+    def get_prefilter_stats(self) -> Dict[str, any]:
+        """Get the Bloom filter counters of this ContentFilter.
+        
+        Returns:
+            Dict with the lookups the filter rejected (misses) and passed on
+            (hits), the hits that were not blocked (false_positives), and the
+            size and configuration of the filter
+        """
+        stats = dict(self.prefilter_stats)
+        bloom = self._prefilter
+        stats.update({
+            'enabled': self.prefilter_fp_rate is not None,
+            'fp_rate': self.prefilter_fp_rate,
+            'keys': bloom.count if bloom else 0,
+            'bytes': bloom.size // 8 if bloom else 0,
+        })
+        return stats
+    
+    def save_prefilter_stats(self) -> bool:
+        """Save the Bloom filter counters of this process for read_prefilter_stats.
+        
+        Lookups usually run in another process than the web interface and
+        the API, e.g. the DNS sinkhole, which calls this periodically.
+        
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        try:
+            os.makedirs(self.prefilter_stats_path, exist_ok=True)
+            stats = self.get_prefilter_stats()
+            stats['updated'] = time.time()
+            fd, temp_path = tempfile.mkstemp(prefix='.stats-', dir=self.prefilter_stats_path)
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(stats, f)
+                os.chmod(temp_path, 0o644)
+                os.replace(temp_path, os.path.join(self.prefilter_stats_path, f"{os.getpid()}.json"))
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.unlink(temp_path)
+                raise
+            return True
         except Exception as e:
-            logger.error(f"Failed to check if domain {domain} is blocked: {e}")
+            logger.error(f"Failed to save Bloom filter statistics: {e}")
             return False
     
+    def read_prefilter_stats(self) -> Dict[str, any]:
+        """Get the Bloom filter counters saved by all processes.
+        
+        Returns:
+            Dict with the hits, misses and false_positives summed over the
+            processes, the number of processes, and the configuration of the
+            filter from the most recent save
+        """
+        stats = {'hits': 0, 'misses': 0, 'false_positives': 0, 'processes': 0,
+                 'enabled': False, 'fp_rate': None, 'keys': 0, 'bytes': 0, 'updated': None}
+        try:
+            names = sorted(os.listdir(self.prefilter_stats_path))
+        except OSError:
+            return stats
+        for name in names:
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.prefilter_stats_path, name)) as f:
+                    saved = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Skipping Bloom filter statistics {name}: {e}")
+                continue
+            for key in ('hits', 'misses', 'false_positives'):
+                stats[key] += saved.get(key, 0)
+            stats['processes'] += 1
+            if stats['updated'] is None or saved.get('updated', 0) > stats['updated']:
+                stats.update({key: saved.get(key, stats[key])
+                              for key in ('enabled', 'fp_rate', 'keys', 'bytes', 'updated')})
+        return stats
+    
     def add_category(self, name: str, description: str, enabled: bool = True) -> bool:
         """Add a new category for content filtering.
         
@@ -286,13 +838,16 @@ class ContentFilter:
                 
             cursor = conn.cursor()
             
-            cursor.execute('''
-                INSERT OR REPLACE INTO categories (name, description, enabled)
-                VALUES (?, ?, ?)
-            ''', (name, description, 1 if enabled else 0))
+            with conn:
+                cursor.execute('''
+                    INSERT OR REPLACE INTO categories (name, description, enabled)
+                    VALUES (?, ?, ?)
+                ''', (name, description, 1 if enabled else 0))
             
-            conn.commit()
-            conn.close()
+            if self._index is not None:
+                self._index.set_category_enabled(name, enabled)
+            # Only the manifest changes; the Bloom filter holds every category
+            self._update_snapshot(set())
             
             logger.info(f"Added category: {name}")
             return True
@@ -317,19 +872,21 @@ class ContentFilter:
                 
             cursor = conn.cursor()
             
-            cursor.execute('''
-                UPDATE categories
-                SET enabled = ?
-                WHERE name = ?
-            ''', (1 if enabled else 0, name))
+            with conn:
+                cursor.execute('''
+                    UPDATE categories
+                    SET enabled = ?
+                    WHERE name = ?
+                ''', (1 if enabled else 0, name))
             
             if cursor.rowcount == 0:
                 logger.warning(f"Category {name} not found")
-                conn.close()
                 return False
-                
-            conn.commit()
-            conn.close()
+            
+            if self._index is not None:
+                self._index.set_category_enabled(name, enabled)
+            # Only the manifest changes; the Bloom filter holds every category
+            self._update_snapshot(set())
             
             status = "enabled" if enabled else "disabled"
             logger.info(f"Category {name} {status}")
@@ -352,8 +909,8 @@ class ContentFilter:
             if not conn:
                 return []
                 
-            conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
             
             query = '''
                 SELECT name, description, enabled,
@@ -369,7 +926,6 @@ class ContentFilter:
             cursor.execute(query)
             
             categories = [dict(row) for row in cursor.fetchall()]
-            conn.close()
             
             return categories
         except Exception as e:
@@ -399,13 +955,33 @@ class ContentFilter:
             ''', (category,))
             
             domains = [row[0] for row in cursor.fetchall()]
-            conn.close()
             
             return domains
         except Exception as e:
             logger.error(f"Failed to get domains for category {category}: {e}")
             return []
     
+    def count_domains(self, category: str) -> int:
+        """Count the domains in a specific category without loading them.
+        
+        Args:
+            category: The category to count domains for
+            
+        Returns:
+            int: Number of domains, 0 if the category is empty or on error
+        """
+        try:
+            conn = self._get_connection()
+            if not conn:
+                return 0
+                
+            cursor = conn.cursor()
+            cursor.execute('SELECT COUNT(*) FROM domains WHERE category = ?', (category,))
+            return cursor.fetchone()[0]
+        except Exception as e:
+            logger.error(f"Failed to count domains for category {category}: {e}")
+            return 0
+    
     def apply_to_firewall(self, table_name: str = "charon") -> bool:
         """Apply the content filters to the firewall.
         
@@ -420,6 +996,10 @@ class ContentFilter:
         Returns:
             bool: True if successful, False otherwise
         """
+        # Rebuild the Bloom filter from the current categories
+        if self.prefilter_fp_rate is not None or os.path.exists(self.prefilter_path):
+            self.build_prefilter()
+            
         # Get enabled categories and domains
         domains = self._get_blocked_domains()
         if not domains:
@@ -431,6 +1011,49 @@ class ContentFilter:
         else:
             return self._apply_to_nftables(domains, table_name)
     
+    def pin_blocked_addresses(self, table_name: str = "charon", pinner: Optional['DomainPinner'] = None,
+                              **options) -> Dict[str, int]:
+        """Resolve the blocked domains and pin their addresses into nftables sets.
+        
+        Blocks traffic to the domains on the packet path, which nftables
+        cannot do by name. Each call only resolves the domains whose pinned
+        addresses are about to expire, so it is meant to be called
+        periodically, e.g. every minute (see DomainPinner.run for a loop).
+        
+        Args:
+            table_name: The nftables table holding the sets
+            pinner: Pinner to use instead of the one kept for the table
+            **options: Options for a new DomainPinner, e.g. upstreams or concurrency
+            
+        Returns:
+            Dict with the counts of resolved, failed, added, refreshed and
+            removed elements; empty if the sets could not be updated
+        """
+        # Imported here so that the content filter does not load nftables support
+        from .domain_pinning import DomainPinner
+        from .packet_filter import PacketFilter
+        
+        if pinner is None:
+            pinner = self._pinners.get(table_name)
+            if pinner is None:
+                pinner = DomainPinner(PacketFilter(table_name), **options)
+                self._pinners[table_name] = pinner
+        
+        domains = self._get_blocked_domains()
+        
+        async def sync():
+            try:
+                return await pinner.sync(domains)
+            finally:
+                # The upstream sockets belong to this call's event loop
+                pinner.close()
+        
+        try:
+            return asyncio.run(sync())
+        except Exception as e:
+            logger.error(f"Failed to pin blocked addresses: {e}")
+            return {}
+    
     def _get_blocked_domains(self) -> List[str]:
         """Get a list of domains to block from enabled categories.
         
@@ -454,7 +1077,6 @@ class ContentFilter:
             
             if not enabled_categories:
                 logger.warning("No enabled categories found")
-                conn.close()
                 return []
             
             # Get domains for enabled categories
@@ -465,7 +1087,6 @@ class ContentFilter:
             ''', enabled_categories)
             
             domains = [row[0] for row in cursor.fetchall()]
-            conn.close()
             
             if not domains:
                 logger.warning("No domains found in enabled categories")
@@ -479,6 +1100,12 @@ class ContentFilter:
     def _apply_to_nftables(self, domains: List[str], table_name: str) -> bool:
         """Apply content filters using nftables (Linux).
         
+        Only the domains that changed since the previous call are added and
+        deleted, in a single atomic nftables transaction. The first call in
+        a process compares against the live set instead; if the set does
+        not exist or cannot be read, it is created and filled in the same
+        transaction that empties it, so it is never seen half-filled.
+        
         Args:
             domains: List of domains to block
             table_name: Name of the nftables table
@@ -486,54 +1113,74 @@ class ContentFilter:
         Returns:
             bool: True if successful, False otherwise
         """
+        if not domains:
+            return False
+        
+        # Imported here so that the content filter does not load nftables support
+        from .packet_filter import PacketFilter
+        
+        wanted = set(domains)
         try:
-            # Create a temporary file with the list of domains
-            with tempfile.NamedTemporaryFile(mode="w", delete=False) as tmp_file:
-                tmp_path = tmp_file.name
-                for domain in domains:
-                    tmp_file.write(domain + "\n")
-            
-            # Create or update the nftables set
-            try:
-                # Try to delete the set if it exists
-                cmd = [
-                    "nft", "delete", "set", "inet", table_name, "blocked_domains"
-                ]
-                subprocess.run(cmd, check=False, capture_output=True)
-            except subprocess.SubprocessError:
-                pass  # Ignore errors from trying to delete a non-existent set
-            
-            # Create the set
-            cmd = [
-                "nft", "add", "set", "inet", table_name, "blocked_domains",
-                "{", "type", "string", ";", "flags", "interval", ";", "auto-merge", ";", "}"
-            ]
-            subprocess.run(cmd, check=True, capture_output=True)
-            
-            # Populate the set from the file
-            cmd = [
-                "nft", "add", "element", "inet", table_name, "blocked_domains", "{",
-                f'elements="{tmp_path}"', "}"
-            ]
-            subprocess.run(cmd, check=True, capture_output=True)
-            
-            # Add a rule to block access to the domains in the set
-            # This assumes there's an existing chain called "input"
-            cmd = [
-                "nft", "add", "rule", "inet", table_name, "input",
-                "meta", "l4proto", "tcp", "tcp", "dport", "53",
-                "reject", "comment", "\"Block DNS requests for filtered domains\""
-            ]
-            subprocess.run(cmd, check=True, capture_output=True)
-            
-            # Clean up temporary file
-            os.unlink(tmp_path)
-            
-            logger.info(f"Applied content filter with {len(domains)} domains using nftables")
+            packet_filter = PacketFilter(table_name)
+            applied = self._nft_domains.get(table_name)
+            if applied is None:
+                applied = self._read_nft_domains(packet_filter)
+            
+            txn = packet_filter.transaction()
+            if applied is None:
+                added = sorted(wanted)
+                removed = []
+                txn.add_set("blocked_domains", "string", ["interval"], auto_merge=True)
+                txn.flush_set("blocked_domains")
+            else:
+                added = sorted(wanted - applied)
+                removed = sorted(applied - wanted)
+            for start in range(0, len(added), self.NFT_ELEMENT_CHUNK):
+                txn.add_element("blocked_domains", added[start:start + self.NFT_ELEMENT_CHUNK])
+            for start in range(0, len(removed), self.NFT_ELEMENT_CHUNK):
+                txn.delete_element("blocked_domains", removed[start:start + self.NFT_ELEMENT_CHUNK])
+            
+            # No rule matches the set: nftables cannot match names on the
+            # packet path, and rejecting DNS over TCP would also cut off the
+            # DNS sinkhole, which enforces the list where names are resolved
+            
+            if not txn.commit():
+                # The set is unchanged, but may differ from what was last applied; read it next time
+                self._nft_domains.pop(table_name, None)
+                return False
+            self._nft_domains[table_name] = wanted
+            if applied is None:
+                logger.info(f"Applied content filter with {len(domains)} domains using nftables")
+            else:
+                logger.info(f"Updated content filter in nftables: {len(added)} domains added, "
+                            f"{len(removed)} removed")
             return True
         except Exception as e:
+            self._nft_domains.pop(table_name, None)
             logger.error(f"Failed to apply content filter to nftables: {e}")
             return False
+    
+    @staticmethod
+    def _read_nft_domains(packet_filter: 'PacketFilter') -> Optional[Set[str]]:
+        """Read the domains of the live blocked_domains set.
+        
+        Returns:
+            The domains in the set, or None if the set does not exist, cannot
+            be read or holds elements other than plain strings
+        """
+        try:
+            output = packet_filter.backend.run(
+                ["list", "set", "inet", packet_filter.table_name, "blocked_domains"],
+                json_output=True, capture=True)
+            for item in json.loads(output or '{}').get('nftables', []):
+                if 'set' in item:
+                    elements = item['set'].get('elem', [])
+                    if all(isinstance(element, str) for element in elements):
+                        return set(elements)
+                    return None
+        except (NftError, ValueError, AttributeError) as e:
+            logger.debug(f"Could not read the blocked_domains set: {e}")
+        return None
             
     def _apply_to_windows_firewall(self, domains: List[str]) -> bool:
         """Apply content filters using Windows Defender Firewall.
@@ -586,16 +1233,20 @@ class ContentFilter:
             return False
     
     def _get_connection(self) -> Optional[sqlite3.Connection]:
-        """Get a connection to the SQLite database.
+        """Get the connection of the calling thread to the SQLite database.
+        
+        The connection is kept open and reused by later calls from the same
+        thread, so callers must not close it.
         
         Returns:
             sqlite3.Connection: A connection to the database, or None if failed
         """
         try:
-            # Ensure directory exists before connecting
-            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
-            conn = sqlite3.connect(self.db_path)
-            return conn
+            if self._pool.db_path != self.db_path:
+                # The database was moved; stop using the old one
+                self._pool.close()
+                self._pool = SQLitePool(self.db_path)
+            return self._pool.connection()
         except Exception as e:
             logger.error(f"Failed to connect to database: {e}")
             return None
@@ -611,8 +1262,8 @@ class ContentFilter:
             if not conn:
                 return []
                 
-            conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
             
             cursor.execute('''
                 SELECT d.id, d.domain, d.category, d.added_date, c.enabled
@@ -622,7 +1273,6 @@ class ContentFilter:
             ''')
             
             domains = [dict(row) for row in cursor.fetchall()]
-            conn.close()
             
             return domains
         except Exception as e:
@@ -0,0 +1,677 @@
+#!/usr/bin/env python3
+"""
+DNS Sinkhole Module for Charon Firewall
+
+This module provides a forwarding DNS resolver that enforces the content
+filter. Queries for blocked names are answered locally, either with NXDOMAIN
+or with an unspecified address (0.0.0.0 / ::), and all other queries are
+forwarded to the configured upstream resolvers.
+
+- Upstream queries share a small pool of connected UDP sockets per upstream,
+  matched to responses by transaction ID, and fall back to pooled TCP
+  connections for truncated answers.
+- Answers are cached until their TTL expires. The TTLs of a cached answer
+  are counted down when it is served again, and when the cache is full,
+  expired entries are evicted before the least recently used ones.
+- Identical queries arriving while one is forwarded wait for its answer
+  instead of being forwarded again.
+
+Blocked and cached queries are answered synchronously from the datagram
+callback, without creating a task, which keeps a single process at tens of
+thousands of queries per second.
+
+Usage:
+    python -m charon.src.core.dns_sinkhole --listen 127.0.0.1 --port 5353 --upstream 1.1.1.1
+"""
+
+import argparse
+import asyncio
+import heapq
+import ipaddress
+import logging
+import random
+import struct
+import time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger('charon.dns_sinkhole')
+
+DNS_PORT = 53
+
+TYPE_A = 1
+TYPE_AAAA = 28
+TYPE_OPT = 41
+CLASS_IN = 1
+
+RCODE_NOERROR = 0
+RCODE_FORMERR = 1
+RCODE_SERVFAIL = 2
+RCODE_NXDOMAIN = 3
+
+FLAG_QR = 0x8000
+FLAG_TC = 0x0200
+FLAG_RA = 0x0080
+# Opcode and RD are copied from the query into the response
+FLAGS_FROM_QUERY = 0x7900
+
+BLOCK_NXDOMAIN = "nxdomain"
+BLOCK_ZERO = "zero"
+
+HEADER = struct.Struct('!HHHHHH')
+RECORD = struct.Struct('!HHIH')
+COUNTS = struct.Struct('!HHHH')
+
+# Key of a question in the cache: lowercased name, type and class
+QuestionKey = Tuple[bytes, int, int]
+
+
+def skip_name(message: bytes, offset: int) -> int:
+    """Get the offset after a (possibly compressed) domain name."""
+    while True:
+        length = message[offset]
+        if length & 0xC0 == 0xC0:
+            return offset + 2
+        if length & 0xC0:
+            raise ValueError("invalid label type")
+        offset += length + 1
+        if length == 0:
+            return offset
+
+
+def parse_question(message: bytes) -> Tuple[QuestionKey, int]:
+    """Parse the single question of a DNS query.
+
+    Returns:
+        Tuple of the question key and the offset after the question
+
+    Raises:
+        ValueError: If the message is not a query with exactly one question
+    """
+    if len(message) < 12:
+        raise ValueError("message too short")
+    flags, qdcount = struct.unpack_from('!HH', message, 2)
+    if flags & FLAG_QR or qdcount != 1:
+        raise ValueError("not a query with one question")
+
+    labels = []
+    offset = 12
+    while True:
+        length = message[offset]
+        if length & 0xC0:
+            raise ValueError("compressed name in question")
+        offset += 1
+        if length == 0:
+            break
+        labels.append(message[offset:offset + length])
+        offset += length
+    if len(message) < offset + 4:
+        raise ValueError("truncated question")
+    qtype, qclass = struct.unpack_from('!HH', message, offset)
+    return (b'.'.join(labels).lower(), qtype, qclass), offset + 4
+
+
+def response_ttls(message: bytes) -> Tuple[Optional[int], List[Tuple[int, int]]]:
+    """Find the TTLs of the records in a DNS response.
+
+    Returns:
+        Tuple of the lowest TTL (None if there are no records) and the
+        (offset, TTL) of every record, EDNS OPT pseudo-records excluded
+    """
+    qdcount, ancount, nscount, arcount = COUNTS.unpack_from(message, 4)
+    offset = 12
+    for _ in range(qdcount):
+        offset = skip_name(message, offset) + 4
+    lowest = None
+    ttls = []
+    for _ in range(ancount + nscount + arcount):
+        offset = skip_name(message, offset)
+        rtype, _, ttl, rdlength = RECORD.unpack_from(message, offset)
+        if rtype != TYPE_OPT:
+            ttls.append((offset + 4, ttl))
+            lowest = ttl if lowest is None else min(lowest, ttl)
+        offset += RECORD.size + rdlength
+    if offset > len(message):
+        raise ValueError("truncated response")
+    return lowest, ttls
+
+
+def build_query(name: str, qtype: int, query_id: int = 0) -> Tuple[bytes, int]:
+    """Build a recursive query for a name.
+
+    Returns:
+        Tuple of the query and the offset after its question
+
+    Raises:
+        ValueError: If the name is not a valid DNS name
+    """
+    labels = [label.encode('idna') for label in name.rstrip('.').split('.')]
+    if not all(0 < len(label) < 64 for label in labels):
+        raise ValueError(f"invalid DNS name: {name}")
+    question = b''.join(bytes([len(label)]) + label for label in labels) + b'\x00'
+    query = HEADER.pack(query_id, 0x0100, 1, 0, 0, 0) + question + struct.pack('!HH', qtype, CLASS_IN)
+    return query, len(query)
+
+
+def answer_addresses(message: bytes) -> Tuple[List[Tuple[str, int]], int]:
+    """Get the A and AAAA records of the answer section of a response.
+
+    Records reached through CNAMEs are included, since the answer section
+    holds the whole chain.
+
+    Returns:
+        Tuple of the (address, TTL) pairs and the response code
+    """
+    flags, qdcount, ancount = struct.unpack_from('!HHH', message, 2)
+    offset = 12
+    for _ in range(qdcount):
+        offset = skip_name(message, offset) + 4
+    addresses = []
+    for _ in range(ancount):
+        offset = skip_name(message, offset)
+        rtype, rclass, ttl, rdlength = RECORD.unpack_from(message, offset)
+        offset += RECORD.size
+        if rclass == CLASS_IN and (rtype, rdlength) in ((TYPE_A, 4), (TYPE_AAAA, 16)):
+            addresses.append((str(ipaddress.ip_address(message[offset:offset + rdlength])), ttl))
+        offset += rdlength
+    return addresses, flags & 0x000F
+
+
+def udp_payload_limit(message: bytes, question_end: int) -> int:
+    """Get the largest UDP response the client accepts (512 without EDNS)."""
+    if not message[10:12] == b'\x00\x00':
+        try:
+            offset = skip_name(message, question_end)
+            rtype, payload = struct.unpack_from('!HH', message, offset)
+            if rtype == TYPE_OPT:
+                return max(512, payload)
+        except (IndexError, ValueError, struct.error):
+            pass
+    return 512
+
+
+def build_response(query: bytes, question_end: int, rcode: int, answers: bytes = b'', ancount: int = 0) -> bytes:
+    """Build a response echoing the question of a query."""
+    query_id, flags = struct.unpack_from('!HH', query)
+    flags = FLAG_QR | FLAG_RA | (flags & FLAGS_FROM_QUERY) | rcode
+    return HEADER.pack(query_id, flags, 1, ancount, 0, 0) + query[12:question_end] + answers
+
+
+class DNSCache:
+    """TTL-aware LRU cache of DNS responses."""
+
+    def __init__(self, max_entries: int = 10000, max_ttl: int = 86400):
+        """Initialize the cache.
+
+        Args:
+            max_entries: Number of responses kept
+            max_ttl: Longest time in seconds a response is kept
+        """
+        self.max_entries = max_entries
+        self.max_ttl = max_ttl
+        # key -> (response, stored, expires, [(offset, ttl)])
+        self._entries: 'OrderedDict[QuestionKey, Tuple[bytes, float, float, List[Tuple[int, int]]]]' = OrderedDict()
+        self._expiry: List[Tuple[float, QuestionKey]] = []
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: QuestionKey, query: bytes, question_end: int, now: float) -> Optional[bytes]:
+        """Get a cached response for a query, with its TTLs counted down.
+
+        The response carries the ID and question (including letter case) of
+        the query.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        response, stored, expires, ttls = entry
+        if now >= expires:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+
+        message = bytearray(response)
+        message[0:2] = query[0:2]
+        message[12:question_end] = query[12:question_end]
+        elapsed = int(now - stored)
+        if elapsed:
+            for offset, ttl in ttls:
+                struct.pack_into('!I', message, offset, max(ttl - elapsed, 0))
+        return bytes(message)
+
+    def put(self, key: QuestionKey, response: bytes, now: float) -> bool:
+        """Cache a NOERROR or NXDOMAIN response for as long as its lowest TTL.
+
+        Returns:
+            bool: True if the response was cached
+        """
+        flags = struct.unpack_from('!H', response, 2)[0]
+        if flags & FLAG_TC or flags & 0x000F not in (RCODE_NOERROR, RCODE_NXDOMAIN):
+            return False
+        try:
+            lowest, ttls = response_ttls(response)
+        except (IndexError, ValueError, struct.error):
+            return False
+        if not lowest:
+            return False
+
+        expires = now + min(lowest, self.max_ttl)
+        self._entries[key] = (response, now, expires, ttls)
+        self._entries.move_to_end(key)
+        heapq.heappush(self._expiry, (expires, key))
+        while len(self._entries) > self.max_entries:
+            self._evict(now)
+        if len(self._expiry) > 2 * self.max_entries:
+            self._expiry = [(e, k) for k, (_, _, e, _) in self._entries.items()]
+            heapq.heapify(self._expiry)
+        return True
+
+    def _evict(self, now: float) -> None:
+        """Remove an expired entry, or the least recently used one if none expired."""
+        while self._expiry and self._expiry[0][0] <= now:
+            expires, key = heapq.heappop(self._expiry)
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] == expires:
+                del self._entries[key]
+                return
+        self._entries.popitem(last=False)
+
+
+class _UpstreamProtocol(asyncio.DatagramProtocol):
+    """Connected UDP socket to an upstream, matching responses to queries by ID."""
+
+    def __init__(self):
+        self.transport: Optional[asyncio.DatagramTransport] = None
+        self.pending: Dict[int, asyncio.Future] = {}
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if len(data) >= 12:
+            future = self.pending.pop(int.from_bytes(data[:2], 'big'), None)
+            if future is not None and not future.done():
+                future.set_result(data)
+
+    def error_received(self, exc):
+        logger.debug(f"Upstream socket error: {exc}")
+
+    def connection_lost(self, exc):
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError("upstream socket closed"))
+        self.pending.clear()
+
+
+class UpstreamPool:
+    """Pooled UDP and TCP connections to the upstream resolvers."""
+
+    def __init__(self, upstreams: List[Tuple[str, int]], timeout: float = 2.0, pool_size: int = 4):
+        """Initialize the pool.
+
+        Args:
+            upstreams: (address, port) of the upstream resolvers, tried in turn
+            timeout: Seconds to wait for an upstream before trying the next
+            pool_size: UDP sockets and idle TCP connections kept per upstream
+        """
+        if not upstreams:
+            raise ValueError("at least one upstream resolver is required")
+        self.upstreams = upstreams
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._udp: Dict[Tuple[str, int], List[_UpstreamProtocol]] = {}
+        self._tcp: Dict[Tuple[str, int], Deque[Tuple[asyncio.StreamReader, asyncio.StreamWriter]]] = {}
+        self._next = 0
+
+    async def _udp_socket(self, upstream: Tuple[str, int]) -> _UpstreamProtocol:
+        sockets = self._udp.setdefault(upstream, [])
+        sockets[:] = [s for s in sockets if s.transport is not None and not s.transport.is_closing()]
+        if len(sockets) < self.pool_size:
+            loop = asyncio.get_running_loop()
+            _, protocol = await loop.create_datagram_endpoint(_UpstreamProtocol, remote_addr=upstream)
+            sockets.append(protocol)
+            return protocol
+        # Spread queries over the sockets, and so over source ports
+        return sockets[random.randrange(len(sockets))]
+
+    async def _query_udp(self, upstream: Tuple[str, int], message: bytes, question_end: int) -> bytes:
+        protocol = await self._udp_socket(upstream)
+        query_id = random.getrandbits(16)
+        while query_id in protocol.pending:
+            query_id = random.getrandbits(16)
+        future = asyncio.get_running_loop().create_future()
+        protocol.pending[query_id] = future
+        try:
+            protocol.transport.sendto(query_id.to_bytes(2, 'big') + message[2:])
+            response = await asyncio.wait_for(future, self.timeout)
+        finally:
+            protocol.pending.pop(query_id, None)
+        # Reject answers to a different question, e.g. spoofed ones
+        if response[12:question_end].lower() != message[12:question_end].lower():
+            raise ConnectionError("upstream answered a different question")
+        return response
+
+    async def _query_tcp(self, upstream: Tuple[str, int], message: bytes) -> bytes:
+        pool = self._tcp.setdefault(upstream, deque())
+        while True:
+            fresh = not pool
+            if fresh:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection(*upstream), self.timeout)
+            else:
+                reader, writer = pool.pop()
+            try:
+                writer.write(len(message).to_bytes(2, 'big') + message)
+                await writer.drain()
+                length = int.from_bytes(await asyncio.wait_for(reader.readexactly(2), self.timeout), 'big')
+                response = await asyncio.wait_for(reader.readexactly(length), self.timeout)
+            except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+                writer.close()
+                if fresh:
+                    raise
+                # The idle connection was closed by the upstream; try another
+                continue
+            if len(pool) < self.pool_size:
+                pool.append((reader, writer))
+            else:
+                writer.close()
+            return response
+
+    async def query(self, message: bytes, question_end: int) -> bytes:
+        """Resolve a query through the first upstream that answers.
+
+        Truncated UDP answers are retried over TCP.
+
+        Raises:
+            ConnectionError: If no upstream answered
+        """
+        start = self._next
+        self._next = (self._next + 1) % len(self.upstreams)
+        for attempt in range(len(self.upstreams)):
+            upstream = self.upstreams[(start + attempt) % len(self.upstreams)]
+            try:
+                response = await self._query_udp(upstream, message, question_end)
+                if response[2] & (FLAG_TC >> 8):
+                    response = await self._query_tcp(upstream, message)
+                return response
+            except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+                logger.warning(f"Upstream {upstream[0]}:{upstream[1]} failed: {e!r}")
+        raise ConnectionError("no upstream resolver answered")
+
+    def close(self) -> None:
+        for sockets in self._udp.values():
+            for protocol in sockets:
+                if protocol.transport is not None:
+                    protocol.transport.close()
+        for pool in self._tcp.values():
+            for _, writer in pool:
+                writer.close()
+        self._udp.clear()
+        self._tcp.clear()
+
+
+class _ServerProtocol(asyncio.DatagramProtocol):
+    """UDP listener of the sinkhole."""
+
+    def __init__(self, sinkhole: 'DNSSinkhole'):
+        self.sinkhole = sinkhole
+        self.transport: Optional[asyncio.DatagramTransport] = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        sinkhole = self.sinkhole
+        answer = sinkhole.resolve_local(data)
+        if answer is None:
+            task = asyncio.ensure_future(self._forward(data, addr))
+            sinkhole._tasks.add(task)
+            task.add_done_callback(sinkhole._tasks.discard)
+        elif answer:
+            self.transport.sendto(sinkhole.fit_udp(data, answer), addr)
+
+    async def _forward(self, data, addr):
+        answer = await self.sinkhole.forward(data)
+        if answer and not self.transport.is_closing():
+            self.transport.sendto(self.sinkhole.fit_udp(data, answer), addr)
+
+
+class DNSSinkhole:
+    """Forwarding DNS resolver answering blocked names locally."""
+
+    def __init__(self, content_filter: Any, upstreams: List[Tuple[str, int]],
+                 block_mode: str = BLOCK_NXDOMAIN, block_ttl: int = 300,
+                 cache_size: int = 10000, max_ttl: int = 86400,
+                 timeout: float = 2.0, pool_size: int = 4):
+        """Initialize the sinkhole.
+
+        Args:
+            content_filter: ContentFilter (or any object with is_domain_blocked)
+            upstreams: (address, port) of the upstream resolvers
+            block_mode: BLOCK_NXDOMAIN, or BLOCK_ZERO to answer A/AAAA queries
+                        with 0.0.0.0 / :: (other types get an empty answer)
+            block_ttl: TTL of the addresses returned in BLOCK_ZERO mode
+            cache_size: Number of upstream responses cached
+            max_ttl: Longest time in seconds a response is cached
+            timeout: Seconds to wait for an upstream before trying the next
+            pool_size: UDP sockets and idle TCP connections kept per upstream
+        """
+        if block_mode not in (BLOCK_NXDOMAIN, BLOCK_ZERO):
+            raise ValueError(f"invalid block mode: {block_mode}")
+        self.content_filter = content_filter
+        self.block_mode = block_mode
+        self.block_ttl = block_ttl
+        self.cache = DNSCache(cache_size, max_ttl)
+        self.upstreams = UpstreamPool(upstreams, timeout, pool_size)
+        self.stats = {'queries': 0, 'blocked': 0, 'cached': 0, 'forwarded': 0, 'failed': 0, 'malformed': 0}
+        self._inflight: Dict[QuestionKey, asyncio.Future] = {}
+        self._tasks = set()
+        self._udp: Optional[asyncio.DatagramTransport] = None
+        self._tcp: Optional[asyncio.AbstractServer] = None
+
+    def _blocked_response(self, query: bytes, question: QuestionKey, question_end: int) -> bytes:
+        if self.block_mode == BLOCK_NXDOMAIN:
+            return build_response(query, question_end, RCODE_NXDOMAIN)
+        _, qtype, qclass = question
+        if qclass == CLASS_IN and qtype in (TYPE_A, TYPE_AAAA):
+            address = b'\x00' * (4 if qtype == TYPE_A else 16)
+            # The owner name is a pointer to the question at offset 12
+            record = b'\xc0\x0c' + RECORD.pack(qtype, CLASS_IN, self.block_ttl, len(address)) + address
+            return build_response(query, question_end, RCODE_NOERROR, record, 1)
+        return build_response(query, question_end, RCODE_NOERROR)
+
+    def resolve_local(self, query: bytes) -> Optional[bytes]:
+        """Answer a query without contacting an upstream, if possible.
+
+        Returns:
+            The response for blocked, cached and malformed queries, b'' if
+            the query cannot be answered at all, or None if it has to be
+            forwarded
+        """
+        self.stats['queries'] += 1
+        try:
+            question, question_end = parse_question(query)
+        except (IndexError, ValueError, struct.error):
+            self.stats['malformed'] += 1
+            if len(query) < 12 or query[2] & 0x80:
+                return b''
+            return HEADER.pack(struct.unpack_from('!H', query)[0], FLAG_QR | RCODE_FORMERR, 0, 0, 0, 0)
+
+        name = question[0].decode('ascii', 'replace')
+        if name and self.content_filter.is_domain_blocked(name):
+            self.stats['blocked'] += 1
+            return self._blocked_response(query, question, question_end)
+
+        answer = self.cache.get(question, query, question_end, time.monotonic())
+        if answer is not None:
+            self.stats['cached'] += 1
+        return answer
+
+    async def resolve(self, query: bytes) -> bytes:
+        """Answer a query, forwarding it to an upstream if needed."""
+        answer = self.resolve_local(query)
+        if answer is not None:
+            return answer
+        return await self.forward(query)
+
+    async def forward(self, query: bytes) -> bytes:
+        """Answer a query that resolve_local() returned None for from an upstream.
+
+        Concurrent identical queries share one upstream query. If the task
+        running it is cancelled, the queries waiting for it get SERVFAIL.
+        """
+        question, question_end = parse_question(query)
+        pending = self._inflight.get(question)
+        if pending is None:
+            pending = asyncio.get_running_loop().create_future()
+            self._inflight[question] = pending
+            self.stats['forwarded'] += 1
+            response = None
+            try:
+                response = await self.upstreams.query(query, question_end)
+                self.cache.put(question, response, time.monotonic())
+            except Exception as e:
+                logger.error(f"Failed to resolve {question[0]!r}: {e}")
+            finally:
+                del self._inflight[question]
+                if not pending.done():
+                    pending.set_result(response)
+        else:
+            response = await pending
+
+        if response is None:
+            self.stats['failed'] += 1
+            return build_response(query, question_end, RCODE_SERVFAIL)
+        return query[:2] + response[2:12] + query[12:question_end] + response[question_end:]
+
+    @staticmethod
+    def fit_udp(query: bytes, response: bytes) -> bytes:
+        """Truncate a response that is too large for the client's UDP buffer."""
+        if len(response) <= 512:
+            return response
+        try:
+            _, question_end = parse_question(query)
+        except (IndexError, ValueError, struct.error):
+            return response
+        if len(response) <= udp_payload_limit(query, question_end):
+            return response
+        query_id, flags = struct.unpack_from('!HH', response)
+        return HEADER.pack(query_id, flags | FLAG_TC, 1, 0, 0, 0) + response[12:question_end]
+
+    async def _serve_tcp(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                length = int.from_bytes(await reader.readexactly(2), 'big')
+                query = await reader.readexactly(length)
+                answer = await self.resolve(query)
+                if answer:
+                    writer.write(len(answer).to_bytes(2, 'big') + answer)
+                    await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            logger.error(f"Error serving DNS over TCP: {e}")
+        finally:
+            writer.close()
+
+    async def start(self, host: str = '127.0.0.1', port: int = DNS_PORT) -> Tuple[str, int]:
+        """Listen for queries over UDP and TCP.
+
+        Args:
+            host: Address to listen on
+            port: Port to listen on; 0 picks a free port
+
+        Returns:
+            The (address, port) the sinkhole listens on
+        """
+        loop = asyncio.get_running_loop()
+        self._udp, _ = await loop.create_datagram_endpoint(lambda: _ServerProtocol(self), local_addr=(host, port))
+        address = self._udp.get_extra_info('sockname')[:2]
+        self._tcp = await asyncio.start_server(self._serve_tcp, address[0], address[1])
+        logger.info(f"DNS sinkhole listening on {address[0]}:{address[1]}")
+        return address
+
+    async def close(self) -> None:
+        """Stop listening and close the upstream connections."""
+        if self._udp is not None:
+            self._udp.close()
+        if self._tcp is not None:
+            self._tcp.close()
+            await self._tcp.wait_closed()
+        for task in list(self._tasks):
+            task.cancel()
+        self.upstreams.close()
+
+
+def parse_upstream(value: str) -> Tuple[str, int]:
+    """Parse "address", "address:port" or "[v6 address]:port"."""
+    if value.startswith('['):
+        address, _, port = value[1:].partition(']:')
+        return address, int(port or DNS_PORT)
+    if value.count(':') == 1:
+        address, port = value.split(':')
+        return address, int(port)
+    ipaddress.ip_address(value)
+    return value, DNS_PORT
+
+
+def main():
+    """Run the sinkhole as a service."""
+    from .content_filter import ContentFilter
+
+    parser = argparse.ArgumentParser(description='Charon DNS sinkhole')
+    parser.add_argument('--listen', default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('--port', type=int, default=DNS_PORT, help='Port to listen on')
+    parser.add_argument('--upstream', action='append', default=[],
+                        help='Upstream resolver as address[:port]; may be repeated')
+    parser.add_argument('--block-mode', choices=(BLOCK_NXDOMAIN, BLOCK_ZERO), default=BLOCK_NXDOMAIN)
+    parser.add_argument('--db', default=None, help='Content filter database')
+    parser.add_argument('--cache-size', type=int, default=10000)
+    parser.add_argument('--snapshot', dest='snapshot', action='store_true', default=True,
+                        help='Read the shared blocklist snapshot (default)')
+    parser.add_argument('--no-snapshot', dest='snapshot', action='store_false',
+                        help='Hold the block list in this process and reload it every --reload-interval seconds')
+    parser.add_argument('--reload-interval', type=int, default=60,
+                        help='Seconds between reloads of the block list with --no-snapshot')
+    parser.add_argument('--prefilter-fp-rate', type=float, default=None,
+                        help='False-positive rate of the Bloom filter checked before lookups, e.g. 0.01')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    upstreams = [parse_upstream(value) for value in args.upstream or ['1.1.1.1', '9.9.9.9']]
+    content_filter = ContentFilter(args.db, use_snapshot=args.snapshot, prefilter_fp_rate=args.prefilter_fp_rate)
+
+    async def reload_index():
+        # The in-process index does not see changes made by the web interface
+        # or the API, so reload it periodically, off the event loop
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(args.reload_interval)
+            await loop.run_in_executor(None, content_filter.reload_index)
+
+    async def serve():
+        sinkhole = DNSSinkhole(content_filter, upstreams, args.block_mode, cache_size=args.cache_size)
+        await sinkhole.start(args.listen, args.port)
+        reloader = None if args.snapshot else asyncio.ensure_future(reload_index())
+        try:
+            while True:
+                await asyncio.sleep(60)
+                logger.info(f"DNS sinkhole stats: {sinkhole.stats}")
+                if args.prefilter_fp_rate is not None:
+                    # Shown by GET /api/v1/content-filter/prefilter
+                    content_filter.save_prefilter_stats()
+        finally:
+            if reloader is not None:
+                reloader.cancel()
+            await sinkhole.close()
+            if args.prefilter_fp_rate is not None:
+                content_filter.save_prefilter_stats()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Domain Index Module for Charon Firewall
+
+This module keeps the content filter block list in memory so that a lookup,
+done for every DNS query, needs no database access. Each category has its
+own shard of two hash sets:
+
+- exact: names blocked as is (``example.com``)
+- wildcard: suffixes blocked for all their subdomains (``*.example.com`` is
+  stored as ``example.com``)
+
+The active block list is the union of the shards of the enabled categories.
+Enabling or disabling a category attaches or detaches its shard without
+touching its domains, and adding a domain only changes the shard of its
+category. A lookup checks the name in the exact set of each active shard and
+then each of its parent suffixes in the wildcard sets, which is one hash
+probe per label and shard. Shards without exact names or without wildcards
+are left out of the respective checks.
+"""
+
+import threading
+from typing import Dict, Iterable, Iterator, Optional, Set, Tuple
+
+from .blocklist_import import normalize_domain
+
+
+class DomainShard:
+    """Blocked names of one category."""
+
+    __slots__ = ('exact', 'wildcard')
+
+    def __init__(self):
+        self.exact: Set[str] = set()
+        self.wildcard: Set[str] = set()
+
+    def add(self, domain: str) -> None:
+        if domain.startswith('*.'):
+            self.wildcard.add(domain[2:])
+        else:
+            self.exact.add(domain)
+
+    def discard(self, domain: str) -> bool:
+        """Remove a stored domain; returns True if the shard held it."""
+        if domain.startswith('*.'):
+            members, domain = self.wildcard, domain[2:]
+        else:
+            members = self.exact
+        if domain in members:
+            members.discard(domain)
+            return True
+        return False
+
+    def __contains__(self, domain: str) -> bool:
+        if domain.startswith('*.'):
+            return domain[2:] in self.wildcard
+        return domain in self.exact
+
+    def __len__(self) -> int:
+        return len(self.exact) + len(self.wildcard)
+
+    def __iter__(self) -> Iterator[str]:
+        """Iterate over the domains in their stored form."""
+        yield from self.exact
+        for suffix in self.wildcard:
+            yield '*.' + suffix
+
+
+class DomainIndex:
+    """In-memory index of blocked domains sharded by category."""
+
+    def __init__(self):
+        # Every category with domains, enabled or not, as stored in the database
+        self.shards: Dict[str, DomainShard] = {}
+        self.enabled: Set[str] = set()
+        # Enabled shards holding exact names and wildcards, read by lookups
+        self._exact: Tuple[Set[str], ...] = ()
+        self._wildcard: Tuple[Set[str], ...] = ()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Tuple[str, str, Optional[bool]]]) -> 'DomainIndex':
+        """Build an index from (domain, category, category enabled) rows.
+
+        Domains of categories that do not exist (enabled is None) are kept
+        but not blocked until the category is created.
+        """
+        index = cls()
+        for domain, category, enabled in rows:
+            shard = index.shards.get(category)
+            if shard is None:
+                shard = index.shards[category] = DomainShard()
+            shard.add(domain)
+            if enabled:
+                index.enabled.add(category)
+        index._attach()
+        return index
+
+    def _attach(self) -> None:
+        """Recompute the shards read by lookups; costs one step per category."""
+        active = [self.shards[name] for name in self.enabled if name in self.shards]
+        self._exact = tuple(shard.exact for shard in active if shard.exact)
+        self._wildcard = tuple(shard.wildcard for shard in active if shard.wildcard)
+
+    def add(self, domain: str, category: str) -> None:
+        """Add a normalized domain, moving it out of any other category."""
+        self.add_many((domain,), category)
+
+    def add_many(self, domains: Iterable[str], category: str) -> None:
+        """Add normalized domains to a category, moving them out of any other."""
+        domains = set(domains)
+        with self._lock:
+            for name, shard in self.shards.items():
+                if name != category:
+                    for domain in domains:
+                        shard.discard(domain)
+            shard = self.shards.get(category)
+            if shard is None:
+                shard = self.shards[category] = DomainShard()
+            for domain in domains:
+                shard.add(domain)
+            self._attach()
+
+    def remove(self, domain: str) -> None:
+        """Remove a normalized domain from whichever category holds it."""
+        with self._lock:
+            for shard in self.shards.values():
+                shard.discard(domain)
+            self._attach()
+
+    def category_of(self, domain: str) -> Optional[str]:
+        """Get the category holding a stored domain."""
+        for name, shard in self.shards.items():
+            if domain in shard:
+                return name
+        return None
+
+    def set_category_enabled(self, category: str, enabled: bool) -> None:
+        """Start or stop blocking the domains of a category."""
+        with self._lock:
+            if enabled:
+                self.enabled.add(category)
+            else:
+                self.enabled.discard(category)
+            self._attach()
+
+    def is_blocked(self, domain: str, normalized: bool = False) -> bool:
+        """Check whether a domain is blocked by an enabled category.
+
+        Args:
+            domain: The domain to check, normalized or not (e.g. a URL)
+            normalized: True if the caller already normalized the domain,
+                which skips the checks for URLs, case and "www."
+        """
+        if not normalized and (not domain.islower() or '/' in domain or
+                               domain.startswith('www.') or domain.endswith('.')):
+            domain = normalize_domain(domain)
+        for exact in self._exact:
+            if domain in exact:
+                return True
+        wildcards = self._wildcard
+        if not wildcards:
+            return False
+        dot = domain.find('.')
+        while dot != -1:
+            domain = domain[dot + 1:]
+            for wildcard in wildcards:
+                if domain in wildcard:
+                    return True
+            dot = domain.find('.')
+        return False
+
+    def __len__(self) -> int:
+        """Number of blocked names in the enabled categories."""
+        return sum(map(len, self._exact)) + sum(map(len, self._wildcard))
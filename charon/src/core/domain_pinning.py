@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Domain Pinning Module for Charon Firewall
+
+nftables cannot match DNS names on the packet path, so this module resolves
+the blocked domains and pins their addresses into two nft sets,
+``blocked_ipv4`` (ipv4_addr) and ``blocked_ipv6`` (ipv6_addr), which are
+matched by a reject rule in the forward and output hooks. Each set lookup
+is a single hash probe, however many domains are blocked.
+
+Set elements carry a timeout derived from the DNS TTL (clamped between a
+floor and a ceiling), so the kernel drops addresses that are no longer
+refreshed. Each sync only resolves the domains whose pins are about to
+expire, and sends all additions and removals as a single nft transaction.
+Timeouts get a little random jitter, so domains pinned together do not all
+expire, and get refreshed, at the same moment. The first sync of a process
+flushes the sets in the same transaction, so pins left by a previous run
+are replaced rather than kept with their old timeouts.
+
+Wildcard entries (``*.example.com``) cannot be enumerated and are not
+pinned; the DNS sinkhole blocks them at resolution time.
+"""
+
+import asyncio
+import logging
+import math
+import random
+import re
+import time
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from .dns_sinkhole import (
+    DNS_PORT, RCODE_NOERROR, RCODE_NXDOMAIN, TYPE_A, TYPE_AAAA, UpstreamPool, answer_addresses, build_query
+)
+from .packet_filter import NftTransaction, PacketFilter
+
+logger = logging.getLogger('charon.domain_pinning')
+
+IPV4_SET = "blocked_ipv4"
+IPV6_SET = "blocked_ipv6"
+CHAINS = {"content_filter_forward": "forward", "content_filter_output": "output"}
+
+# Elements per "add element" command
+ELEMENT_CHUNK = 1000
+
+# Resolves a domain to (address, TTL) pairs; raises on failure
+Resolver = Callable[[str], Awaitable[List[Tuple[str, int]]]]
+
+
+def system_resolvers(path: str = '/etc/resolv.conf') -> List[Tuple[str, int]]:
+    """Get the nameservers configured in resolv.conf."""
+    try:
+        with open(path) as f:
+            return [(match.group(1), DNS_PORT)
+                    for match in re.finditer(r'^\s*nameserver\s+(\S+)', f.read(), re.MULTILINE)]
+    except OSError:
+        return []
+
+
+class DomainPinner:
+    """Keeps the addresses of blocked domains in nft sets."""
+
+    def __init__(self, packet_filter: PacketFilter, resolver: Optional[Resolver] = None,
+                 upstreams: Optional[List[Tuple[str, int]]] = None, concurrency: int = 64,
+                 min_timeout: int = 300, max_timeout: int = 86400,
+                 refresh_margin: float = 0.2, jitter: float = 0.1):
+        """Initialize the pinner.
+
+        Args:
+            packet_filter: Packet filter whose table holds the sets
+            resolver: Coroutine resolving a domain to (address, TTL) pairs;
+                      defaults to querying `upstreams` directly
+            upstreams: Resolvers used by the default resolver, defaults to the
+                       nameservers of /etc/resolv.conf. These must not be the
+                       DNS sinkhole, which would hide the blocked addresses.
+            concurrency: Largest number of domains resolved at the same time
+            min_timeout: Shortest element timeout in seconds, however low the TTL
+            max_timeout: Longest element timeout in seconds
+            refresh_margin: Fraction of its timeout before expiry at which a
+                            domain is resolved again
+            jitter: Largest random fraction added to each timeout
+        """
+        self.packet_filter = packet_filter
+        self.concurrency = concurrency
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.refresh_margin = refresh_margin
+        self.jitter = jitter
+        self._pool = None
+        if resolver is None:
+            self._pool = UpstreamPool(upstreams or system_resolvers() or [('1.1.1.1', DNS_PORT)])
+            resolver = self._resolve
+        self.resolver = resolver
+
+        # domain -> (expires, timeout, addresses)
+        self._domains: Dict[str, Tuple[float, float, Set[str]]] = {}
+        # address -> expiry of its set element
+        self._elements: Dict[str, float] = {}
+        self._initialized = False
+
+    async def _resolve(self, domain: str) -> List[Tuple[str, int]]:
+        """Resolve the A and AAAA records of a domain through the upstream pool."""
+        addresses = []
+        for qtype in (TYPE_A, TYPE_AAAA):
+            query, question_end = build_query(domain, qtype)
+            records, rcode = answer_addresses(await self._pool.query(query, question_end))
+            if rcode not in (RCODE_NOERROR, RCODE_NXDOMAIN):
+                raise ConnectionError(f"upstream returned rcode {rcode}")
+            addresses.extend(records)
+        return addresses
+
+    def _setup(self, txn: NftTransaction) -> None:
+        """Queue the sets and the chains rejecting traffic to them.
+
+        The sets are flushed: elements left by an earlier process are not
+        tracked, and adding them again would not extend their timeouts.
+        """
+        txn.add_table()
+        txn.add_set(IPV4_SET, "ipv4_addr", ["timeout"])
+        txn.add_set(IPV6_SET, "ipv6_addr", ["timeout"])
+        txn.flush_set(IPV4_SET)
+        txn.flush_set(IPV6_SET)
+        for chain, hook in CHAINS.items():
+            # Ahead of the main filter chains, which run at priority 0
+            txn.add_chain(chain, f"type filter hook {hook} priority -5; policy accept;")
+            txn.flush_chain(chain)
+            txn.add_rule(chain, f"ip daddr @{IPV4_SET} reject")
+            txn.add_rule(chain, f"ip6 daddr @{IPV6_SET} reject")
+
+    def _timeout(self, ttl: Optional[int]) -> float:
+        timeout = min(max(ttl or 0, self.min_timeout), self.max_timeout)
+        return timeout * (1 + random.uniform(0, self.jitter))
+
+    def due(self, domains: Iterable[str], now: Optional[float] = None) -> List[str]:
+        """Get the domains that are not pinned or whose pins expire soon."""
+        now = time.time() if now is None else now
+        due = []
+        for domain in domains:
+            state = self._domains.get(domain)
+            if state is None or now >= state[0] - self.refresh_margin * state[1]:
+                due.append(domain)
+        return due
+
+    async def _resolve_all(self, domains: List[str]) -> Dict[str, Optional[List[Tuple[str, int]]]]:
+        """Resolve domains with at most `concurrency` resolutions at a time."""
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def resolve(domain):
+            async with semaphore:
+                try:
+                    return domain, await self.resolver(domain)
+                except Exception as e:
+                    logger.debug(f"Failed to resolve {domain}: {e!r}")
+                    return domain, None
+
+        return dict(await asyncio.gather(*(resolve(domain) for domain in domains)))
+
+    async def sync(self, domains: Iterable[str], now: Optional[float] = None) -> Dict[str, int]:
+        """Bring the sets in line with the blocked domains.
+
+        Only new domains and domains whose pins expire within the refresh
+        margin are resolved. A domain that fails to resolve keeps its current
+        pins until they expire, and is retried on the next sync.
+
+        Args:
+            domains: Blocked domains; wildcards are skipped
+            now: Current time, for tests
+
+        Returns:
+            Dict with the counts of resolved, failed, added, refreshed and
+            removed elements; empty if the nft transaction failed
+        """
+        now = time.time() if now is None else now
+        wanted = {domain for domain in domains if not domain.startswith('*.')}
+        due = self.due(wanted, now)
+        results = await self._resolve_all(due)
+        stats = {'resolved': 0, 'failed': 0, 'added': 0, 'refreshed': 0, 'removed': 0}
+
+        domains_state = dict(self._domains)
+        for domain, records in results.items():
+            if records is None:
+                stats['failed'] += 1
+                continue
+            stats['resolved'] += 1
+            # Names without addresses are checked again after min_timeout
+            timeout = self._timeout(min((ttl for _, ttl in records), default=None))
+            domains_state[domain] = (now + timeout, timeout, {address for address, _ in records})
+        for domain in list(domains_state):
+            if domain not in wanted:
+                del domains_state[domain]
+
+        # Every address expires with the last domain pinning it
+        expiry: Dict[str, float] = {}
+        for expires, _, addresses in domains_state.values():
+            for address in addresses:
+                if expiry.get(address, 0) < expires:
+                    expiry[address] = expires
+
+        added: List[Tuple[str, float]] = []
+        refreshed: List[Tuple[str, float]] = []
+        removed: List[str] = []
+        # Sorted so that the commands do not depend on resolution order
+        for address, expires in sorted(expiry.items()):
+            current = self._elements.get(address)
+            if current is None or current <= now:
+                added.append((address, expires))
+            elif current < expires:
+                refreshed.append((address, expires))
+        for address, current in sorted(self._elements.items()):
+            if address not in expiry and current > now:
+                removed.append(address)
+
+        txn = self.packet_filter.transaction()
+        if not self._initialized:
+            self._setup(txn)
+        self._queue(txn, added, refreshed, removed, now)
+        if not txn.commit():
+            logger.error("Failed to update pinned content filter addresses")
+            return {}
+
+        self._initialized = True
+        self._domains = domains_state
+        removed_addresses = set(removed)
+        self._elements = {address: expires for address, expires in self._elements.items()
+                          if expires > now and address not in removed_addresses}
+        self._elements.update(added)
+        self._elements.update(refreshed)
+        stats.update(added=len(added), refreshed=len(refreshed), removed=len(removed))
+        if added or refreshed or removed:
+            logger.info(f"Pinned content filter addresses: {stats}")
+        return stats
+
+    @staticmethod
+    def _queue(txn: NftTransaction, added: List[Tuple[str, float]], refreshed: List[Tuple[str, float]],
+               removed: List[str], now: float) -> None:
+        """Queue the element changes of a sync."""
+        def element(address, expires):
+            return f"{address} timeout {math.ceil(expires - now)}s"
+
+        def by_set(addresses):
+            ipv4 = [a for a in addresses if ':' not in a.split(' ', 1)[0]]
+            ipv6 = [a for a in addresses if ':' in a.split(' ', 1)[0]]
+            return ((IPV4_SET, ipv4), (IPV6_SET, ipv6))
+
+        # Adding an element that exists does not change its timeout, and
+        # deleting one that has just expired fails the transaction, so an
+        # element is added (a no-op if present), deleted and added back.
+        # The transaction is atomic, so packets never see the gap.
+        for set_name, addresses in by_set([a for a, _ in refreshed] + removed):
+            for start in range(0, len(addresses), ELEMENT_CHUNK):
+                chunk = addresses[start:start + ELEMENT_CHUNK]
+                txn.add_element(set_name, chunk)
+                txn.delete_element(set_name, chunk)
+        for set_name, elements in by_set([element(a, e) for a, e in added + refreshed]):
+            for start in range(0, len(elements), ELEMENT_CHUNK):
+                txn.add_element(set_name, elements[start:start + ELEMENT_CHUNK])
+
+    async def run(self, get_domains: Callable[[], Iterable[str]], interval: float = 60.0) -> None:
+        """Sync the sets with `get_domains()` every `interval` seconds until cancelled."""
+        try:
+            while True:
+                try:
+                    await self.sync(get_domains())
+                except Exception as e:
+                    logger.error(f"Failed to sync pinned content filter addresses: {e}")
+                await asyncio.sleep(interval)
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        """Close the upstream connections of the default resolver."""
+        if self._pool is not None:
+            self._pool.close()
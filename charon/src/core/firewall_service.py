@@ -24,42 +24,48 @@ def main():
     # Create packet filter instance
     pf = PacketFilter()
 
-    # Set up base tables and chains
-    if not pf.setup_base_table():
-        logger.error("Failed to set up base tables and chains")
-        return
+    # Build the whole ruleset in one transaction so it is applied atomically
+    txn = pf.transaction()
+
+    # Set up base tables and chains, replacing any previous ruleset
+    txn.setup_base_table(flush=True)
 
     # Allow established and related connections
-    pf.add_rule("input", "ct state established,related counter accept comment \"Allow established and related connections\"")
-    pf.add_rule("output", "ct state established,related counter accept comment \"Allow established and related connections\"")
-    pf.add_rule("forward", "ct state established,related counter accept comment \"Allow established and related connections\"")
+    txn.add_rule("input", "ct state established,related counter accept comment \"Allow established and related connections\"")
+    txn.add_rule("output", "ct state established,related counter accept comment \"Allow established and related connections\"")
+    txn.add_rule("forward", "ct state established,related counter accept comment \"Allow established and related connections\"")
 
     # Allow ICMP
-    pf.add_rule("input", "meta l4proto icmp counter accept comment \"Allow incoming ICMP\"")
-    pf.add_rule("output", "meta l4proto icmp counter accept comment \"Allow outgoing ICMP\"")
-    pf.add_rule("forward", "meta l4proto icmp counter accept comment \"Allow forwarded ICMP\"")
+    txn.add_rule("input", "meta l4proto icmp counter accept comment \"Allow incoming ICMP\"")
+    txn.add_rule("output", "meta l4proto icmp counter accept comment \"Allow outgoing ICMP\"")
+    txn.add_rule("forward", "meta l4proto icmp counter accept comment \"Allow forwarded ICMP\"")
 
     # Allow SSH access to the firewall
-    pf.add_rule("input", "tcp dport 22 ct state new counter accept comment \"Allow SSH access\"")
+    txn.add_rule("input", "tcp dport 22 ct state new counter accept comment \"Allow SSH access\"")
 
     # Allow HTTP/HTTPS access to the firewall's web interface
-    pf.add_rule("input", "tcp dport { 80, 443 } ct state new counter accept comment \"Allow HTTP/HTTPS access\"")
+    txn.add_rule("input", "tcp dport { 80, 443 } ct state new counter accept comment \"Allow HTTP/HTTPS access\"")
 
     # Set up NAT for LAN clients
-    pf.add_nat_rule(NATType.MASQUERADE, {
+    txn.add_nat_rule(NATType.MASQUERADE, {
         "chain": "postrouting",
         "source": "10.0.0.0/24",  # LAN network
         "comment": "NAT for LAN clients"
     })
 
     # Allow forwarding from LAN to DMZ
-    pf.add_rule("forward", "ip saddr 10.0.0.0/24 ip daddr 172.16.0.0/24 ct state new counter accept comment \"Allow LAN to DMZ\"")
+    txn.add_rule("forward", "ip saddr 10.0.0.0/24 ip daddr 172.16.0.0/24 ct state new counter accept comment \"Allow LAN to DMZ\"")
 
     # Allow forwarding from LAN to WAN
-    pf.add_rule("forward", "ip saddr 10.0.0.0/24 ct state new counter accept comment \"Allow LAN to WAN\"")
+    txn.add_rule("forward", "ip saddr 10.0.0.0/24 ct state new counter accept comment \"Allow LAN to WAN\"")
 
     # Allow forwarding from DMZ to WAN
-    pf.add_rule("forward", "ip saddr 172.16.0.0/24 ct state new counter accept comment \"Allow DMZ to WAN\"")
+    txn.add_rule("forward", "ip saddr 172.16.0.0/24 ct state new counter accept comment \"Allow DMZ to WAN\"")
+
+    # Commit everything as a single nftables transaction
+    if not txn.commit():
+        logger.error("Failed to apply firewall ruleset, previous ruleset left in place")
+        return
 
     logger.info("Firewall rules configured successfully")
 
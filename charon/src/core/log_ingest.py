@@ -0,0 +1,520 @@
+#!/usr/bin/env python3
+"""
+Firewall Log Ingestion Module for Charon Firewall
+
+Database.add_log commits one ORM object per call, which tops out at a few
+hundred events per second. This module moves firewall log events into the
+daily log partitions (see LogStore) at kernel log rates instead:
+
+- Readers follow log files (kern.log, syslog, or the JSON output of ulogd for
+  NFLOG) or a stream such as stdin, in large chunks, and hand complete lines
+  to the ingestor.
+- Lines wait in a bounded buffer. Readers of files block when it is full,
+  which pauses reading (backpressure); other producers can submit without
+  blocking, in which case the lines that do not fit are dropped and counted.
+- A writer thread parses the lines with precompiled patterns and inserts
+  them with one executemany per batch, when a batch is full or the oldest
+  waiting line is older than the flush interval. Their rollup counts are
+  collected in memory and added to the rollup tables every rollup interval,
+  so a source and destination seen in many batches costs one upsert per
+  interval instead of one per batch. As the only writer of the logs, the
+  thread also applies their retention.
+
+Kernel lines are the output of the LOG target ("... IN=eth0 OUT= SRC=...
+DST=... PROTO=TCP SPT=... DPT=..."); the chain follows from IN/OUT, the
+action from DROP, REJECT or ACCEPT in the log prefix, and a rule ID from
+"charon:<id>" in the prefix. JSON lines use the ulogd field names (oob.prefix,
+oob.in, src_ip, dest_ip, ip.protocol, ...). Lines of neither kind are skipped.
+
+On SQLite the ingestor's connections use WAL with synchronous=NORMAL, so
+readers of the log tables are not blocked by the writer and a batch costs one
+WAL append.
+"""
+
+import argparse
+import collections
+import datetime
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from typing import Any, Deque, Dict, Iterable, List, Optional, TextIO, Tuple
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import SQLAlchemyError
+
+from ..db.database import Database
+from ..db.log_archive import LogArchive
+from ..db.log_store import LogStore
+
+logger = logging.getLogger('charon.log_ingest')
+
+# Characters read from a file or stream at once
+READ_SIZE = 1 << 20
+
+# Fields of a LOG target line, after "IN="
+KERNEL_FIELDS = re.compile(
+    r'IN=(?P<in>\S*) OUT=(?P<out>\S*).*? SRC=(?P<src>\S+) DST=(?P<dst>\S+)'
+    r'.*? PROTO=(?P<proto>\w+)(?:.*? SPT=(?P<spt>\d+) DPT=(?P<dpt>\d+))?'
+)
+ACTION = re.compile(r'\b(DROP|REJECT|ACCEPT)', re.IGNORECASE)
+RULE_ID = re.compile(r'charon[:-](\d+)', re.IGNORECASE)
+MONTHS = {name: number for number, name in enumerate(
+    ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'), 1)}
+# Traditional syslog timestamp, "Oct 17 05:42:07"
+SYSLOG_STAMP = re.compile(r'(?:%s) [ \d]\d \d\d:\d\d:\d\d' % '|'.join(MONTHS))
+
+IP_PROTOCOLS = {1: "icmp", 6: "tcp", 17: "udp", 58: "icmpv6", 132: "sctp"}
+
+
+class LogParser:
+    """Turns kernel LOG lines and ulogd JSON lines into FirewallLog rows."""
+
+    def __init__(self):
+        # Log lines come in bursts with the same timestamp; parse each one once
+        self._stamp: Optional[str] = None
+        self._time: Optional[datetime.datetime] = None
+        # Log prefixes repeat; action and rule ID of each one seen
+        self._prefixes: Dict[str, Tuple[str, Optional[int]]] = {}
+
+    def parse(self, line: str) -> Optional[Dict[str, Any]]:
+        """Parse one log line.
+
+        Returns:
+            Optional[Dict[str, Any]]: Column values of a FirewallLog row, or None
+                if the line is not a firewall log event
+        """
+        if line.startswith('{'):
+            return self._parse_json(line)
+        start = line.find('IN=')
+        if start < 0:
+            return None
+        match = KERNEL_FIELDS.search(line, start)
+        if match is None:
+            return None
+        head = line[:start]
+        # The log prefix follows the syslog header and the kernel uptime, "kernel: [123.456] "
+        prefix = head[head.find(': ') + 1:]
+        if prefix.startswith(' ['):
+            prefix = prefix[prefix.find(']') + 1:]
+        fields = match.groupdict()
+        return self._row(self._kernel_time(head), prefix, fields['in'], fields['out'], fields['src'],
+                         fields['dst'], fields['proto'].lower(), fields['spt'], fields['dpt'])
+
+    def _parse_json(self, line: str) -> Optional[Dict[str, Any]]:
+        try:
+            data = json.loads(line)
+        except ValueError:
+            return None
+        if not isinstance(data, dict) or 'src_ip' not in data:
+            return None
+        protocol = data.get('ip.protocol')
+        if isinstance(protocol, int):
+            protocol = IP_PROTOCOLS.get(protocol, str(protocol))
+        src_port, dst_port = data.get('src_port'), data.get('dest_port')
+        return self._row(self._iso_time(data.get('timestamp')), data.get('oob.prefix') or '',
+                         data.get('oob.in'), data.get('oob.out'), data['src_ip'], data.get('dest_ip'),
+                         protocol, None if src_port is None else str(src_port),
+                         None if dst_port is None else str(dst_port))
+
+    def _row(self, timestamp: datetime.datetime, prefix: str, interface_in: Optional[str],
+             interface_out: Optional[str], src_ip: str, dst_ip: Optional[str], protocol: Optional[str],
+             src_port: Optional[str], dst_port: Optional[str]) -> Dict[str, Any]:
+        if interface_in and interface_out:
+            chain = 'forward'
+        elif interface_out:
+            chain = 'output'
+        else:
+            chain = 'input'
+        try:
+            action, rule_id = self._prefixes[prefix]
+        except KeyError:
+            match = ACTION.search(prefix)
+            rule = RULE_ID.search(prefix)
+            action = match.group(1).lower() if match else 'log'
+            rule_id = int(rule.group(1)) if rule else None
+            if len(self._prefixes) < 10000:
+                self._prefixes[prefix] = (action, rule_id)
+        return {
+            'timestamp': timestamp,
+            'chain': chain,
+            'action': action,
+            'protocol': protocol,
+            'src_ip': src_ip,
+            'dst_ip': dst_ip,
+            'src_port': src_port,
+            'dst_port': dst_port,
+            'rule_id': rule_id,
+        }
+
+    def _kernel_time(self, head: str) -> datetime.datetime:
+        """Timestamp of a syslog line: RFC 3339 or traditional, else now."""
+        stamp = head[:head.find(' ')]
+        if stamp == self._stamp or head[:15] == self._stamp:
+            return self._time
+        if 'T' in stamp and stamp[:4].isdigit():
+            return self._iso_time(stamp)
+        if SYSLOG_STAMP.match(head):
+            stamp = head[:15]
+            now = datetime.datetime.now()
+            parsed = datetime.datetime(now.year, MONTHS[stamp[:3]], int(stamp[4:6]), int(stamp[7:9]),
+                                       int(stamp[10:12]), int(stamp[13:15]))
+            if parsed > now + datetime.timedelta(days=1):
+                # Traditional timestamps have no year; this one is from December
+                parsed = parsed.replace(year=now.year - 1)
+            self._stamp, self._time = stamp, parsed
+            return parsed
+        return datetime.datetime.now()
+
+    def _iso_time(self, stamp: Optional[str]) -> datetime.datetime:
+        if not stamp:
+            return datetime.datetime.now()
+        if stamp != self._stamp:
+            try:
+                parsed = datetime.datetime.fromisoformat(stamp.replace('Z', '+00:00'))
+            except ValueError:
+                return datetime.datetime.now()
+            if parsed.tzinfo is not None:
+                # FirewallLog stores naive local times
+                parsed = parsed.astimezone().replace(tzinfo=None)
+            self._stamp, self._time = stamp, parsed
+        return self._time
+
+
+class LogIngestor:
+    """Buffers firewall log lines and writes them to the log partitions in batches."""
+
+    def __init__(self, connection_string: Optional[str] = None, batch_size: int = 5000,
+                 flush_interval: float = 1.0, max_pending: int = 200000, rollup_interval: float = 10.0,
+                 retention_interval: Optional[float] = None, raw_days: Optional[int] = 7,
+                 minute_days: Optional[int] = 2, hour_days: Optional[int] = 90,
+                 archive_path: Optional[str] = None, archive_days: Optional[int] = None):
+        """Initialize the ingestor.
+
+        Args:
+            connection_string: SQLAlchemy connection string (defaults to the one
+                Database uses)
+            batch_size: Rows inserted per transaction
+            flush_interval: Longest time in seconds a line waits before it is written
+            max_pending: Lines the buffer holds before producers block or lines are dropped
+            rollup_interval: Seconds the rollup counts of written batches are collected
+                before they are added to the rollup tables
+            retention_interval: Seconds between retention runs of the writer thread
+                (None leaves retention to Database.apply_log_retention)
+            raw_days: Days of raw logs to keep
+            minute_days: Days of per-minute counts to keep
+            hour_days: Days of per-hour counts to keep
+            archive_path: Directory of the log archive, which receives the raw logs
+                past their retention instead of them being dropped
+            archive_days: Days of archived logs to keep
+        """
+        self.connection_string = connection_string or Database().connection_string
+        self.engine = create_engine(self.connection_string)
+        if self.engine.dialect.name == 'sqlite':
+            event.listen(self.engine, 'connect', self._configure_sqlite)
+        self.store = LogStore(LogArchive(archive_path) if archive_path else None)
+        self.parser = LogParser()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.rollup_interval = rollup_interval
+        self.retention_interval = retention_interval
+        self.retention = {'raw_days': raw_days, 'minute_days': minute_days, 'hour_days': hour_days,
+                          'archive_days': archive_days}
+        self._last_retention: Optional[float] = None
+
+        self._pending: Deque[str] = collections.deque()
+        self._oldest: Optional[float] = None  # When the oldest pending line arrived
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._writer: Optional[threading.Thread] = None
+        self._readers: List[threading.Thread] = []
+        self._write_lock = threading.Lock()
+        # Rollup counts of the rows written since the rollup tables were last updated
+        self._rollups: Optional[Dict[str, Dict[tuple, int]]] = None
+        self._last_rollup = time.monotonic()
+        self.counters = {'received': 0, 'dropped': 0, 'skipped': 0, 'inserted': 0, 'failed': 0, 'batches': 0}
+
+    @staticmethod
+    def _configure_sqlite(dbapi_connection: Any, connection_record: Any) -> None:
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute('PRAGMA busy_timeout=5000')
+        cursor.close()
+
+    def submit(self, lines: List[str], block: bool = False, timeout: Optional[float] = None) -> int:
+        """Queue log lines for ingestion.
+
+        Args:
+            lines: Complete log lines
+            block: Wait for room in the buffer instead of dropping lines
+            timeout: Longest wait in seconds when blocking
+
+        Returns:
+            int: Number of lines accepted; the others were dropped
+        """
+        with self._cond:
+            if block:
+                self._cond.wait_for(lambda: len(self._pending) + len(lines) <= self.max_pending
+                                    or self._stop.is_set() or not self._pending, timeout)
+            room = max(0, self.max_pending - len(self._pending))
+            accepted = lines if len(lines) <= room else lines[:room]
+            if accepted:
+                if not self._pending:
+                    self._oldest = time.monotonic()
+                self._pending.extend(accepted)
+                self.counters['received'] += len(accepted)
+                if len(self._pending) >= self.batch_size:
+                    self._cond.notify_all()
+            self.counters['dropped'] += len(lines) - len(accepted)
+            return len(accepted)
+
+    def _take(self, wait: bool) -> List[str]:
+        """Take the next batch once it is full, old enough, or the ingestor stops."""
+        with self._cond:
+            if wait:
+                while not self._stop.is_set() and len(self._pending) < self.batch_size:
+                    remaining = (self.flush_interval if self._oldest is None or not self._pending
+                                 else self._oldest + self.flush_interval - time.monotonic())
+                    if self._pending and remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            count = min(len(self._pending), self.batch_size)
+            batch = [self._pending.popleft() for _ in range(count)]
+            self._oldest = time.monotonic() if self._pending else None
+            self._cond.notify_all()  # Room for blocked producers
+            return batch
+
+    def _write(self, lines: List[str]) -> int:
+        """Parse and insert one batch of lines."""
+        parse = self.parser.parse
+        rows = [row for row in map(parse, lines) if row is not None]
+        self.counters['skipped'] += len(lines) - len(rows)
+        if not rows:
+            return 0
+        with self._write_lock:
+            try:
+                with self.engine.begin() as conn:
+                    self.store.insert(conn, rows, rollup=False)
+            except SQLAlchemyError as e:
+                self.counters['failed'] += len(rows)
+                logger.error(f"Failed to insert {len(rows)} firewall log rows: {e}")
+                return 0
+            self.counters['inserted'] += len(rows)
+            self.counters['batches'] += 1
+            self._rollups = self.store.rollup_counts(rows, self._rollups)
+            if time.monotonic() - self._last_rollup >= self.rollup_interval:
+                self._write_rollups()
+        return len(rows)
+
+    def _write_rollups(self) -> None:
+        """Add the counts collected since the last call to the rollup tables."""
+        self._last_rollup = time.monotonic()
+        if self._rollups is None:
+            return
+        try:
+            with self.engine.begin() as conn:
+                self.store.write_rollups(conn, self._rollups)
+        except SQLAlchemyError as e:
+            # The counts are kept and written with the next ones
+            logger.error(f"Failed to update the firewall log rollups: {e}")
+            return
+        self._rollups = None
+
+    def flush(self) -> int:
+        """Write every pending line now.
+
+        Returns:
+            int: Number of rows inserted
+        """
+        inserted = 0
+        while True:
+            batch = self._take(wait=False)
+            if not batch:
+                break
+            inserted += self._write(batch)
+        with self._write_lock:
+            self._write_rollups()
+        return inserted
+
+    def ingest(self, lines: Iterable[str]) -> int:
+        """Parse and insert lines synchronously, bypassing the buffer.
+
+        Returns:
+            int: Number of rows inserted
+        """
+        inserted = 0
+        batch: List[str] = []
+        for line in lines:
+            batch.append(line)
+            if len(batch) >= self.batch_size:
+                inserted += self._write(batch)
+                batch = []
+        if batch:
+            inserted += self._write(batch)
+        with self._write_lock:
+            self._write_rollups()
+        return inserted
+
+    def start(self) -> None:
+        """Start the writer thread."""
+        if self._writer is not None and self._writer.is_alive():
+            return
+        self._stop.clear()
+        self._writer = threading.Thread(target=self._run, name="log-ingest-writer", daemon=True)
+        self._writer.start()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            batch = self._take(wait=True)
+            if batch:
+                self._write(batch)
+            if self.retention_interval is not None and (
+                    self._last_retention is None
+                    or time.monotonic() - self._last_retention >= self.retention_interval):
+                self.apply_retention()
+
+    def apply_retention(self) -> Optional[Dict[str, int]]:
+        """Drop (or archive) the log partitions and rollup counts older than their retention.
+
+        Returns:
+            Optional[Dict[str, int]]: What was removed, or None if it failed
+        """
+        self._last_retention = time.monotonic()
+        try:
+            with self.engine.begin() as conn:
+                return self.store.apply_retention(conn, **self.retention)
+        except (SQLAlchemyError, OSError) as e:
+            logger.error(f"Failed to apply log retention: {e}")
+            return None
+
+    def follow(self, path: str, from_end: bool = True, poll_interval: float = 0.2) -> None:
+        """Follow a log file in a background thread, like ``tail -F``.
+
+        The file is reopened when it is rotated or truncated.
+
+        Args:
+            path: The log file
+            from_end: Skip the lines already in the file
+            poll_interval: Seconds to wait for new data at the end of the file
+        """
+        reader = threading.Thread(target=self._follow, args=(path, from_end, poll_interval),
+                                  name=f"log-ingest-{os.path.basename(path)}", daemon=True)
+        self._readers.append(reader)
+        reader.start()
+
+    def _follow(self, path: str, from_end: bool, poll_interval: float) -> None:
+        f: Optional[TextIO] = None
+        inode = None
+        remainder = ''
+        try:
+            while not self._stop.is_set():
+                if f is None:
+                    try:
+                        f = open(path, 'r', errors='replace')
+                    except OSError:
+                        self._stop.wait(poll_interval)
+                        continue
+                    inode = os.fstat(f.fileno()).st_ino
+                    if from_end:
+                        f.seek(0, os.SEEK_END)
+                        from_end = False  # A rotated file is read from the start
+                chunk = f.read(READ_SIZE)
+                if chunk:
+                    lines = (remainder + chunk).split('\n')
+                    remainder = lines.pop()
+                    self.submit(lines, block=True)
+                    continue
+                try:
+                    stat = os.stat(path)
+                    rotated = stat.st_ino != inode or stat.st_size < f.tell()
+                except OSError:
+                    rotated = False  # Not recreated yet
+                if rotated:
+                    f.close()
+                    f = None
+                    remainder = ''
+                else:
+                    self._stop.wait(poll_interval)
+        finally:
+            if f is not None:
+                f.close()
+
+    def read_stream(self, stream: TextIO) -> None:
+        """Read log lines from a stream (e.g. stdin) until it ends."""
+        remainder = ''
+        while not self._stop.is_set():
+            chunk = stream.read(READ_SIZE) if stream.seekable() else stream.readline()
+            if not chunk:
+                break
+            lines = (remainder + chunk).split('\n')
+            remainder = lines.pop()
+            self.submit(lines, block=True)
+        if remainder:
+            self.submit([remainder], block=True)
+
+    def stop(self) -> None:
+        """Stop the readers and the writer, writing what is still pending."""
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        for reader in self._readers:
+            reader.join()
+        self._readers = []
+        if self._writer is not None:
+            self._writer.join()
+            self._writer = None
+        self.flush()
+
+    def stats(self) -> Dict[str, int]:
+        """Get the counters and the number of pending lines."""
+        with self._cond:
+            return dict(self.counters, pending=len(self._pending))
+
+
+def main():
+    """Run the ingestor on log files or stdin."""
+    parser = argparse.ArgumentParser(description='Charon firewall log ingestion')
+    parser.add_argument('paths', nargs='*', default=['-'],
+                        help='Log files to follow (kern.log, ulogd JSON), or - for stdin')
+    parser.add_argument('--db', default=None, help='SQLAlchemy connection string')
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--flush-interval', type=float, default=1.0)
+    parser.add_argument('--from-start', action='store_true', help='Read files from the beginning')
+    parser.add_argument('--raw-days', type=int, default=7, help='Days of raw logs to keep')
+    parser.add_argument('--minute-days', type=int, default=2, help='Days of per-minute counts to keep')
+    parser.add_argument('--hour-days', type=int, default=90, help='Days of per-hour counts to keep')
+    parser.add_argument('--archive-dir', default=os.environ.get('CHARON_LOG_ARCHIVE_PATH'),
+                        help='Move raw logs past their retention into Parquet files here (needs pyarrow)')
+    parser.add_argument('--archive-days', type=int, default=None, help='Days of archived logs to keep')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    ingestor = LogIngestor(args.db, batch_size=args.batch_size, flush_interval=args.flush_interval,
+                           retention_interval=3600.0, raw_days=args.raw_days,
+                           minute_days=args.minute_days, hour_days=args.hour_days,
+                           archive_path=args.archive_dir, archive_days=args.archive_days)
+    ingestor.start()
+    try:
+        files = [path for path in args.paths if path != '-']
+        for path in files:
+            ingestor.follow(path, from_end=not args.from_start)
+        if '-' in args.paths:
+            ingestor.read_stream(sys.stdin)
+        else:
+            while True:
+                time.sleep(60)
+                logger.info(f"Log ingestion stats: {ingestor.stats()}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ingestor.stop()
+        logger.info(f"Log ingestion stats: {ingestor.stats()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+nftables Backend Module for Charon Firewall
+
+This module provides the backends used by the packet filter to talk to
+nftables. Three implementations are available:
+
+- LibNftablesBackend drives libnftables in-process through ctypes and keeps a
+  single context alive for the life of the process.
+- SubprocessBackend runs the ``nft`` command line tool, one process per call.
+  It is used as a fallback when libnftables is not available.
+- MockBackend records every command it receives so the packet filter can be
+  tested without root privileges or a kernel with nftables.
+"""
+
+import ctypes
+import ctypes.util
+import json
+import logging
+import os
+import subprocess
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger('charon.nft_backend')
+
+# Output flags from libnftables.h
+NFT_CTX_OUTPUT_HANDLE = 1 << 3
+NFT_CTX_OUTPUT_JSON = 1 << 4
+
+
+class NftError(Exception):
+    """Raised when nftables rejects a command."""
+
+
+class NftBackend:
+    """Interface for executing nftables commands."""
+
+    name = "base"
+
+    def run(self, args: List[str], json_output: bool = False, capture: bool = False) -> str:
+        """Run a single nft command.
+
+        Args:
+            args: The command as an argument list without the leading "nft",
+                e.g. ["add", "rule", "inet", "charon", "input", "tcp dport 22 accept"]
+            json_output: Request JSON formatted output
+            capture: Return the command output instead of discarding it
+
+        Returns:
+            str: The command output (empty if not captured)
+
+        Raises:
+            NftError: If nftables rejects the command
+        """
+        raise NotImplementedError
+
+    def run_script(self, script: str) -> str:
+        """Run an nftables script as a single atomic transaction.
+
+        Args:
+            script: Commands in nftables syntax, one per line
+
+        Returns:
+            str: The output of the script
+
+        Raises:
+            NftError: If nftables rejects the script; nothing is applied
+        """
+        raise NotImplementedError
+
+    def run_json(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Run a batch of commands in the nftables JSON schema.
+
+        Args:
+            payload: A document of the form {"nftables": [...]}
+
+        Returns:
+            Dict[str, Any]: The decoded JSON output, empty if there was none
+
+        Raises:
+            NftError: If nftables rejects the batch; nothing is applied
+        """
+        raise NotImplementedError
+
+
+class SubprocessBackend(NftBackend):
+    """Backend that runs the nft command line tool for every call."""
+
+    name = "subprocess"
+
+    def __init__(self, nft_path: str = "nft"):
+        """Initialize the subprocess backend.
+
+        Args:
+            nft_path: Path to the nft binary
+        """
+        self.nft_path = nft_path
+
+    def run(self, args: List[str], json_output: bool = False, capture: bool = False) -> str:
+        cmd = [self.nft_path]
+        if json_output:
+            cmd.append("--json")
+        cmd.extend(args)
+        try:
+            if capture:
+                result = subprocess.run(cmd, check=True, capture_output=True, text=True)
+                return result.stdout
+            subprocess.run(cmd, check=True)
+            return ""
+        except subprocess.CalledProcessError as e:
+            raise NftError((e.stderr or str(e)).strip()) from e
+
+    def run_script(self, script: str) -> str:
+        try:
+            result = subprocess.run([self.nft_path, "-f", "-"], input=script, check=True,
+                                    capture_output=True, text=True)
+            return result.stdout or ""
+        except subprocess.CalledProcessError as e:
+            raise NftError((e.stderr or str(e)).strip()) from e
+
+    def run_json(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            result = subprocess.run([self.nft_path, "--json", "-f", "-"], input=json.dumps(payload),
+                                    check=True, capture_output=True, text=True)
+        except subprocess.CalledProcessError as e:
+            raise NftError((e.stderr or str(e)).strip()) from e
+        return json.loads(result.stdout) if result.stdout and result.stdout.strip() else {}
+
+
+class LibNftablesBackend(NftBackend):
+    """Backend that drives libnftables in-process through ctypes.
+
+    A single nft context is created per process and reused for every call,
+    so commands pay neither fork/exec nor library initialization costs.
+    libnftables contexts are not thread safe, so calls are serialized.
+    """
+
+    name = "libnftables"
+
+    def __init__(self, library: Optional[str] = None):
+        """Load libnftables and create the nft context.
+
+        Args:
+            library: Path or name of the shared library (auto-detected if None)
+
+        Raises:
+            OSError: If libnftables cannot be loaded
+        """
+        library = library or ctypes.util.find_library("nftables")
+        if not library:
+            raise OSError("libnftables not found")
+
+        self._lib = ctypes.CDLL(library)
+        self._lib.nft_ctx_new.restype = ctypes.c_void_p
+        self._lib.nft_ctx_new.argtypes = [ctypes.c_uint32]
+        self._lib.nft_ctx_free.argtypes = [ctypes.c_void_p]
+        self._lib.nft_ctx_buffer_output.argtypes = [ctypes.c_void_p]
+        self._lib.nft_ctx_buffer_error.argtypes = [ctypes.c_void_p]
+        self._lib.nft_ctx_output_set_flags.argtypes = [ctypes.c_void_p, ctypes.c_uint]
+        self._lib.nft_ctx_get_output_buffer.restype = ctypes.c_char_p
+        self._lib.nft_ctx_get_output_buffer.argtypes = [ctypes.c_void_p]
+        self._lib.nft_ctx_get_error_buffer.restype = ctypes.c_char_p
+        self._lib.nft_ctx_get_error_buffer.argtypes = [ctypes.c_void_p]
+        self._lib.nft_run_cmd_from_buffer.restype = ctypes.c_int
+        self._lib.nft_run_cmd_from_buffer.argtypes = [ctypes.c_void_p, ctypes.c_char_p]
+
+        self._lock = threading.Lock()
+        self._ctx = None
+        self._pid = None
+        self._flags = None
+        self._context()
+
+    def __del__(self):
+        if getattr(self, "_ctx", None) and self._pid == os.getpid():
+            self._lib.nft_ctx_free(self._ctx)
+            self._ctx = None
+
+    def _context(self):
+        """Return the nft context, creating a fresh one after a fork."""
+        if self._ctx is None or self._pid != os.getpid():
+            ctx = self._lib.nft_ctx_new(0)  # NFT_CTX_DEFAULT
+            if not ctx:
+                raise OSError("Failed to create libnftables context")
+            self._lib.nft_ctx_buffer_output(ctx)
+            self._lib.nft_ctx_buffer_error(ctx)
+            self._ctx = ctx
+            self._pid = os.getpid()
+            self._flags = None
+        return self._ctx
+
+    def _execute(self, buffer: str, flags: int) -> Tuple[int, str, str]:
+        with self._lock:
+            ctx = self._context()
+            if flags != self._flags:
+                self._lib.nft_ctx_output_set_flags(ctx, flags)
+                self._flags = flags
+            rc = self._lib.nft_run_cmd_from_buffer(ctx, buffer.encode())
+            output = self._lib.nft_ctx_get_output_buffer(ctx) or b""
+            error = self._lib.nft_ctx_get_error_buffer(ctx) or b""
+        return rc, output.decode(), error.decode()
+
+    def run(self, args: List[str], json_output: bool = False, capture: bool = False) -> str:
+        flags = NFT_CTX_OUTPUT_JSON | NFT_CTX_OUTPUT_HANDLE if json_output else 0
+        rc, output, error = self._execute(" ".join(args), flags)
+        if rc != 0:
+            raise NftError(error.strip() or f"nft command failed: {' '.join(args)}")
+        return output if capture else ""
+
+    def run_script(self, script: str) -> str:
+        rc, output, error = self._execute(script, 0)
+        if rc != 0:
+            raise NftError(error.strip() or "nft script failed")
+        return output
+
+    def run_json(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        # With JSON output enabled libnftables also parses its input as JSON
+        rc, output, error = self._execute(json.dumps(payload), NFT_CTX_OUTPUT_JSON | NFT_CTX_OUTPUT_HANDLE)
+        if rc != 0:
+            raise NftError(error.strip() or "nft JSON batch failed")
+        return json.loads(output) if output.strip() else {}
+
+
+class MockBackend(NftBackend):
+    """Backend that records commands instead of executing them."""
+
+    name = "mock"
+
+    def __init__(self, responses: Optional[Dict[str, str]] = None, fail_on: Optional[str] = None):
+        """Initialize the mock backend.
+
+        Args:
+            responses: Output to return for commands starting with a given prefix,
+                e.g. {"list table": '{"nftables": []}'}
+            fail_on: Raise NftError for any command containing this substring
+        """
+        self.responses = responses or {}
+        self.fail_on = fail_on
+        self.commands: List[Tuple[str, Any]] = []
+
+    def _check(self, text: str) -> None:
+        if self.fail_on and self.fail_on in text:
+            raise NftError(f"mock failure: {text}")
+
+    def _response(self, text: str) -> str:
+        for prefix, output in self.responses.items():
+            if text.startswith(prefix):
+                return output
+        return ""
+
+    def run(self, args: List[str], json_output: bool = False, capture: bool = False) -> str:
+        command = " ".join(args)
+        self._check(command)
+        self.commands.append(("cmd", command))
+        return self._response(command) if capture else ""
+
+    def run_script(self, script: str) -> str:
+        self._check(script)
+        self.commands.append(("script", script))
+        return ""
+
+    def run_json(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        self._check(json.dumps(payload))
+        self.commands.append(("json", payload))
+        return {}
+
+    def reset(self) -> None:
+        """Forget all recorded commands."""
+        self.commands = []
+
+
+_shared_backends: Dict[str, NftBackend] = {}
+_shared_lock = threading.Lock()
+
+
+def get_backend(name: Optional[str] = None) -> NftBackend:
+    """Get the nftables backend to use.
+
+    Backends are shared across the process, so every PacketFilter reuses the
+    same libnftables context.
+
+    Args:
+        name: "libnftables", "subprocess", "mock" or "auto". Defaults to the
+            CHARON_NFT_BACKEND environment variable, or "auto", which prefers
+            libnftables and falls back to the nft command line tool.
+
+    Returns:
+        NftBackend: The backend instance
+    """
+    name = (name or os.environ.get('CHARON_NFT_BACKEND', 'auto')).lower()
+
+    with _shared_lock:
+        if name in ("auto", "libnftables"):
+            if "libnftables" in _shared_backends:
+                return _shared_backends["libnftables"]
+            try:
+                backend = LibNftablesBackend()
+                _shared_backends["libnftables"] = backend
+                logger.info("Using libnftables backend")
+                return backend
+            except OSError as e:
+                if name == "libnftables":
+                    logger.warning(f"libnftables unavailable ({e}), falling back to nft subprocess")
+                else:
+                    logger.debug(f"libnftables unavailable ({e}), using nft subprocess")
+            name = "subprocess"
+
+        if name == "mock":
+            return MockBackend()
+
+        if name != "subprocess":
+            logger.warning(f"Unknown nftables backend '{name}', using nft subprocess")
+        if "subprocess" not in _shared_backends:
+            _shared_backends["subprocess"] = SubprocessBackend()
+        return _shared_backends["subprocess"]
@@ -6,13 +6,18 @@ This module provides the core functionality for packet filtering using nftables.
 It defines the basic structure for creating and managing firewall rules.
 """
 
-import subprocess
 import logging
 import os
 import json
 from typing import List, Dict, Any, Optional, Tuple
 from enum import Enum
 
+try:
+    from .nft_backend import NftBackend, NftError, get_backend
+except ImportError:
+    # Imported as a top-level module when firewall_service.py runs as a script
+    from nft_backend import NftBackend, NftError, get_backend
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -36,13 +41,16 @@ class NATType(Enum):
 class PacketFilter:
     """Base class for packet filtering operations using nftables."""
     
-    def __init__(self, table_name: str = "charon"):
+    def __init__(self, table_name: str = "charon", backend: Optional[NftBackend] = None):
         """Initialize the packet filter with a table name.
         
         Args:
             table_name (str): Name of the nftables table to use.
+            backend (Optional[NftBackend]): Backend used to execute nftables
+                commands. Defaults to the shared backend from get_backend().
         """
         self.table_name = table_name
+        self.backend = backend or get_backend()
         self._check_permissions()
     
     def _check_permissions(self) -> None:
@@ -50,48 +58,30 @@ class PacketFilter:
         if os.geteuid() != 0:
             logger.warning("Not running as root. Some operations may fail.")
     
+    def transaction(self) -> "NftTransaction":
+        """Start a new ruleset transaction on this table.
+        
+        Returns:
+            NftTransaction: An empty transaction bound to this packet filter.
+        """
+        return NftTransaction(self)
+    
     def setup_base_table(self) -> bool:
         """Create the base table and chains for the firewall.
         
+        All tables and chains are created in a single nftables transaction.
+        
         Returns:
             bool: True if successful, False otherwise.
         """
-        try:
-            # Create the main table
-            cmd = [
-                "nft", "add", "table", "inet", self.table_name
-            ]
-            subprocess.run(cmd, check=True)
-            
-            # Create base chains
-            chains = ["input", "output", "forward"]
-            for chain in chains:
-                cmd = [
-                    "nft", "add", "chain", "inet", self.table_name,
-                    chain, "{ type filter hook " + chain + " priority 0; policy drop; }"
-                ]
-                subprocess.run(cmd, check=True)
-            
-            # Create NAT table and chains
-            nat_cmd = [
-                "nft", "add", "table", "ip", f"{self.table_name}_nat"
-            ]
-            subprocess.run(nat_cmd, check=True)
-            
-            # Create NAT chains
-            nat_chains = ["prerouting", "postrouting"]
-            for chain in nat_chains:
-                cmd = [
-                    "nft", "add", "chain", "ip", f"{self.table_name}_nat",
-                    chain, "{ type nat hook " + chain + " priority 0; }"
-                ]
-                subprocess.run(cmd, check=True)
-            
-            logger.info(f"Base tables and chains created successfully")
-            return True
-        except subprocess.CalledProcessError as e:
-            logger.error(f"Failed to create base tables: {e}")
+        txn = self.transaction()
+        txn.setup_base_table()
+        if not txn.commit():
+            logger.error("Failed to create base tables")
             return False
+        
+        logger.info(f"Base tables and chains created successfully")
+        return True
 
     def add_stateful_rule(self, chain: str, rule_spec: Dict[str, Any]) -> bool:
         """Add a stateful rule to a specific chain.
@@ -110,45 +100,54 @@ class PacketFilter:
             bool: True if successful, False otherwise.
         """
         try:
-            # Build the rule string
-            rule_parts = []
-            
-            # Add protocol if specified
-            if 'protocol' in rule_spec:
-                rule_parts.append(f"protocol {rule_spec['protocol']}")
-            
-            # Add source if specified
-            if 'source' in rule_spec:
-                rule_parts.append(f"ip saddr {rule_spec['source']}")
-            
-            # Add destination if specified
-            if 'destination' in rule_spec:
-                rule_parts.append(f"ip daddr {rule_spec['destination']}")
-            
-            # Add state tracking
-            if 'state' in rule_spec:
-                rule_parts.append(f"ct state {rule_spec['state']}")
-            
-            # Add comment if specified
-            if 'comment' in rule_spec:
-                rule_parts.append(f"comment \"{rule_spec['comment']}\"")
-            
-            # Add action
-            rule_parts.append(rule_spec['action'].value)
-            
-            # Combine all parts
-            rule = " ".join(rule_parts)
-            
+            rule = self._build_stateful_rule(rule_spec)
             cmd = [
-                "nft", "add", "rule", "inet", self.table_name, chain, rule
+                "add", "rule", "inet", self.table_name, chain, rule
             ]
-            subprocess.run(cmd, check=True)
+            self.backend.run(cmd)
             logger.info(f"Stateful rule added to {chain} chain: {rule}")
             return True
-        except subprocess.CalledProcessError as e:
+        except NftError as e:
             logger.error(f"Failed to add stateful rule to {chain}: {e}")
             return False
 
+    @staticmethod
+    def _build_stateful_rule(rule_spec: Dict[str, Any]) -> str:
+        """Build the nftables rule string for a stateful rule specification.
+        
+        Args:
+            rule_spec (Dict[str, Any]): Rule specification, see add_stateful_rule.
+            
+        Returns:
+            str: The rule in nftables syntax.
+        """
+        rule_parts = []
+        
+        # Add protocol if specified
+        if 'protocol' in rule_spec:
+            rule_parts.append(f"protocol {rule_spec['protocol']}")
+        
+        # Add source if specified
+        if 'source' in rule_spec:
+            rule_parts.append(f"ip saddr {rule_spec['source']}")
+        
+        # Add destination if specified
+        if 'destination' in rule_spec:
+            rule_parts.append(f"ip daddr {rule_spec['destination']}")
+        
+        # Add state tracking
+        if 'state' in rule_spec:
+            rule_parts.append(f"ct state {rule_spec['state']}")
+        
+        # Add comment if specified
+        if 'comment' in rule_spec:
+            rule_parts.append(f"comment \"{rule_spec['comment']}\"")
+        
+        # Add action
+        rule_parts.append(rule_spec['action'].value)
+        
+        return " ".join(rule_parts)
+
     def add_nat_rule(self, nat_type: NATType, rule_spec: Dict[str, Any]) -> bool:
         """Add a NAT rule.
         
@@ -165,45 +164,55 @@ class PacketFilter:
             bool: True if successful, False otherwise.
         """
         try:
-            # Build the rule string
-            rule_parts = []
-            
-            # Add protocol if specified
-            if 'protocol' in rule_spec:
-                rule_parts.append(f"protocol {rule_spec['protocol']}")
-            
-            # Add source if specified
-            if 'source' in rule_spec:
-                rule_parts.append(f"ip saddr {rule_spec['source']}")
-            
-            # Add destination if specified
-            if 'destination' in rule_spec:
-                rule_parts.append(f"ip daddr {rule_spec['destination']}")
-            
-            # Add NAT target
-            if nat_type == NATType.MASQUERADE:
-                rule_parts.append("masquerade")
-            else:
-                rule_parts.append(f"{nat_type.value} to {rule_spec['to']}")
-            
-            # Add comment if specified
-            if 'comment' in rule_spec:
-                rule_parts.append(f"comment \"{rule_spec['comment']}\"")
-            
-            # Combine all parts
-            rule = " ".join(rule_parts)
-            
+            rule = self._build_nat_rule(nat_type, rule_spec)
             cmd = [
-                "nft", "add", "rule", "ip", f"{self.table_name}_nat",
+                "add", "rule", "ip", f"{self.table_name}_nat",
                 rule_spec['chain'], rule
             ]
-            subprocess.run(cmd, check=True)
+            self.backend.run(cmd)
             logger.info(f"NAT rule added to {rule_spec['chain']} chain: {rule}")
             return True
-        except subprocess.CalledProcessError as e:
+        except NftError as e:
             logger.error(f"Failed to add NAT rule: {e}")
             return False
 
+    @staticmethod
+    def _build_nat_rule(nat_type: NATType, rule_spec: Dict[str, Any]) -> str:
+        """Build the nftables rule string for a NAT rule specification.
+        
+        Args:
+            nat_type (NATType): Type of NAT (SNAT/DNAT/MASQUERADE)
+            rule_spec (Dict[str, Any]): Rule specification, see add_nat_rule.
+            
+        Returns:
+            str: The rule in nftables syntax.
+        """
+        rule_parts = []
+        
+        # Add protocol if specified
+        if 'protocol' in rule_spec:
+            rule_parts.append(f"protocol {rule_spec['protocol']}")
+        
+        # Add source if specified
+        if 'source' in rule_spec:
+            rule_parts.append(f"ip saddr {rule_spec['source']}")
+        
+        # Add destination if specified
+        if 'destination' in rule_spec:
+            rule_parts.append(f"ip daddr {rule_spec['destination']}")
+        
+        # Add NAT target
+        if nat_type == NATType.MASQUERADE:
+            rule_parts.append("masquerade")
+        else:
+            rule_parts.append(f"{nat_type.value} to {rule_spec['to']}")
+        
+        # Add comment if specified
+        if 'comment' in rule_spec:
+            rule_parts.append(f"comment \"{rule_spec['comment']}\"")
+        
+        return " ".join(rule_parts)
+
     def add_rule(self, chain: str, rule: str) -> bool:
         """Add a rule to a specific chain.
         
@@ -216,12 +225,12 @@ class PacketFilter:
         """
         try:
             cmd = [
-                "nft", "add", "rule", "inet", self.table_name, chain, rule
+                "add", "rule", "inet", self.table_name, chain, rule
             ]
-            subprocess.run(cmd, check=True)
+            self.backend.run(cmd)
             logger.info(f"Rule added to {chain} chain: {rule}")
             return True
-        except subprocess.CalledProcessError as e:
+        except NftError as e:
             logger.error(f"Failed to add rule to {chain}: {e}")
             return False
     
@@ -237,12 +246,12 @@ class PacketFilter:
         """
         try:
             cmd = [
-                "nft", "delete", "rule", "inet", self.table_name, chain, "handle", str(handle)
+                "delete", "rule", "inet", self.table_name, chain, "handle", str(handle)
             ]
-            subprocess.run(cmd, check=True)
+            self.backend.run(cmd)
             logger.info(f"Rule with handle {handle} deleted from {chain} chain")
             return True
-        except subprocess.CalledProcessError as e:
+        except NftError as e:
             logger.error(f"Failed to delete rule with handle {handle} from {chain}: {e}")
             return False
     
@@ -253,9 +262,345 @@ class PacketFilter:
             Optional[str]: JSON formatted string of rules or None if failed.
         """
         try:
-            cmd = ["nft", "--json", "list", "table", "inet", self.table_name]
-            result = subprocess.run(cmd, check=True, capture_output=True, text=True)
-            return result.stdout
-        except subprocess.CalledProcessError as e:
+            cmd = ["list", "table", "inet", self.table_name]
+            return self.backend.run(cmd, json_output=True, capture=True)
+        except NftError as e:
             logger.error(f"Failed to list rules: {e}")
-            return None 
\ No newline at end of file
+            return None
+
+
+class NftTransaction:
+    """A batch of nftables changes committed as one atomic transaction.
+    
+    Tables, chains, sets and rules are collected in memory and rendered into
+    a single nftables script. The script is loaded by the packet filter
+    backend in one call (``nft -f`` or a single libnftables buffer), which
+    the kernel applies as a single netlink batch: either every change
+    is committed or none of them are, so a failing rule never leaves the
+    ruleset half-configured.
+    
+    The transaction can also be used as a context manager, in which case it
+    is committed on a clean exit and discarded if an exception is raised.
+    """
+    
+    def __init__(self, packet_filter: PacketFilter):
+        """Initialize an empty transaction.
+        
+        Args:
+            packet_filter (PacketFilter): The packet filter the transaction applies to.
+        """
+        self.packet_filter = packet_filter
+        self.table_name = packet_filter.table_name
+        self.nat_table_name = f"{packet_filter.table_name}_nat"
+        self.commands: List[str] = []
+    
+    def __len__(self) -> int:
+        return len(self.commands)
+    
+    def __enter__(self) -> "NftTransaction":
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb) -> bool:
+        if exc_type is not None:
+            logger.error(f"Discarding nftables transaction after error: {exc_val}")
+            self.discard()
+            return False
+        if self.commands:
+            self.commit()
+        return False
+    
+    def add_table(self, family: str = "inet", table: Optional[str] = None) -> "NftTransaction":
+        """Queue the creation of a table.
+        
+        Args:
+            family (str): Address family of the table (inet, ip, ip6, ...).
+            table (Optional[str]): Table name, defaults to the packet filter table.
+            
+        Returns:
+            NftTransaction: This transaction, for chaining.
+        """
+        self.commands.append(f"add table {family} {table or self.table_name}")
+        return self
+    
+    def flush_table(self, family: str = "inet", table: Optional[str] = None) -> "NftTransaction":
+        """Queue the removal of all rules from a table.
+        
+        Args:
+            family (str): Address family of the table.
+            table (Optional[str]): Table name, defaults to the packet filter table.
+            
+        Returns:
+            NftTransaction: This transaction, for chaining.
+        """
+        self.commands.append(f"flush table {family} {table or self.table_name}")
+        return self
+    
+    def add_chain(self, chain: str, spec: Optional[str] = None, family: str = "inet",
+                  table: Optional[str] = None) -> "NftTransaction":
+        """Queue the creation of a chain.
+        
+        Args:
+            chain (str): Name of the chain.
+            spec (Optional[str]): Base chain specification, e.g.
+                "type filter hook input priority 0; policy drop;".
+            family (str): Address family of the table.
+            table (Optional[str]): Table name, defaults to the packet filter table.
+            
+        Returns:
+            NftTransaction: This transaction, for chaining.
+        """
+        command = f"add chain {family} {table or self.table_name} {chain}"
+        if spec:
+            command += " { " + spec + " }"
+        self.commands.append(command)
+        return self
+    
+    def add_set(self, name: str, set_type: str, flags: Optional[List[str]] = None,
+                elements: Optional[List[str]] = None, family: str = "inet",
+                table: Optional[str] = None, auto_merge: bool = False) -> "NftTransaction":
+        """Queue the creation of a named set.
+        
+        Args:
+            name (str): Name of the set.
+            set_type (str): Element type, e.g. "ipv4_addr" or "inet_service".
+            flags (Optional[List[str]]): Set flags, e.g. ["interval"].
+            elements (Optional[List[str]]): Initial elements of the set.
+            family (str): Address family of the table.
+            table (Optional[str]): Table name, defaults to the packet filter table.
+            auto_merge (bool): Merge adjacent and overlapping interval elements.
+            
+        Returns:
+            NftTransaction: This transaction, for chaining.
+        """
+        body = [f"type {set_type};"]
+        if flags:
+            body.append(f"flags {', '.join(flags)};")
+        if auto_merge:
+            body.append("auto-merge;")
+        if elements:
+            body.append(f"elements = {{ {', '.join(elements)} }};")
+        self.commands.append(
+            f"add set {family} {table or self.table_name} {name} {{ {' '.join(body)} }}"
+        )
+        return self
+    
+    def add_element(self, set_name: str, elements: List[str], family: str = "inet",
+                    table: Optional[str] = None) -> "NftTransaction":
+        """Queue the addition of elements to a named set.
+        
+        Args:
+            set_name (str): Name of the set.
+            elements (List[str]): Elements to add.
+            family (str): Address family of the table.
+            table (Optional[str]): Table name, defaults to the packet filter table.
+            
+        Returns:
+            NftTransaction: This transaction, for chaining.
+        """
+        if elements:
+            self.commands.append(
+                f"add element {family} {table or self.table_name} {set_name} "
+                f"{{ {', '.join(elements)} }}"
+            )
+        return self
+    
+    def delete_element(self, set_name: str, elements: List[str], family: str = "inet",
+                       table: Optional[str] = None) -> "NftTransaction":
+        """Queue the removal of elements from a named set.
+        
+        Args:
+            set_name (str): Name of the set.
+            elements (List[str]): Elements to remove; the transaction fails
+                if one of them is not in the set.
+            family (str): Address family of the table.
+            table (Optional[str]): Table name, defaults to the packet filter table.
+        
+        Returns:
+            NftTransaction: This transaction, for chaining.
+        """
+        if elements:
+            self.commands.append(
+                f"delete element {family} {table or self.table_name} {set_name} "
+                f"{{ {', '.join(elements)} }}"
+            )
+        return self
+    
+    def flush_set(self, set_name: str, family: str = "inet",
+                  table: Optional[str] = None) -> "NftTransaction":
+        """Queue the removal of all elements from a named set.
+        
+        Args:
+            set_name (str): Name of the set.
+            family (str): Address family of the table.
+            table (Optional[str]): Table name, defaults to the packet filter table.
+        
+        Returns:
+            NftTransaction: This transaction, for chaining.
+        """
+        self.commands.append(f"flush set {family} {table or self.table_name} {set_name}")
+        return self
+    
+    def flush_chain(self, chain: str, family: str = "inet",
+                    table: Optional[str] = None) -> "NftTransaction":
+        """Queue the removal of all rules from a chain.
+        
+        Args:
+            chain (str): Name of the chain.
+            family (str): Address family of the table.
+            table (Optional[str]): Table name, defaults to the packet filter table.
+        
+        Returns:
+            NftTransaction: This transaction, for chaining.
+        """
+        self.commands.append(f"flush chain {family} {table or self.table_name} {chain}")
+        return self
+    
+    def setup_base_table(self, flush: bool = False) -> "NftTransaction":
+        """Queue the base filter and NAT tables with their hooked chains.
+        
+        Args:
+            flush (bool): Also flush any rules already present in the tables,
+                so the transaction atomically replaces the previous ruleset.
+                
+        Returns:
+            NftTransaction: This transaction, for chaining.
+        """
+        self.add_table("inet")
+        if flush:
+            self.flush_table("inet")
+        for chain in ["input", "output", "forward"]:
+            self.add_chain(chain, f"type filter hook {chain} priority 0; policy drop;")
+        
+        self.add_table("ip", self.nat_table_name)
+        if flush:
+            self.flush_table("ip", self.nat_table_name)
+        for chain in ["prerouting", "postrouting"]:
+            self.add_chain(chain, f"type nat hook {chain} priority 0;",
+                           family="ip", table=self.nat_table_name)
+        return self
+    
+    def add_rule(self, chain: str, rule: str, family: str = "inet",
+                 table: Optional[str] = None, position: Optional[int] = None) -> "NftTransaction":
+        """Queue a rule in nftables syntax.
+        
+        Args:
+            chain (str): The chain to add the rule to.
+            rule (str): The rule specification in nftables syntax.
+            family (str): Address family of the table.
+            table (Optional[str]): Table name, defaults to the packet filter table.
+            position (Optional[int]): Handle of the rule to add this rule after.
+                The rule is appended to the chain if None.
+            
+        Returns:
+            NftTransaction: This transaction, for chaining.
+        """
+        location = f" position {position}" if position is not None else ""
+        self.commands.append(f"add rule {family} {table or self.table_name} {chain}{location} {rule}")
+        return self
+    
+    def insert_rule(self, chain: str, rule: str, family: str = "inet",
+                    table: Optional[str] = None, position: Optional[int] = None) -> "NftTransaction":
+        """Queue a rule to be inserted before another rule.
+        
+        Args:
+            chain (str): The chain to insert the rule into.
+            rule (str): The rule specification in nftables syntax.
+            family (str): Address family of the table.
+            table (Optional[str]): Table name, defaults to the packet filter table.
+            position (Optional[int]): Handle of the rule to insert this rule before.
+                The rule is inserted at the top of the chain if None.
+            
+        Returns:
+            NftTransaction: This transaction, for chaining.
+        """
+        location = f" position {position}" if position is not None else ""
+        self.commands.append(f"insert rule {family} {table or self.table_name} {chain}{location} {rule}")
+        return self
+    
+    def replace_rule(self, chain: str, handle: int, rule: str, family: str = "inet",
+                     table: Optional[str] = None) -> "NftTransaction":
+        """Queue the in-place replacement of a rule, keeping its position.
+        
+        Args:
+            chain (str): The chain containing the rule.
+            handle (int): The handle identifying the rule.
+            rule (str): The new rule specification in nftables syntax.
+            family (str): Address family of the table.
+            table (Optional[str]): Table name, defaults to the packet filter table.
+            
+        Returns:
+            NftTransaction: This transaction, for chaining.
+        """
+        self.commands.append(
+            f"replace rule {family} {table or self.table_name} {chain} handle {handle} {rule}"
+        )
+        return self
+    
+    def add_stateful_rule(self, chain: str, rule_spec: Dict[str, Any]) -> "NftTransaction":
+        """Queue a stateful rule, see PacketFilter.add_stateful_rule.
+        
+        Returns:
+            NftTransaction: This transaction, for chaining.
+        """
+        return self.add_rule(chain, PacketFilter._build_stateful_rule(rule_spec))
+    
+    def add_nat_rule(self, nat_type: NATType, rule_spec: Dict[str, Any]) -> "NftTransaction":
+        """Queue a NAT rule, see PacketFilter.add_nat_rule.
+        
+        Returns:
+            NftTransaction: This transaction, for chaining.
+        """
+        return self.add_rule(rule_spec['chain'], PacketFilter._build_nat_rule(nat_type, rule_spec),
+                             family="ip", table=self.nat_table_name)
+    
+    def delete_rule(self, chain: str, handle: int, family: str = "inet",
+                    table: Optional[str] = None) -> "NftTransaction":
+        """Queue the deletion of a rule by handle.
+        
+        Args:
+            chain (str): The chain containing the rule.
+            handle (int): The handle identifying the rule.
+            family (str): Address family of the table.
+            table (Optional[str]): Table name, defaults to the packet filter table.
+            
+        Returns:
+            NftTransaction: This transaction, for chaining.
+        """
+        self.commands.append(
+            f"delete rule {family} {table or self.table_name} {chain} handle {handle}"
+        )
+        return self
+    
+    def render(self) -> str:
+        """Render the queued changes as an nftables script.
+        
+        Returns:
+            str: The script, one command per line.
+        """
+        return "\n".join(self.commands) + "\n"
+    
+    def discard(self) -> None:
+        """Drop all queued changes without applying them."""
+        self.commands = []
+    
+    def commit(self) -> bool:
+        """Apply all queued changes as a single atomic nftables transaction.
+        
+        If any command in the batch is rejected, the kernel aborts the whole
+        transaction and the previous ruleset stays in place.
+        
+        Returns:
+            bool: True if successful, False otherwise.
+        """
+        if not self.commands:
+            return True
+        
+        try:
+            self.packet_filter.backend.run_script(self.render())
+        except NftError as e:
+            logger.error(f"nftables transaction rolled back: {e}")
+            return False
+        
+        logger.info(f"Committed nftables transaction with {len(self.commands)} commands")
+        self.commands = []
+        return True
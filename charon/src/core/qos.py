@@ -6,15 +6,229 @@ This module provides traffic shaping functionality to manage bandwidth and prior
 It supports both Linux (using tc) and Windows (using PowerShell Network QoS Policies).
 """
 
+import ipaddress
 import subprocess
 import logging
 import os
 import platform
+import re
 import tempfile
-from typing import Dict, List, Optional, Tuple, Any
+from typing import Dict, List, Mapping, Optional, Set, Tuple, Any
 
 logger = logging.getLogger('charon.qos')
 
+# IP protocol numbers matched by u32 filters
+PROTOCOL_NUMBERS = {"tcp": 6, "udp": 17}
+
+# Bulk host classification modes
+CLASSIFY_U32 = "u32"
+CLASSIFY_FLOWER = "flower"
+
+# Offset of the source and destination address in the IPv4 header
+HOST_OFFSETS = {"src": 12, "dst": 16}
+
+# u32 hash table handles used for host classification: each priority gets a
+# block of 257 tables (0x800, the root table, is never used)
+U32_TABLE_BASE = 0x100
+U32_TABLE_BLOCKS = 6
+
+# tc options that name the object a command creates
+_IDENTITY_OPTIONS = ("parent", "handle", "classid", "protocol", "prio")
+
+
+class TcPlan:
+    """A batch of tc changes committed with a single ``tc -batch`` call.
+    
+    Qdiscs, classes and filters are collected in memory and written to tc
+    as one batch script, so a profile costs one process however many
+    classes and filters it has. tc stops at the first command the kernel
+    rejects; the objects that the applied commands added are then deleted
+    in reverse order, so a failing plan does not leave a half-built hierarchy
+    behind. Only added objects are undone: objects changed by a replace
+    command are left as the plan set them, objects it deleted are not
+    restored, and what a replaced qdisc held is lost.
+    
+    The plan can also be used as a context manager, in which case it is
+    committed on a clean exit and discarded if an exception is raised.
+    """
+    
+    def __init__(self, interface: str, tc_path: str = "tc"):
+        """Initialize an empty plan.
+        
+        Args:
+            interface: The network interface the plan applies to
+            tc_path: Path to the tc binary
+        """
+        self.interface = interface
+        self.tc_path = tc_path
+        self.commands: List[List[str]] = []
+    
+    def __len__(self) -> int:
+        return len(self.commands)
+    
+    def __enter__(self) -> "TcPlan":
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb) -> bool:
+        if exc_type is not None:
+            logger.error(f"Discarding tc plan after error: {exc_val}")
+            self.discard()
+            return False
+        if self.commands:
+            self.commit()
+        return False
+    
+    def add(self, args: List[str]) -> "TcPlan":
+        """Queue a tc command.
+        
+        Args:
+            args: The command without the leading "tc", e.g.
+                ["class", "add", "dev", "eth0", "parent", "1:1", "classid", "1:10", ...]
+                
+        Returns:
+            TcPlan: This plan, for chaining.
+        """
+        self.commands.append([str(arg) for arg in args])
+        return self
+    
+    def add_qdisc(self, parent: str, handle: str, kind: str, *options: Any,
+                  replace: bool = False) -> "TcPlan":
+        """Queue a qdisc.
+        
+        Args:
+            parent: Parent class ("1:10") or "root"
+            handle: Handle of the qdisc ("10:")
+            kind: Qdisc type (htb, sfq, fq_codel, ...)
+            *options: Options of the qdisc type
+            replace: Replace the qdisc at this parent instead of adding one
+        """
+        where = ["root"] if parent == "root" else ["parent", parent]
+        return self.add(["qdisc", "replace" if replace else "add", "dev", self.interface,
+                         *where, "handle", handle, kind, *options])
+    
+    def add_class(self, parent: str, classid: str, kind: str, *options: Any) -> "TcPlan":
+        """Queue a class.
+        
+        Args:
+            parent: Parent qdisc or class ("1:" or "1:1")
+            classid: Identifier of the class ("1:10")
+            kind: Class type (htb, ...)
+            *options: Options of the class type
+        """
+        return self.add(["class", "add", "dev", self.interface, "parent", parent,
+                         "classid", classid, kind, *options])
+    
+    def add_filter(self, parent: str, prio: int, kind: str, *options: Any,
+                   protocol: str = "ip", handle: Optional[str] = None,
+                   replace: bool = False) -> "TcPlan":
+        """Queue a filter.
+        
+        Filters are undone by priority, so a plan should not share filter
+        priorities with filters created outside of it.
+        
+        Args:
+            parent: Qdisc the filter is attached to ("1:0")
+            prio: Filter priority (lower number = higher priority)
+            kind: Classifier (u32, flower, ...)
+            *options: Match and action options, e.g. "match", "ip", "dport", 22, "0xffff", "flowid", "1:10"
+            protocol: Link layer protocol to match
+            handle: Filter handle, e.g. "100:" to create a u32 hash table
+            replace: Replace the filter with this handle instead of adding one
+        """
+        action = "replace" if replace else "add"
+        return self.add(["filter", action, "dev", self.interface, "protocol", protocol, "parent", parent,
+                         "prio", prio, *(["handle", handle] if handle else []), kind, *options])
+    
+    def render(self) -> str:
+        """Render the plan as a tc batch script, one command per line."""
+        return "".join(" ".join(args) + "\n" for args in self.commands)
+    
+    def discard(self) -> None:
+        """Drop all queued commands without applying them."""
+        self.commands = []
+    
+    def commit(self) -> bool:
+        """Apply all queued commands with a single tc process.
+        
+        If a command is rejected, the commands applied before it are undone.
+        
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        if not self.commands:
+            return True
+        
+        try:
+            subprocess.run([self.tc_path, "-batch", "-"], input=self.render(),
+                           check=True, capture_output=True, text=True)
+        except subprocess.CalledProcessError as e:
+            # tc reports the failing line as "Command failed -:<line>"
+            error = (e.stderr or str(e)).strip()
+            failed = re.search(r"Command failed \S*:(\d+)", error)
+            applied = int(failed.group(1)) - 1 if failed else len(self.commands)
+            logger.error(f"tc plan failed, rolling back {applied} commands: {error}")
+            self._rollback(self.commands[:applied])
+            return False
+        except (subprocess.SubprocessError, OSError) as e:
+            logger.error(f"Failed to run tc: {e}")
+            return False
+        
+        logger.info(f"Committed tc plan with {len(self.commands)} commands on {self.interface}")
+        self.commands = []
+        return True
+    
+    def _rollback(self, applied: List[List[str]]) -> None:
+        """Delete the objects that applied commands added, in reverse order, ignoring errors.
+        
+        Replace commands are not undone, as they may have replaced an object
+        that existed before the plan, and the old object cannot be restored.
+        """
+        undo = []
+        for args in reversed(applied):
+            command = self._undo(args)
+            if command is None:
+                continue
+            if command[-1] == "root":
+                # Deleting the root qdisc removes everything below it
+                undo = [command]
+                break
+            if command not in undo:
+                undo.append(command)
+        if not undo:
+            return
+        script = "".join(" ".join(args) + "\n" for args in undo)
+        try:
+            subprocess.run([self.tc_path, "-force", "-batch", "-"], input=script,
+                           check=False, capture_output=True, text=True)
+        except (subprocess.SubprocessError, OSError) as e:
+            logger.error(f"Failed to roll back tc plan: {e}")
+    
+    @staticmethod
+    def _undo(args: List[str]) -> Optional[List[str]]:
+        """Get the command deleting the object an add command created."""
+        if len(args) < 4 or args[1] != "add" or args[2] != "dev":
+            return None
+        kind, device = args[0], args[3]
+        options = {args[i]: args[i + 1] for i in range(4, len(args) - 1) if args[i] in _IDENTITY_OPTIONS}
+        if kind == "qdisc":
+            if "root" in args[4:6]:
+                return ["qdisc", "del", "dev", device, "root"]
+            if "parent" in options:
+                return ["qdisc", "del", "dev", device, "parent", options["parent"]]
+            return None
+        if kind == "class" and "classid" in options:
+            return ["class", "del", "dev", device, "classid", options["classid"]]
+        if kind == "filter" and "prio" in options:
+            command = ["filter", "del", "dev", device, "parent", options.get("parent", "1:0"),
+                       "protocol", options.get("protocol", "all"), "prio", options["prio"]]
+            classifier = args[args.index("handle") + 2] if "handle" in options else None
+            if classifier == "flower":
+                # flower filters with a handle can be deleted one by one
+                command += ["handle", options["handle"], "flower"]
+            return command
+        return None
+
+
 class QoS:
     """Quality of Service (QoS) manager for bandwidth control and traffic prioritization."""
     
@@ -33,6 +247,14 @@ class QoS:
             self.interface = self._detect_default_interface()
         else:
             self.interface = interface
+        
+        # Filter priorities used by classify_hosts and classify_ports, and the
+        # u32 hash table block of each priority
+        self._classifier_prios: Set[int] = set()
+        self._u32_blocks: Dict[int, int] = {}
+        
+        # Classes added through this instance, scaled by set_total_bandwidth
+        self.classes: Dict[int, Dict[str, Any]] = {}
             
         self._check_permissions()
     
@@ -158,15 +380,38 @@ Write-Output "Windows QoS policies have been configured."
             logger.error(f"Unexpected error setting up Windows QoS: {e}")
             return False
     
-    def setup_tc_qdisc(self) -> bool:
+    def plan(self) -> TcPlan:
+        """Start a plan of tc changes for this interface (Linux only).
+        
+        Pass the plan to setup_tc_qdisc, add_traffic_class and add_filter to
+        queue their commands, then commit it to apply them with one tc call.
+        
+        Returns:
+            TcPlan: An empty plan
+        """
+        return TcPlan(self.interface)
+    
+    def setup_tc_qdisc(self, plan: Optional[TcPlan] = None) -> bool:
         """Set up the traffic control queuing discipline (Linux only).
         
+        Args:
+            plan: Queue the commands in this plan instead of running them
+        
         Returns:
             bool: True if successful, False otherwise
         """
         if self.platform == 'Windows':
             logger.warning("setup_tc_qdisc is not supported on Windows")
             return False
+        
+        rate_kbps = int(self.total_bandwidth * 1000)  # Convert to Kbps
+        # The classes below the old root qdisc go away with it
+        self.classes = {}
+        if plan is not None:
+            # Replacing the root qdisc drops the old hierarchy in the same step
+            plan.add_qdisc("root", "1:", "htb", "default", "30", replace=True)
+            plan.add_class("1:", "1:1", "htb", "rate", f"{rate_kbps}kbit", "ceil", f"{rate_kbps}kbit")
+            return True
             
         try:
             # Remove any existing qdisc
@@ -184,7 +429,6 @@ Write-Output "Windows QoS policies have been configured."
             subprocess.run(cmd, check=True, capture_output=True)
             
             # Set up root class with total bandwidth
-            rate_kbps = self.total_bandwidth * 1000  # Convert to Kbps
             cmd = [
                 "tc", "class", "add", "dev", self.interface, 
                 "parent", "1:", "classid", "1:1", "htb", 
@@ -199,7 +443,7 @@ Write-Output "Windows QoS policies have been configured."
             return False
     
     def add_traffic_class(self, class_id: int, rate: int, ceiling: Optional[int] = None, 
-                          parent_id: int = 1, priority: int = 0) -> bool:
+                          parent_id: int = 1, priority: int = 0, plan: Optional[TcPlan] = None) -> bool:
         """Add a traffic class for bandwidth allocation (Linux only).
         
         Args:
@@ -208,6 +452,7 @@ Write-Output "Windows QoS policies have been configured."
             ceiling: Maximum bandwidth in Kbps (defaults to rate if None)
             parent_id: Parent class ID
             priority: Priority level (0-7, lower is higher priority)
+            plan: Queue the commands in this plan instead of running them
             
         Returns:
             bool: True if successful, False otherwise
@@ -218,32 +463,99 @@ Write-Output "Windows QoS policies have been configured."
             
         if ceiling is None:
             ceiling = rate
+        
+        commands = TcPlan(self.interface) if plan is None else plan
+        commands.add_class(f"1:{parent_id}", f"1:{class_id}", "htb",
+                           "rate", f"{rate}kbit", "ceil", f"{ceiling}kbit", "prio", priority)
+        # Add SFQ qdisc to ensure fair queuing within the class
+        commands.add_qdisc(f"1:{class_id}", f"{class_id}:", "sfq", "perturb", "10")
+        settings = {"rate": rate, "ceiling": ceiling, "parent_id": parent_id, "priority": priority}
+        if plan is not None:
+            self.classes[class_id] = settings
+            return True
             
         try:
-            cmd = [
-                "tc", "class", "add", "dev", self.interface,
-                "parent", f"1:{parent_id}", "classid", f"1:{class_id}", "htb",
-                "rate", f"{rate}kbit", "ceil", f"{ceiling}kbit", "prio", str(priority)
-            ]
-            subprocess.run(cmd, check=True, capture_output=True)
-            
-            # Add SFQ qdisc to ensure fair queuing within the class
-            cmd = [
-                "tc", "qdisc", "add", "dev", self.interface,
-                "parent", f"1:{class_id}", "handle", f"{class_id}:", "sfq", "perturb", "10"
-            ]
-            subprocess.run(cmd, check=True, capture_output=True)
+            for args in commands.commands:
+                subprocess.run(["tc"] + args, check=True, capture_output=True)
             
+            self.classes[class_id] = settings
             logger.info(f"Added traffic class 1:{class_id} with rate {rate}kbit, ceiling {ceiling}kbit")
             return True
         except subprocess.SubprocessError as e:
             logger.error(f"Failed to add traffic class: {e}")
             return False
     
+    def remove_traffic_class(self, class_id: int, plan: Optional[TcPlan] = None) -> bool:
+        """Remove a traffic class and its queue (Linux only).
+        
+        Filters pointing at the class must be removed first.
+        
+        Args:
+            class_id: The class identifier
+            plan: Queue the command in this plan instead of running it
+            
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        if self.platform == 'Windows':
+            logger.warning("remove_traffic_class is not supported on Windows")
+            return False
+        
+        commands = self.plan() if plan is None else plan
+        commands.add(["class", "del", "dev", self.interface, "classid", f"1:{class_id}"])
+        if plan is None and not commands.commit():
+            return False
+        self.classes.pop(class_id, None)
+        return True
+    
+    def set_total_bandwidth(self, total_bandwidth: float, plan: Optional[TcPlan] = None) -> bool:
+        """Change the total bandwidth without rebuilding the hierarchy (Linux only).
+        
+        The root class 1:1 gets the new rate, and the rate and ceiling of
+        every class added through this instance are scaled by the same
+        factor, so each class keeps its share. All changes use
+        ``tc class change``, which keeps the queues and their packets.
+        
+        Args:
+            total_bandwidth: The new total bandwidth in Mbps
+            plan: Queue the commands in this plan instead of applying them
+            
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        if self.platform == 'Windows':
+            logger.warning("set_total_bandwidth is not supported on Windows")
+            return False
+        if total_bandwidth <= 0:
+            logger.error(f"Invalid total bandwidth: {total_bandwidth}")
+            return False
+        
+        ratio = total_bandwidth / self.total_bandwidth
+        total_kbps = max(1, round(total_bandwidth * 1000))
+        commands = self.plan() if plan is None else plan
+        commands.add(["class", "change", "dev", self.interface, "parent", "1:", "classid", "1:1", "htb",
+                      "rate", f"{total_kbps}kbit", "ceil", f"{total_kbps}kbit"])
+        classes = {}
+        for class_id, settings in sorted(self.classes.items()):
+            rate = settings["rate"] * ratio
+            ceiling = max(settings["ceiling"] * ratio, rate)
+            classes[class_id] = dict(settings, rate=rate, ceiling=ceiling)
+            commands.add(["class", "change", "dev", self.interface,
+                          "parent", f"1:{settings['parent_id']}", "classid", f"1:{class_id}", "htb",
+                          "rate", f"{max(1, round(rate))}kbit", "ceil", f"{max(1, round(ceiling))}kbit",
+                          "prio", settings["priority"]])
+        if plan is None and not commands.commit():
+            return False
+        
+        self.total_bandwidth = total_bandwidth
+        self.classes.update(classes)
+        logger.info(f"Changed total bandwidth on {self.interface} to {total_bandwidth:.1f} Mbps")
+        return True
+    
     def add_filter(self, class_id: int, protocol: str = "ip", 
                    src_ip: Optional[str] = None, dst_ip: Optional[str] = None,
                    src_port: Optional[int] = None, dst_port: Optional[int] = None,
-                   priority: int = 1) -> bool:
+                   priority: int = 1, plan: Optional[TcPlan] = None) -> bool:
         """Add a filter to classify traffic into classes (Linux only).
         
         Args:
@@ -254,6 +566,7 @@ Write-Output "Windows QoS policies have been configured."
             src_port: Source port
             dst_port: Destination port
             priority: Filter priority (lower number = higher priority)
+            plan: Queue the command in this plan instead of running it
             
         Returns:
             bool: True if successful, False otherwise
@@ -261,38 +574,32 @@ Write-Output "Windows QoS policies have been configured."
         if self.platform == 'Windows':
             logger.warning("add_filter is not supported on Windows")
             return False
+        
+        # Build the match conditions based on provided parameters
+        match = []
+        
+        if protocol in ["tcp", "udp"]:
+            match.append(f"match ip protocol {PROTOCOL_NUMBERS[protocol]} 0xff")
             
-        try:
-            # Start building the filter command
-            cmd = [
-                "tc", "filter", "add", "dev", self.interface,
-                "protocol", "ip", "parent", "1:0", "prio", str(priority),
-                "u32"
-            ]
+        if src_ip:
+            match.append(f"match ip src {src_ip}")
             
-            # Build the match string based on provided parameters
-            match = []
+        if dst_ip:
+            match.append(f"match ip dst {dst_ip}")
             
-            if protocol in ["tcp", "udp"]:
-                match.append(f"ip protocol {protocol}")
-                
-            if src_ip:
-                match.append(f"match ip src {src_ip}")
-                
-            if dst_ip:
-                match.append(f"match ip dst {dst_ip}")
-                
-            if src_port and protocol in ["tcp", "udp"]:
-                match.append(f"match {protocol} sport {src_port} 0xffff")
-                
-            if dst_port and protocol in ["tcp", "udp"]:
-                match.append(f"match {protocol} dport {dst_port} 0xffff")
+        if src_port and protocol in ["tcp", "udp"]:
+            match.append(f"match {protocol} src {src_port} 0xffff")
             
-            # Add match conditions and flowid
-            cmd.extend(match)
-            cmd.extend(["flowid", f"1:{class_id}"])
+        if dst_port and protocol in ["tcp", "udp"]:
+            match.append(f"match {protocol} dst {dst_port} 0xffff")
+        
+        commands = TcPlan(self.interface) if plan is None else plan
+        commands.add_filter("1:0", priority, "u32", *" ".join(match).split(), "flowid", f"1:{class_id}")
+        if plan is not None:
+            return True
             
-            subprocess.run(cmd, check=True, capture_output=True)
+        try:
+            subprocess.run(["tc"] + commands.commands[0], check=True, capture_output=True)
             
             logger.info(f"Added filter for class 1:{class_id} with {match}")
             return True
@@ -300,6 +607,149 @@ Write-Output "Windows QoS policies have been configured."
             logger.error(f"Failed to add filter: {e}")
             return False
 
+    def classify_hosts(self, assignments: Mapping[str, int], direction: str = "src",
+                       mode: str = CLASSIFY_U32, priority: int = 10,
+                       plan: Optional[TcPlan] = None) -> bool:
+        """Classify traffic of many hosts into classes with constant lookup cost (Linux only).
+        
+        Unlike add_filter, which adds filters that every packet walks in
+        turn, the hosts are placed in hash tables:
+        
+        - u32 mode builds a two-level u32 hash: the third octet of the
+          address selects a table and the fourth octet a bucket in it, which
+          holds the host filters. IPv4 only.
+        - flower mode adds one flower filter per host. flower keeps filters
+          with the same mask in a hash table, so a lookup costs one hash
+          probe. IPv6 hosts are placed at priority + 1.
+        
+        All filters are added in one tc batch. Calling it again with the same
+        priority replaces the hosts classified before.
+        
+        Args:
+            assignments: Host address to class identifier, e.g. {"192.168.1.50": 50}
+            direction: Match the "src" or "dst" address
+            mode: CLASSIFY_U32 or CLASSIFY_FLOWER
+            priority: Filter priority, which must not be used by other filters
+            plan: Queue the commands in this plan instead of applying them
+            
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        if self.platform == 'Windows':
+            logger.warning("classify_hosts is not supported on Windows")
+            return False
+        if direction not in HOST_OFFSETS or mode not in (CLASSIFY_U32, CLASSIFY_FLOWER):
+            logger.error(f"Invalid host classification: direction {direction}, mode {mode}")
+            return False
+        
+        try:
+            hosts = [(ipaddress.ip_address(host), class_id) for host, class_id in assignments.items()]
+        except ValueError as e:
+            logger.error(f"Invalid host address: {e}")
+            return False
+        if mode == CLASSIFY_U32 and any(address.version != 4 for address, _ in hosts):
+            logger.error("u32 host classification only supports IPv4 addresses")
+            return False
+        if mode == CLASSIFY_U32 and priority not in self._u32_blocks:
+            if len(self._u32_blocks) >= U32_TABLE_BLOCKS:
+                logger.error(f"No u32 hash tables left for priority {priority}")
+                return False
+            self._u32_blocks[priority] = min(set(range(U32_TABLE_BLOCKS)) - set(self._u32_blocks.values()))
+        
+        commands = self.plan() if plan is None else plan
+        self._replace_classifier(commands, priority)
+        if mode == CLASSIFY_U32:
+            self._queue_u32_hosts(commands, hosts, direction, priority)
+        else:
+            for address, class_id in hosts:
+                if address.version == 4:
+                    commands.add_filter("1:0", priority, "flower", f"{direction}_ip", address,
+                                        "classid", f"1:{class_id}")
+                else:
+                    commands.add_filter("1:0", priority + 1, "flower", f"{direction}_ip", address,
+                                        "classid", f"1:{class_id}", protocol="ipv6")
+            if any(address.version == 6 for address, _ in hosts):
+                self._classifier_prios.add(priority + 1)
+        
+        if plan is not None or commands.commit():
+            logger.info(f"Classified {len(hosts)} hosts by {direction} address ({mode})")
+            return True
+        # The rollback removed the filters of the failed plan
+        self._classifier_prios -= {priority, priority + 1}
+        return False
+    
+    def classify_ports(self, assignments: Mapping[int, int], protocol: str = "tcp",
+                       direction: str = "dst", priority: int = 20,
+                       plan: Optional[TcPlan] = None) -> bool:
+        """Classify traffic of many ports into classes with constant lookup cost (Linux only).
+        
+        Each port gets a flower filter. The filters share one mask, so flower
+        finds the match with one hash probe however many ports there are.
+        Calling it again with the same priority replaces the ports
+        classified before.
+        
+        Args:
+            assignments: Port to class identifier, e.g. {22: 10, 443: 20}
+            protocol: Transport protocol (tcp, udp)
+            direction: Match the "src" or "dst" port
+            priority: Filter priority, which must not be used by other filters
+            plan: Queue the commands in this plan instead of applying them
+            
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        if self.platform == 'Windows':
+            logger.warning("classify_ports is not supported on Windows")
+            return False
+        if protocol not in PROTOCOL_NUMBERS or direction not in ("src", "dst"):
+            logger.error(f"Invalid port classification: protocol {protocol}, direction {direction}")
+            return False
+        
+        commands = self.plan() if plan is None else plan
+        self._replace_classifier(commands, priority)
+        for port, class_id in assignments.items():
+            commands.add_filter("1:0", priority, "flower", "ip_proto", protocol,
+                                f"{direction}_port", int(port), "classid", f"1:{class_id}")
+        
+        if plan is not None or commands.commit():
+            logger.info(f"Classified {len(assignments)} {protocol} ports by {direction} port")
+            return True
+        # The rollback removed the filters of the failed plan
+        self._classifier_prios -= {priority, priority + 1}
+        return False
+    
+    def _replace_classifier(self, plan: TcPlan, priority: int) -> None:
+        """Queue the removal of the filters a previous classify call added at a priority."""
+        for prio in (priority, priority + 1):
+            if prio in self._classifier_prios:
+                plan.add(["filter", "del", "dev", self.interface, "parent", "1:0", "prio", prio])
+                self._classifier_prios.discard(prio)
+        self._classifier_prios.add(priority)
+    
+    def _queue_u32_hosts(self, plan: TcPlan, hosts: List[Tuple[ipaddress.IPv4Address, int]],
+                         direction: str, priority: int) -> None:
+        """Queue a two-level u32 hash table classifying IPv4 hosts."""
+        offset = HOST_OFFSETS[direction]
+        # The top table and one table per third octet, from the block of the priority
+        top = U32_TABLE_BASE + self._u32_blocks[priority] * 0x101
+        tables: Dict[int, int] = {}
+        for address, _ in hosts:
+            tables.setdefault(address.packed[2], top + 1 + len(tables))
+        
+        plan.add_filter("1:0", priority, "u32", "divisor", 256, handle=f"{top:x}:")
+        for table in tables.values():
+            plan.add_filter("1:0", priority, "u32", "divisor", 256, handle=f"{table:x}:")
+        # Hosts first, so that traffic is only classified once every host is in place
+        for address, class_id in hosts:
+            table = tables[address.packed[2]]
+            plan.add_filter("1:0", priority, "u32", "ht", f"{table:x}:{address.packed[3]:x}:",
+                            "match", "ip", direction, f"{address}/32", "flowid", f"1:{class_id}")
+        for octet, table in tables.items():
+            plan.add_filter("1:0", priority, "u32", "ht", f"{top:x}:{octet:x}:", "match", "u32", "0", "0",
+                            "hashkey", "mask", "0x000000ff", "at", offset, "link", f"{table:x}:")
+        plan.add_filter("1:0", priority, "u32", "match", "u32", "0", "0",
+                        "hashkey", "mask", "0x0000ff00", "at", offset, "link", f"{top:x}:")
+    
     def add_windows_policy(self, name: str, protocol: str = "TCP", 
                           dst_ports: Optional[List[int]] = None,
                           dscp_value: int = 0) -> bool:
@@ -364,6 +814,7 @@ Write-Output "Windows QoS policies have been configured."
                 # Remove Linux tc configuration
                 cmd = ["tc", "qdisc", "del", "dev", self.interface, "root"]
                 subprocess.run(cmd, check=True, capture_output=True)
+                self.classes = {}
                 logger.info("Removed all Linux QoS settings")
                 
             return True
@@ -430,10 +881,39 @@ Write-Output "Windows QoS policies have been configured."
             
         return status
     
+    def apply_profile(self, profile_id: str, profiles: Optional[Dict[str, Dict[str, Any]]] = None) -> bool:
+        """Apply a QoS profile, changing only what differs from the live setup.
+        
+        Profiles are declarative documents (see qos_profiles.PROFILES). The
+        root qdisc and the queues of unchanged classes are kept, so profiles
+        can be switched without flushing traffic. On Windows only the default
+        profile is supported.
+        
+        Args:
+            profile_id: Name of the profile, e.g. "default", "gaming", "streaming", "voip" or "bulk"
+            profiles: Additional profile documents by name
+            
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        if self.platform == 'Windows':
+            if profile_id != "default":
+                logger.warning(f"QoS profile {profile_id} is not supported on Windows")
+                return False
+            return self._apply_windows_qos()
+        
+        # Imported here because the profile engine builds on this module
+        from .qos_profiles import ProfileEngine, ProfileError
+        try:
+            return ProfileEngine(self, profiles).apply(profile_id)
+        except ProfileError as e:
+            logger.error(f"Invalid QoS profile: {e}")
+            return False
+    
     def setup_default_profile(self) -> bool:
         """Set up a default QoS profile with common traffic classes.
         
-        This creates a basic profile with classes for:
+        This applies the "default" profile, with classes for:
         - High priority (VoIP, SSH)
         - Medium priority (HTTP/HTTPS)
         - Low priority (P2P, bulk downloads)
@@ -442,41 +922,4 @@ Write-Output "Windows QoS policies have been configured."
         Returns:
             bool: True if successful, False otherwise
         """
-        # For Windows, use the _apply_windows_qos method
-        if self.platform == 'Windows':
-            return self._apply_windows_qos()
-            
-        # Linux implementation
-        success = True
-        
-        # Set up the qdisc first
-        if not self.setup_tc_qdisc():
-            return False
-            
-        # Calculate bandwidth percentages for each class
-        total_kbps = self.total_bandwidth * 1000
-        high_rate = int(total_kbps * 0.2)     # 20% guaranteed for high priority
-        medium_rate = int(total_kbps * 0.3)   # 30% guaranteed for medium priority
-        low_rate = int(total_kbps * 0.1)      # 10% guaranteed for low priority
-        default_rate = int(total_kbps * 0.4)  # 40% guaranteed for default traffic
-        
-        # Set up traffic classes
-        success &= self.add_traffic_class(10, high_rate, total_kbps, priority=0)    # High priority
-        success &= self.add_traffic_class(20, medium_rate, total_kbps, priority=1)  # Medium priority
-        success &= self.add_traffic_class(30, default_rate, total_kbps, priority=2)  # Default
-        success &= self.add_traffic_class(40, low_rate, total_kbps, priority=3)     # Low priority
-        
-        # Add filters for high priority traffic
-        success &= self.add_filter(10, protocol="tcp", dst_port=22)  # SSH
-        success &= self.add_filter(10, protocol="udp", dst_port=5060)  # SIP
-        success &= self.add_filter(10, protocol="udp", dst_port=5061)  # SIP Secure
-        
-        # Add filters for medium priority traffic
-        success &= self.add_filter(20, protocol="tcp", dst_port=80)   # HTTP
-        success &= self.add_filter(20, protocol="tcp", dst_port=443)  # HTTPS
-        
-        # Add filters for low priority traffic (P2P common ports as example)
-        success &= self.add_filter(40, protocol="tcp", dst_port=6881)  # BitTorrent
-        
-        logger.info("Default QoS profile setup complete")
-        return success 
\ No newline at end of file
+        return self.apply_profile("default")
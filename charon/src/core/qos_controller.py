@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""
+Adaptive QoS Bandwidth Controller Module for Charon Firewall
+
+HTB only prioritizes traffic if the queue builds up in the firewall, which
+means the shaped rate must stay just below what the link can really carry.
+A fixed total_bandwidth is either too low (wasted capacity) or, when the
+link slows down, too high (the queue moves into the modem and latency
+climbs: bufferbloat). This module tunes the rate continuously:
+
+- RateController decides the rate from throughput and latency samples. It
+  keeps a baseline RTT, treats RTT above the baseline plus a threshold as
+  bufferbloat and lowers the rate below the measured throughput, and raises
+  the rate in small steps while the link is loaded and latency stays low.
+  Decisions need several consecutive samples, increases wait for a hold-off
+  after every decrease and slow down near the rate that last caused
+  bufferbloat, and changes below a dead band are ignored, so the rate does
+  not flap.
+- BandwidthController samples the interface byte counters and RTT probes
+  to a local target (e.g. the upstream gateway) in a background thread and
+  applies the decisions with QoS.set_total_bandwidth (``tc class change``).
+- LinkModel and simulate() replay a recorded trace of link capacity and
+  offered load against a RateController, so its behaviour can be tested
+  without a real link.
+"""
+
+import csv
+import logging
+import re
+import subprocess
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger('charon.qos_controller')
+
+# Counter file of the bytes sent or received by an interface
+STATISTICS_PATH = "/sys/class/net/{interface}/statistics/{direction}_bytes"
+
+
+class RateController:
+    """Feedback controller turning throughput and RTT samples into a shaped rate."""
+
+    def __init__(self, rate: float, min_rate: float, max_rate: float,
+                 bloat_threshold: float = 15.0, load_threshold: float = 0.8,
+                 decrease_factor: float = 0.9, increase_step: float = 0.05,
+                 decrease_after: int = 2, increase_after: int = 5,
+                 hold_off: float = 10.0, probe_interval: float = 60.0,
+                 dead_band: float = 0.02, baseline_alpha: float = 0.01):
+        """Initialize the controller.
+
+        Args:
+            rate: Initial rate in Mbps
+            min_rate: Lowest rate the controller sets, in Mbps
+            max_rate: Highest rate the controller sets, in Mbps
+            bloat_threshold: Milliseconds of RTT above the baseline counted as bufferbloat
+            load_threshold: Fraction of the rate the throughput must reach before increasing
+            decrease_factor: Fraction of the measured throughput set on bufferbloat
+            increase_step: Fraction of the rate added per increase
+            decrease_after: Consecutive bloated samples before decreasing
+            increase_after: Consecutive loaded samples without bloat before increasing
+            hold_off: Seconds after a decrease during which the rate is not increased
+            probe_interval: Seconds between increases close to the rate that last
+                caused bufferbloat
+            dead_band: Smallest relative rate change that is applied
+            baseline_alpha: Weight of a higher RTT sample in the baseline; lower
+                samples replace the baseline at once
+        """
+        self.rate = min(max(rate, min_rate), max_rate)
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.bloat_threshold = bloat_threshold
+        self.load_threshold = load_threshold
+        self.decrease_factor = decrease_factor
+        self.increase_step = increase_step
+        self.decrease_after = decrease_after
+        self.increase_after = increase_after
+        self.hold_off = hold_off
+        self.probe_interval = probe_interval
+        self.dead_band = dead_band
+        self.baseline_alpha = baseline_alpha
+
+        self.baseline: Optional[float] = None
+        self._bloated = 0
+        self._loaded = 0
+        self._last_decrease: Optional[float] = None
+        self._last_change: Optional[float] = None
+        # Rate in use when bufferbloat was last detected
+        self._bloat_rate: Optional[float] = None
+        self.changes = 0
+
+    def update(self, now: float, throughput: float, rtt: Optional[float]) -> Optional[float]:
+        """Feed one sample and get the new rate, if it should change.
+
+        Args:
+            now: Time of the sample in seconds
+            throughput: Measured throughput in Mbps
+            rtt: Measured round-trip time in milliseconds, None if the probe failed
+
+        Returns:
+            Optional[float]: The new rate in Mbps, or None to keep the current one
+        """
+        if rtt is None:
+            # Without a latency sample no decision can be made
+            return None
+
+        if self.baseline is None or rtt < self.baseline:
+            self.baseline = rtt
+        else:
+            self.baseline += (rtt - self.baseline) * self.baseline_alpha
+
+        target = None
+        if rtt - self.baseline > self.bloat_threshold:
+            self._bloated += 1
+            self._loaded = 0
+            if self._bloated >= self.decrease_after:
+                # The link carries less than we send: shape below what got through
+                target = min(self.rate, throughput) * self.decrease_factor
+                self._bloated = 0
+                self._last_decrease = now
+                self._bloat_rate = self.rate
+        else:
+            self._bloated = 0
+            if throughput >= self.rate * self.load_threshold:
+                self._loaded += 1
+            else:
+                self._loaded = 0
+            if self._loaded >= self.increase_after and self._may_increase(now):
+                target = self.rate * (1 + self.increase_step)
+                self._loaded = 0
+                if self._bloat_rate is not None and target > self._bloat_rate:
+                    # The link carries more than it did when it was bloated
+                    self._bloat_rate = None
+
+        if target is None:
+            return None
+        target = min(max(target, self.min_rate), self.max_rate)
+        if abs(target - self.rate) < self.rate * self.dead_band:
+            return None
+        self.rate = target
+        self._last_change = now
+        self.changes += 1
+        return target
+
+    def _may_increase(self, now: float) -> bool:
+        if self._last_decrease is not None and now - self._last_decrease < self.hold_off:
+            return False
+        # Close to the rate that caused bufferbloat, probe slowly instead of saw-toothing
+        near_limit = (self._bloat_rate is not None and
+                      self.rate * (1 + self.increase_step) >= self._bloat_rate * (1 - self.increase_step))
+        return not near_limit or self._last_change is None or now - self._last_change >= self.probe_interval
+
+
+def read_interface_bytes(interface: str, direction: str = "tx") -> int:
+    """Read the byte counter of an interface ("tx" or "rx")."""
+    with open(STATISTICS_PATH.format(interface=interface, direction=direction)) as f:
+        return int(f.read())
+
+
+def ping_rtt(target: str, timeout: float = 1.0) -> Optional[float]:
+    """Measure the round-trip time to a host with one ICMP echo.
+
+    Returns:
+        Optional[float]: The RTT in milliseconds, None if there was no reply
+    """
+    try:
+        result = subprocess.run(["ping", "-n", "-c", "1", "-W", str(max(1, round(timeout))), target],
+                                capture_output=True, text=True, timeout=timeout + 1)
+    except (subprocess.SubprocessError, OSError) as e:
+        logger.error(f"Failed to ping {target}: {e}")
+        return None
+    match = re.search(r"time[=<]([\d.]+) ?ms", result.stdout)
+    return float(match.group(1)) if match else None
+
+
+class BandwidthController:
+    """Background loop adjusting the QoS total bandwidth to the link."""
+
+    def __init__(self, qos: Any, target: str, min_bandwidth: Optional[float] = None,
+                 max_bandwidth: Optional[float] = None, interval: float = 1.0,
+                 direction: str = "tx", probe: Optional[Callable[[], Optional[float]]] = None,
+                 **options: Any):
+        """Initialize the controller.
+
+        Args:
+            qos: The QoS manager whose total bandwidth is tuned
+            target: Host to probe for RTT, ideally the first hop beyond the bottleneck
+            min_bandwidth: Lowest total bandwidth in Mbps (defaults to 10% of the current one)
+            max_bandwidth: Highest total bandwidth in Mbps (defaults to the current one)
+            interval: Seconds between samples
+            direction: Interface counter measured, "tx" for egress shaping
+            probe: Function returning an RTT in milliseconds, ping_rtt(target) by default
+            **options: Tuning options passed to RateController
+        """
+        self.qos = qos
+        self.target = target
+        self.interval = interval
+        self.direction = direction
+        self.probe = probe or (lambda: ping_rtt(target, timeout=interval))
+        max_bandwidth = max_bandwidth or qos.total_bandwidth
+        self.rate_controller = RateController(qos.total_bandwidth, min_bandwidth or max_bandwidth * 0.1,
+                                              max_bandwidth, **options)
+        self._bytes: Optional[int] = None
+        self._time: Optional[float] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def step(self, now: Optional[float] = None) -> bool:
+        """Take one sample and apply the resulting rate, if it changed.
+
+        Returns:
+            bool: True if the rate was changed
+        """
+        now = time.monotonic() if now is None else now
+        try:
+            counter = read_interface_bytes(self.qos.interface, self.direction)
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to read the traffic counters of {self.qos.interface}: {e}")
+            return False
+        rtt = self.probe()
+
+        previous_bytes, previous_time = self._bytes, self._time
+        self._bytes, self._time = counter, now
+        if previous_bytes is None or now <= previous_time or counter < previous_bytes:
+            return False
+        throughput = (counter - previous_bytes) * 8 / (now - previous_time) / 1e6
+
+        rate = self.rate_controller.update(now, throughput, rtt)
+        if rate is None:
+            return False
+        if not self.qos.set_total_bandwidth(rate):
+            # Keep the controller in line with what is really configured
+            self.rate_controller.rate = self.qos.total_bandwidth
+            return False
+        return True
+
+    def start(self) -> None:
+        """Start adjusting the bandwidth in a background thread."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=f"qos-controller-{self.qos.interface}",
+                                        daemon=True)
+        self._thread.start()
+        logger.info(f"Started adaptive bandwidth control on {self.qos.interface} probing {self.target}")
+
+    def stop(self) -> None:
+        """Stop the background thread."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.step()
+            self._stop.wait(self.interval)
+
+
+class LinkModel:
+    """Bottleneck link with a drop-tail buffer, used to simulate the controller.
+
+    Traffic is shaped to the controller's rate before it reaches the link.
+    Whatever the link cannot carry queues in its buffer, which adds the time
+    needed to drain the queue to the RTT.
+    """
+
+    def __init__(self, buffer_ms: float = 500.0):
+        """Initialize an empty link.
+
+        Args:
+            buffer_ms: Buffer size expressed as milliseconds at the link capacity
+        """
+        self.buffer_ms = buffer_ms
+        self.queue = 0.0  # Megabits waiting in the buffer
+
+    def step(self, dt: float, offered: float, rate: float, capacity: float,
+             base_rtt: float) -> Dict[str, float]:
+        """Advance the link by dt seconds.
+
+        Args:
+            dt: Seconds elapsed
+            offered: Traffic the hosts want to send, in Mbps
+            rate: Shaped rate in Mbps
+            capacity: Capacity of the link in Mbps
+            base_rtt: RTT of an empty link in milliseconds
+
+        Returns:
+            Dict[str, float]: "throughput" in Mbps and "rtt" in milliseconds
+        """
+        sent = min(offered, rate)
+        capacity_mbit = max(capacity, 1e-6)
+        self.queue += (sent - capacity) * dt
+        self.queue = min(max(self.queue, 0.0), capacity_mbit * self.buffer_ms / 1000)
+        throughput = min(sent, capacity) if self.queue <= 0 else capacity
+        return {"throughput": throughput, "rtt": base_rtt + self.queue / capacity_mbit * 1000}
+
+
+def load_trace(path: str) -> List[Dict[str, float]]:
+    """Load a trace recorded as CSV with columns time, capacity, offered and base_rtt.
+
+    capacity and offered are in Mbps, base_rtt in milliseconds and time in seconds.
+    """
+    with open(path, newline='') as f:
+        return [{key: float(value) for key, value in row.items()} for row in csv.DictReader(f)]
+
+
+def simulate(controller: RateController, trace: Iterable[Dict[str, float]],
+             link: Optional[LinkModel] = None) -> List[Dict[str, float]]:
+    """Replay a trace against a controller.
+
+    Args:
+        controller: The controller under test
+        trace: Rows with time (s), capacity (Mbps), offered (Mbps) and base_rtt (ms)
+        link: The link model (a 500 ms drop-tail buffer by default)
+
+    Returns:
+        List[Dict[str, float]]: One row per trace row with the time, the rate
+            in use, the throughput and the RTT
+    """
+    link = link or LinkModel()
+    results = []
+    previous = None
+    for row in trace:
+        dt = 1.0 if previous is None else row["time"] - previous
+        previous = row["time"]
+        sample = link.step(dt, row["offered"], controller.rate, row["capacity"], row["base_rtt"])
+        results.append({"time": row["time"], "rate": controller.rate, **sample})
+        controller.update(row["time"], sample["throughput"], sample["rtt"])
+    return results
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Per-Host Fair Share Module for Charon Firewall
+
+This module gives every active LAN host its own HTB class, so that hosts
+share the bandwidth fairly without a hand-written class per host.
+
+HostFairShare watches the ARP table and the conntrack table for addresses in
+the LAN networks. A host that appears gets a class below a common parent
+class and a flower filter matching its address; a host that has not been
+seen for the idle timeout loses both again. All host classes have the same
+rate and ceiling, so HTB lends the spare bandwidth of idle hosts to the
+busy ones in equal parts.
+
+Class identifiers come from a free list, so allocating and reclaiming one is
+constant work however many hosts there are, and each update is a single tc
+batch that only adds and deletes the classes and filters of the hosts that
+changed. The flower filters share one mask per address family, so classifying
+a packet costs one hash probe.
+
+Shaping happens on egress, so per-host classes belong on the LAN interface
+with direction "dst" (downloads). On the WAN interface the source addresses
+have already been replaced by NAT.
+"""
+
+import ipaddress
+import logging
+import os
+import re
+import subprocess
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+logger = logging.getLogger('charon.qos_fairshare')
+
+ARP_PATH = "/proc/net/arp"
+CONNTRACK_PATH = "/proc/net/nf_conntrack"
+
+# Class identifiers handed out to hosts. Like all class identifiers they are
+# written as is after "1:", which tc reads as hex, so the range stays within
+# numbers made of decimal digits.
+FIRST_HOST_CLASS = 1000
+LAST_HOST_CLASS = 9999
+
+# ARP entry flags of an incomplete entry (no reply yet)
+_ARP_INCOMPLETE = 0x0
+
+_CONNTRACK_ADDRESS = re.compile(r"\b(?:src|dst)=(\S+)")
+
+
+def read_arp_hosts(path: str = ARP_PATH) -> Set[str]:
+    """Get the addresses with a resolved entry in the ARP table."""
+    hosts = set()
+    with open(path) as f:
+        next(f, None)  # Header
+        for line in f:
+            fields = line.split()
+            if len(fields) >= 4 and int(fields[2], 16) != _ARP_INCOMPLETE:
+                hosts.add(fields[0])
+    return hosts
+
+
+def read_conntrack_hosts(path: str = CONNTRACK_PATH) -> Set[str]:
+    """Get the addresses of the tracked connections.
+
+    Reads the conntrack proc file, or ``conntrack -L`` on kernels without it.
+    """
+    if os.path.exists(path):
+        with open(path) as f:
+            text = f.read()
+    else:
+        result = subprocess.run(["conntrack", "-L"], check=True, capture_output=True, text=True)
+        text = result.stdout
+    return set(_CONNTRACK_ADDRESS.findall(text))
+
+
+class HostFairShare:
+    """Fair-share mode of a QoS hierarchy with one class per active host."""
+
+    def __init__(self, qos: Any, networks: Iterable[str], parent_id: int = 2,
+                 rate: Optional[int] = None, ceiling: Optional[int] = None,
+                 host_rate: int = 1000, direction: str = "dst", priority: int = 100,
+                 idle_timeout: float = 300.0, interval: float = 5.0,
+                 max_hosts: int = LAST_HOST_CLASS - FIRST_HOST_CLASS + 1):
+        """Initialize the fair-share mode.
+
+        Args:
+            qos: The QoS manager whose hierarchy gets the host classes
+            networks: LAN networks whose hosts get a class, e.g. ["192.168.1.0/24"]
+            parent_id: Class identifier of the parent of the host classes
+            rate: Guaranteed bandwidth of all hosts together in Kbps
+                (defaults to half the total bandwidth)
+            ceiling: Maximum bandwidth of a host in Kbps (defaults to the total bandwidth)
+            host_rate: Guaranteed bandwidth of each host in Kbps
+            direction: Match the "dst" (downloads) or "src" (uploads) address
+            priority: Filter priority of IPv4 hosts; IPv6 hosts use priority + 1.
+                Filters with a lower priority, such as port filters, are matched first.
+            idle_timeout: Seconds a host must be absent before its class is reclaimed
+            interval: Seconds between scans of the ARP and conntrack tables
+            max_hosts: Largest number of host classes
+        """
+        total_kbps = int(qos.total_bandwidth * 1000)
+        self.qos = qos
+        self.networks = [ipaddress.ip_network(network, strict=False) for network in networks]
+        self.parent_id = parent_id
+        self.rate = rate or total_kbps // 2
+        self.ceiling = ceiling or total_kbps
+        self.host_rate = host_rate
+        self.direction = direction
+        self.priority = priority
+        self.idle_timeout = idle_timeout
+        self.interval = interval
+        self.max_hosts = min(max_hosts, LAST_HOST_CLASS - FIRST_HOST_CLASS + 1)
+
+        # Host address to class identifier, and when the host was last seen
+        self.hosts: Dict[str, int] = {}
+        self.last_seen: Dict[str, float] = {}
+        # Reclaimed identifiers, and the lowest identifier never handed out
+        self._free: List[int] = []
+        self._next = FIRST_HOST_CLASS
+
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def setup(self, plan: Optional[Any] = None) -> bool:
+        """Add the parent class of the host classes below the root class 1:1.
+
+        Args:
+            plan: Queue the commands in this plan instead of running them
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        return self.qos.add_traffic_class(self.parent_id, rate=self.rate, ceiling=self.ceiling,
+                                          parent_id=1, plan=plan)
+
+    def discover(self) -> Set[str]:
+        """Get the active LAN hosts from the ARP and conntrack tables."""
+        seen: Set[str] = set()
+        for table, source in (("ARP", read_arp_hosts), ("conntrack", read_conntrack_hosts)):
+            try:
+                seen |= source()
+            except (OSError, subprocess.SubprocessError) as e:
+                logger.debug(f"Could not read hosts from the {table} table: {e}")
+
+        hosts = set()
+        for host in seen:
+            try:
+                address = ipaddress.ip_address(host)
+            except ValueError:
+                continue
+            if any(address in network for network in self.networks):
+                hosts.add(str(address))
+        return hosts
+
+    def update(self, active: Iterable[str], now: Optional[float] = None) -> bool:
+        """Allocate classes for new hosts and reclaim those of idle hosts.
+
+        Args:
+            active: Addresses of the hosts seen since the last update
+            now: Time of the update in seconds
+
+        Returns:
+            bool: True if successful (or nothing changed), False otherwise
+        """
+        now = time.monotonic() if now is None else now
+        for host in active:
+            self.last_seen[host] = now
+
+        idle = sorted(host for host in self.hosts if now - self.last_seen[host] > self.idle_timeout)
+        new = sorted(host for host in self.last_seen if host not in self.hosts and
+                     now - self.last_seen[host] <= self.idle_timeout)
+        for host in [host for host in self.last_seen if host not in self.hosts and host not in new]:
+            del self.last_seen[host]
+        if not idle and not new:
+            return True
+
+        plan = self.qos.plan()
+        # Identifiers of the idle hosts can be handed out again in the same batch,
+        # as their classes are deleted before the new ones are added
+        reclaimed = []
+        for host in idle:
+            self._queue_remove(plan, host)
+            reclaimed.append(self.hosts.pop(host))
+            del self.last_seen[host]
+        idle_ids = set(reclaimed)
+
+        added = {}
+        for host in new:
+            class_id = reclaimed.pop() if reclaimed else self._allocate()
+            if class_id is None:
+                logger.warning(f"No host classes left, {len(new) - len(added)} hosts are not shaped")
+                break
+            added[host] = class_id
+            self._queue_add(plan, host, class_id)
+
+        if not plan.commit():
+            # The added classes were rolled back and the hosts are retried next
+            # time. The classes of idle hosts may not have been deleted, so their
+            # identifiers are not reused.
+            for class_id in added.values():
+                self.qos.classes.pop(class_id, None)
+                if class_id not in idle_ids:
+                    self._free.append(class_id)
+            return False
+
+        self._free.extend(reclaimed)
+        self.hosts.update(added)
+        logger.info(f"Fair share on {self.qos.interface}: {len(added)} hosts added, "
+                    f"{len(idle)} reclaimed, {len(self.hosts)} active")
+        return True
+
+    def step(self, now: Optional[float] = None) -> bool:
+        """Scan for active hosts once and update the host classes."""
+        return self.update(self.discover(), now)
+
+    def clear(self) -> bool:
+        """Remove the classes and filters of all hosts.
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        plan = self.qos.plan()
+        for host in sorted(self.hosts):
+            self._queue_remove(plan, host)
+        success = plan.commit()
+        self.hosts = {}
+        self.last_seen = {}
+        self._free = []
+        self._next = FIRST_HOST_CLASS
+        return success
+
+    def _allocate(self) -> Optional[int]:
+        if self._free:
+            return self._free.pop()
+        if self._next - FIRST_HOST_CLASS >= self.max_hosts:
+            return None
+        self._next += 1
+        return self._next - 1
+
+    def _filter(self, host: str) -> Dict[str, Any]:
+        """Priority and protocol of the filter of a host."""
+        if ipaddress.ip_address(host).version == 4:
+            return {"prio": self.priority, "protocol": "ip"}
+        return {"prio": self.priority + 1, "protocol": "ipv6"}
+
+    def _queue_add(self, plan: Any, host: str, class_id: int) -> None:
+        self.qos.add_traffic_class(class_id, rate=self.host_rate, ceiling=self.ceiling,
+                                   parent_id=self.parent_id, plan=plan)
+        match = self._filter(host)
+        plan.add_filter("1:0", match["prio"], "flower", f"{self.direction}_ip", host,
+                        "classid", f"1:{class_id}", protocol=match["protocol"], handle=str(class_id))
+
+    def _queue_remove(self, plan: Any, host: str) -> None:
+        class_id = self.hosts[host]
+        match = self._filter(host)
+        # The filter goes first: a class with filters pointing at it cannot be deleted
+        plan.add(["filter", "del", "dev", self.qos.interface, "parent", "1:0", "protocol", match["protocol"],
+                  "prio", match["prio"], "handle", class_id, "flower"])
+        self.qos.remove_traffic_class(class_id, plan=plan)
+
+    def start(self) -> None:
+        """Start tracking hosts in a background thread."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=f"qos-fairshare-{self.qos.interface}",
+                                        daemon=True)
+        self._thread.start()
+        logger.info(f"Started per-host fair share on {self.qos.interface}")
+
+    def stop(self) -> None:
+        """Stop the background thread."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.step()
+            self._stop.wait(self.interval)
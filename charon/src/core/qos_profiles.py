@@ -0,0 +1,424 @@
+#!/usr/bin/env python3
+"""
+QoS Profile Engine Module for Charon Firewall
+
+This module describes QoS profiles as declarative documents and applies
+them to a QoS hierarchy. A profile lists traffic classes, with their
+guaranteed and maximum bandwidth as percentages of the total bandwidth,
+and the ports whose traffic goes into each class:
+
+    {
+        "name": "Gaming",
+        "description": "Low latency for game and voice traffic",
+        "classes": [
+            {"id": 10, "name": "Games", "rate": 40, "priority": 0,
+             "match": [{"protocol": "udp", "ports": [3074, 27015]}]},
+            {"id": 30, "name": "Default", "rate": 60, "priority": 2}
+        ]
+    }
+
+Unmatched traffic goes to class 30, the default class of the HTB qdisc, so
+every profile defines it. A profile is compiled into the classes and flower
+filters it needs for the current total bandwidth. Applying it compares that
+with the live hierarchy read from tc and only adds, changes and deletes what
+differs, as one tc batch: switching profiles keeps the root qdisc and the
+queues of the classes both profiles share, so no packets are flushed. The
+hierarchy is only built from scratch when there is none yet.
+
+Every port filter has a handle derived from its protocol, direction and
+port, so the same port keeps the same filter across profiles and a move to
+another class is a single ``tc filter replace``.
+"""
+
+import json
+import logging
+import subprocess
+from typing import Any, Dict, List, Optional
+
+from .qos import PROTOCOL_NUMBERS, TcPlan
+
+logger = logging.getLogger('charon.qos_profiles')
+
+# The default class of the HTB qdisc, see QoS.setup_tc_qdisc
+DEFAULT_CLASS = 30
+
+# Filter priority of the port filters of a profile
+PROFILE_PRIORITY = 1
+
+# Profile class identifiers, below the per-host classes of the fair-share mode
+MIN_CLASS_ID = 10
+MAX_CLASS_ID = 999
+
+DIRECTIONS = ("dst", "src")
+
+PROFILES: Dict[str, Dict[str, Any]] = {
+    "default": {
+        "name": "Default",
+        "description": "Remote access and VoIP first, then web browsing, then everything else",
+        "classes": [
+            {"id": 10, "name": "High priority", "rate": 20, "priority": 0,
+             "match": [{"protocol": "tcp", "ports": [22]}, {"protocol": "udp", "ports": [5060, 5061]}]},
+            {"id": 20, "name": "Web", "rate": 30, "priority": 1,
+             "match": [{"protocol": "tcp", "ports": [80, 443]}]},
+            {"id": 30, "name": "Default", "rate": 40, "priority": 2},
+            {"id": 40, "name": "Low priority", "rate": 10, "priority": 3,
+             "match": [{"protocol": "tcp", "ports": [6881]}]},
+        ],
+    },
+    "gaming": {
+        "name": "Gaming",
+        "description": "Low latency for game traffic and voice chat, downloads capped at half the link",
+        "classes": [
+            {"id": 10, "name": "Games and voice chat", "rate": 40, "priority": 0,
+             "match": [{"protocol": "udp", "ports": [3074, 3478, 3479, 3480, 27015, 27036]},
+                       {"protocol": "tcp", "ports": [22]}]},
+            {"id": 20, "name": "Web", "rate": 25, "priority": 1,
+             "match": [{"protocol": "tcp", "ports": [80, 443]}, {"protocol": "udp", "ports": [443]}]},
+            {"id": 30, "name": "Default", "rate": 25, "priority": 2},
+            {"id": 40, "name": "Bulk downloads", "rate": 10, "ceil": 50, "priority": 3,
+             "match": [{"protocol": "tcp", "ports": [6881]}]},
+        ],
+    },
+    "streaming": {
+        "name": "Streaming",
+        "description": "Most of the link for video streaming over HTTP, QUIC and RTMP",
+        "classes": [
+            {"id": 10, "name": "Interactive", "rate": 10, "priority": 0,
+             "match": [{"protocol": "tcp", "ports": [22]}, {"protocol": "udp", "ports": [5060, 5061]}]},
+            {"id": 20, "name": "Streaming", "rate": 55, "priority": 1,
+             "match": [{"protocol": "tcp", "ports": [80, 443, 1935]}, {"protocol": "udp", "ports": [443]}]},
+            {"id": 30, "name": "Default", "rate": 25, "priority": 2},
+            {"id": 40, "name": "Bulk downloads", "rate": 10, "ceil": 60, "priority": 3,
+             "match": [{"protocol": "tcp", "ports": [6881]}]},
+        ],
+    },
+    "voip": {
+        "name": "VoIP first",
+        "description": "SIP and STUN/TURN before everything else, then remote access",
+        "classes": [
+            {"id": 10, "name": "Voice", "rate": 30, "priority": 0,
+             "match": [{"protocol": "udp", "ports": [5060, 5061, 3478, 3479]},
+                       {"protocol": "tcp", "ports": [5061]}]},
+            {"id": 20, "name": "Interactive", "rate": 20, "priority": 1,
+             "match": [{"protocol": "tcp", "ports": [22, 3389]}]},
+            {"id": 30, "name": "Default", "rate": 40, "priority": 2},
+            {"id": 40, "name": "Low priority", "rate": 10, "priority": 3,
+             "match": [{"protocol": "tcp", "ports": [6881]}]},
+        ],
+    },
+    "bulk": {
+        "name": "Bulk transfers",
+        "description": "Throughput for file transfers and backups, with a small class for remote access",
+        "classes": [
+            {"id": 10, "name": "Interactive", "rate": 10, "priority": 0,
+             "match": [{"protocol": "tcp", "ports": [22]}]},
+            {"id": 20, "name": "Transfers", "rate": 60, "priority": 1,
+             "match": [{"protocol": "tcp", "ports": [20, 21, 80, 443, 873, 6881]}]},
+            {"id": 30, "name": "Default", "rate": 30, "priority": 2},
+        ],
+    },
+}
+
+
+def list_profiles(profiles: Optional[Dict[str, Dict[str, Any]]] = None) -> List[Dict[str, str]]:
+    """Get the id, name and description of every profile (the built-in ones by default)."""
+    return [{"id": profile_id, "name": profile.get("name", profile_id),
+             "description": profile.get("description", "")}
+            for profile_id, profile in (PROFILES if profiles is None else profiles).items()]
+
+
+class ProfileError(ValueError):
+    """Raised for unknown or invalid QoS profiles."""
+
+
+def filter_handle(protocol: str, direction: str, port: int) -> int:
+    """The handle of the filter of a port: protocol number, direction bit and port."""
+    return (PROTOCOL_NUMBERS[protocol] << 17) | (DIRECTIONS.index(direction) << 16) | port
+
+
+def load_profile(path: str) -> Dict[str, Any]:
+    """Load a profile document from a JSON file and validate it.
+
+    Raises:
+        ProfileError: If the document is not a valid profile
+    """
+    try:
+        with open(path) as f:
+            profile = json.load(f)
+    except (OSError, ValueError) as e:
+        raise ProfileError(f"Cannot read QoS profile {path}: {e}")
+    validate_profile(profile)
+    return profile
+
+
+def validate_profile(profile: Dict[str, Any]) -> None:
+    """Check a profile document.
+
+    Raises:
+        ProfileError: If the document is not a valid profile
+    """
+    classes = profile.get("classes") if isinstance(profile, dict) else None
+    if not classes:
+        raise ProfileError("A QoS profile needs a list of classes")
+
+    ids = set()
+    ports = set()
+    total_rate = 0
+    for cls in classes:
+        class_id = cls.get("id")
+        if not isinstance(class_id, int) or not MIN_CLASS_ID <= class_id <= MAX_CLASS_ID:
+            raise ProfileError(f"Class identifiers must be {MIN_CLASS_ID}-{MAX_CLASS_ID}: {class_id}")
+        if class_id in ids:
+            raise ProfileError(f"Duplicate class {class_id}")
+        ids.add(class_id)
+
+        rate, ceil = cls.get("rate"), cls.get("ceil", 100)
+        if not isinstance(rate, (int, float)) or not 0 < rate <= ceil <= 100:
+            raise ProfileError(f"Class {class_id} needs 0 < rate <= ceil <= 100 (percent): {rate}, {ceil}")
+        total_rate += rate
+        if not 0 <= cls.get("priority", 0) <= 7:
+            raise ProfileError(f"Class {class_id} priority must be 0-7")
+
+        for match in cls.get("match", []):
+            protocol, direction = match.get("protocol"), match.get("direction", "dst")
+            if protocol not in PROTOCOL_NUMBERS or direction not in DIRECTIONS:
+                raise ProfileError(f"Class {class_id} has an invalid match: {match}")
+            for port in match.get("ports", []):
+                if not isinstance(port, int) or not 0 < port < 65536:
+                    raise ProfileError(f"Class {class_id} has an invalid port: {port}")
+                if (protocol, direction, port) in ports:
+                    raise ProfileError(f"{protocol} {direction} port {port} is matched by two classes")
+                ports.add((protocol, direction, port))
+
+    if DEFAULT_CLASS not in ids:
+        raise ProfileError(f"A QoS profile must define the default class {DEFAULT_CLASS}")
+    if total_rate > 100:
+        raise ProfileError(f"The guaranteed rates add up to {total_rate}% of the bandwidth")
+
+
+class CompiledProfile:
+    """The classes and filters a profile needs at a given total bandwidth."""
+
+    def __init__(self, profile_id: str, classes: Dict[int, Dict[str, Any]],
+                 filters: Dict[int, Dict[str, Any]]):
+        """Initialize a compiled profile.
+
+        Args:
+            profile_id: Name of the profile
+            classes: Class identifier to rate and ceiling in Kbps and priority
+            filters: Filter handle to protocol, direction, port and class identifier
+        """
+        self.profile_id = profile_id
+        self.classes = classes
+        self.filters = filters
+
+    def __repr__(self) -> str:
+        return f"CompiledProfile({self.profile_id!r}, {len(self.classes)} classes, {len(self.filters)} filters)"
+
+
+class ProfileEngine:
+    """Compiles QoS profiles and applies them to a QoS manager as diffs."""
+
+    def __init__(self, qos: Any, profiles: Optional[Dict[str, Dict[str, Any]]] = None):
+        """Initialize the engine.
+
+        Args:
+            qos: The QoS manager the profiles are applied to
+            profiles: Additional profile documents by name; they may replace built-in ones
+
+        Raises:
+            ProfileError: If one of the additional profiles is invalid
+        """
+        self.qos = qos
+        self.profiles = dict(PROFILES)
+        for profile in (profiles or {}).values():
+            validate_profile(profile)
+        self.profiles.update(profiles or {})
+        # Classes that belong to some profile; other classes are never touched
+        self.managed = {cls["id"] for profile in self.profiles.values() for cls in profile["classes"]}
+
+    def compile(self, profile_id: str) -> CompiledProfile:
+        """Compile a profile for the current total bandwidth.
+
+        Raises:
+            ProfileError: If the profile is unknown
+        """
+        profile = self.profiles.get(profile_id)
+        if profile is None:
+            raise ProfileError(f"Unknown QoS profile: {profile_id}")
+
+        total_kbps = int(self.qos.total_bandwidth * 1000)
+        classes = {}
+        filters = {}
+        for cls in profile["classes"]:
+            classes[cls["id"]] = {"rate": int(total_kbps * cls["rate"] / 100),
+                                  "ceiling": int(total_kbps * cls.get("ceil", 100) / 100),
+                                  "priority": cls.get("priority", 0)}
+            for match in cls.get("match", []):
+                direction = match.get("direction", "dst")
+                for port in match["ports"]:
+                    filters[filter_handle(match["protocol"], direction, port)] = {
+                        "protocol": match["protocol"], "direction": direction, "port": port,
+                        "class_id": cls["id"]}
+        return CompiledProfile(profile_id, classes, filters)
+
+    @staticmethod
+    def parse_live(qdisc_json: str, class_json: str, filter_json: str) -> Optional[Dict[str, Any]]:
+        """Extract the hierarchy from ``tc -j`` qdisc, class and filter output.
+
+        Returns:
+            Optional[Dict[str, Any]]: "root_rate" (Kbps of class 1:1), "classes"
+                (class identifier to rate, ceiling and priority below 1:1),
+                "filters" (handle to class identifier of the profile filters) and
+                "foreign" (other filters at the profile priority), or None if
+                there is no HTB root qdisc with the default class
+        """
+        root = next((q for q in json.loads(qdisc_json or "[]") if q.get("root")), None)
+        if root is None or root.get("kind") != "htb" or root.get("handle") != "1:":
+            return None
+        # tc reads class identifiers as hex, so class 30 is reported as default 0x30
+        default = (root.get("options") or {}).get("default", 0)
+        if (default if isinstance(default, int) else int(default, 16)) != int(str(DEFAULT_CLASS), 16):
+            return None
+
+        live: Dict[str, Any] = {"root_rate": None, "classes": {}, "filters": {}, "foreign": False}
+        for entry in json.loads(class_json or "[]"):
+            major, _, minor = str(entry.get("handle", "")).partition(":")
+            if major != "1" or not minor.isdigit():
+                continue
+            # tc reports rates in bytes per second
+            settings = {"rate": int(entry.get("rate", 0)) * 8 // 1000,
+                        "ceiling": int(entry.get("ceil", 0)) * 8 // 1000,
+                        "priority": entry.get("prio")}
+            if minor == "1":
+                live["root_rate"] = settings["rate"]
+            elif entry.get("parent") == "1:1":
+                live["classes"][int(minor)] = settings
+
+        for entry in json.loads(filter_json or "[]"):
+            if entry.get("pref") != PROFILE_PRIORITY or entry.get("protocol") != "ip":
+                continue
+            if entry.get("kind") != "flower":
+                live["foreign"] = True
+                continue
+            options = entry.get("options")
+            if not options or "handle" not in options:
+                continue  # The filter chain head, not a filter
+            _, _, minor = str(options.get("classid", "")).partition(":")
+            live["filters"][int(str(options["handle"]), 0)] = int(minor) if minor.isdigit() else None
+        return live
+
+    def read_live(self) -> Optional[Dict[str, Any]]:
+        """Read the hierarchy of the interface with tc, see parse_live.
+
+        Returns None if there is no hierarchy to update or it cannot be read.
+        """
+        def show(*args: str) -> str:
+            return subprocess.run(["tc", "-j", *args, "show", "dev", self.qos.interface],
+                                  check=True, capture_output=True, text=True).stdout
+
+        try:
+            qdiscs = show("qdisc")
+            if self.parse_live(qdiscs, "[]", "[]") is None:
+                return None
+            return self.parse_live(qdiscs, show("class"), show("filter", "parent", "1:"))
+        except (subprocess.SubprocessError, OSError, ValueError) as e:
+            logger.warning(f"Could not read the QoS hierarchy of {self.qos.interface}: {e}")
+            return None
+
+    def diff(self, compiled: CompiledProfile, live: Dict[str, Any]) -> TcPlan:
+        """Plan the changes turning the live hierarchy into a compiled profile.
+
+        New classes are added first, so that filters never point at a missing
+        class, and classes of the old profile are deleted last, after the
+        filters that pointed at them.
+
+        Args:
+            compiled: The profile to apply
+            live: The hierarchy returned by read_live
+
+        Returns:
+            TcPlan: The changes, empty if the hierarchy already matches
+        """
+        qos = self.qos
+        plan = qos.plan()
+        total_kbps = int(qos.total_bandwidth * 1000)
+        if live["root_rate"] != total_kbps:
+            plan.add(["class", "change", "dev", qos.interface, "parent", "1:", "classid", "1:1", "htb",
+                      "rate", f"{total_kbps}kbit", "ceil", f"{total_kbps}kbit"])
+
+        for class_id, settings in compiled.classes.items():
+            current = live["classes"].get(class_id)
+            if current is None:
+                qos.add_traffic_class(class_id, settings["rate"], settings["ceiling"],
+                                      priority=settings["priority"], plan=plan)
+            elif (current["rate"], current["ceiling"]) != (settings["rate"], settings["ceiling"]) or \
+                    current["priority"] not in (None, settings["priority"]):
+                plan.add(["class", "change", "dev", qos.interface, "parent", "1:1", "classid", f"1:{class_id}",
+                          "htb", "rate", f"{settings['rate']}kbit", "ceil", f"{settings['ceiling']}kbit",
+                          "prio", settings["priority"]])
+
+        live_filters = live["filters"]
+        if live["foreign"]:
+            # Filters of another kind at the profile priority, e.g. from an older release
+            plan.add(["filter", "del", "dev", qos.interface, "parent", "1:0", "protocol", "ip",
+                      "prio", PROFILE_PRIORITY])
+            live_filters = {}
+        for handle, match in compiled.filters.items():
+            if live_filters.get(handle, -1) == match["class_id"]:
+                continue
+            plan.add_filter("1:0", PROFILE_PRIORITY, "flower", "ip_proto", match["protocol"],
+                            f"{match['direction']}_port", match["port"], "classid", f"1:{match['class_id']}",
+                            handle=str(handle), replace=handle in live_filters)
+        for handle in live_filters:
+            if handle not in compiled.filters:
+                plan.add(["filter", "del", "dev", qos.interface, "parent", "1:0", "protocol", "ip",
+                          "prio", PROFILE_PRIORITY, "handle", handle, "flower"])
+
+        for class_id in sorted(live["classes"]):
+            if class_id in self.managed and class_id not in compiled.classes:
+                qos.remove_traffic_class(class_id, plan=plan)
+        return plan
+
+    def build(self, compiled: CompiledProfile) -> TcPlan:
+        """Plan a new hierarchy for a compiled profile, replacing the root qdisc."""
+        plan = self.qos.plan()
+        self.qos.setup_tc_qdisc(plan)
+        for class_id, settings in compiled.classes.items():
+            self.qos.add_traffic_class(class_id, settings["rate"], settings["ceiling"],
+                                       priority=settings["priority"], plan=plan)
+        for handle, match in compiled.filters.items():
+            plan.add_filter("1:0", PROFILE_PRIORITY, "flower", "ip_proto", match["protocol"],
+                            f"{match['direction']}_port", match["port"], "classid", f"1:{match['class_id']}",
+                            handle=str(handle))
+        return plan
+
+    def apply(self, profile_id: str) -> bool:
+        """Apply a profile, changing only what differs from the live hierarchy (Linux only).
+
+        Args:
+            profile_id: Name of the profile
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        if self.qos.platform == 'Windows':
+            logger.warning("QoS profiles are not supported on Windows")
+            return False
+        try:
+            compiled = self.compile(profile_id)
+        except ProfileError as e:
+            logger.error(str(e))
+            return False
+
+        live = self.read_live()
+        plan = self.build(compiled) if live is None else self.diff(compiled, live)
+        changes = len(plan)
+        if not plan.commit():
+            logger.error(f"Failed to apply QoS profile {profile_id}")
+            return False
+
+        for class_id, settings in compiled.classes.items():
+            self.qos.classes[class_id] = dict(settings, parent_id=1)
+        logger.info(f"Applied QoS profile {profile_id} on {self.qos.interface} with {changes} tc commands")
+        return True
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+QoS Statistics Module for Charon Firewall
+
+This module samples the counters of the tc classes on an interface and keeps
+their recent history in memory, so that the web interface and the API can
+show live QoS statistics without running tc on every request.
+
+A QoSStatsCollector runs ``tc -s -j class show`` once per interval in a
+background thread. Each sample is parsed into per-class counters (bytes,
+packets, drops, overlimits) and the current backlog, and the counter
+increments are turned into rates. Every class with history has two
+fixed-size ring buffers of rates:
+
+- fine: one row per sample (1 s), covering 24 hours by default
+- coarse: one row per 5 minutes, covering 24 hours by default
+
+Rows are float32 NumPy arrays, so the fine history of one class takes about
+1.7 MiB for 24 hours. Only the first ``max_history_classes`` classes get a
+history, and never the per-host classes of the fair-share mode, which can
+number in the thousands; for the others only the latest sample is kept. A
+class that disappears from tc keeps its history until it has been absent for
+longer than the fine span. The history needs NumPy (the "perf" extra).
+"""
+
+import json
+import logging
+import math
+import subprocess
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .qos_fairshare import FIRST_HOST_CLASS, LAST_HOST_CLASS
+
+logger = logging.getLogger('charon.qos_stats')
+
+# Columns of the history rings
+FIELDS = ("bytes_per_sec", "packets_per_sec", "drops_per_sec", "overlimits_per_sec", "backlog")
+
+# Counters read from tc; backlog is a gauge and not turned into a rate
+COUNTERS = ("bytes", "packets", "drops", "overlimits")
+
+RESOLUTION_FINE = "1s"
+RESOLUTION_COARSE = "5m"
+
+# Classes with a history ring; at 1 s resolution this bounds the fine history to about 110 MiB
+MAX_HISTORY_CLASSES = 64
+
+
+def is_host_class(handle: str) -> bool:
+    """Check whether a class handle is one handed out to a host by the fair-share mode."""
+    minor = handle.partition(":")[2]
+    return minor.isdigit() and FIRST_HOST_CLASS <= int(minor) <= LAST_HOST_CLASS
+
+
+def parse_class_stats(output: str) -> Dict[str, Dict[str, Any]]:
+    """Parse the output of ``tc -s -j class show`` into per-class statistics.
+
+    Args:
+        output: JSON printed by tc
+
+    Returns:
+        Dict[str, Dict[str, Any]]: Class handle ("1:10") to its kind, parent
+            and counters (bytes, packets, drops, overlimits, backlog, qlen)
+    """
+    classes = {}
+    for entry in json.loads(output or "[]"):
+        handle = entry.get("handle")
+        if not handle:
+            continue
+        stats = entry.get("stats") or {}
+        classes[handle] = {
+            "kind": entry.get("class"),
+            "parent": entry.get("parent", "root" if entry.get("root") else None),
+            "bytes": int(stats.get("bytes", 0)),
+            "packets": int(stats.get("packets", 0)),
+            "drops": int(stats.get("drops", 0)),
+            "overlimits": int(stats.get("overlimits", 0)),
+            "backlog": int(stats.get("backlog", 0)),
+            "qlen": int(stats.get("qlen", 0)),
+        }
+    return classes
+
+
+class Ring:
+    """Fixed-size history of FIELDS rows with a shared timestamp column."""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.times = np.full(capacity, np.nan)
+        self.values: Dict[str, np.ndarray] = {}
+        self.position = 0  # Next row to write
+        self.count = 0
+
+    def append(self, now: float, rows: Dict[str, Optional['np.ndarray']]) -> None:
+        """Write one row for every known class; classes without a row get NaN."""
+        for handle, row in rows.items():
+            if handle not in self.values:
+                self.values[handle] = np.full((self.capacity, len(FIELDS)), np.nan, dtype=np.float32)
+        for handle, values in self.values.items():
+            row = rows.get(handle)
+            values[self.position] = np.nan if row is None else row
+        self.times[self.position] = now
+        self.position = (self.position + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def read(self, handle: str, since: Optional[float] = None) -> Dict[str, List[Optional[float]]]:
+        """Get the history of a class, oldest first."""
+        order = np.arange(self.position - self.count, self.position) % self.capacity
+        times = self.times[order]
+        values = self.values.get(handle)
+        if values is None:
+            return {}
+        values = values[order]
+        if since is not None:
+            keep = times >= since
+            times, values = times[keep], values[keep]
+        history = {"time": times.tolist()}
+        for column, field in enumerate(FIELDS):
+            history[field] = [None if math.isnan(v) else v for v in values[:, column].tolist()]
+        return history
+
+    def forget(self, handle: str) -> None:
+        self.values.pop(handle, None)
+
+
+class QoSStatsCollector:
+    """Periodic sampler of tc class statistics with in-memory history."""
+
+    def __init__(self, interface: str, interval: float = 1.0, fine_span: float = 86400,
+                 coarse_interval: float = 300, coarse_span: float = 86400, tc_path: str = "tc",
+                 max_history_classes: int = MAX_HISTORY_CLASSES):
+        """Initialize the collector.
+
+        Args:
+            interface: The network interface whose classes are sampled
+            interval: Seconds between samples (the fine resolution)
+            fine_span: Seconds of history kept at the fine resolution
+            coarse_interval: Seconds per row of the coarse history
+            coarse_span: Seconds of history kept at the coarse resolution
+            tc_path: Path to the tc binary
+            max_history_classes: Most classes with a history; further classes and
+                per-host classes only have their latest sample
+            
+        Raises:
+            ImportError: If NumPy is not installed
+        """
+        if np is None:
+            raise ImportError("QoS statistics history requires numpy")
+        self.interface = interface
+        self.interval = interval
+        self.coarse_interval = coarse_interval
+        self.tc_path = tc_path
+        self.fine = Ring(max(1, int(fine_span / interval)))
+        self.coarse = Ring(max(1, int(coarse_span / coarse_interval)))
+        self.max_history_classes = max_history_classes
+
+        self._lock = threading.Lock()
+        self._latest: Dict[str, Dict[str, Any]] = {}
+        self._previous: Optional[float] = None
+        self._counters: Dict[str, np.ndarray] = {}
+        # Counters and time at the start of the current coarse row
+        self._coarse_start: Optional[float] = None
+        self._coarse_counters: Dict[str, np.ndarray] = {}
+        self._coarse_backlog: Dict[str, float] = {}
+        self._last_seen: Dict[str, float] = {}
+        self._fine_span = fine_span
+        # Classes recorded in the rings
+        self._history: Set[str] = set()
+        self._history_full = False
+
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.errors = 0
+
+    def sample(self, now: Optional[float] = None) -> bool:
+        """Read the class statistics from tc once and record them.
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        now = time.time() if now is None else now
+        try:
+            result = subprocess.run([self.tc_path, "-s", "-j", "class", "show", "dev", self.interface],
+                                    check=True, capture_output=True, text=True)
+            classes = parse_class_stats(result.stdout)
+        except (subprocess.SubprocessError, OSError, ValueError) as e:
+            self.errors += 1
+            logger.error(f"Failed to read tc class statistics on {self.interface}: {e}")
+            return False
+        self.record(classes, now)
+        return True
+
+    def record(self, classes: Dict[str, Dict[str, Any]], now: float) -> None:
+        """Record a sample of parsed class statistics taken at `now`."""
+        with self._lock:
+            elapsed = None if self._previous is None else now - self._previous
+            rows: Dict[str, Optional[np.ndarray]] = {}
+            latest = {}
+            for handle, stats in classes.items():
+                counters = np.array([stats[name] for name in COUNTERS], dtype=np.float64)
+                rates = self._rates(self._counters.get(handle), counters, elapsed)
+                self._counters[handle] = counters
+                self._last_seen[handle] = now
+                self._coarse_backlog[handle] = max(self._coarse_backlog.get(handle, 0), stats["backlog"])
+                if rates is not None and self._keeps_history(handle):
+                    rows[handle] = np.append(rates, stats["backlog"])
+                latest[handle] = dict(stats, **{field: (None if rates is None else float(rates[i]))
+                                               for i, field in enumerate(FIELDS[:-1])})
+
+            if elapsed is not None:
+                self.fine.append(now, rows)
+            self._latest = latest
+            self._previous = now
+
+            if self._coarse_start is None:
+                self._coarse_start = now
+                self._coarse_counters = dict(self._counters)
+            elif now - self._coarse_start >= self.coarse_interval:
+                self._close_coarse_row(now)
+
+            # Drop the history of classes gone for longer than the fine span
+            for handle in [h for h, seen in self._last_seen.items() if now - seen > self._fine_span]:
+                for state in (self._last_seen, self._counters, self._coarse_counters, self._coarse_backlog):
+                    state.pop(handle, None)
+                self._history.discard(handle)
+                self._history_full = False
+                self.fine.forget(handle)
+                self.coarse.forget(handle)
+
+    def _keeps_history(self, handle: str) -> bool:
+        """Check whether a class is recorded in the rings, admitting it while there is room."""
+        if handle in self._history:
+            return True
+        if is_host_class(handle):
+            return False
+        if len(self._history) >= self.max_history_classes:
+            if not self._history_full:
+                logger.warning(f"More than {self.max_history_classes} QoS classes on {self.interface}, "
+                               f"keeping only the latest statistics of {handle} and later classes")
+                self._history_full = True
+            return False
+        self._history.add(handle)
+        return True
+
+    def _close_coarse_row(self, now: float) -> None:
+        """Write the average rates since the last coarse row."""
+        elapsed = now - self._coarse_start
+        rows = {}
+        for handle, counters in self._counters.items():
+            if self._last_seen.get(handle, 0) < self._coarse_start or handle not in self._history:
+                continue
+            rates = self._rates(self._coarse_counters.get(handle), counters, elapsed)
+            if rates is not None:
+                # The coarse backlog is the largest backlog seen in the interval
+                rows[handle] = np.append(rates, self._coarse_backlog.get(handle, 0))
+        self.coarse.append(now, rows)
+        self._coarse_start = now
+        self._coarse_counters = dict(self._counters)
+        self._coarse_backlog = {}
+
+    @staticmethod
+    def _rates(before: Optional['np.ndarray'], after: 'np.ndarray',
+               elapsed: Optional[float]) -> Optional['np.ndarray']:
+        if before is None or not elapsed or elapsed <= 0:
+            return None
+        delta = after - before
+        # A counter that went backwards was reset (the class was recreated)
+        delta = np.where(delta < 0, after, delta)
+        return delta / elapsed
+
+    def latest(self) -> Dict[str, Dict[str, Any]]:
+        """Get the counters and rates of every class from the last sample."""
+        with self._lock:
+            return {handle: dict(stats) for handle, stats in self._latest.items()}
+
+    def history(self, handle: str, resolution: str = RESOLUTION_FINE,
+                since: Optional[float] = None) -> Dict[str, List[Optional[float]]]:
+        """Get the rate history of a class, oldest first.
+
+        Args:
+            handle: Class handle, e.g. "1:10"
+            resolution: RESOLUTION_FINE or RESOLUTION_COARSE
+            since: Only return rows taken at or after this Unix time
+
+        Returns:
+            Dict[str, List]: "time" and one list per FIELDS entry (None where the
+                class was not present), empty if the class is unknown
+        """
+        ring = self.coarse if resolution == RESOLUTION_COARSE else self.fine
+        with self._lock:
+            return ring.read(handle, since)
+
+    def start(self) -> None:
+        """Start sampling in a background thread."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=f"qos-stats-{self.interface}", daemon=True)
+        self._thread.start()
+        logger.info(f"Started QoS statistics collector on {self.interface}")
+
+    def stop(self) -> None:
+        """Stop the background thread."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        deadline = time.monotonic()
+        while not self._stop.is_set():
+            self.sample()
+            # Keep a fixed cadence regardless of how long tc takes
+            deadline += self.interval
+            delay = deadline - time.monotonic()
+            if delay < 0:
+                deadline = time.monotonic()
+                delay = 0
+            self._stop.wait(delay)
+
+
+# Collectors shared by the web interface and the API, one per interface
+_collectors: Dict[str, QoSStatsCollector] = {}
+_collectors_lock = threading.Lock()
+
+
+def shared_collector(interface: str, **options: Any) -> QoSStatsCollector:
+    """Get the running collector of an interface, starting it on first use.
+
+    Args:
+        interface: The network interface
+        **options: Options passed to QoSStatsCollector when it is created
+    """
+    with _collectors_lock:
+        collector = _collectors.get(interface)
+        if collector is None:
+            collector = _collectors[interface] = QoSStatsCollector(interface, **options)
+            collector.start()
+        return collector
@@ -0,0 +1,633 @@
+#!/usr/bin/env python3
+"""
+Rule Analyzer Module for Charon Firewall
+
+This module finds rules that never decide the fate of a packet, or whose
+outcome depends on their position, so the ruleset can be pruned:
+
+- shadowed: an earlier rule with a different verdict matches every packet
+  the rule matches, so the rule never fires and its verdict is never applied
+- redundant: the rule can be removed without changing any verdict, because
+  an earlier rule, or a later one with no conflicting rule in between, has
+  the same verdict and matches every packet the rule matches
+- correlated: an earlier rule with a different verdict matches some, but not
+  all, of the packets the rule matches, so swapping them changes verdicts
+
+Comparing every pair of rules is quadratic, so each rule is first checked
+for an earlier rule covering it, which settles most rules of a large
+ruleset. The first rules of a chain are indexed with bitmaps per dimension
+(addresses and ports), where covering rules are usually found. The other
+rules are grouped by the dimensions they restrict, with wildcard rules in a
+bucket of their own, and every group is scanned or queried in a nested
+containment list. Only uncovered rules look for the rules they overlap.
+50,000 random rules, 30% with unrestricted addresses and 40% with
+unrestricted ports, are analyzed in under a second (see
+scripts/benchmark_rule_analyzer.py).
+"""
+
+import bisect
+import gc
+import heapq
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .rule_evaluator import SegmentIndex
+from .rule_match import RuleMatch
+from .ruleset_compiler import VALID_ACTIONS, VALID_CHAINS
+
+logger = logging.getLogger('charon.rule_analyzer')
+
+DIMENSIONS = ('src', 'dst', 'sport', 'dport')
+
+# Hull of a dimension a rule does not restrict, wide enough for IPv6
+FULL_RANGE = (0, (1 << 128) - 1)
+
+# Rules at the start of a chain indexed with bitmaps, where the rules
+# covering others are usually found (bitmaps of n rules take n² bits)
+PREFIX_RULES = 1024
+
+# Groups with at most this many rules before the best covering rule found so
+# far are scanned without querying their index
+SCAN_LIMIT = 16
+
+
+@contextmanager
+def _gc_paused():
+    """Pause the cyclic garbage collector.
+
+    The analysis allocates objects for every rule and anomaly but creates no
+    reference cycles, and collections triggered by those allocations would
+    repeatedly traverse the growing heap.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def _bits(bitmap: int) -> Iterator[int]:
+    """Iterate over the positions of the set bits of a bitmap in ascending order."""
+    while bitmap:
+        yield (bitmap & -bitmap).bit_length() - 1
+        bitmap &= bitmap - 1
+
+
+class IntervalIndex:
+    """Nested containment list over closed integer intervals.
+
+    Intervals are sorted by start and arranged so that every interval is a
+    child of the smallest earlier interval containing it. Siblings then have
+    increasing starts and ends, so the siblings overlapping a range are
+    contiguous and found by binary search. Address and port ranges in
+    firewall rules are mostly nested or disjoint, which keeps the lists flat.
+    """
+
+    def __init__(self, intervals: Iterable[Tuple[int, int, int]]):
+        """Build the index.
+
+        Args:
+            intervals: (start, end, item) tuples
+        """
+        entries = sorted((start, -end, item) for start, end, item in intervals)
+        self.starts = [entry[0] for entry in entries]
+        self.ends = ends = [-entry[1] for entry in entries]
+        self.items = [entry[2] for entry in entries]
+        self.sorted_starts = self.starts
+        self.sorted_ends = sorted(ends)
+
+        # Sublists of node indexes keyed by parent node, -1 for the top level,
+        # and the ends of the nodes in every sublist
+        self.children: Dict[int, List[int]] = {-1: []}
+        self.child_ends: Dict[int, List[int]] = {-1: []}
+        children, child_ends = self.children, self.child_ends
+        stack = [-1]
+        for node, end in enumerate(ends):
+            while len(stack) > 1 and ends[stack[-1]] < end:
+                stack.pop()
+            parent = stack[-1]
+            if parent in children:
+                children[parent].append(node)
+                child_ends[parent].append(end)
+            else:
+                children[parent] = [node]
+                child_ends[parent] = [end]
+            stack.append(node)
+
+    def count(self, start: int, end: int) -> int:
+        """Count the intervals overlapping [start, end]."""
+        return bisect.bisect_right(self.sorted_starts, end) - bisect.bisect_left(self.sorted_ends, start)
+
+    def query(self, start: int, end: int) -> List[int]:
+        """Get the items of the intervals overlapping [start, end]."""
+        starts, items, children, child_ends = self.starts, self.items, self.children, self.child_ends
+        found = []
+        pending = [-1]
+        while pending:
+            parent = pending.pop()
+            nodes = children[parent]
+            for position in range(bisect.bisect_left(child_ends[parent], start), len(nodes)):
+                node = nodes[position]
+                if starts[node] > end:
+                    break
+                found.append(items[node])
+                if node in children:
+                    pending.append(node)
+        return found
+
+
+class RuleAnomaly:
+    """A rule that is shadowed, redundant or correlated with another rule."""
+
+    SHADOWED = "shadowed"
+    REDUNDANT = "redundant"
+    CORRELATED = "correlated"
+
+    __slots__ = ('kind', 'rule_id', 'related_rule_id', 'chain')
+
+    def __init__(self, kind: str, rule_id: int, related_rule_id: int, chain: str):
+        """Initialize an anomaly.
+
+        Args:
+            kind: SHADOWED, REDUNDANT or CORRELATED
+            rule_id: The rule the anomaly is reported for
+            related_rule_id: The rule that shadows, makes redundant, or
+                correlates with it
+            chain: The chain of both rules
+        """
+        self.kind = kind
+        self.rule_id = rule_id
+        self.related_rule_id = related_rule_id
+        self.chain = chain
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'kind': self.kind,
+            'rule_id': self.rule_id,
+            'related_rule_id': self.related_rule_id,
+            'chain': self.chain
+        }
+
+    def __repr__(self) -> str:
+        return f"RuleAnomaly({self.kind!r}, {self.rule_id}, {self.related_rule_id})"
+
+
+class RuleGroup:
+    """The rules of a chain that restrict the same dimensions.
+
+    The interval index of a dimension is built on first use, as most groups
+    are only scanned.
+    """
+
+    def __init__(self, restricted: int, keys: List[Tuple[int, ...]]):
+        """Initialize an empty group.
+
+        Args:
+            restricted: Bitmask of the restricted DIMENSIONS
+            keys: The keys of every rule of the chain
+        """
+        self.restricted = restricted
+        self.keys = keys
+        self.positions: List[int] = []
+        self._indexes: Dict[int, IntervalIndex] = {}
+        self._selective: Optional[int] = None
+
+    def index(self, bit: int) -> IntervalIndex:
+        """Get the index over the hulls of the rules in the dimension DIMENSIONS[bit]."""
+        index = self._indexes.get(bit)
+        if index is None:
+            keys = self.keys
+            index = self._indexes[bit] = IntervalIndex(
+                [(keys[position][2 + 2 * bit], keys[position][3 + 2 * bit], position)
+                 for position in self.positions])
+        return index
+
+    def query_bit(self, shared: int) -> int:
+        """Choose the dimension to query among a subset of the restricted ones.
+
+        An index that is already built is preferred over the most selective
+        dimension, so that rarely queried groups build only one index.
+        """
+        for bit in self._indexes:
+            if shared & (1 << bit):
+                return bit
+        bit = self.selective_bit()
+        if shared & (1 << bit):
+            return bit
+        return (shared & -shared).bit_length() - 1
+
+    def selective_bit(self) -> int:
+        """Get the restricted dimension with the most distinct hull starts, likely the most selective."""
+        if self._selective is None:
+            keys = self.keys
+            self._selective = max(
+                (bit for bit in range(len(DIMENSIONS)) if self.restricted & (1 << bit)),
+                key=lambda bit: len({keys[position][2 + 2 * bit] for position in self.positions}))
+        return self._selective
+
+
+class ChainIndex:
+    """Indexes over the rules of one chain.
+
+    The first PREFIX_RULES rules are indexed with bitmaps. Rules are also
+    grouped by the dimensions they restrict, and every group has an interval
+    index per restricted dimension over the hulls of its rules. Rules that
+    restrict no dimension (wildcards) form their own bucket and are never
+    put in an index.
+    """
+
+    def __init__(self, matches: List[RuleMatch]):
+        self.matches = matches
+
+        # Flattened copies of every rule for the pairwise checks: protocol and
+        # family as small bitmasks, and the hull of every dimension
+        protocols = sorted({p for match in matches if match.protocols for p in match.protocols})
+        protocol_bits = {protocol: 1 << bit for bit, protocol in enumerate(protocols)}
+        protocol_masks: Dict[Any, int] = {None: -1}
+        for match in matches:
+            if match.protocols not in protocol_masks:
+                protocol_masks[match.protocols] = sum(protocol_bits[p] for p in match.protocols)
+        family_masks = {None: 3, 4: 1, 6: 2}
+        low, high = FULL_RANGE
+        self.keys: List[Tuple[int, ...]] = []
+        self.simple: List[bool] = []
+        self.restricted: List[int] = []
+        self.wildcards: List[int] = []
+        self.groups: Dict[int, RuleGroup] = {}
+        for position, match in enumerate(matches):
+            src, dst, sport, dport = match.src, match.dst, match.sport, match.dport
+            key = (protocol_masks[match.protocols], family_masks[match.family],
+                   low if src is None else src[0][0], high if src is None else src[-1][1],
+                   low if dst is None else dst[0][0], high if dst is None else dst[-1][1],
+                   low if sport is None else sport[0][0], high if sport is None else sport[-1][1],
+                   low if dport is None else dport[0][0], high if dport is None else dport[-1][1])
+            restricted = ((src is not None) | (dst is not None) << 1
+                          | (sport is not None) << 2 | (dport is not None) << 3)
+            self.keys.append(key)
+            self.simple.append((src is None or len(src) == 1) and (dst is None or len(dst) == 1)
+                               and (sport is None or len(sport) == 1) and (dport is None or len(dport) == 1))
+            self.restricted.append(restricted)
+            if restricted:
+                group = self.groups.get(restricted)
+                if group is None:
+                    group = self.groups[restricted] = RuleGroup(restricted, self.keys)
+                group.positions.append(position)
+            else:
+                self.wildcards.append(position)
+
+        # The first wildcard for every protocol and family, and, by the
+        # protocols and family of a rule, the first wildcard covering them
+        self.first_wildcards: Dict[Tuple[int, int], int] = {}
+        for position in self.wildcards:
+            self.first_wildcards.setdefault(self.keys[position][:2], position)
+        self.wildcard_covering: Dict[Tuple[int, int], int] = {}
+
+        # Bitmaps of the first rules containing each value of each dimension,
+        # of those not restricting it, and of those matching every protocol
+        # and family of a rule
+        self.prefix_size = min(len(matches), PREFIX_RULES)
+        self.prefix_indexes = [
+            SegmentIndex([[(key[2 + 2 * bit], key[3 + 2 * bit])] for key in self.keys[:self.prefix_size]], high)
+            for bit in range(len(DIMENSIONS))
+        ]
+        self.prefix_unrestricted = [index.lookup(low) & index.lookup(high) for index in self.prefix_indexes]
+        self.prefix_masks: Dict[Tuple[int, int], int] = {}
+        self.prefix_overlap_masks: Dict[Tuple[int, int], int] = {}
+
+        # The hull starts of the first rules in ascending order, and for each
+        # count the bitmap of that many rules with the lowest starts
+        self.prefix_starts: List[List[int]] = []
+        self.prefix_started: List[List[int]] = []
+        for bit in range(len(DIMENSIONS)):
+            order = sorted(range(self.prefix_size), key=lambda other: self.keys[other][2 + 2 * bit])
+            started = [0]
+            for other in order:
+                started.append(started[-1] | 1 << other)
+            self.prefix_starts.append([self.keys[other][2 + 2 * bit] for other in order])
+            self.prefix_started.append(started)
+
+        # The groups that may cover a rule restricting a set of dimensions,
+        # those restricting the fewest first, as they cover the most rules
+        self.covering_groups: Dict[int, List[RuleGroup]] = {}
+        for restricted in self.groups:
+            self.covering_groups[restricted] = sorted(
+                (group for mask, group in self.groups.items() if not mask & ~restricted),
+                key=lambda group: bin(group.restricted).count('1'))
+
+    def first_covering(self, position: int) -> Optional[int]:
+        """Get the position of the first earlier rule covering the rule at `position`.
+
+        A rule can only be covered by wildcards with the same protocols and
+        family, or by rules restricting a subset of its dimensions. Each of
+        those groups is either scanned up to the best position found so far,
+        or queried for the rules whose hull contains the start of the rule's
+        hull in the group's most selective dimension, whichever visits fewer
+        rules.
+        """
+        key = self.keys[position]
+        best = self.wildcard_covering.get(key[:2])
+        if best is None:
+            best = self.wildcard_covering[key[:2]] = min(
+                (other for (protocol_mask, family_mask), other in self.first_wildcards.items()
+                 if key[0] & ~protocol_mask == 0 and key[1] & ~family_mask == 0), default=len(self.keys))
+        best = min(best, position)
+
+        # The first rules, by bitmaps of the rules whose protocols, family and
+        # hulls contain the rule's, which cover it if their hulls are exact
+        covers = self.covers
+        candidates = self.prefix_candidates(key, min(best, self.prefix_size))
+        while candidates:
+            other = (candidates & -candidates).bit_length() - 1
+            if self.simple[other] or covers(other, position):
+                return other
+            candidates &= candidates - 1
+        if best <= self.prefix_size:
+            return best if best < position else None
+
+        # The other rules, by group
+        for group in self.covering_groups.get(self.restricted[position], ()):
+            positions = group.positions
+            if positions[0] >= best or positions[-1] < self.prefix_size:
+                continue
+            first = bisect.bisect_left(positions, self.prefix_size)
+            scan = bisect.bisect_left(positions, best, first) - first
+            if scan <= SCAN_LIMIT:
+                index = None
+            else:
+                bit = group.selective_bit()
+                index = group.index(bit)
+                start = key[2 + 2 * bit]
+            if index is None or scan <= index.count(start, start):
+                for other in positions[first:first + scan]:
+                    if covers(other, position):
+                        best = other
+                        break
+            else:
+                for other in index.query(start, start):
+                    if self.prefix_size <= other < best and covers(other, position):
+                        best = other
+        return best if best < position else None
+
+    def prefix_candidates(self, key: Tuple[int, ...], limit: int) -> int:
+        """Get the bitmap of the first rules whose hulls contain the hulls of a rule, by its key.
+
+        Args:
+            key: The key of the rule
+            limit: Only rules before this position are included
+        """
+        candidates = self.prefix_masks.get(key[:2])
+        if candidates is None:
+            candidates = 0
+            for other in range(self.prefix_size):
+                if key[0] & ~self.keys[other][0] == 0 and key[1] & ~self.keys[other][1] == 0:
+                    candidates |= 1 << other
+            self.prefix_masks[key[:2]] = candidates
+        candidates &= (1 << limit) - 1
+        low, high = FULL_RANGE
+        for bit, index in enumerate(self.prefix_indexes):
+            if not candidates:
+                break
+            start, end = key[2 + 2 * bit], key[3 + 2 * bit]
+            if start == low and end == high:
+                candidates &= self.prefix_unrestricted[bit]
+                continue
+            candidates &= index.masks[bisect.bisect_right(index.breaks, start)]
+            if end != start:
+                candidates &= index.masks[bisect.bisect_right(index.breaks, end)]
+        return candidates
+
+    def prefix_overlapping(self, key: Tuple[int, ...]) -> int:
+        """Get the bitmap of the first rules whose hulls overlap the hulls of a rule, by its key.
+
+        A hull overlaps [start, end] if it contains start or starts after
+        start but not after end.
+        """
+        candidates = self.prefix_overlap_masks.get(key[:2])
+        if candidates is None:
+            candidates = 0
+            for other in range(self.prefix_size):
+                if key[0] & self.keys[other][0] and key[1] & self.keys[other][1]:
+                    candidates |= 1 << other
+            self.prefix_overlap_masks[key[:2]] = candidates
+        for bit, index in enumerate(self.prefix_indexes):
+            start, end = key[2 + 2 * bit], key[3 + 2 * bit]
+            starts, started = self.prefix_starts[bit], self.prefix_started[bit]
+            candidates &= index.lookup(start) | (started[bisect.bisect_right(starts, end)]
+                                                 ^ started[bisect.bisect_right(starts, start)])
+        return candidates
+
+    def overlapping(self, position: int) -> Tuple[List[int], Iterator[int]]:
+        """Get the rules that can match the same packets as the rule at `position`.
+
+        The first rules are found with bitmaps. After them, wildcards and
+        groups restricting none of the rule's dimensions overlap it whatever
+        their ranges, and other groups are queried in one dimension both
+        restrict; the pairwise check removes the rest.
+
+        Returns:
+            Tuple of the earlier positions in ascending order, and an iterator
+            over the later positions in ascending order, which is computed as
+            it is consumed
+        """
+        overlaps = self.overlaps
+        candidates = self.prefix_overlapping(self.keys[position])
+        earlier = [other for other in _bits(candidates & ((1 << min(position, self.prefix_size)) - 1))
+                   if overlaps(other, position)]
+        lists = None
+        if position > self.prefix_size:
+            lists = self._overlapping_groups(position)
+            after = heapq.merge(*(positions[:bisect.bisect_left(positions, position)] for positions in lists))
+            earlier.extend(other for other in after if overlaps(other, position))
+        return earlier, self._later(position, candidates >> (position + 1) << (position + 1), lists)
+
+    def _later(self, position: int, candidates: int, lists: Optional[List[List[int]]]) -> Iterator[int]:
+        """Iterate over the rules after `position` overlapping it.
+
+        Args:
+            position: The position of the rule
+            candidates: Bitmap of the first rules after it overlapping its hulls
+            lists: The result of _overlapping_groups(position), if computed
+        """
+        overlaps = self.overlaps
+        for other in _bits(candidates):
+            if overlaps(other, position):
+                yield other
+        if lists is None:
+            lists = self._overlapping_groups(position)
+        for other in heapq.merge(*(positions[bisect.bisect_right(positions, position):] for positions in lists)):
+            if overlaps(other, position):
+                yield other
+
+    def _overlapping_groups(self, position: int) -> List[List[int]]:
+        """Get, by group, the sorted positions after the first rules that may overlap the rule at `position`."""
+        key = self.keys[position]
+        restricted = self.restricted[position]
+        prefix_size = self.prefix_size
+        lists = [self.wildcards[bisect.bisect_left(self.wildcards, prefix_size):]]
+        for mask, group in self.groups.items():
+            positions = group.positions
+            if positions[-1] < prefix_size:
+                continue
+            if not mask & restricted:
+                lists.append(positions[bisect.bisect_left(positions, prefix_size):])
+                continue
+            bit = group.query_bit(mask & restricted)
+            lists.append(sorted(other for other in group.index(bit).query(key[2 + 2 * bit], key[3 + 2 * bit])
+                                if other >= prefix_size))
+        return lists
+
+    def overlaps(self, a: int, b: int) -> bool:
+        """Check whether the rules at positions a and b can match the same packet."""
+        x, y = self.keys[a], self.keys[b]
+        if not (x[0] & y[0] and x[1] & y[1] and x[2] <= y[3] and y[2] <= x[3] and x[4] <= y[5]
+                and y[4] <= x[5] and x[6] <= y[7] and y[6] <= x[7] and x[8] <= y[9] and y[8] <= x[9]):
+            return False
+        if self.simple[a] and self.simple[b]:
+            return True
+        return self.matches[a].overlaps(self.matches[b])
+
+    def covers(self, a: int, b: int) -> bool:
+        """Check whether the rule at position a matches every packet of the rule at b."""
+        x, y = self.keys[a], self.keys[b]
+        if not (y[0] & ~x[0] == 0 and y[1] & ~x[1] == 0 and x[2] <= y[2] and y[3] <= x[3]
+                and x[4] <= y[4] and y[5] <= x[5] and x[6] <= y[6] and y[7] <= x[7]
+                and x[8] <= y[8] and y[9] <= x[9]):
+            return False
+        if self.simple[a]:
+            return True
+        return self.matches[a].covers(self.matches[b])
+
+
+class RuleAnalyzer:
+    """Finds shadowed, redundant and correlated firewall rules."""
+
+    def analyze(self, rules: Iterable[Any]) -> List[RuleAnomaly]:
+        """Analyze the enabled rules of every chain.
+
+        Args:
+            rules: FirewallRule rows (or objects with the same attributes);
+                disabled and invalid rows are ignored
+
+        Returns:
+            List[RuleAnomaly]: The anomalies, ordered by chain and rule
+        """
+        chains: Dict[str, List[RuleMatch]] = {chain: [] for chain in VALID_CHAINS}
+        anomalies: List[RuleAnomaly] = []
+        with _gc_paused():
+            enabled = [rule for rule in rules if getattr(rule, 'enabled', True)]
+            for rule in sorted(enabled, key=lambda r: getattr(r, 'id', 0) or 0):
+                try:
+                    match = RuleMatch.from_rule(rule)
+                except ValueError as e:
+                    logger.debug(f"Skipping firewall rule {getattr(rule, 'id', None)}: {e}")
+                    continue
+                if match.chain in chains and match.action in VALID_ACTIONS:
+                    chains[match.chain].append(match)
+
+            for chain, matches in chains.items():
+                if matches:
+                    anomalies.extend(self._analyze_chain(chain, matches))
+        return anomalies
+
+    def _analyze_chain(self, chain: str, matches: List[RuleMatch]) -> List[RuleAnomaly]:
+        index = ChainIndex(matches)
+        anomalies: List[RuleAnomaly] = []
+
+        for position, match in enumerate(matches):
+            # Most rules of a large ruleset with broad rules are covered, so
+            # they are settled without looking at the rules they overlap
+            other = index.first_covering(position)
+            if other is not None:
+                covering = matches[other]
+                kind = RuleAnomaly.REDUNDANT if covering.action == match.action else RuleAnomaly.SHADOWED
+                anomalies.append(RuleAnomaly(kind, match.rule_id, covering.rule_id, chain))
+                continue
+
+            earlier, later = index.overlapping(position)
+            for other in earlier:
+                if matches[other].action != match.action and not index.covers(position, other):
+                    anomalies.append(RuleAnomaly(RuleAnomaly.CORRELATED, match.rule_id,
+                                                 matches[other].rule_id, chain))
+
+            # A later rule with the same verdict covering this one makes it
+            # redundant, unless a rule in between decides some of its packets
+            for other in later:
+                if matches[other].action != match.action:
+                    break
+                if index.covers(other, position):
+                    anomalies.append(RuleAnomaly(RuleAnomaly.REDUNDANT, match.rule_id,
+                                                 matches[other].rule_id, chain))
+                    break
+        return anomalies
+
+    def report(self, rules: Iterable[Any]) -> Dict[str, Any]:
+        """Analyze the rules and summarize the anomalies for the API.
+
+        Returns:
+            Dict with the rule count, the anomalies grouped by kind and the
+            time the analysis took in seconds
+        """
+        started = time.perf_counter()
+        rules = list(rules)
+        result: Dict[str, Any] = {
+            'rules': len(rules),
+            RuleAnomaly.SHADOWED: [],
+            RuleAnomaly.REDUNDANT: [],
+            RuleAnomaly.CORRELATED: [],
+        }
+        with _gc_paused():
+            for anomaly in self.analyze(rules):
+                result[anomaly.kind].append(anomaly.to_dict())
+        result['elapsed'] = round(time.perf_counter() - started, 3)
+        return result
+
+
+class RuleAnalysisCache:
+    """The last analysis report, reused while the rules are unchanged.
+
+    The rules are analyzed outside the lock. While one request analyzes
+    changed rules, the others get the previous report instead of waiting.
+    """
+
+    def __init__(self, analyzer: Optional[RuleAnalyzer] = None):
+        self.analyzer = analyzer or RuleAnalyzer()
+        self._lock = threading.Lock()
+        # (rules version, report) of the last analysis
+        self._last: Optional[Tuple[Any, Dict[str, Any]]] = None
+        # Number of analyses in progress
+        self._running = 0
+
+    def report(self, db: Any) -> Dict[str, Any]:
+        """Get the report of the rules of a database, analyzing them if they changed.
+
+        Args:
+            db: Database whose get_rules_version() tells whether the rules
+                changed since the last report
+
+        Returns:
+            Dict[str, Any]: The report (see RuleAnalyzer.report), possibly of
+                the previous rules while another request analyzes the new ones
+        """
+        version = db.get_rules_version()
+        with self._lock:
+            last = self._last
+            if last is not None and ((version is not None and last[0] == version) or self._running):
+                return last[1]
+            self._running += 1
+        try:
+            report = self.analyzer.report(db.get_rules())
+            with self._lock:
+                self._last = (version, report)
+            return report
+        finally:
+            with self._lock:
+                self._running -= 1
+
+
+# Reports shared by the web interface and the API
+shared_analysis = RuleAnalysisCache()
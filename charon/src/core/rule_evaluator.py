@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+"""
+Rule Evaluator Module for Charon Firewall
+
+This module answers "which rule would match this packet?" without touching
+the kernel. The enabled FirewallRule rows are compiled into one matcher per
+chain, which classifies flows (chain, protocol, addresses and ports) with
+first-match semantics, exactly as nftables walks the chain.
+
+Each matcher uses the bit-vector classification scheme: the values of every
+dimension (source address, destination address, source port, destination
+port) are cut into elementary segments at the rule boundaries, and every
+segment stores the bitmap of rules matching it. Protocols are bucketed the
+same way. Classifying a flow is then one binary search per dimension, an AND
+of the bitmaps and a lowest-set-bit scan. When NumPy is installed, batches of
+IPv4 flows are classified with vectorized searches and bitmap operations.
+"""
+
+import bisect
+import logging
+import socket
+from collections import namedtuple
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from .rule_match import RuleMatch
+from .ruleset_compiler import VALID_ACTIONS, VALID_CHAINS
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger('charon.rule_evaluator')
+
+# Base chains created by PacketFilter.setup_base_table() drop by default
+DEFAULT_POLICY = "drop"
+
+# Largest values of each dimension
+MAX_IPV4 = (1 << 32) - 1
+MAX_IPV6 = (1 << 128) - 1
+MAX_PORT = 65535
+
+# Number of flows classified per vectorized step, bounds temporary memory
+BATCH_SIZE = 65536
+
+Verdict = namedtuple('Verdict', ['rule_id', 'action'])
+Verdict.__doc__ = """The outcome of evaluating a flow.
+
+rule_id is the ID of the first matching rule, or None if the chain policy
+applied. action is the effective verdict: accept, drop or reject.
+"""
+
+
+def _field(flow: Any, name: str) -> Any:
+    """Read a flow field from a dict or from an object such as a FirewallLog row."""
+    if isinstance(flow, dict):
+        return flow.get(name)
+    return getattr(flow, name, None)
+
+
+def _parse_address(value: Any) -> Tuple[Optional[int], Optional[int]]:
+    """Convert an address to (version, integer), or (None, None) if absent or invalid."""
+    if not value:
+        return None, None
+    text = str(value).strip()
+    try:
+        return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, text), 'big')
+    except OSError:
+        pass
+    try:
+        return 6, int.from_bytes(socket.inet_pton(socket.AF_INET6, text), 'big')
+    except OSError:
+        return None, None
+
+
+def _parse_port(value: Any) -> int:
+    """Convert a port to an integer, or -1 if absent or invalid."""
+    if value is None or value == '':
+        return -1
+    try:
+        port = int(value)
+    except (TypeError, ValueError):
+        return -1
+    return port if 0 <= port <= MAX_PORT else -1
+
+
+class SegmentIndex:
+    """Maps the values of one dimension to the bitmap of rules matching them.
+
+    The first bitmap is used for flows that have no value in this dimension
+    (e.g. ports of an ICMP packet), which only wildcard rules match.
+    """
+
+    def __init__(self, values: Sequence[Optional[List[Tuple[int, int]]]], maximum: int):
+        """Build the index.
+
+        Args:
+            values: For every rule in chain order, its intervals in this
+                dimension or None if the rule matches any value
+            maximum: The largest value of the dimension
+        """
+        wildcard = 0
+        events: Dict[int, List[int]] = {}
+        for position, intervals in enumerate(values):
+            bit = 1 << position
+            if intervals is None:
+                wildcard |= bit
+                continue
+            for start, end in intervals:
+                events.setdefault(start, []).append(bit)
+                if end < maximum:
+                    events.setdefault(end + 1, []).append(-bit)
+
+        self.breaks: List[int] = [0]
+        self.masks: List[int] = [wildcard, wildcard]
+        current = 0
+        for point in sorted(events):
+            for bit in events[point]:
+                if bit > 0:
+                    current |= bit
+                else:
+                    current &= ~(-bit)
+            if point == 0:
+                self.masks[1] = current | wildcard
+            elif current | wildcard != self.masks[-1]:
+                self.breaks.append(point)
+                self.masks.append(current | wildcard)
+
+        self._array = None
+        self._words = None
+        self._breaks_array = None
+
+    def lookup(self, value: Optional[int]) -> int:
+        """Get the bitmap of rules matching a value (None or -1 for no value)."""
+        if value is None or value < 0:
+            return self.masks[0]
+        return self.masks[bisect.bisect_right(self.breaks, value)]
+
+    def arrays(self, words: int):
+        """Get the breakpoints and the bitmaps as NumPy arrays of 64-bit words."""
+        if self._array is None or self._words != words:
+            self._breaks_array = np.array(self.breaks, dtype=np.int64)
+            self._array = _to_words(self.masks, words)
+            self._words = words
+        return self._breaks_array, self._array
+
+    def lookup_many(self, values, words: int):
+        """Get the bitmaps for an array of values (-1 for no value)."""
+        breaks, masks = self.arrays(words)
+        rows = np.searchsorted(breaks, values, side='right')
+        rows[values < 0] = 0
+        return masks[rows]
+
+
+def _to_words(masks: Sequence[int], words: int):
+    """Convert integer bitmaps to a (len(masks), words) array of little endian words."""
+    size = words * 8
+    buffer = b''.join(mask.to_bytes(size, 'little') for mask in masks)
+    return np.frombuffer(buffer, dtype='<u8').reshape(len(masks), words).copy()
+
+
+class ChainMatcher:
+    """First-match classifier for the rules of one chain."""
+
+    def __init__(self, chain: str, matches: List[RuleMatch]):
+        """Compile the matcher.
+
+        Args:
+            chain: The chain name
+            matches: The rules of the chain in evaluation order
+        """
+        self.chain = chain
+        self.matches = matches
+        self.rule_ids = [match.rule_id for match in matches]
+        self.actions = [match.action for match in matches]
+        self.words = max(1, (len(matches) + 63) // 64)
+
+        protocols = sorted({p for match in matches if match.protocols for p in match.protocols})
+        self.protocol_buckets = {protocol: index for index, protocol in enumerate(protocols)}
+        self.protocol_masks = []
+        for protocol in protocols + [None]:
+            mask = 0
+            for position, match in enumerate(matches):
+                if match.protocols is None or protocol in match.protocols:
+                    mask |= 1 << position
+            self.protocol_masks.append(mask)
+
+        self.family_masks = {}
+        for family in (4, 6):
+            mask = 0
+            for position, match in enumerate(matches):
+                if match.family in (None, family):
+                    mask |= 1 << position
+            self.family_masks[family] = mask
+
+        self.src = {4: SegmentIndex([m.src if m.family != 6 else [] for m in matches], MAX_IPV4),
+                    6: SegmentIndex([m.src if m.family != 4 else [] for m in matches], MAX_IPV6)}
+        self.dst = {4: SegmentIndex([m.dst if m.family != 6 else [] for m in matches], MAX_IPV4),
+                    6: SegmentIndex([m.dst if m.family != 4 else [] for m in matches], MAX_IPV6)}
+        self.sport = SegmentIndex([m.sport for m in matches], MAX_PORT)
+        self.dport = SegmentIndex([m.dport for m in matches], MAX_PORT)
+        self._protocol_array = None
+
+    def protocol_bucket(self, protocol: Any) -> int:
+        """Get the protocol bucket of a flow; unknown protocols share the last bucket."""
+        return self.protocol_buckets.get(str(protocol or '').lower(), len(self.protocol_buckets))
+
+    def match(self, protocol: Any, family: Optional[int], src: Optional[int], dst: Optional[int],
+              sport: int, dport: int) -> int:
+        """Classify a single flow.
+
+        Returns:
+            int: Position of the first matching rule, or -1 if none matches
+        """
+        family = family or 4
+        mask = self.protocol_masks[self.protocol_bucket(protocol)] & self.family_masks[family]
+        if mask:
+            mask &= self.src[family].lookup(src)
+        if mask:
+            mask &= self.dst[family].lookup(dst)
+        if mask:
+            mask &= self.sport.lookup(sport)
+        if mask:
+            mask &= self.dport.lookup(dport)
+        if not mask:
+            return -1
+        return (mask & -mask).bit_length() - 1
+
+    def match_many(self, buckets, src, dst, sport, dport):
+        """Classify a batch of IPv4 flows given as NumPy arrays.
+
+        Args:
+            buckets: Protocol bucket of every flow
+            src: Source addresses (-1 for none)
+            dst: Destination addresses (-1 for none)
+            sport: Source ports (-1 for none)
+            dport: Destination ports (-1 for none)
+
+        Returns:
+            Array of rule positions, -1 where no rule matches
+        """
+        if self._protocol_array is None:
+            family = self.family_masks[4]
+            self._protocol_array = _to_words([mask & family for mask in self.protocol_masks], self.words)
+
+        mask = self._protocol_array[buckets]
+        mask &= self.src[4].lookup_many(src, self.words)
+        mask &= self.dst[4].lookup_many(dst, self.words)
+        mask &= self.sport.lookup_many(sport, self.words)
+        mask &= self.dport.lookup_many(dport, self.words)
+
+        nonzero = mask != 0
+        matched = nonzero.any(axis=1)
+        word = nonzero.argmax(axis=1)
+        value = mask[np.arange(len(mask)), word]
+        lowest = value & (~value + np.uint64(1))
+        # Powers of two are exact in float64, so the exponent is the bit index
+        bit = np.frexp(lowest.astype(np.float64))[1] - 1
+        return np.where(matched, word.astype(np.int64) * 64 + bit, -1)
+
+
+class RuleEvaluator:
+    """Evaluates flows against the firewall rules without touching nftables."""
+
+    def __init__(self, rules: Iterable[Any], policy: str = DEFAULT_POLICY):
+        """Compile the enabled rules into per-chain matchers.
+
+        Args:
+            rules: FirewallRule rows (or objects with the same attributes);
+                disabled and invalid rows are ignored, as the compiler does
+            policy: Verdict for flows that match no rule
+        """
+        self.policy = policy
+        chains: Dict[str, List[RuleMatch]] = {chain: [] for chain in VALID_CHAINS}
+        enabled = [rule for rule in rules if getattr(rule, 'enabled', True)]
+        for rule in sorted(enabled, key=lambda r: getattr(r, 'id', 0) or 0):
+            try:
+                match = RuleMatch.from_rule(rule)
+                if match.chain not in VALID_CHAINS:
+                    raise ValueError(f"Unknown chain: {match.chain}")
+                if match.action not in VALID_ACTIONS:
+                    raise ValueError(f"Unknown action: {match.action}")
+            except ValueError as e:
+                logger.warning(f"Skipping firewall rule {getattr(rule, 'id', None)}: {e}")
+                continue
+            chains[match.chain].append(match)
+
+        self.matchers = {chain: ChainMatcher(chain, matches) for chain, matches in chains.items()}
+
+    def _verdict(self, matcher: Optional[ChainMatcher], position: int) -> Verdict:
+        if matcher is None or position < 0:
+            return Verdict(None, self.policy)
+        action = matcher.actions[position]
+        # "return" from a base chain falls through to the chain policy
+        return Verdict(matcher.rule_ids[position], self.policy if action == "return" else action)
+
+    def evaluate_one(self, flow: Any) -> Verdict:
+        """Evaluate a single flow.
+
+        Args:
+            flow: A dict or object with chain, protocol, src_ip, dst_ip,
+                src_port and dst_port (a FirewallLog row works); the chain
+                defaults to input
+
+        Returns:
+            Verdict: The matching rule and the effective verdict
+        """
+        matcher = self.matchers.get(str(_field(flow, 'chain') or 'input').lower())
+        if matcher is None:
+            return Verdict(None, self.policy)
+        src_family, src = _parse_address(_field(flow, 'src_ip'))
+        dst_family, dst = _parse_address(_field(flow, 'dst_ip'))
+        if src_family and dst_family and src_family != dst_family:
+            return Verdict(None, self.policy)
+        position = matcher.match(_field(flow, 'protocol'), src_family or dst_family, src, dst,
+                                 _parse_port(_field(flow, 'src_port')),
+                                 _parse_port(_field(flow, 'dst_port')))
+        return self._verdict(matcher, position)
+
+    def evaluate(self, flows: Iterable[Any]) -> List[Verdict]:
+        """Evaluate a batch of flows.
+
+        IPv4 flows are classified with NumPy when it is available; other
+        flows, or all flows without NumPy, are classified one at a time.
+
+        Args:
+            flows: Dicts or objects as accepted by evaluate_one()
+
+        Returns:
+            List[Verdict]: One verdict per flow, in input order
+        """
+        if np is None:
+            return [self.evaluate_one(flow) for flow in flows]
+
+        results: List[Verdict] = []
+        batch: List[Any] = []
+        for flow in flows:
+            batch.append(flow)
+            if len(batch) == BATCH_SIZE:
+                results.extend(self._evaluate_batch(batch))
+                batch = []
+        if batch:
+            results.extend(self._evaluate_batch(batch))
+        return results
+
+    def _evaluate_batch(self, flows: List[Any]) -> List[Verdict]:
+        results: List[Optional[Verdict]] = [None] * len(flows)
+        addresses: Dict[Any, Tuple[Optional[int], Optional[int]]] = {}
+        vectorized: Dict[str, List[Tuple[int, int, int, int, int, int]]] = {}
+
+        for index, flow in enumerate(flows):
+            chain = str(_field(flow, 'chain') or 'input').lower()
+            matcher = self.matchers.get(chain)
+            if matcher is None:
+                results[index] = Verdict(None, self.policy)
+                continue
+
+            src_ip, dst_ip = _field(flow, 'src_ip'), _field(flow, 'dst_ip')
+            if src_ip not in addresses:
+                addresses[src_ip] = _parse_address(src_ip)
+            if dst_ip not in addresses:
+                addresses[dst_ip] = _parse_address(dst_ip)
+            src_family, src = addresses[src_ip]
+            dst_family, dst = addresses[dst_ip]
+            if src_family == 6 or dst_family == 6:
+                results[index] = self.evaluate_one(flow)
+                continue
+
+            vectorized.setdefault(chain, []).append((
+                index, matcher.protocol_bucket(_field(flow, 'protocol')),
+                -1 if src is None else src, -1 if dst is None else dst,
+                _parse_port(_field(flow, 'src_port')), _parse_port(_field(flow, 'dst_port'))
+            ))
+
+        for chain, rows in vectorized.items():
+            matcher = self.matchers[chain]
+            table = np.array(rows, dtype=np.int64)
+            positions = matcher.match_many(table[:, 1], table[:, 2], table[:, 3], table[:, 4], table[:, 5])
+            for index, position in zip(table[:, 0].tolist(), positions.tolist()):
+                results[index] = self._verdict(matcher, position)
+        return results
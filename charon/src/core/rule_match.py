@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+Rule Match Module for Charon Firewall
+
+This module parses the match columns of a FirewallRule (protocol, addresses
+and ports) into numeric intervals, so rules can be compared with each other
+without going through nftables: whether two rules can match the same packet,
+and whether one rule matches every packet another rule matches.
+"""
+
+import ipaddress
+import socket
+from typing import Any, FrozenSet, List, Optional, Tuple
+
+# A closed interval of integers (addresses or ports)
+Interval = Tuple[int, int]
+
+ALL_PROTOCOLS = None
+PORT_PROTOCOLS = frozenset(("tcp", "udp"))
+
+
+def merge_intervals(intervals: List[Interval]) -> List[Interval]:
+    """Sort intervals and merge the ones that overlap or touch.
+
+    Args:
+        intervals: Closed intervals in any order
+
+    Returns:
+        List[Interval]: Disjoint intervals in ascending order
+    """
+    merged: List[Interval] = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1] + 1:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def intervals_intersect(a: List[Interval], b: List[Interval]) -> bool:
+    """Check whether two sorted, disjoint interval lists share any value."""
+    i = j = 0
+    while i < len(a) and j < len(b):
+        if a[i][1] < b[j][0]:
+            i += 1
+        elif b[j][1] < a[i][0]:
+            j += 1
+        else:
+            return True
+    return False
+
+
+def intervals_contain(outer: List[Interval], inner: List[Interval]) -> bool:
+    """Check whether every value of `inner` lies within `outer`.
+
+    Both lists must be sorted and disjoint, as returned by merge_intervals().
+    """
+    i = 0
+    for start, end in inner:
+        while i < len(outer) and outer[i][1] < start:
+            i += 1
+        if i == len(outer) or outer[i][0] > start or outer[i][1] < end:
+            return False
+    return True
+
+
+def _parse_network(item: str) -> Tuple[int, int, int]:
+    """Parse an address or CIDR network into (version, first, last) integers."""
+    address, _, prefix = item.partition('/')
+    version, family, bits = (6, socket.AF_INET6, 128) if ':' in address else (4, socket.AF_INET, 32)
+    try:
+        value = int.from_bytes(socket.inet_pton(family, address), 'big')
+        length = int(prefix) if prefix else bits
+    except (OSError, ValueError):
+        length = -1
+    if 0 <= length <= bits:
+        host_mask = (1 << (bits - length)) - 1
+        return version, value & ~host_mask, value | host_mask
+
+    # Forms inet_pton does not accept (e.g. scoped IPv6) go through ipaddress
+    network = ipaddress.ip_network(item, strict=False)
+    return network.version, int(network.network_address), int(network.broadcast_address)
+
+
+def parse_addresses(value: Optional[str]) -> Tuple[Optional[int], Optional[List[Interval]]]:
+    """Parse a src_ip/dst_ip column value into address intervals.
+
+    Args:
+        value: Comma separated addresses, CIDR networks or "a-b" ranges
+
+    Returns:
+        Tuple of the IP version (4 or 6) and merged intervals, or (None, None)
+        if the column matches any address
+
+    Raises:
+        ValueError: If the value is not a valid address list
+    """
+    if not value:
+        return None, None
+    value = value.strip()
+    if ',' not in value and '-' not in value:
+        # A single address or network, the common case
+        if value.lower() == 'any':
+            return None, None
+        version, start, end = _parse_network(value)
+        return version, [(start, end)]
+    if value.lower() == 'any':
+        return None, None
+
+    versions = set()
+    intervals: List[Interval] = []
+    for item in (part.strip() for part in value.split(',')):
+        if not item:
+            continue
+        if '-' in item:
+            start, end = (ipaddress.ip_address(part.strip()) for part in item.split('-', 1))
+            if start.version != end.version or int(start) > int(end):
+                raise ValueError(f"Invalid address range: {item}")
+            versions.add(start.version)
+            intervals.append((int(start), int(end)))
+        else:
+            version, start, end = _parse_network(item)
+            versions.add(version)
+            intervals.append((start, end))
+
+    if not intervals:
+        return None, None
+    if len(versions) != 1:
+        raise ValueError(f"Mixed address families: {value}")
+    return versions.pop(), merge_intervals(intervals)
+
+
+def parse_ports(value: Optional[str]) -> Optional[List[Interval]]:
+    """Parse a src_port/dst_port column value into port intervals.
+
+    Args:
+        value: Comma separated ports or "a-b" ranges
+
+    Returns:
+        Optional[List[Interval]]: Merged intervals, or None for any port
+
+    Raises:
+        ValueError: If the value is not a valid port list
+    """
+    if value is None:
+        return None
+    value = str(value).strip()
+    if value.isdigit():
+        # A single port, the common case
+        port = int(value)
+        if port > 65535:
+            raise ValueError(f"Invalid port range: {value}")
+        return [(port, port)]
+    if value.lower() in ('', 'any'):
+        return None
+
+    intervals: List[Interval] = []
+    for item in (part.strip() for part in value.split(',')):
+        if not item:
+            continue
+        start, _, end = item.partition('-')
+        low, high = int(start), int(end or start)
+        if not 0 <= low <= high <= 65535:
+            raise ValueError(f"Invalid port range: {item}")
+        intervals.append((low, high))
+    if len(intervals) > 1:
+        return merge_intervals(intervals)
+    return intervals or None
+
+
+def format_addresses(version: int, intervals: List[Interval]) -> List[str]:
+    """Render address intervals as the smallest list of CIDR networks.
+
+    Args:
+        version: IP version of the intervals
+        intervals: Address intervals
+
+    Returns:
+        List[str]: Addresses and networks, single hosts without a prefix
+    """
+    address = ipaddress.IPv4Address if version == 4 else ipaddress.IPv6Address
+    result = []
+    for start, end in merge_intervals(intervals):
+        for network in ipaddress.summarize_address_range(address(start), address(end)):
+            result.append(str(network.network_address) if network.num_addresses == 1 else str(network))
+    return result
+
+
+def format_ports(intervals: List[Interval]) -> List[str]:
+    """Render port intervals as ports and "a-b" ranges."""
+    return [str(start) if start == end else f"{start}-{end}" for start, end in merge_intervals(intervals)]
+
+
+class RuleMatch:
+    """The set of packets a firewall rule matches, as numeric intervals.
+
+    Every dimension is None when the rule matches any value.
+    """
+
+    __slots__ = ('rule_id', 'chain', 'action', 'protocols', 'family',
+                 'src', 'dst', 'sport', 'dport')
+
+    def __init__(self, rule_id: Optional[int], chain: str, action: str,
+                 protocols: Optional[FrozenSet[str]], family: Optional[int],
+                 src: Optional[List[Interval]], dst: Optional[List[Interval]],
+                 sport: Optional[List[Interval]], dport: Optional[List[Interval]]):
+        self.rule_id = rule_id
+        self.chain = chain
+        self.action = action
+        self.protocols = protocols
+        self.family = family
+        self.src = src
+        self.dst = dst
+        self.sport = sport
+        self.dport = dport
+
+    @classmethod
+    def from_rule(cls, rule: Any) -> "RuleMatch":
+        """Parse a FirewallRule row.
+
+        Args:
+            rule: A FirewallRule row (or any object with the same attributes)
+
+        Returns:
+            RuleMatch: The parsed match
+
+        Raises:
+            ValueError: If an address or port column is invalid
+        """
+        src_version, src = parse_addresses(getattr(rule, 'src_ip', None))
+        dst_version, dst = parse_addresses(getattr(rule, 'dst_ip', None))
+        if src_version and dst_version and src_version != dst_version:
+            raise ValueError("Source and destination address families differ")
+
+        sport = parse_ports(getattr(rule, 'src_port', None))
+        dport = parse_ports(getattr(rule, 'dst_port', None))
+        protocol = (getattr(rule, 'protocol', None) or '').lower()
+        if protocol in ('', 'any'):
+            # Ports without a protocol match both TCP and UDP
+            protocols = PORT_PROTOCOLS if (sport or dport) else ALL_PROTOCOLS
+        else:
+            protocols = frozenset((protocol,))
+
+        return cls(getattr(rule, 'id', None), (getattr(rule, 'chain', None) or '').lower(),
+                   (getattr(rule, 'action', None) or '').lower(), protocols,
+                   src_version or dst_version, src, dst, sport, dport)
+
+    def overlaps(self, other: "RuleMatch") -> bool:
+        """Check whether some packet could match both rules."""
+        if self.family and other.family and self.family != other.family:
+            return False
+        if self.protocols is not None and other.protocols is not None \
+                and not self.protocols & other.protocols:
+            return False
+        for mine, theirs in ((self.src, other.src), (self.dst, other.dst),
+                             (self.sport, other.sport), (self.dport, other.dport)):
+            if mine is not None and theirs is not None and not intervals_intersect(mine, theirs):
+                return False
+        return True
+
+    def covers(self, other: "RuleMatch") -> bool:
+        """Check whether every packet matching `other` also matches this rule."""
+        if self.family and self.family != other.family:
+            return False
+        if self.protocols is not None and (other.protocols is None or not other.protocols <= self.protocols):
+            return False
+        for mine, theirs in ((self.src, other.src), (self.dst, other.dst),
+                             (self.sport, other.sport), (self.dport, other.dport)):
+            if mine is not None and (theirs is None or not intervals_contain(mine, theirs)):
+                return False
+        return True
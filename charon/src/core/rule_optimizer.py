@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Rule Optimizer Module for Charon Firewall
+
+nftables evaluates the rules of a chain one after the other, so a chain with
+hundreds of rules that only differ by source address or destination port
+costs hundreds of comparisons per packet. This module collapses such rules
+into a single rule matching an anonymous set, e.g.
+
+    ip saddr { 10.0.0.5, 10.0.0.9, 192.168.0.0/16 } meta l4proto tcp tcp dport 22 counter drop
+
+which the kernel looks up in a hash table or interval tree.
+
+Rules are grouped when they share chain, action and protocol and differ in a
+single match column. A rule is only moved up into an earlier group when no
+rule in between with a different verdict could match the same packets, so
+the first-match semantics of the chain are preserved.
+"""
+
+import logging
+from types import SimpleNamespace
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .rule_match import RuleMatch, format_addresses, format_ports
+from .ruleset_compiler import RulesetCompiler, RulesetModel
+
+logger = logging.getLogger('charon.rule_optimizer')
+
+# Columns a group of rules may differ in, in order of preference
+GROUPABLE_FIELDS = ('src_ip', 'dst_ip', 'dst_port', 'src_port')
+MATCH_ATTRIBUTES = {'src_ip': 'src', 'dst_ip': 'dst', 'src_port': 'sport', 'dst_port': 'dport'}
+
+
+class OptimizationReport:
+    """Summary of what the optimizer collapsed."""
+
+    def __init__(self):
+        self.input_rules = 0
+        self.output_rules = 0
+        self.groups: List[Dict[str, Any]] = []
+
+    @property
+    def collapsed(self) -> int:
+        """Number of rules removed from the ruleset by grouping."""
+        return self.input_rules - self.output_rules
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'input_rules': self.input_rules,
+            'output_rules': self.output_rules,
+            'collapsed': self.collapsed,
+            'groups': self.groups
+        }
+
+
+class RuleOptimizer:
+    """Groups near-identical firewall rules into set-based rules."""
+
+    def __init__(self, compiler: Optional[RulesetCompiler] = None):
+        """Initialize the optimizer.
+
+        Args:
+            compiler: Compiler used to render the optimized rules
+        """
+        self.compiler = compiler or RulesetCompiler()
+
+    @staticmethod
+    def _group_key(field: str, match: RuleMatch) -> Optional[Tuple]:
+        """Key shared by all rules that can be merged on `field`."""
+        if getattr(match, MATCH_ATTRIBUTES[field]) is None:
+            return None
+
+        fixed = []
+        for other, attribute in MATCH_ATTRIBUTES.items():
+            if other != field:
+                value = getattr(match, attribute)
+                fixed.append(tuple(value) if value is not None else None)
+        protocols = tuple(sorted(match.protocols)) if match.protocols is not None else None
+        return (field, match.action, protocols, match.family, tuple(fixed))
+
+    @staticmethod
+    def _is_safe_move(matches: List[RuleMatch], anchor: int, index: int) -> bool:
+        """Check that moving rule `index` up to position `anchor` keeps verdicts."""
+        moved = matches[index]
+        for between in matches[anchor + 1:index]:
+            if between.action != moved.action and between.overlaps(moved):
+                return False
+        return True
+
+    def _group_chain(self, matches: List[RuleMatch]) -> List[Tuple[Optional[str], List[int]]]:
+        """Partition the rules of one chain into mergeable groups.
+
+        Returns:
+            List of (merged column, rule indexes) in chain order; the column is
+            None for rules that stay on their own
+        """
+        # Choose for every rule the column shared with the most other rules
+        candidates = [
+            [key for key in (self._group_key(field, match) for field in GROUPABLE_FIELDS) if key]
+            for match in matches
+        ]
+        counts: Dict[Tuple, int] = {}
+        for keys in candidates:
+            for key in keys:
+                counts[key] = counts.get(key, 0) + 1
+
+        groups: List[Tuple[Optional[str], List[int]]] = []
+        open_groups: Dict[Tuple, List[int]] = {}
+        for index, keys in enumerate(candidates):
+            best = max(keys, key=lambda k: counts[k], default=None)
+            if best is None or counts[best] < 2:
+                groups.append((None, [index]))
+                continue
+
+            group = open_groups.get(best)
+            if group is not None and self._is_safe_move(matches, group[0], index):
+                group.append(index)
+                continue
+
+            group = [index]
+            groups.append((best[0], group))
+            open_groups[best] = group
+        return groups
+
+    def _merge(self, rules: List[Any], matches: List[RuleMatch], field: str) -> Any:
+        """Build a rule equivalent to the given rules, which differ only in `field`."""
+        first = rules[0]
+        merged = SimpleNamespace(**{
+            name: getattr(first, name, None)
+            for name in ('id', 'chain', 'action', 'protocol', 'src_ip', 'dst_ip', 'src_port', 'dst_port')
+        })
+        attribute = MATCH_ATTRIBUTES[field]
+        intervals = [interval for match in matches for interval in getattr(match, attribute)]
+        if field.endswith('_ip'):
+            values = format_addresses(matches[0].family, intervals)
+        else:
+            values = format_ports(intervals)
+        setattr(merged, field, ",".join(values))
+        return merged
+
+    def optimize(self, rules: Iterable[Any]) -> Tuple[RulesetModel, OptimizationReport]:
+        """Compile the enabled rules, collapsing groups into set-based rules.
+
+        Args:
+            rules: FirewallRule rows; disabled rows are ignored
+
+        Returns:
+            Tuple of the optimized ruleset model and a report of the groups
+        """
+        report = OptimizationReport()
+        model = RulesetModel()
+
+        chains: Dict[str, List[Tuple[Any, RuleMatch]]] = {}
+        enabled = [rule for rule in rules if getattr(rule, 'enabled', True)]
+        for rule in sorted(enabled, key=lambda r: getattr(r, 'id', 0) or 0):
+            if self.compiler.compile_rule(rule) is None:
+                continue
+            try:
+                match = RuleMatch.from_rule(rule)
+            except ValueError as e:
+                logger.warning(f"Skipping firewall rule {getattr(rule, 'id', None)}: {e}")
+                continue
+            chains.setdefault(match.chain, []).append((rule, match))
+
+        for chain, entries in chains.items():
+            rules_in_chain = [rule for rule, _ in entries]
+            matches = [match for _, match in entries]
+            report.input_rules += len(entries)
+
+            for field, group in self._group_chain(matches):
+                group_rules = [rules_in_chain[i] for i in group]
+                if len(group) == 1:
+                    compiled = self.compiler.compile_rule(group_rules[0])
+                else:
+                    compiled = self.compiler.compile_rule(
+                        self._merge(group_rules, [matches[i] for i in group], field)
+                    )
+                    report.groups.append({
+                        'chain': chain,
+                        'field': field,
+                        'rule_ids': [getattr(rule, 'id', None) for rule in group_rules]
+                    })
+                if compiled is not None:
+                    model.add(compiled)
+                    report.output_rules += 1
+
+        if report.collapsed:
+            logger.info(f"Collapsed {report.collapsed} of {report.input_rules} rules "
+                        f"into {len(report.groups)} set-based rules")
+        return model, report
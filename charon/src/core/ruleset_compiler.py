@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+"""
+Ruleset Compiler Module for Charon Firewall
+
+This module turns the enabled FirewallRule rows stored in the database into a
+canonical nftables ruleset model, and reconciles that model with the live
+ruleset. Every managed rule carries a comment of the form
+``charon:<rule id>:<digest>`` so the live rule belonging to a database row can
+be found, and so a changed row can be detected without comparing expressions.
+Only the minimal set of add, delete and replace operations is emitted, and
+they are applied as one atomic transaction.
+"""
+
+import hashlib
+import ipaddress
+import json
+import logging
+import re
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .packet_filter import PacketFilter
+
+logger = logging.getLogger('charon.ruleset_compiler')
+
+COMMENT_PREFIX = "charon:"
+VALID_CHAINS = ("input", "output", "forward")
+VALID_ACTIONS = ("accept", "drop", "reject", "return")
+PORT_PATTERN = re.compile(r'^\d{1,5}(-\d{1,5})?$')
+
+
+class CompiledRule:
+    """A database rule compiled into nftables syntax."""
+
+    def __init__(self, rule_id: int, chain: str, expr: str):
+        """Initialize a compiled rule.
+
+        Args:
+            rule_id: ID of the FirewallRule row
+            chain: The chain the rule belongs to
+            expr: The match and verdict expression in nftables syntax
+        """
+        self.rule_id = rule_id
+        self.chain = chain
+        self.expr = expr
+        self.digest = hashlib.sha1(f"{chain}|{expr}".encode()).hexdigest()[:12]
+
+    @property
+    def comment(self) -> str:
+        """The comment identifying this rule in the live ruleset."""
+        return f"{COMMENT_PREFIX}{self.rule_id}:{self.digest}"
+
+    def text(self) -> str:
+        """Get the full rule text including the identifying comment.
+
+        Returns:
+            str: The rule in nftables syntax
+        """
+        return f"{self.expr} comment \"{self.comment}\""
+
+    def __repr__(self) -> str:
+        return f"CompiledRule({self.rule_id}, {self.chain!r}, {self.expr!r})"
+
+
+class LiveRule:
+    """A Charon-managed rule found in the live nftables ruleset."""
+
+    def __init__(self, rule_id: int, chain: str, handle: int, digest: str):
+        self.rule_id = rule_id
+        self.chain = chain
+        self.handle = handle
+        self.digest = digest
+
+    def __repr__(self) -> str:
+        return f"LiveRule({self.rule_id}, {self.chain!r}, handle={self.handle})"
+
+
+class RuleOperation:
+    """A single change needed to bring the live ruleset in line with the model."""
+
+    ADD = "add"
+    INSERT = "insert"
+    DELETE = "delete"
+    REPLACE = "replace"
+
+    def __init__(self, kind: str, chain: str, rule: Optional[CompiledRule] = None,
+                 handle: Optional[int] = None):
+        """Initialize an operation.
+
+        Args:
+            kind: One of ADD, INSERT, DELETE or REPLACE
+            chain: The chain the operation applies to
+            rule: The compiled rule to add or replace with (None for DELETE)
+            handle: The handle of the rule to delete or replace, or the handle
+                to position an added (after) or inserted (before) rule against
+        """
+        self.kind = kind
+        self.chain = chain
+        self.rule = rule
+        self.handle = handle
+
+    def __repr__(self) -> str:
+        rule_id = self.rule.rule_id if self.rule else None
+        return f"RuleOperation({self.kind!r}, {self.chain!r}, rule={rule_id}, handle={self.handle})"
+
+
+class RulesetModel:
+    """The canonical ruleset compiled from the database, ordered per chain."""
+
+    def __init__(self):
+        self.chains: Dict[str, List[CompiledRule]] = {chain: [] for chain in VALID_CHAINS}
+
+    def add(self, rule: CompiledRule) -> None:
+        self.chains.setdefault(rule.chain, []).append(rule)
+
+    def rules(self) -> List[CompiledRule]:
+        """Get all compiled rules across chains."""
+        return [rule for chain_rules in self.chains.values() for rule in chain_rules]
+
+    def __len__(self) -> int:
+        return sum(len(chain_rules) for chain_rules in self.chains.values())
+
+
+def _address_match(direction: str, value: Optional[str]) -> Optional[str]:
+    """Build an address match for a src_ip/dst_ip column value."""
+    if not value or value.lower() == 'any':
+        return None
+
+    families = set()
+    elements = []
+    for item in (part.strip() for part in value.split(',')):
+        if not item:
+            continue
+        if '-' in item:
+            start, end = (ipaddress.ip_address(part.strip()) for part in item.split('-', 1))
+            if start.version != end.version:
+                raise ValueError(f"Mixed address family range: {item}")
+            families.add(start.version)
+            elements.append(f"{start}-{end}")
+        else:
+            network = ipaddress.ip_network(item, strict=False)
+            families.add(network.version)
+            elements.append(str(network.network_address) if network.num_addresses == 1 else str(network))
+
+    if not elements:
+        return None
+    if len(families) != 1:
+        raise ValueError(f"Mixed address families: {value}")
+    keyword = "ip" if families.pop() == 4 else "ip6"
+    if len(elements) == 1:
+        return f"{keyword} {direction} {elements[0]}"
+    return f"{keyword} {direction} {{ {', '.join(elements)} }}"
+
+
+def _port_value(value: Optional[str]) -> Optional[str]:
+    """Render a src_port/dst_port column value as an nftables port expression."""
+    if not value or str(value).lower() == 'any':
+        return None
+
+    ports = [part.strip() for part in str(value).split(',') if part.strip()]
+    for port in ports:
+        if not PORT_PATTERN.match(port) or any(int(p) > 65535 for p in port.split('-')):
+            raise ValueError(f"Invalid port specification: {value}")
+    if not ports:
+        return None
+    if len(ports) == 1:
+        return ports[0]
+    return f"{{ {', '.join(ports)} }}"
+
+
+class RulesetCompiler:
+    """Compiles database firewall rules and reconciles them with nftables."""
+
+    def __init__(self, optimize: bool = False):
+        """Initialize the compiler.
+
+        Args:
+            optimize: Collapse rules that differ in a single column into
+                set-based rules (see rule_optimizer)
+        """
+        self.optimize = optimize
+        self.last_report = None
+
+    def compile_rule(self, rule: Any) -> Optional[CompiledRule]:
+        """Compile a single FirewallRule into nftables syntax.
+
+        Args:
+            rule: A FirewallRule row (or any object with the same attributes)
+
+        Returns:
+            Optional[CompiledRule]: The compiled rule, or None if it is invalid
+        """
+        rule_id = getattr(rule, 'id', None)
+        try:
+            chain = (getattr(rule, 'chain', None) or '').lower()
+            action = (getattr(rule, 'action', None) or '').lower()
+            if chain not in VALID_CHAINS:
+                raise ValueError(f"Unknown chain: {chain}")
+            if action not in VALID_ACTIONS:
+                raise ValueError(f"Unknown action: {action}")
+
+            protocol = (getattr(rule, 'protocol', None) or '').lower()
+            if protocol == 'any':
+                protocol = ''
+
+            parts = []
+            src = _address_match("saddr", getattr(rule, 'src_ip', None))
+            dst = _address_match("daddr", getattr(rule, 'dst_ip', None))
+            if src:
+                parts.append(src)
+            if dst:
+                parts.append(dst)
+
+            sport = _port_value(getattr(rule, 'src_port', None))
+            dport = _port_value(getattr(rule, 'dst_port', None))
+            if protocol in ('tcp', 'udp'):
+                parts.append(f"meta l4proto {protocol}")
+                header = protocol
+            elif protocol:
+                if sport or dport:
+                    raise ValueError(f"Ports are not supported for protocol {protocol}")
+                parts.append(f"meta l4proto {protocol}")
+            elif sport or dport:
+                # Ports without a protocol match both TCP and UDP
+                parts.append("meta l4proto { tcp, udp }")
+                header = "th"
+            if sport:
+                parts.append(f"{header} sport {sport}")
+            if dport:
+                parts.append(f"{header} dport {dport}")
+
+            parts.append("counter")
+            parts.append(action)
+            return CompiledRule(rule_id, chain, " ".join(parts))
+        except ValueError as e:
+            logger.warning(f"Skipping firewall rule {rule_id}: {e}")
+            return None
+
+    def compile(self, rules: Iterable[Any]) -> RulesetModel:
+        """Compile the enabled rules into a canonical ruleset model.
+
+        Args:
+            rules: FirewallRule rows; disabled rows are ignored
+
+        Returns:
+            RulesetModel: The compiled rules, ordered by rule ID within each chain
+        """
+        if self.optimize:
+            from .rule_optimizer import RuleOptimizer
+            model, self.last_report = RuleOptimizer(self).optimize(rules)
+            return model
+
+        model = RulesetModel()
+        enabled = [rule for rule in rules if getattr(rule, 'enabled', True)]
+        for rule in sorted(enabled, key=lambda r: getattr(r, 'id', 0) or 0):
+            compiled = self.compile_rule(rule)
+            if compiled:
+                model.add(compiled)
+        return model
+
+    @staticmethod
+    def parse_live(ruleset_json: Optional[str]) -> Dict[str, List[LiveRule]]:
+        """Extract the Charon-managed rules from `nft --json list table` output.
+
+        Args:
+            ruleset_json: JSON output of PacketFilter.list_rules()
+
+        Returns:
+            Dict mapping chain names to managed rules in ruleset order
+        """
+        live: Dict[str, List[LiveRule]] = {}
+        if not ruleset_json:
+            return live
+
+        for item in json.loads(ruleset_json).get("nftables", []):
+            rule = item.get("rule")
+            if not rule:
+                continue
+            comment = rule.get("comment") or ""
+            if not comment.startswith(COMMENT_PREFIX):
+                continue
+            try:
+                rule_id, digest = comment[len(COMMENT_PREFIX):].split(":", 1)
+                live.setdefault(rule["chain"], []).append(
+                    LiveRule(int(rule_id), rule["chain"], int(rule["handle"]), digest)
+                )
+            except (KeyError, ValueError):
+                logger.warning(f"Ignoring rule with malformed Charon comment: {comment}")
+        return live
+
+    def diff(self, model: RulesetModel, ruleset_json: Optional[str]) -> List[RuleOperation]:
+        """Compute the minimal operations turning the live ruleset into the model.
+
+        Rules are matched on the rule ID in their comment. A matched rule whose
+        digest differs is replaced in place; unmatched live rules are deleted;
+        missing rules are added next to their nearest surviving neighbour so
+        the chain keeps the order of the model.
+
+        Args:
+            model: The compiled ruleset model
+            ruleset_json: JSON output of PacketFilter.list_rules()
+
+        Returns:
+            List[RuleOperation]: Deletes first, then replaces, then additions
+        """
+        live = self.parse_live(ruleset_json)
+        deletes: List[RuleOperation] = []
+        replaces: List[RuleOperation] = []
+        additions: List[RuleOperation] = []
+
+        for chain in sorted(set(model.chains) | set(live)):
+            desired = model.chains.get(chain, [])
+            desired_ids = {rule.rule_id for rule in desired}
+
+            # Keep the first live copy of each wanted rule, delete everything else
+            kept: Dict[int, LiveRule] = {}
+            for live_rule in live.get(chain, []):
+                if live_rule.rule_id in desired_ids and live_rule.rule_id not in kept:
+                    kept[live_rule.rule_id] = live_rule
+                else:
+                    deletes.append(RuleOperation(RuleOperation.DELETE, chain, handle=live_rule.handle))
+
+            for rule in desired:
+                live_rule = kept.get(rule.rule_id)
+                if live_rule and live_rule.digest != rule.digest:
+                    replaces.append(RuleOperation(RuleOperation.REPLACE, chain, rule, live_rule.handle))
+
+            additions.extend(self._position_additions(chain, desired, kept))
+
+        return deletes + replaces + additions
+
+    @staticmethod
+    def _position_additions(chain: str, desired: List[CompiledRule],
+                            kept: Dict[int, LiveRule]) -> List[RuleOperation]:
+        """Place missing rules relative to the rules that survive in the chain."""
+        operations: List[RuleOperation] = []
+        group: List[RuleOperation] = []
+        anchor: Optional[int] = None
+
+        def flush() -> None:
+            # "add ... position H" puts each rule directly after H, so a run of
+            # rules after the same anchor has to be emitted in reverse order
+            operations.extend(reversed(group) if anchor is not None else group)
+            group.clear()
+
+        for index, rule in enumerate(desired):
+            if rule.rule_id in kept:
+                flush()
+                anchor = kept[rule.rule_id].handle
+                continue
+            if anchor is not None:
+                group.append(RuleOperation(RuleOperation.ADD, chain, rule, anchor))
+                continue
+
+            # Nothing survives before this rule: insert before the next survivor
+            following = next((kept[r.rule_id].handle for r in desired[index + 1:] if r.rule_id in kept), None)
+            if following is not None:
+                group.append(RuleOperation(RuleOperation.INSERT, chain, rule, following))
+            else:
+                group.append(RuleOperation(RuleOperation.ADD, chain, rule))
+        flush()
+        return operations
+
+    def apply(self, packet_filter: PacketFilter, operations: List[RuleOperation],
+              bootstrap: bool = False) -> bool:
+        """Apply operations to the live ruleset as one atomic transaction.
+
+        Args:
+            packet_filter: The packet filter to apply the operations with
+            operations: Operations returned by diff()
+            bootstrap: Create the base table and chains first
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        if not operations and not bootstrap:
+            return True
+
+        txn = packet_filter.transaction()
+        if bootstrap:
+            txn.setup_base_table()
+        for op in operations:
+            if op.kind == RuleOperation.DELETE:
+                txn.delete_rule(op.chain, op.handle)
+            elif op.kind == RuleOperation.REPLACE:
+                txn.replace_rule(op.chain, op.handle, op.rule.text())
+            elif op.kind == RuleOperation.INSERT:
+                txn.insert_rule(op.chain, op.rule.text(), position=op.handle)
+            else:
+                txn.add_rule(op.chain, op.rule.text(), position=op.handle)
+        return txn.commit()
+
+    def sync(self, packet_filter: PacketFilter, rules: Iterable[Any]) -> Tuple[bool, List[RuleOperation]]:
+        """Bring the live ruleset in line with the database rules.
+
+        Args:
+            packet_filter: The packet filter managing the live ruleset
+            rules: FirewallRule rows
+
+        Returns:
+            Tuple of success flag and the operations that were applied
+        """
+        model = self.compile(rules)
+        live_json = packet_filter.list_rules()
+        operations = self.diff(model, live_json)
+
+        success = self.apply(packet_filter, operations, bootstrap=live_json is None)
+        if success:
+            collapsed = f", {self.last_report.collapsed} collapsed into sets" if self.optimize else ""
+            logger.info(f"Ruleset synchronized: {len(model)} rules{collapsed}, {len(operations)} changes")
+        else:
+            logger.error("Failed to synchronize ruleset")
+        return success, operations
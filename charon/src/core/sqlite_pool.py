@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+SQLite Connection Pool Module for Charon Firewall
+
+Opening an SQLite database costs a file open, a schema read and the setup of
+every PRAGMA, and closing it throws away the statement cache. This module
+keeps one connection per thread and database instead, opened on first use
+and reused by every later call from that thread, so the sqlite3 statement
+cache stays warm and repeated queries skip the SQL compiler.
+
+Connections are tuned for a read-mostly workload with concurrent readers:
+
+- journal_mode=WAL lets readers run while a writer commits
+- synchronous=NORMAL syncs at checkpoints instead of every commit, which is
+  safe in WAL mode (a power loss can only lose the last transactions)
+- mmap_size maps the database file, so reads skip a copy through the page cache
+- busy_timeout waits for a writer in another process instead of failing
+"""
+
+import contextlib
+import logging
+import os
+import sqlite3
+import threading
+import weakref
+from typing import Dict, Iterator, List, Tuple
+
+logger = logging.getLogger('charon.sqlite_pool')
+
+# Prepared statements kept per connection (sqlite3 defaults to 128)
+CACHED_STATEMENTS = 256
+
+
+class SQLitePool:
+    """Per-thread SQLite connections to one database."""
+
+    def __init__(self, db_path: str, mmap_size: int = 256 * 2**20, busy_timeout: float = 5.0):
+        """Initialize the pool.
+
+        Args:
+            db_path: Path to the database; its directory is created on first use
+            mmap_size: Bytes of the database file to memory-map
+            busy_timeout: Seconds to wait for a lock held by another connection
+        """
+        self.db_path = db_path
+        self.mmap_size = mmap_size
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # Connections with the thread that owns them, to close them when it ends
+        self._connections: List[Tuple[weakref.ref, sqlite3.Connection]] = []
+        self._pid = os.getpid()
+
+    def _connect(self) -> sqlite3.Connection:
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout,
+                               cached_statements=CACHED_STATEMENTS, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA mmap_size={int(self.mmap_size)}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        return conn
+
+    def connection(self) -> sqlite3.Connection:
+        """Get the connection of the calling thread, opening it on first use.
+
+        A transaction left open by a failed call is rolled back, so every
+        caller starts outside a transaction. A transaction opened with
+        transaction() is still in use, so it is left alone and this raises.
+
+        Raises:
+            sqlite3.ProgrammingError: If the thread is inside transaction(),
+                e.g. when called from a callback of the transaction
+        """
+        if self._pid != os.getpid():
+            # Connections must not be shared with a forked child
+            self._local = threading.local()
+            self._connections = []
+            self._pid = os.getpid()
+
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+            with self._lock:
+                self._close_orphans()
+                self._connections.append((weakref.ref(threading.current_thread()), conn))
+        elif conn.in_transaction:
+            if getattr(self._local, 'transaction', False):
+                logger.error(f"Connection to {self.db_path} requested inside an open transaction")
+                raise sqlite3.ProgrammingError("The connection of this thread is in a transaction")
+            conn.rollback()
+        return conn
+
+    @contextlib.contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """Run a write transaction on the connection of the calling thread.
+
+        The transaction starts with BEGIN IMMEDIATE, so it takes the write
+        lock at once. It is committed on a clean exit and rolled back if an
+        exception is raised. Until then, connection() calls from the same
+        thread raise instead of rolling it back.
+
+        Yields:
+            sqlite3.Connection: The connection, in autocommit mode inside the transaction
+        """
+        conn = self.connection()
+        isolation_level = conn.isolation_level
+        try:
+            conn.isolation_level = None
+            conn.execute('BEGIN IMMEDIATE')
+            self._local.transaction = True
+            yield conn
+            conn.execute('COMMIT')
+        except BaseException:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            self._local.transaction = False
+            conn.isolation_level = isolation_level
+
+    def _close_orphans(self) -> None:
+        """Close the connections of threads that have ended."""
+        alive = []
+        for thread, conn in self._connections:
+            owner = thread()
+            if owner is not None and owner.is_alive():
+                alive.append((thread, conn))
+            else:
+                conn.close()
+        self._connections = alive
+
+    def close(self) -> None:
+        """Close every connection of the pool.
+
+        Threads that use the pool afterwards open a new connection.
+        """
+        with self._lock:
+            for _, conn in self._connections:
+                try:
+                    conn.close()
+                except sqlite3.Error as e:
+                    logger.error(f"Failed to close connection to {self.db_path}: {e}")
+            self._connections = []
+            self._local = threading.local()
+
+    def stats(self) -> Dict[str, int]:
+        """Get the number of open connections."""
+        with self._lock:
+            return {'connections': len(self._connections)}
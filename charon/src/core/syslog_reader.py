@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+"""
+Syslog Reader Module for Charon Firewall
+
+The web interface shows the firewall lines of the system log (syslog,
+kern.log or messages) when no log database is available. Reading the whole
+file for every page costs seconds and memory proportional to the file on a
+log of several gigabytes. SyslogReader reads only what a page needs instead:
+
+- Pages are numbered from the newest line, so the file is read backwards in
+  fixed-size blocks from the end. Only the lines with "IN=" (firewall lines)
+  are looked at, found by searching the blocks for it, and only the lines of
+  the requested page are decoded.
+- While it reads backwards, the reader records a checkpoint every 1000
+  matching lines: the byte offset where the search for the next matching
+  line starts. A deep page starts at the nearest checkpoint before it
+  instead of the end of the file. The checkpoints are kept per file and
+  filter in a JSON index file, so they survive restarts.
+- Checkpoints count lines back from an anchor, the end of the file when it
+  was last read. Lines appended since are counted forwards once and the
+  checkpoints shifted by their number, so an index stays valid while the
+  log grows.
+- Files are identified by device and inode. A log rotated by renaming keeps
+  its inode and so its index as syslog.1, and pages continue from the live
+  file into the rotated ones (uncompressed only). A file that was truncated
+  or replaced is indexed anew.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_right
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger('charon.syslog_reader')
+
+BLOCK_SIZE = 1 << 16
+
+# Matching lines between checkpoints
+CHECKPOINT_EVERY = 1000
+
+# Bytes appended since the last read beyond which a file is indexed anew
+# rather than counting the new lines
+MAX_TAIL = 64 << 20
+
+# Files whose index is kept
+MAX_ENTRIES = 32
+
+# Bytes at the beginning of a file and before its anchor that tell whether it was replaced
+_HEAD_SIZE = 64
+
+# Firewall lines of each log type, as in the web interface
+FILTERS: Dict[Optional[str], Callable[[bytes], bool]] = {
+    None: lambda line: b'IN=' in line and (b'DROP' in line or b'ACCEPT' in line),
+    'error': lambda line: b'IN=' in line and b'DROP' in line,
+    'info': lambda line: b'IN=' in line and b'ACCEPT' in line,
+}
+
+# Every firewall line has this, so only the lines with it are looked at
+_NEEDLE = b'IN='
+
+
+def rotated_files(path: str) -> List[str]:
+    """Get a log file and its uncompressed rotations (path.1, path.2, ...), newest first."""
+    files = [path]
+    while os.path.exists(f"{path}.{len(files)}"):
+        files.append(f"{path}.{len(files)}")
+    return files
+
+
+def find_lines(data: bytes, needle: bytes) -> List[Tuple[int, int]]:
+    """Get the lines that contain a needle in text made of complete lines.
+
+    Searching for the needle skips the other lines without looking at them one by one.
+
+    Returns:
+        List[Tuple[int, int]]: Start and end (at the newline) of each line, in order
+    """
+    lines = []
+    index = data.find(needle)
+    while index >= 0:
+        end = data.find(b'\n', index)
+        lines.append((data.rfind(b'\n', 0, index) + 1, end))
+        index = data.find(needle, end + 1)
+    return lines
+
+
+def reverse_lines(f: Any, end: int, block_size: int = BLOCK_SIZE,
+                  needle: Optional[bytes] = None) -> Iterator[Tuple[int, bytes]]:
+    """Read the lines before an offset from last to first.
+
+    Args:
+        f: File opened in binary mode
+        end: Offset of the end of a line
+        block_size: Bytes read at once
+        needle: Only read the lines with these bytes
+
+    Yields:
+        Tuple of the offset of each line and the line without its newline
+    """
+    position = end
+    partial = b''
+    while position > 0:
+        size = min(block_size, position)
+        position -= size
+        f.seek(position)
+        data = f.read(size) + partial
+        if position:
+            # The bytes up to the first newline end a line that begins in an earlier block
+            cut = data.find(b'\n') + 1
+            if not cut:
+                partial = data
+                continue
+            partial, data = data[:cut], data[cut:]
+            start = position + cut
+        else:
+            start = 0
+        if needle is not None:
+            for line_start, line_end in reversed(find_lines(data, needle)):
+                yield start + line_start, data[line_start:line_end]
+            continue
+        line_end = start + len(data)
+        # data ends with a newline, so the last item of the split is empty
+        for line in reversed(data.split(b'\n')[:-1]):
+            line_end -= len(line) + 1
+            yield line_end, line
+
+
+class SyslogReader:
+    """Pages of the firewall lines of system log files, newest first."""
+
+    def __init__(self, index_path: Optional[str] = None, block_size: int = BLOCK_SIZE,
+                 checkpoint_every: int = CHECKPOINT_EVERY, max_tail: int = MAX_TAIL):
+        """Initialize the reader.
+
+        Args:
+            index_path: JSON file of the checkpoints (None keeps them in memory only)
+            block_size: Bytes read at once
+            checkpoint_every: Matching lines between checkpoints
+            max_tail: Bytes appended to a file since it was last read beyond which it
+                is indexed anew instead of counting the appended lines
+        """
+        self.index_path = index_path
+        self.block_size = block_size
+        self.checkpoint_every = checkpoint_every
+        self.max_tail = max_tail
+        self._entries: Dict[str, Dict[str, Any]] = self._load()
+        # Whether the index changed since it was saved
+        self._changed = False
+        self._lock = threading.Lock()
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        if not self.index_path or not os.path.exists(self.index_path):
+            return {}
+        try:
+            with open(self.index_path) as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring the syslog index {self.index_path}: {e}")
+            return {}
+
+    def _save(self) -> None:
+        if not self.index_path or not self._changed:
+            return
+        self._changed = False
+        # Only the most recently used files keep their index
+        for key in sorted(self._entries, key=lambda key: self._entries[key]['used'])[:-MAX_ENTRIES]:
+            del self._entries[key]
+        temporary = f"{self.index_path}.tmp"
+        try:
+            with open(temporary, 'w') as f:
+                json.dump(self._entries, f)
+            os.replace(temporary, self.index_path)
+        except OSError as e:
+            logger.warning(f"Could not save the syslog index {self.index_path}: {e}")
+
+    def page(self, path: str, offset: int = 0, limit: int = 10, log_type: Optional[str] = None) -> List[str]:
+        """Get a page of firewall lines of a log file and its rotations, newest first.
+
+        Args:
+            path: The log file, e.g. /var/log/syslog
+            offset: Number of matching lines to skip
+            limit: Maximum number of lines
+            log_type: "error" for drops, "info" for accepts, None for both
+
+        Returns:
+            List[str]: The lines, without their newline
+        """
+        kind = log_type.lower() if log_type and log_type.lower() in FILTERS else None
+        lines: List[str] = []
+        with self._lock:
+            for file in rotated_files(path):
+                try:
+                    with open(file, 'rb') as f:
+                        found, total = self._read(f, kind, offset, limit - len(lines))
+                except OSError as e:
+                    logger.debug(f"Could not read {file}: {e}")
+                    break
+                lines.extend(line.decode('utf-8', 'replace') for line in found)
+                if len(lines) >= limit or total is None:
+                    break
+                offset = max(0, offset - total)
+            self._save()
+        return lines
+
+    def count(self, path: str, log_type: Optional[str] = None) -> int:
+        """Count the firewall lines of a log file and its rotations.
+
+        The first count reads the files completely; later ones only what was appended.
+        """
+        kind = log_type.lower() if log_type and log_type.lower() in FILTERS else None
+        total = 0
+        with self._lock:
+            for file in rotated_files(path):
+                try:
+                    with open(file, 'rb') as f:
+                        entry = self._entry(f, kind)
+                        if entry['total'] is None:
+                            self._scan(f, entry, kind, entry['frontier'], target=None, limit=0)
+                        total += entry['total']
+                except OSError as e:
+                    logger.debug(f"Could not read {file}: {e}")
+                    break
+            self._save()
+        return total
+
+    def _read(self, f: Any, kind: Optional[str], offset: int, limit: int) -> Tuple[List[bytes], Optional[int]]:
+        """Get matching lines of one file.
+
+        Returns:
+            Tuple of the lines and the number of matching lines of the file, or None
+            if the page ended before the file was read to its beginning
+        """
+        entry = self._entry(f, kind)
+        total = entry['total']
+        if total is not None and offset >= total:
+            return [], total
+        # Start at the nearest known position at or before the first line of the page
+        points = entry['checkpoints']
+        index = bisect_right(points, [offset, float('inf')])
+        start = tuple(points[index - 1]) if index else (0, entry['anchor'])
+        if start[0] < entry['frontier'][0] <= offset:
+            start = tuple(entry['frontier'])
+        found = self._scan(f, entry, kind, start, offset, limit)
+        return found, entry['total'] if len(found) < limit else None
+
+    def _entry(self, f: Any, kind: Optional[str]) -> Dict[str, Any]:
+        """Get the index of a file, brought up to date with the lines appended since."""
+        stat = os.fstat(f.fileno())
+        key = f"{stat.st_dev}:{stat.st_ino}:{kind or 'all'}"
+        f.seek(0)
+        head = f.read(_HEAD_SIZE).hex()
+        entry = self._entries.get(key)
+        if entry is not None and (stat.st_size < entry['anchor'] or not head.startswith(entry['head'])
+                                  or self._tail(f, entry['anchor']) != entry['tail']
+                                  or stat.st_size - entry['anchor'] > self.max_tail):
+            # Truncated, replaced, or too much to catch up with
+            entry = None
+        if entry is None:
+            anchor = self._line_end(f, stat.st_size)
+            entry = {'anchor': anchor, 'checkpoints': [], 'frontier': [0, anchor], 'total': None if anchor else 0}
+            self._entries[key] = entry
+            self._changed = True
+        elif stat.st_size > entry['anchor']:
+            self._append(f, entry, kind, stat.st_size)
+        entry['head'] = head[:2 * entry['anchor']]
+        entry['tail'] = self._tail(f, entry['anchor'])
+        entry['used'] = time.time()
+        return entry
+
+    @staticmethod
+    def _tail(f: Any, anchor: int) -> str:
+        """Bytes before the anchor, which tell whether the file was rewritten up to it."""
+        start = max(0, anchor - _HEAD_SIZE)
+        f.seek(start)
+        return f.read(anchor - start).hex()
+
+    def _line_end(self, f: Any, size: int) -> int:
+        """Get the end of the last complete line before an offset."""
+        position = size
+        while position > 0:
+            start = max(0, position - self.block_size)
+            f.seek(start)
+            cut = f.read(position - start).rfind(b'\n')
+            if cut >= 0:
+                return start + cut + 1
+            position = start
+        return 0
+
+    def _append(self, f: Any, entry: Dict[str, Any], kind: Optional[str], size: int) -> None:
+        """Count the matching lines appended after the anchor and move the anchor past them."""
+        matches = FILTERS[kind]
+        anchor = entry['anchor']
+        f.seek(anchor)
+        data = f.read(size - anchor)
+        end = data.rfind(b'\n') + 1
+        if not end:
+            return
+        # End offsets of every checkpoint_every-th appended match, oldest first
+        ends = []
+        count = 0
+        for line_start, line_end in find_lines(data[:end], _NEEDLE):
+            if matches(data[line_start:line_end]):
+                if count % self.checkpoint_every == 0:
+                    ends.append((count, anchor + line_end + 1))
+                count += 1
+        entry['anchor'] = anchor + end
+        self._changed = True
+        if not count:
+            return
+        # Numbered from the new anchor, the appended matches come first
+        entry['checkpoints'] = sorted([[count - 1 - n, position] for n, position in ends] + [[count, anchor]] +
+                                      [[n + count, position] for n, position in entry['checkpoints']])
+        entry['frontier'] = [entry['frontier'][0] + count, entry['frontier'][1]]
+        if entry['total'] is not None:
+            entry['total'] += count
+
+    def _scan(self, f: Any, entry: Dict[str, Any], kind: Optional[str], start: Tuple[int, int],
+              target: Optional[int], limit: int) -> List[bytes]:
+        """Read matching lines backwards from a checkpoint, recording new checkpoints.
+
+        Args:
+            f: The file
+            entry: Its index
+            kind: Log type of the index
+            start: Checkpoint (number of the next matching line, offset) to start at
+            target: Number of the first matching line to return (None reads to the beginning)
+            limit: Number of lines to return
+
+        Returns:
+            List[bytes]: Matching lines target to target + limit - 1, or fewer at the beginning
+        """
+        matches = FILTERS[kind]
+        known = {point[0] for point in entry['checkpoints']}
+        added = []
+        found: List[bytes] = []
+        number, position = start
+        for line_start, line in reverse_lines(f, position, self.block_size, _NEEDLE):
+            if not matches(line):
+                continue
+            if number and number % self.checkpoint_every == 0 and number not in known:
+                # The search for this line starts at its end
+                added.append([number, line_start + len(line) + 1])
+            if target is not None and number >= target:
+                found.append(line)
+            number += 1
+            position = line_start
+            if target is not None and len(found) >= limit:
+                break
+        else:
+            # Read to the beginning of the file
+            position = 0
+            entry['total'] = number
+            self._changed = True
+        if added:
+            entry['checkpoints'] = sorted(entry['checkpoints'] + added)
+            self._changed = True
+        if number > entry['frontier'][0]:
+            entry['frontier'] = [number, position]
+            self._changed = True
+        return found
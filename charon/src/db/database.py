@@ -6,9 +6,11 @@ This module provides functionality to interact with a database for storing
 logs, configurations, and other data. Supports both SQLite and MySQL.
 """
 
+import argparse
 import logging
 import os
 import secrets
+import sys
 import hashlib
 from typing import Dict, List, Optional, Any, Tuple
 import datetime
@@ -41,7 +43,13 @@ class FirewallRule(Base):
     updated_at = Column(DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
 
 class FirewallLog(Base):
-    """Model for firewall logs."""
+    """Legacy model of the unpartitioned firewall log table.
+    
+    Logs are stored in daily partitions (see log_store), which copy the columns
+    of this model. The table only holds logs written before partitioning, until
+    Database.migrate_logs() moves them. Log rows read from the partitions carry
+    rule_id but not the rule relationship; load the rule with get_rules.
+    """
     __tablename__ = 'firewall_logs'
     
     id = Column(Integer, primary_key=True)
@@ -56,6 +64,41 @@ class FirewallLog(Base):
     rule_id = Column(Integer, ForeignKey('firewall_rules.id'), nullable=True)
     rule = relationship("FirewallRule")
 
+class LogSequence(Base):
+    """Model for the next firewall log ID, shared by all log partitions."""
+    __tablename__ = 'firewall_log_sequence'
+    
+    id = Column(Integer, primary_key=True)
+    next_id = Column(Integer, nullable=False)
+
+class LogRollupMinute(Base):
+    """Model for firewall log counts per minute."""
+    __tablename__ = 'firewall_log_rollups_minute'
+    
+    # The counted columns are the key, so the rows are stored in key order (clustered)
+    bucket = Column(DateTime, primary_key=True)
+    action = Column(String(20), primary_key=True)
+    protocol = Column(String(20), primary_key=True, default='')
+    src_ip = Column(String(50), primary_key=True, default='')
+    dst_ip = Column(String(50), primary_key=True, default='')
+    count = Column(Integer, nullable=False, default=0)
+    
+    __table_args__ = {'sqlite_with_rowid': False}
+
+class LogRollupHour(Base):
+    """Model for firewall log counts per hour."""
+    __tablename__ = 'firewall_log_rollups_hour'
+    
+    # The counted columns are the key, so the rows are stored in key order (clustered)
+    bucket = Column(DateTime, primary_key=True)
+    action = Column(String(20), primary_key=True)
+    protocol = Column(String(20), primary_key=True, default='')
+    src_ip = Column(String(50), primary_key=True, default='')
+    dst_ip = Column(String(50), primary_key=True, default='')
+    count = Column(Integer, nullable=False, default=0)
+    
+    __table_args__ = {'sqlite_with_rowid': False}
+
 class ConfigSetting(Base):
     """Model for configuration settings."""
     __tablename__ = 'config_settings'
@@ -89,15 +132,30 @@ class User(Base):
 class Database:
     """Database manager for Charon firewall."""
     
-    def __init__(self, connection_string=None):
+    def __init__(self, connection_string=None, archive_path=None):
         """Initialize the database manager.
         
         Args:
             connection_string: SQLAlchemy connection string. If None, uses environment variables
                 or defaults to SQLite for development.
+            archive_path: Directory of the log archive, which receives the logs past their
+                retention. If None, uses CHARON_LOG_ARCHIVE_PATH; without either, old logs
+                are dropped.
         """
+        # Imported here, as the log store builds on the models of this module
+        from .log_archive import LogArchive
+        from .log_store import LogStore
+        
         self.session = None
         self.engine = None
+        archive = None
+        archive_path = archive_path or os.environ.get('CHARON_LOG_ARCHIVE_PATH')
+        if archive_path:
+            try:
+                archive = LogArchive(archive_path)
+            except ImportError as e:
+                logger.warning(f"Log archive disabled, old logs are dropped: {e}")
+        self.logs = LogStore(archive)
         
         # If no connection string is provided, try to use environment variables or default to SQLite
         if not connection_string:
@@ -145,11 +203,32 @@ class Database:
         try:
             Base.metadata.create_all(self.engine)
             logger.info("Created database tables")
+            
+            if self.session.query(FirewallLog.id).first() is not None:
+                logger.warning("The unpartitioned firewall_logs table holds logs that are not listed; "
+                               "move them with: python -m charon.src.db.database --migrate")
             return True
         except Exception as e:
             logger.error(f"Error creating database tables: {e}")
             return False
     
+    def migrate_logs(self):
+        """Move the logs of the unpartitioned firewall_logs table into the daily partitions.
+        
+        Returns:
+            The number of logs moved, or None if it fails
+        """
+        try:
+            logger.info("Moving firewall logs into daily partitions")
+            moved = self.logs.migrate(self.session.connection())
+            self.session.commit()
+            logger.info(f"Moved {moved} firewall logs into daily partitions")
+            return moved
+        except Exception as e:
+            self.session.rollback()
+            logger.error(f"Error moving firewall logs into daily partitions: {e}")
+            return None
+    
     def close(self):
         """Close the database connection."""
         if self.session:
@@ -458,9 +537,41 @@ class Database:
             logger.error(f"Error getting firewall rules: {e}")
             return []
     
+    def get_rules_page(self, filters=None, limit=100, cursor=None):
+        """Get a page of firewall rules in ID order, continuing after a cursor.
+        
+        Args:
+            filters: Dictionary of filters to apply
+            limit: Number of rules per page
+            cursor: Cursor returned with the previous page (None for the first page)
+            
+        Returns:
+            Tuple of the rules and the cursor of the next page (None on the last page)
+        """
+        try:
+            query = self.session.query(FirewallRule)
+            
+            if filters:
+                for key, value in filters.items():
+                    if hasattr(FirewallRule, key):
+                        query = query.filter(getattr(FirewallRule, key) == value)
+            
+            # The cursor is the ID of the last rule of the previous page
+            if cursor:
+                query = query.filter(FirewallRule.id > int(cursor))
+            
+            rules = query.order_by(FirewallRule.id).limit(limit + 1).all()
+            if len(rules) > limit:
+                rules = rules[:limit]
+                return rules, str(rules[-1].id)
+            return rules, None
+        except Exception as e:
+            logger.error(f"Error getting firewall rules: {e}")
+            return [], None
+    
     # Log methods
     def add_log(self, log_data):
-        """Add a log entry to the database.
+        """Add a log entry to the partition of its day.
         
         Args:
             log_data: Dictionary containing log data
@@ -469,76 +580,162 @@ class Database:
             The ID of the created log entry, or None if it fails
         """
         try:
-            log = FirewallLog(**log_data)
-            self.session.add(log)
+            log_id = self.logs.add(self.session.connection(), log_data)
             self.session.commit()
-            logger.debug(f"Added firewall log: {log.id}")
-            return log.id
+            logger.debug(f"Added firewall log: {log_id}")
+            return log_id
         except Exception as e:
             self.session.rollback()
             logger.error(f"Error adding firewall log: {e}")
             return None
     
-    def get_logs(self, log_type=None, filters=None, limit=100, offset=None):
-        """Get log entries from the database.
+    def get_logs(self, log_type=None, filters=None, limit=100, offset=None, since=None, until=None):
+        """Get log entries from the database, newest first.
         
         Args:
-            log_type: Filter by log type
+            log_type: Filter by action ('all' for every action)
             filters: Dictionary of filters to apply
             limit: Maximum number of logs to return
             offset: Number of logs to skip
+            since: Only logs from this time on
+            until: Only logs before this time
             
         Returns:
             List of log entries
         """
         try:
-            query = self.session.query(FirewallLog).order_by(FirewallLog.timestamp.desc())
-            
+            filters = dict(filters or {})
             if log_type and log_type != 'all':
-                query = query.filter(FirewallLog.type == log_type)
-            
-            if filters:
-                for key, value in filters.items():
-                    if hasattr(FirewallLog, key):
-                        query = query.filter(getattr(FirewallLog, key) == value)
-            
-            if offset is not None:
-                query = query.offset(offset)
-                
-            if limit:
-                query = query.limit(limit)
-            
-            logs = query.all()
-            return logs
+                filters['action'] = log_type
+            return self.logs.query(self.session.connection(), filters, limit, offset, since, until)
         except Exception as e:
             logger.error(f"Error getting firewall logs: {e}")
             return []
     
-    def count_logs(self, log_type=None, filters=None):
+    def count_logs(self, log_type=None, filters=None, since=None, until=None):
         """Count log entries in the database.
         
         Args:
-            log_type: Filter by log type if provided
+            log_type: Filter by action if provided
             filters: Dictionary of filters to apply
+            since: Only logs from this time on
+            until: Only logs before this time
             
         Returns:
             Count of log entries
         """
         try:
-            query = self.session.query(FirewallLog)
+            filters = dict(filters or {})
+            if log_type and log_type != 'all':
+                filters['action'] = log_type
+            return self.logs.count(self.session.connection(), filters, since, until)
+        except Exception as e:
+            logger.error(f"Error counting logs: {e}")
+            return 0
+    
+    def get_logs_page(self, log_type=None, filters=None, limit=50, cursor=None, since=None, until=None):
+        """Get a page of log entries, newest first, continuing after a cursor.
+        
+        Unlike get_logs with an offset, the cost of a page does not grow with its depth.
+        Pages continue from the database into the log archive, if there is one.
+        
+        Args:
+            log_type: Filter by action ('all' for every action)
+            filters: Dictionary of filters to apply
+            limit: Number of logs per page
+            cursor: Cursor returned with the previous page (None for the first page)
+            since: Only logs from this time on
+            until: Only logs before this time
             
-            if log_type:
-                query = query.filter(FirewallLog.type == log_type)
-                
-            if filters:
-                for key, value in filters.items():
-                    if hasattr(FirewallLog, key):
-                        query = query.filter(getattr(FirewallLog, key) == value)
+        Returns:
+            Tuple of the log entries and the cursor of the next page (None on the last page)
+        """
+        try:
+            filters = dict(filters or {})
+            if log_type and log_type != 'all':
+                filters['action'] = log_type
+            return self.logs.page(self.session.connection(), filters, limit, cursor, since, until)
+        except Exception as e:
+            logger.error(f"Error getting firewall logs: {e}")
+            return [], None
+    
+    def count_logs_by(self, column='action', filters=None, since=None, until=None):
+        """Count log entries per value of a column in one query.
+        
+        Args:
+            column: Column to count by
+            filters: Dictionary of filters to apply
+            since: Only logs from this time on
+            until: Only logs before this time
             
-            return query.count()
+        Returns:
+            Dictionary of the count per value
+        """
+        try:
+            return self.logs.count_by(self.session.connection(), column, filters, since, until)
         except Exception as e:
             logger.error(f"Error counting logs: {e}")
-            return 0
+            return {}
+    
+    def get_log_days(self):
+        """Get the days that have a log partition in the database.
+        
+        Returns:
+            List of dates, newest first
+        """
+        try:
+            return [day for day, _ in self.logs.partitions(self.session.connection())]
+        except Exception as e:
+            logger.error(f"Error listing log partitions: {e}")
+            return []
+    
+    def get_log_stats(self, since=None, until=None, group_by=('action',), resolution='hour',
+                      filters=None, by_bucket=False, limit=None):
+        """Get log counts from the per-minute or per-hour rollups.
+        
+        Args:
+            since: Only counts from this time on
+            until: Only counts before this time
+            group_by: Columns to count by (action, protocol, src_ip, dst_ip)
+            resolution: 'minute' or 'hour'
+            filters: Dictionary of filters on the group_by columns
+            by_bucket: Count per minute or hour instead of in total
+            limit: Maximum number of groups
+            
+        Returns:
+            List of dictionaries with the group_by values and the count
+        """
+        try:
+            return self.logs.stats(self.session.connection(), since, until, group_by, resolution,
+                                   filters, by_bucket, limit)
+        except Exception as e:
+            logger.error(f"Error getting log statistics: {e}")
+            return []
+    
+    def apply_log_retention(self, raw_days=7, minute_days=2, hour_days=90, archive_days=None):
+        """Drop log partitions and rollup counts older than their retention.
+        
+        With a log archive, the partitions are moved into the archive instead.
+        
+        Args:
+            raw_days: Days of raw logs to keep in the database (None keeps all)
+            minute_days: Days of per-minute counts to keep (None keeps all)
+            hour_days: Days of per-hour counts to keep (None keeps all)
+            archive_days: Days of archived logs to keep (None keeps all)
+            
+        Returns:
+            Dictionary with the number of partitions dropped and rollup rows deleted,
+            or None if it fails
+        """
+        try:
+            removed = self.logs.apply_retention(self.session.connection(), raw_days, minute_days, hour_days,
+                                                archive_days)
+            self.session.commit()
+            return removed
+        except Exception as e:
+            self.session.rollback()
+            logger.error(f"Error applying log retention: {e}")
+            return None
     
     # Configuration methods
     def set_config(self, section, key, value, description=None):
@@ -717,4 +914,44 @@ class Database:
             return query.count()
         except Exception as e:
             logger.error(f"Error counting firewall rules: {e}")
-            return 0 
\ No newline at end of file
+            return 0
+    
+    def get_rules_version(self):
+        """Get a value that changes whenever a firewall rule is added, updated or deleted.
+        
+        The version is read with one aggregate query, so results derived from
+        all the rules can be cached until it changes.
+        
+        Returns:
+            Tuple of the rule count, the highest rule ID and the latest update
+            time, or None if it fails
+        """
+        try:
+            return tuple(self.session.query(
+                sqlalchemy.func.count(FirewallRule.id),
+                sqlalchemy.func.max(FirewallRule.id),
+                sqlalchemy.func.max(FirewallRule.updated_at)).one())
+        except Exception as e:
+            logger.error(f"Error getting firewall rules version: {e}")
+            return None
+
+
+
+def main():
+    """Maintain the Charon database from the command line."""
+    parser = argparse.ArgumentParser(description='Maintain the Charon database')
+    parser.add_argument('--migrate', action='store_true',
+                        help='Move logs written before log partitioning into the daily partitions')
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    db = Database()
+    if not db.connect() or not db.create_tables():
+        return 1
+    if args.migrate and db.migrate_logs() is None:
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
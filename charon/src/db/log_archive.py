@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+Log Archive Module for Charon Firewall
+
+Raw firewall logs stay in the daily partitions of LogStore for a few days.
+For forensics over months, partitions past their retention are moved into
+compressed columnar files instead of being dropped:
+
+- Each archived partition becomes one Parquet file per day,
+  firewall_logs_YYYYMMDD.parquet, with its rows in (timestamp, id) order,
+  written in row groups of 64k rows and compressed with zstd.
+- Chains, actions, protocols and addresses are dictionary-encoded: each
+  distinct value is stored once per row group and the rows hold small
+  integer codes. Ports are stored as integers.
+- Every row group records the smallest and largest value of each column.
+  Queries push their predicates on time, addresses and ports down to these
+  statistics and skip the row groups (and, by their file names, the days)
+  that cannot match, so a query for one hour or one host reads only a small
+  part of months of logs.
+- Pages are read newest first: row groups are visited from the newest down
+  and the scan stops once the page is full and no older row group can hold
+  a newer row.
+
+LogStore.page reads the archive after the partitions of the same days, so
+log listings span hot rows in the database and cold rows in the archive with
+the same cursors. The archive needs pyarrow (the "archive" extra).
+"""
+
+import argparse
+import collections
+import datetime
+import functools
+import json
+import logging
+import operator
+import os
+import re
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = ds = pq = None
+
+from .database import FirewallLog
+from .log_store import LOG_COLUMNS, PARTITION_PREFIX, decode_cursor, encode_cursor
+
+logger = logging.getLogger('charon.log_archive')
+
+# Columns of an archive file, in the order rows are given to LogArchive.write
+ARCHIVE_COLUMNS = ('id',) + LOG_COLUMNS
+
+# Columns stored as integers; the partitions hold them as strings
+PORT_COLUMNS = ('src_port', 'dst_port')
+
+ROW_GROUP_SIZE = 65536
+
+# A later archive of the same day (logs that arrived late) gets a sequence number
+_ARCHIVE_NAME = re.compile(PARTITION_PREFIX + r'(\d{8})(?:\.(\d+))?\.parquet$')
+
+
+def _schema() -> Any:
+    text = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([('id', pa.int64()), ('timestamp', pa.timestamp('us')), ('chain', text),
+                      ('action', text), ('protocol', text), ('src_ip', text), ('dst_ip', text),
+                      ('src_port', pa.int32()), ('dst_port', pa.int32()), ('rule_id', pa.int64())])
+
+
+def _port(value: Any) -> Optional[int]:
+    """Get a port as an integer, or None if it is missing or not a number."""
+    if value is None or not str(value).isdigit():
+        return None
+    return int(value)
+
+
+class ArchivedLog(collections.namedtuple('ArchivedLog', FirewallLog.__table__.columns.keys())):
+    """A log row read from the archive, with the attributes of the rows of the partitions."""
+
+    __slots__ = ()
+
+    @property
+    def _mapping(self) -> Dict[str, Any]:
+        return self._asdict()
+
+
+class LogArchive:
+    """Daily Parquet files of the log partitions past their retention."""
+
+    def __init__(self, path: str, row_group_size: int = ROW_GROUP_SIZE, compression: str = 'zstd'):
+        """Initialize the archive.
+
+        Args:
+            path: Directory of the archive files (created by the first archive)
+            row_group_size: Rows per row group; smaller groups are skipped more
+                precisely but compress less well
+            compression: Parquet compression codec
+
+        Raises:
+            ImportError: If pyarrow is not installed
+        """
+        if pa is None:
+            raise ImportError("The log archive requires pyarrow")
+        self.path = path
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.schema = _schema()
+
+    def days(self, since: Optional[datetime.datetime] = None,
+             until: Optional[datetime.datetime] = None) -> Dict[datetime.date, List[str]]:
+        """Get the archive files per day, newest day first.
+
+        Args:
+            since: Only days with logs from this time on
+            until: Only days with logs before this time
+        """
+        if not os.path.isdir(self.path):
+            return {}
+        days: Dict[datetime.date, List[str]] = {}
+        for name in os.listdir(self.path):
+            match = _ARCHIVE_NAME.match(name)
+            if match is None:
+                continue
+            day = datetime.datetime.strptime(match.group(1), '%Y%m%d').date()
+            if (since is None or day >= since.date()) and (until is None or day <= until.date()):
+                days.setdefault(day, []).append(os.path.join(self.path, name))
+        return {day: sorted(days[day]) for day in sorted(days, reverse=True)}
+
+    def highest_id(self) -> int:
+        """Get the highest archived log ID from the row group statistics (0 if the archive is empty)."""
+        highest = 0
+        for paths in self.days().values():
+            for path in paths:
+                metadata = pq.read_metadata(path)
+                column = metadata.schema.names.index('id')
+                for index in range(metadata.num_row_groups):
+                    statistics = metadata.row_group(index).column(column).statistics
+                    if statistics is not None and statistics.has_min_max:
+                        highest = max(highest, statistics.max)
+        return highest
+
+    def write(self, day: datetime.date, batches: Iterable[Sequence[tuple]]) -> int:
+        """Write the logs of a day to a new archive file.
+
+        Args:
+            day: Day of the logs
+            batches: Lists of rows, as tuples of ARCHIVE_COLUMNS in (timestamp, id) order
+
+        Returns:
+            int: Number of rows written
+        """
+        os.makedirs(self.path, exist_ok=True)
+        name = f"{PARTITION_PREFIX}{day:%Y%m%d}"
+        existing = [match for match in map(_ARCHIVE_NAME.match, os.listdir(self.path))
+                    if match is not None and match.group(1) == name[len(PARTITION_PREFIX):]]
+        name += (f".{len(existing)}" if existing else '') + '.parquet'
+        path = os.path.join(self.path, name)
+        # Readers never see a partly written file
+        temporary = path + '.tmp'
+        written = 0
+        with pq.ParquetWriter(temporary, self.schema, compression=self.compression) as writer:
+            for rows in batches:
+                if rows:
+                    writer.write_table(self._table(rows), row_group_size=self.row_group_size)
+                    written += len(rows)
+        if not written:
+            os.remove(temporary)
+            return 0
+        os.replace(temporary, path)
+        logger.info(f"Archived {written} logs of {day} to {path}")
+        return written
+
+    def _table(self, rows: Sequence[tuple]) -> Any:
+        arrays = []
+        for field, values in zip(self.schema, zip(*rows)):
+            if field.name in PORT_COLUMNS:
+                values = [_port(value) for value in values]
+            arrays.append(pa.array(values, type=field.type))
+        return pa.Table.from_arrays(arrays, schema=self.schema)
+
+    def _expression(self, filters: Optional[Dict[str, Any]], since: Optional[datetime.datetime],
+                    until: Optional[datetime.datetime], after: Optional[Tuple[datetime.datetime, int]]) -> Any:
+        """Filter expression of a query, which the scans push down to the row group statistics."""
+        timestamp = ds.field('timestamp')
+        conditions = []
+        for key, value in (filters or {}).items():
+            if key not in self.schema.names:
+                continue
+            if key in PORT_COLUMNS:
+                value = _port(value)
+                if value is None:
+                    # Ports that are not numbers were not archived
+                    return ds.scalar(False)
+            conditions.append(ds.field(key) == value)
+        if since is not None:
+            conditions.append(timestamp >= since)
+        if until is not None:
+            conditions.append(timestamp < until)
+        if after is not None:
+            conditions.append((timestamp < after[0]) | ((timestamp == after[0]) & (ds.field('id') < after[1])))
+        return functools.reduce(operator.and_, conditions) if conditions else None
+
+    def read(self, paths: Sequence[str], filters: Optional[Dict[str, Any]] = None, limit: Optional[int] = None,
+             since: Optional[datetime.datetime] = None, until: Optional[datetime.datetime] = None,
+             after: Optional[Tuple[datetime.datetime, int]] = None) -> List[ArchivedLog]:
+        """Get the newest matching logs of archive files.
+
+        Args:
+            paths: Archive files, usually those of one day (see days)
+            filters: Column values to match; unknown columns are ignored
+            limit: Maximum number of logs
+            since: Only logs from this time on
+            until: Only logs before this time
+            after: Only logs before this (timestamp, id), as in a page cursor
+
+        Returns:
+            List[ArchivedLog]: Logs in (timestamp, id) order, newest first
+        """
+        expression = self._expression(filters, since, until, after)
+        dataset = ds.dataset(list(paths), format='parquet', schema=self.schema)
+        groups = []
+        for fragment in dataset.get_fragments(filter=expression):
+            # Row groups whose statistics rule out the filter are skipped here
+            for group in fragment.split_by_row_group(filter=expression, schema=self.schema):
+                statistics = group.row_groups[0].statistics.get('timestamp', {})
+                groups.append((statistics.get('max'), statistics.get('min'), group))
+        groups.sort(key=lambda group: (group[0] is not None, group[0]), reverse=True)
+
+        tables = []
+        found = 0
+        oldest_needed = None
+        for newest, _, group in groups:
+            # Row groups hold rows of increasing time; once the page is full, a row group
+            # whose newest row is older than the page cannot contribute to it
+            if limit and found >= limit and newest is not None and oldest_needed is not None \
+                    and newest < oldest_needed:
+                break
+            table = group.to_table(filter=expression, schema=self.schema)
+            if table.num_rows:
+                tables.append(table)
+                found += table.num_rows
+                if limit and found >= limit:
+                    page = pa.concat_tables(tables).sort_by([('timestamp', 'descending'), ('id', 'descending')])
+                    tables, found = [page.slice(0, limit)], limit
+                    oldest_needed = tables[0].column('timestamp')[-1].as_py()
+        if not tables:
+            return []
+        table = pa.concat_tables(tables).sort_by([('timestamp', 'descending'), ('id', 'descending')])
+        if limit:
+            table = table.slice(0, limit)
+        logs = []
+        for row in table.to_pylist():
+            for column in PORT_COLUMNS:
+                if row[column] is not None:
+                    row[column] = str(row[column])
+            logs.append(ArchivedLog(**row))
+        return logs
+
+    def query(self, filters: Optional[Dict[str, Any]] = None, limit: int = 100, cursor: Optional[str] = None,
+              since: Optional[datetime.datetime] = None,
+              until: Optional[datetime.datetime] = None) -> Tuple[List[ArchivedLog], Optional[str]]:
+        """Get a page of archived logs, newest first, continuing after a cursor.
+
+        Args:
+            filters: Column values to match; unknown columns are ignored
+            limit: Number of logs per page
+            cursor: Cursor returned with the previous page (None for the first page)
+            since: Only logs from this time on
+            until: Only logs before this time
+
+        Returns:
+            Tuple of the logs and the cursor of the next page (None on the last page)
+
+        Raises:
+            ValueError: If the cursor is invalid
+        """
+        after = decode_cursor(cursor) if cursor else None
+        last_day = after[0] if after and (until is None or after[0] < until) else until
+        logs: List[ArchivedLog] = []
+        for paths in self.days(since, last_day).values():
+            logs.extend(self.read(paths, filters, limit + 1 - len(logs), since, until, after))
+            if len(logs) > limit:
+                logs = logs[:limit]
+                return logs, encode_cursor(logs[-1].timestamp, logs[-1].id)
+        return logs, None
+
+    def count(self, filters: Optional[Dict[str, Any]] = None, since: Optional[datetime.datetime] = None,
+              until: Optional[datetime.datetime] = None) -> int:
+        """Count the archived logs matching filters (see query)."""
+        paths = [path for day_paths in self.days(since, until).values() for path in day_paths]
+        if not paths:
+            return 0
+        dataset = ds.dataset(paths, format='parquet', schema=self.schema)
+        return dataset.count_rows(filter=self._expression(filters, since, until, None))
+
+    def remove_before(self, day: datetime.date) -> int:
+        """Delete the archive files of the days before a day.
+
+        Returns:
+            int: Number of files deleted
+        """
+        removed = 0
+        for file_day, paths in self.days().items():
+            if file_day < day:
+                for path in paths:
+                    os.remove(path)
+                    removed += 1
+                    logger.info(f"Removed log archive {path}")
+        return removed
+
+
+def main():
+    """Query the log archive from the command line, one JSON object per log."""
+    parser = argparse.ArgumentParser(description='Query the Charon firewall log archive')
+    parser.add_argument('path', help='Directory of the archive files')
+    parser.add_argument('--since', type=datetime.datetime.fromisoformat, help='Logs from this time on (ISO 8601)')
+    parser.add_argument('--until', type=datetime.datetime.fromisoformat, help='Logs before this time (ISO 8601)')
+    for column in ('action', 'protocol', 'src_ip', 'dst_ip', 'src_port', 'dst_port'):
+        parser.add_argument(f"--{column.replace('_', '-')}", dest=column, help=f"Match this {column}")
+    parser.add_argument('--limit', type=int, default=100, help='Maximum number of logs')
+    parser.add_argument('--count', action='store_true', help='Print the number of matching logs only')
+    args = parser.parse_args()
+
+    archive = LogArchive(args.path)
+    filters = {column: getattr(args, column) for column in ARCHIVE_COLUMNS
+               if getattr(args, column, None) is not None}
+    if args.count:
+        print(archive.count(filters, args.since, args.until))
+        return
+    logs, _ = archive.query(filters, args.limit, since=args.since, until=args.until)
+    for log in logs:
+        print(json.dumps(log._asdict(), default=str))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,636 @@
+#!/usr/bin/env python3
+"""
+Log Storage Module for Charon Firewall
+
+Firewall log events are stored in one table per day instead of a single
+table that grows without bound:
+
+- Each partition, firewall_logs_YYYYMMDD, has the columns of FirewallLog and
+  an index on (timestamp, id). Once its day has ended, apply_retention adds
+  indexes on (action, timestamp) and (src_ip, timestamp), which would slow
+  down the inserts into the partition of the current day. Queries for a
+  time range only touch the partitions of the days in it, newest first, and
+  stop once they have enough rows.
+- Pages of logs are read with a cursor, the (timestamp, id) of the last row
+  of the previous page, which the (timestamp, id) index seeks to directly;
+  the cost of a page does not grow with its depth as an OFFSET's does.
+- Retention drops whole partitions, which costs the same however many rows
+  they hold and leaves no half-deleted table behind (a DELETE of old rows
+  would rewrite every page and index of the table).
+- Log IDs come from one sequence (LogSequence) rather than the autoincrement
+  of each partition, so (timestamp, id) identifies a log across all days,
+  as the page cursors and the archive require.
+- Every insert also adds its rows to the per-minute and per-hour rollups
+  (LogRollupMinute, LogRollupHour): counts by action, protocol, source and
+  destination address. Dashboards and statistics read the rollups, which
+  stay small, rather than counting raw rows. The rollups have their own,
+  usually longer, retention.
+- With a LogArchive, partitions past their retention are moved into daily
+  Parquet files instead of being dropped, and pages of logs continue from
+  the partitions into the archive.
+
+Daily tables work the same on SQLite and MySQL, so no MySQL partitioning or
+SQLite attachments are needed.
+
+Batches are written with one executemany per partition and rollup, using
+statements compiled once with plain parameter tuples; a Core insert of a list
+of dictionaries would compile the parameters of every row anew.
+"""
+
+import base64
+import datetime
+import logging
+import operator
+import re
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import Column, Index, MetaData, Table, and_, func, inspect, or_, select, union_all
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+
+from .database import FirewallLog, LogRollupHour, LogRollupMinute, LogSequence
+
+logger = logging.getLogger('charon.log_store')
+
+# FirewallLog columns written to the partitions
+LOG_COLUMNS = ('timestamp', 'chain', 'action', 'protocol', 'src_ip', 'dst_ip', 'src_port', 'dst_port', 'rule_id')
+
+# Columns the rollups count by
+ROLLUP_DIMENSIONS = ('action', 'protocol', 'src_ip', 'dst_ip')
+ROLLUP_COLUMNS = ('bucket',) + ROLLUP_DIMENSIONS + ('count',)
+ROLLUPS = {'minute': LogRollupMinute.__table__, 'hour': LogRollupHour.__table__}
+
+# Index of every partition, for keyset pagination
+LOG_INDEXES = (('timestamp', 'id'),)
+
+# Indexes added once the day of a partition has ended, for filters by action
+# or source; maintaining them on the partition being written halves ingest
+CLOSED_LOG_INDEXES = (('action', 'timestamp'), ('src_ip', 'timestamp'))
+
+PARTITION_PREFIX = 'firewall_logs_'
+_PARTITION_NAME = re.compile(PARTITION_PREFIX + r'(\d{8})$')
+
+
+def partition_name(day: datetime.date) -> str:
+    """Get the name of the partition table of a day."""
+    return f"{PARTITION_PREFIX}{day:%Y%m%d}"
+
+
+def truncate(timestamp: datetime.datetime, resolution: str) -> datetime.datetime:
+    """Get the start of the minute or hour of a timestamp."""
+    if resolution == 'minute':
+        return timestamp.replace(second=0, microsecond=0)
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+def encode_cursor(timestamp: datetime.datetime, log_id: int) -> str:
+    """Get the opaque page cursor of the log row with this timestamp and ID."""
+    return base64.urlsafe_b64encode(f"{timestamp.isoformat()}|{log_id}".encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime.datetime, int]:
+    """Get the timestamp and ID of a page cursor.
+
+    Raises:
+        ValueError: If the cursor is not one made by encode_cursor
+    """
+    try:
+        timestamp, log_id = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode().split('|')
+        return datetime.datetime.fromisoformat(timestamp), int(log_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid log cursor: {cursor!r}") from e
+
+
+def log_row(log_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Get the partition columns of a log entry, with the current time if it has none."""
+    row = {name: log_data.get(name) for name in LOG_COLUMNS}
+    if row['timestamp'] is None:
+        row['timestamp'] = datetime.datetime.now()
+    return row
+
+
+class LogStore:
+    """Daily log partitions with per-minute and per-hour rollups."""
+
+    def __init__(self, archive: Optional[Any] = None):
+        """Initialize the log store.
+
+        Args:
+            archive: LogArchive that receives the partitions past their retention
+                (None drops them)
+        """
+        self.archive = archive
+        self.metadata = MetaData()
+        self._tables: Dict[str, Table] = {}
+        # Partitions known to exist, so inserts skip the existence check
+        self._created = set()
+        # Partitions known to have the CLOSED_LOG_INDEXES
+        self._closed = set()
+        # Compiled statement and bind processors per table
+        self._statements: Dict[str, Tuple[str, List[int], List[Optional[Callable]], bool]] = {}
+
+    def _table(self, name: str) -> Table:
+        table = self._tables.get(name)
+        if table is None:
+            # A copy of FirewallLog without the foreign key; the log of a deleted rule stays
+            columns = [Column(column.name, column.type, primary_key=column.primary_key, nullable=column.nullable)
+                       for column in FirewallLog.__table__.columns]
+            table = Table(name, self.metadata, *columns)
+            for indexed in LOG_INDEXES:
+                self._index(table, indexed)
+            self._tables[name] = table
+        return table
+
+    @staticmethod
+    def _index(table: Table, columns: Sequence[str]) -> Index:
+        """Get the index of a partition on columns, adding it to the table if needed."""
+        name = f"ix_{table.name}_{'_'.join(columns)}"
+        for index in table.indexes:
+            if index.name == name:
+                return index
+        return Index(name, *(table.c[column] for column in columns))
+
+    def partition(self, conn: Any, day: datetime.date) -> Table:
+        """Get the partition table of a day, creating it if needed."""
+        table = self._table(partition_name(day))
+        if table.name not in self._created:
+            table.create(conn, checkfirst=True)
+            # Partitions created before an index was added get it now
+            for indexed in LOG_INDEXES:
+                self._index(table, indexed).create(conn, checkfirst=True)
+            self._created.add(table.name)
+        return table
+
+    def close_partitions(self, conn: Any, now: Optional[datetime.datetime] = None) -> int:
+        """Add the CLOSED_LOG_INDEXES to the partitions of the days before today.
+
+        Building an index on a whole day at once is cheaper than maintaining
+        it on every insert. Logs that arrive late for a closed day are still
+        written to its partition and its indexes.
+
+        Args:
+            conn: Database connection; the caller commits
+            now: Current time
+
+        Returns:
+            int: Number of partitions that got indexes
+        """
+        today = (now or datetime.datetime.now()).date()
+        closed = 0
+        for day, table in self.partitions(conn, until=datetime.datetime.combine(today, datetime.time())):
+            if day >= today or table.name in self._closed:
+                continue
+            existing = {index['name'] for index in inspect(conn).get_indexes(table.name)}
+            added = False
+            for indexed in CLOSED_LOG_INDEXES:
+                index = self._index(table, indexed)
+                if index.name not in existing:
+                    index.create(conn)
+                    added = True
+            if added:
+                closed += 1
+                logger.info(f"Indexed closed log partition {table.name}")
+            self._closed.add(table.name)
+        return closed
+
+    def partitions(self, conn: Any, since: Optional[datetime.datetime] = None,
+                   until: Optional[datetime.datetime] = None) -> List[Tuple[datetime.date, Table]]:
+        """Get the existing partitions, newest first.
+
+        Args:
+            conn: Database connection
+            since: Only partitions with logs from this time on
+            until: Only partitions with logs before this time
+        """
+        days = []
+        for name in inspect(conn).get_table_names():
+            match = _PARTITION_NAME.match(name)
+            if match is None:
+                continue
+            day = datetime.datetime.strptime(match.group(1), '%Y%m%d').date()
+            if (since is None or day >= since.date()) and (until is None or day <= until.date()):
+                days.append(day)
+        return [(day, self._table(partition_name(day))) for day in sorted(days, reverse=True)]
+
+    def insert(self, conn: Any, rows: Sequence[Dict[str, Any]], rollup: bool = True) -> int:
+        """Insert log rows into their partitions and add them to the rollups.
+
+        Args:
+            conn: Database connection; the caller commits
+            rows: Dictionaries with all of LOG_COLUMNS (see log_row)
+            rollup: Add the rows to the rollups; without it the caller collects
+                their counts with rollup_counts and writes them with write_rollups
+
+        Returns:
+            int: Number of rows inserted
+        """
+        values = operator.itemgetter(*LOG_COLUMNS)
+        log_id = self.allocate_ids(conn, len(rows)) if rows else None
+        by_day: Dict[datetime.date, List[tuple]] = {}
+        # Rows of the same second share one timestamp object
+        last, day = None, None
+        for row in rows:
+            row = values(row)
+            if row[0] is not last:
+                last, day = row[0], row[0].date()
+            by_day.setdefault(day, []).append((log_id,) + row)
+            log_id += 1
+
+        for day, day_rows in by_day.items():
+            table = self.partition(conn, day)
+            self._execute(conn, table.insert(), ('id',) + LOG_COLUMNS, day_rows)
+        if rollup:
+            self.write_rollups(conn, self.rollup_counts(rows))
+        return len(rows)
+
+    def add(self, conn: Any, log_data: Dict[str, Any]) -> int:
+        """Insert one log entry and add it to the rollups.
+
+        Args:
+            conn: Database connection; the caller commits
+            log_data: FirewallLog column values (see log_row)
+
+        Returns:
+            int: The ID of the row
+        """
+        row = log_row(log_data)
+        log_id = self.allocate_ids(conn, 1)
+        table = self.partition(conn, row['timestamp'].date())
+        conn.execute(table.insert().values(id=log_id, **{name: row[name] for name in LOG_COLUMNS}))
+        self.write_rollups(conn, self.rollup_counts([row]))
+        return log_id
+
+    def allocate_ids(self, conn: Any, count: int) -> int:
+        """Reserve consecutive log IDs.
+
+        The sequence row stays locked until the caller commits, so concurrent
+        writers get distinct IDs.
+
+        Args:
+            conn: Database connection; the caller commits
+            count: Number of IDs
+
+        Returns:
+            int: The first of the IDs
+        """
+        sequence = LogSequence.__table__
+        result = conn.execute(sequence.update().where(sequence.c.id == 1)
+                              .values(next_id=sequence.c.next_id + count))
+        if not result.rowcount:
+            # First use: continue after the logs written before the sequence existed
+            first = self.highest_id(conn) + 1
+            conn.execute(sequence.insert().values(id=1, next_id=first + count))
+            return first
+        return conn.execute(select(sequence.c.next_id).where(sequence.c.id == 1)).scalar() - count
+
+    def highest_id(self, conn: Any) -> int:
+        """Get the highest ID of the logs in the partitions, the unpartitioned table and the archive (0 if none)."""
+        tables = [table for _, table in self.partitions(conn)] + [FirewallLog.__table__]
+        highest = max(conn.execute(select(func.max(table.c.id))).scalar() or 0 for table in tables)
+        if self.archive is not None:
+            highest = max(highest, self.archive.highest_id())
+        return highest
+
+    @staticmethod
+    def rollup_counts(rows: Iterable[Dict[str, Any]],
+                      counts: Optional[Dict[str, Dict[tuple, int]]] = None) -> Dict[str, Dict[tuple, int]]:
+        """Count log rows per rollup key.
+
+        Args:
+            rows: Dictionaries with all of LOG_COLUMNS
+            counts: Add to these counts instead of new ones
+
+        Returns:
+            Dict[str, Dict[tuple, int]]: Count per key of ROLLUP_COLUMNS, for each resolution
+        """
+        counts = counts if counts is not None else {resolution: {} for resolution in ROLLUPS}
+        minute, hour = counts['minute'], counts['hour']
+        # Rows of the same second share one timestamp object
+        last, minute_bucket, hour_bucket = None, None, None
+        for row in rows:
+            timestamp = row['timestamp']
+            if timestamp is not last:
+                last = timestamp
+                minute_bucket, hour_bucket = truncate(timestamp, 'minute'), truncate(timestamp, 'hour')
+            dimensions = (row['action'], row['protocol'] or '', row['src_ip'] or '', row['dst_ip'] or '')
+            key = (minute_bucket,) + dimensions
+            minute[key] = minute.get(key, 0) + 1
+            key = (hour_bucket,) + dimensions
+            hour[key] = hour.get(key, 0) + 1
+        return counts
+
+    def write_rollups(self, conn: Any, counts: Dict[str, Dict[tuple, int]]) -> None:
+        """Add counts from rollup_counts to the rollup tables."""
+        for resolution, table in ROLLUPS.items():
+            self._execute(conn, self._upsert(conn, table), ROLLUP_COLUMNS,
+                          [key + (count,) for key, count in counts[resolution].items()])
+
+    @staticmethod
+    def _upsert(conn: Any, table: Table) -> Any:
+        """Insert that adds to the count of an existing rollup row."""
+        dialect = conn.dialect.name
+        if dialect in ('sqlite', 'postgresql'):
+            stmt = (sqlite if dialect == 'sqlite' else postgresql).insert(table)
+            return stmt.on_conflict_do_update(index_elements=list(ROLLUP_COLUMNS[:-1]),
+                                              set_={'count': table.c['count'] + stmt.excluded['count']})
+        if dialect in ('mysql', 'mariadb'):
+            stmt = mysql.insert(table)
+            return stmt.on_duplicate_key_update(count=table.c['count'] + stmt.inserted['count'])
+        raise NotImplementedError(f"Log rollups are not supported on {dialect}")
+
+    def _execute(self, conn: Any, stmt: Any, columns: Sequence[str], rows: List[tuple]) -> None:
+        """Execute a compiled insert for rows given as tuples of columns."""
+        if not rows:
+            return
+        table = stmt.table
+        prepared = self._statements.get(table.name)
+        if prepared is None:
+            dialect = conn.dialect
+            compiled = stmt.compile(dialect=dialect, column_keys=list(columns))
+            names = compiled.positiontup if dialect.positional else list(columns)
+            processors = [table.c[name].type.dialect_impl(dialect).bind_processor(dialect) for name in names]
+            prepared = (compiled.string, [columns.index(name) for name in names], processors, dialect.positional)
+            self._statements[table.name] = prepared
+        sql, order, processors, positional = prepared
+
+        if order != list(range(len(columns))):
+            reorder = operator.itemgetter(*order)
+            rows = [reorder(row) for row in rows]
+        else:
+            rows = list(rows)
+        for index, process in enumerate(processors):
+            if process is None:
+                continue
+            # Values repeat from row to row (timestamps, buckets); convert each once
+            last, converted = None, None
+            for i, row in enumerate(rows):
+                value = row[index]
+                if value is not None:
+                    if value is not last:
+                        last, converted = value, process(value)
+                    rows[i] = row[:index] + (converted,) + row[index + 1:]
+        if not positional:
+            names = [columns[i] for i in order]
+            rows = [dict(zip(names, row)) for row in rows]
+        conn.exec_driver_sql(sql, rows)
+
+    @staticmethod
+    def _conditions(table: Table, filters: Optional[Dict[str, Any]], since: Optional[datetime.datetime],
+                    until: Optional[datetime.datetime], time_column: str = 'timestamp') -> List[Any]:
+        conditions = []
+        for key, value in (filters or {}).items():
+            if key in table.c:
+                conditions.append(table.c[key] == value)
+        if since is not None:
+            conditions.append(table.c[time_column] >= since)
+        if until is not None:
+            conditions.append(table.c[time_column] < until)
+        return conditions
+
+    def query(self, conn: Any, filters: Optional[Dict[str, Any]] = None, limit: Optional[int] = 100,
+              offset: Optional[int] = None, since: Optional[datetime.datetime] = None,
+              until: Optional[datetime.datetime] = None) -> List[Any]:
+        """Get log rows, newest first.
+
+        Args:
+            conn: Database connection
+            filters: Column values to match; unknown columns are ignored
+            limit: Maximum number of rows
+            offset: Number of rows to skip
+            since: Only rows from this time on
+            until: Only rows before this time
+
+        Returns:
+            List of rows with the FirewallLog columns as attributes
+        """
+        rows: List[Any] = []
+        skip = offset or 0
+        for _, table in self.partitions(conn, since, until):
+            conditions = self._conditions(table, filters, since, until)
+            if skip:
+                available = conn.execute(select(func.count()).select_from(table).where(*conditions)).scalar()
+                if available <= skip:
+                    skip -= available
+                    continue
+            stmt = (select(table).where(*conditions)
+                    .order_by(table.c.timestamp.desc(), table.c.id.desc()).offset(skip or None))
+            skip = 0
+            if limit:
+                stmt = stmt.limit(limit - len(rows))
+            rows.extend(conn.execute(stmt).all())
+            if limit and len(rows) >= limit:
+                break
+        return rows
+
+    def page(self, conn: Any, filters: Optional[Dict[str, Any]] = None, limit: int = 50,
+             cursor: Optional[str] = None, since: Optional[datetime.datetime] = None,
+             until: Optional[datetime.datetime] = None) -> Tuple[List[Any], Optional[str]]:
+        """Get a page of log rows, newest first, continuing after a cursor.
+
+        Args:
+            conn: Database connection
+            filters: Column values to match; unknown columns are ignored
+            limit: Number of rows per page
+            cursor: Cursor returned with the previous page (None for the first page)
+            since: Only rows from this time on
+            until: Only rows before this time
+
+        Returns:
+            Tuple of the rows and the cursor of the next page (None on the last page)
+
+        Raises:
+            ValueError: If the cursor is invalid
+        """
+        after = decode_cursor(cursor) if cursor else None
+        # Partitions after the one of the cursor were read by earlier pages
+        last_day = after[0] if after and (until is None or after[0] < until) else until
+        tables = dict(self.partitions(conn, since, last_day))
+        archived = self.archive.days(since, last_day) if self.archive is not None else {}
+        rows: List[Any] = []
+        for day in sorted(tables.keys() | archived.keys(), reverse=True):
+            # One row more than needed tells whether there is a next page
+            needed = limit + 1 - len(rows)
+            day_rows = []
+            table = tables.get(day)
+            if table is not None:
+                conditions = self._conditions(table, filters, since, until)
+                if after:
+                    conditions.append(or_(table.c.timestamp < after[0],
+                                          and_(table.c.timestamp == after[0], table.c.id < after[1])))
+                stmt = (select(table).where(*conditions)
+                        .order_by(table.c.timestamp.desc(), table.c.id.desc()).limit(needed))
+                day_rows = conn.execute(stmt).all()
+            if day in archived:
+                # A day's logs that arrived after it was archived are in both
+                day_rows += self.archive.read(archived[day], filters, needed, since, until, after)
+                day_rows = sorted(day_rows, key=operator.attrgetter('timestamp', 'id'), reverse=True)[:needed]
+            rows.extend(day_rows)
+            if len(rows) > limit:
+                rows = rows[:limit]
+                return rows, encode_cursor(rows[-1].timestamp, rows[-1].id)
+        return rows, None
+
+    def count_by(self, conn: Any, column: str = 'action', filters: Optional[Dict[str, Any]] = None,
+                 since: Optional[datetime.datetime] = None,
+                 until: Optional[datetime.datetime] = None) -> Dict[Any, int]:
+        """Count the raw log rows per value of a column, in one query over all partitions.
+
+        Args:
+            conn: Database connection
+            column: Column to count by, e.g. "action"
+            filters: Column values to match; unknown columns are ignored
+            since: Only rows from this time on
+            until: Only rows before this time
+
+        Returns:
+            Dict[Any, int]: Number of rows per value
+        """
+        if column not in FirewallLog.__table__.c:
+            raise ValueError(f"Cannot count logs by {column}")
+        counts = []
+        for _, table in self.partitions(conn, since, until):
+            counts.append(select(table.c[column].label('value'), func.count().label('count'))
+                          .where(*self._conditions(table, filters, since, until))
+                          .group_by(table.c[column]))
+        if not counts:
+            return {}
+        counts = (union_all(*counts) if len(counts) > 1 else counts[0]).subquery()
+        stmt = select(counts.c.value, func.sum(counts.c['count'])).group_by(counts.c.value)
+        return {value: int(count) for value, count in conn.execute(stmt)}
+
+    def count(self, conn: Any, filters: Optional[Dict[str, Any]] = None,
+              since: Optional[datetime.datetime] = None, until: Optional[datetime.datetime] = None) -> int:
+        """Count the raw log rows matching filters (see query)."""
+        total = 0
+        for _, table in self.partitions(conn, since, until):
+            conditions = self._conditions(table, filters, since, until)
+            total += conn.execute(select(func.count()).select_from(table).where(*conditions)).scalar()
+        return total
+
+    def stats(self, conn: Any, since: Optional[datetime.datetime] = None,
+              until: Optional[datetime.datetime] = None, group_by: Iterable[str] = ('action',),
+              resolution: str = 'hour', filters: Optional[Dict[str, Any]] = None,
+              by_bucket: bool = False, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Get log counts from the rollups.
+
+        Args:
+            conn: Database connection
+            since: Only counts from this time on (rounded down to the resolution)
+            until: Only counts before this time
+            group_by: Rollup dimensions to count by (see ROLLUP_DIMENSIONS)
+            resolution: Read the "minute" or "hour" rollup
+            filters: Dimension values to match; missing protocols and addresses are ''
+            by_bucket: Count per minute or hour, in time order, instead of in total
+            limit: Maximum number of groups; without by_bucket the largest come first
+
+        Returns:
+            List of dictionaries with the group_by values and the count
+        """
+        if resolution not in ROLLUPS:
+            raise ValueError(f"Unknown rollup resolution: {resolution}")
+        table = ROLLUPS[resolution]
+        group_by = list(group_by)
+        unknown = set(group_by) - set(ROLLUP_DIMENSIONS)
+        if unknown:
+            raise ValueError(f"Cannot group log counts by {', '.join(sorted(unknown))}")
+
+        columns = [table.c[name] for name in group_by]
+        if by_bucket:
+            columns.insert(0, table.c.bucket)
+        total = func.sum(table.c['count']).label('count')
+        since = truncate(since, resolution) if since is not None else None
+        stmt = (select(*columns, total)
+                .where(*self._conditions(table, filters, since, until, time_column='bucket'))
+                .group_by(*columns)
+                .order_by(*(columns if by_bucket else [total.desc()] + columns)))
+        if limit:
+            stmt = stmt.limit(limit)
+        return [dict(row._mapping) for row in conn.execute(stmt)]
+
+    def _drop(self, conn: Any, table: Table) -> None:
+        table.drop(conn)
+        self._created.discard(table.name)
+        self._closed.discard(table.name)
+        self._statements.pop(table.name, None)
+        self._tables.pop(table.name, None)
+        self.metadata.remove(table)
+
+    def archive_partition(self, conn: Any, day: datetime.date, batch_size: int = 65536) -> int:
+        """Move the rows of a partition into the archive and drop the partition.
+
+        Args:
+            conn: Database connection; the caller commits
+            day: Day of the partition
+            batch_size: Rows read from the partition at once
+
+        Returns:
+            int: Number of rows archived
+        """
+        table = self._table(partition_name(day))
+        result = conn.execute(select(table.c.id, *(table.c[name] for name in LOG_COLUMNS))
+                              .order_by(table.c.timestamp, table.c.id))
+        archived = self.archive.write(day, iter(lambda: result.fetchmany(batch_size), []))
+        self._drop(conn, table)
+        return archived
+
+    def apply_retention(self, conn: Any, raw_days: Optional[int] = 7, minute_days: Optional[int] = 2,
+                        hour_days: Optional[int] = 90, archive_days: Optional[int] = None,
+                        now: Optional[datetime.datetime] = None) -> Dict[str, int]:
+        """Drop (or archive) old partitions, index closed ones and drop old rollup rows.
+
+        Args:
+            conn: Database connection; the caller commits
+            raw_days: Days of raw logs to keep, including today (None keeps all)
+            minute_days: Days of per-minute counts to keep (None keeps all)
+            hour_days: Days of per-hour counts to keep (None keeps all)
+            archive_days: Days of archived logs to keep (None keeps all)
+            now: Current time
+
+        Returns:
+            Dict[str, int]: Number of partitions dropped, partitions indexed (see
+                close_partitions) and rollup rows deleted, and with an archive the
+                number of rows archived and archive files deleted
+        """
+        now = now or datetime.datetime.now()
+        removed = {'partitions': 0, 'indexed': 0, 'minute': 0, 'hour': 0}
+        if self.archive is not None:
+            removed.update(archived=0, archive_files=0)
+        if raw_days is not None:
+            oldest = now.date() - datetime.timedelta(days=raw_days - 1)
+            for day, table in self.partitions(conn):
+                if day < oldest:
+                    if self.archive is not None:
+                        removed['archived'] += self.archive_partition(conn, day)
+                    else:
+                        self._drop(conn, table)
+                    removed['partitions'] += 1
+                    logger.info(f"Dropped log partition {table.name}")
+        removed['indexed'] = self.close_partitions(conn, now)
+        for resolution, days in (('minute', minute_days), ('hour', hour_days)):
+            if days is not None:
+                table = ROLLUPS[resolution]
+                result = conn.execute(table.delete().where(table.c.bucket < now - datetime.timedelta(days=days)))
+                removed[resolution] = result.rowcount
+        if self.archive is not None and archive_days is not None:
+            oldest = now.date() - datetime.timedelta(days=archive_days - 1)
+            removed['archive_files'] = self.archive.remove_before(oldest)
+        return removed
+
+    def migrate(self, conn: Any, batch_size: int = 10000) -> int:
+        """Move the rows of the unpartitioned firewall_logs table into the partitions.
+
+        Args:
+            conn: Database connection; the caller commits
+            batch_size: Rows moved per step
+
+        Returns:
+            int: Number of rows moved
+        """
+        legacy = FirewallLog.__table__
+        moved = 0
+        while True:
+            rows = conn.execute(select(legacy).order_by(legacy.c.id).limit(batch_size)).mappings().all()
+            if not rows:
+                return moved
+            self.insert(conn, [log_row(row) for row in rows])
+            conn.execute(legacy.delete().where(legacy.c.id <= rows[-1]['id']))
+            moved += len(rows)
@@ -12,6 +12,7 @@ from typing import Dict, List, Optional, Any, Tuple
 
 from ..db.database import Database
 from ..core.packet_filter import PacketFilter
+from ..core.ruleset_compiler import RulesetCompiler
 from ..core.content_filter import ContentFilter
 from ..core.qos import QoS
 from ..scheduler.firewall_scheduler import FirewallScheduler
@@ -30,6 +31,7 @@ class FirewallService:
         self.qos = None
         self.scheduler = None
         self.plugin_manager = None
+        self.ruleset_compiler = RulesetCompiler(optimize=True)
         
         self._initialize_components()
     
@@ -283,24 +285,8 @@ class FirewallService:
                 rule_id = self.db.add_rule(rule_data)
             
             # Apply the rule to the firewall
-            chain = rule_data.get('chain', 'input')
-            action = rule_data.get('action', 'drop')
-            protocol = rule_data.get('protocol')
-            src_ip = rule_data.get('src_ip')
-            dst_ip = rule_data.get('dst_ip')
-            src_port = rule_data.get('src_port')
-            dst_port = rule_data.get('dst_port')
-            
-            if self.packet_filter:
-                self.packet_filter.add_rule(
-                    chain=chain,
-                    action=action,
-                    protocol=protocol,
-                    src_ip=src_ip,
-                    dst_ip=dst_ip,
-                    src_port=src_port,
-                    dst_port=dst_port
-                )
+            if rule_id is not None:
+                self.sync_rules()
             
             return rule_id
         except Exception as e:
@@ -323,8 +309,9 @@ class FirewallService:
             if self.db:
                 success = self.db.update_rule(rule_id, rule_data)
             
-            # Apply the change to the firewall
-            # In practice, you'd need to delete the old rule and add the new one
+            # Apply the change to the firewall, replacing only the changed rule
+            if success:
+                self.sync_rules()
             
             return success
         except Exception as e:
@@ -341,28 +328,39 @@ class FirewallService:
             bool: True if successful, False otherwise
         """
         try:
-            # Get the rule before deleting it
-            rule = None
-            if self.db:
-                rules = self.db.get_rules({"id": rule_id})
-                if rules:
-                    rule = rules[0]
-            
             # Delete the rule from the database
             success = False
             if self.db:
                 success = self.db.delete_rule(rule_id)
             
             # Remove the rule from the firewall
-            if rule and self.packet_filter:
-                # In practice, you'd need to identify the rule in nftables and delete it
-                pass
+            if success:
+                self.sync_rules()
             
             return success
         except Exception as e:
             logger.error(f"Failed to delete rule {rule_id}: {e}")
             return False
     
+    def sync_rules(self) -> bool:
+        """Synchronize the live nftables ruleset with the database rules.
+        
+        Only the rules that changed are added, replaced or deleted, in a
+        single transaction.
+        
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        if not self.db or not self.packet_filter:
+            return False
+        
+        try:
+            success, _ = self.ruleset_compiler.sync(self.packet_filter, self.db.get_rules())
+            return success
+        except Exception as e:
+            logger.error(f"Failed to synchronize firewall rules: {e}")
+            return False
+    
     def get_content_filter_categories(self) -> List[Dict[str, Any]]:
         """Get a list of content filter categories.
         
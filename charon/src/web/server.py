@@ -10,10 +10,13 @@ import json
 import logging
 import datetime
 import hashlib
+import ipaddress
+import socket
 from functools import wraps
 import secrets
 import platform
 import uuid
+from types import SimpleNamespace
 from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash, abort, current_app, make_response, send_file
 import sys
 import random
@@ -22,6 +25,7 @@ import time
 import subprocess
 import re
 from typing import Dict, List, Optional, Tuple, Union
+from urllib.parse import urljoin, urlparse
 
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -41,6 +45,43 @@ except ImportError as e:
     db_import_error = str(e)
     print(f"Warning: Database module could not be imported: {e}. Using mock data.")
 
+try:
+    from src.core.packet_filter import PacketFilter
+    from src.core.ruleset_compiler import RulesetCompiler
+except ImportError as e:
+    PacketFilter = None
+    RulesetCompiler = None
+    print(f"Warning: Packet filter module could not be imported: {e}. Rule changes will not be applied.")
+
+try:
+    from src.core.rule_evaluator import RuleEvaluator
+    from src.core.rule_analyzer import RuleAnalyzer, shared_analysis
+except ImportError as e:
+    RuleEvaluator = None
+    RuleAnalyzer = None
+    shared_analysis = None
+    print(f"Warning: Rule analysis modules could not be imported: {e}. Rule simulation and analysis will be unavailable.")
+
+try:
+    from src.core.content_filter import ContentFilter
+except ImportError as e:
+    ContentFilter = None
+    print(f"Warning: Content filter module could not be imported: {e}. Blocklist imports will be unavailable.")
+
+try:
+    from src.core.qos import QoS
+    from src.core.qos_stats import shared_collector
+except ImportError as e:
+    QoS = None
+    shared_collector = None
+    print(f"Warning: QoS statistics module could not be imported: {e}. Live QoS statistics will be unavailable.")
+
+try:
+    from src.core.syslog_reader import SyslogReader
+except ImportError as e:
+    SyslogReader = None
+    print(f"Warning: Syslog reader module could not be imported: {e}. System log fallback will be unavailable.")
+
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger('charon.web')
@@ -127,6 +168,58 @@ if Database is not None:
         logger.error(f"Database initialization error: {e}")
         db = None
 
+# Live ruleset synchronization, created on first use
+packet_filter = None
+ruleset_compiler = RulesetCompiler(optimize=True) if RulesetCompiler is not None else None
+
+def apply_rule_changes():
+    """Synchronize the live nftables ruleset with the rules in the database.
+    
+    Only the rules that were added, changed or removed are touched.
+    """
+    global packet_filter
+    if not db or ruleset_compiler is None or platform.system() != 'Linux':
+        return False
+    
+    try:
+        if packet_filter is None:
+            packet_filter = PacketFilter()
+        success, _ = ruleset_compiler.sync(packet_filter, db.get_rules())
+        return success
+    except Exception as e:
+        logger.error(f"Error applying rule changes to firewall: {e}")
+        return False
+
+# Content filter block list, opened on first use
+content_filter_store = None
+
+def get_content_filter():
+    """Get the ContentFilter holding the imported block lists, or None if unavailable."""
+    global content_filter_store
+    if content_filter_store is None and ContentFilter is not None:
+        content_filter_store = ContentFilter(os.environ.get('CHARON_CONTENT_FILTER_DB'))
+    return content_filter_store
+
+# Interface whose QoS class statistics are collected, detected on first use
+qos_interface = None
+
+def get_qos_stats():
+    """Get the background collector of QoS class statistics, or None if unavailable.
+    
+    The collector samples tc in its own thread; pages and API calls only read
+    its in-memory history.
+    """
+    global qos_interface
+    if shared_collector is None or platform.system() != 'Linux':
+        return None
+    try:
+        if qos_interface is None:
+            qos_interface = os.environ.get('CHARON_QOS_INTERFACE') or QoS().interface
+        return shared_collector(qos_interface)
+    except Exception as e:
+        logger.error(f"Error starting QoS statistics collector: {e}")
+        return None
+
 # User management
 USERS_FILE = os.path.join(os.path.dirname(__file__), 'users.json')
 
@@ -397,10 +490,18 @@ def get_network_stats():
             'interfaces': {}
         }
 
+# Pages of the firewall lines of the system log, with their checkpoints kept in the data directory
+syslog_reader = None
+if SyslogReader is not None:
+    syslog_reader = SyslogReader(os.environ.get('CHARON_SYSLOG_INDEX_PATH', os.path.join(
+        os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'data', 'syslog_index.json')))
+
 def parse_firewall_logs(limit=10, offset=0, log_type=None):
-    """Parse firewall logs from system log files."""
+    """Parse a page of firewall logs from the system log files, newest first."""
     try:
-        logs = []
+        if syslog_reader is None:
+            return []
+        
         # Try to read from syslog or kern.log
         log_paths = ['/var/log/syslog', '/var/log/kern.log', '/var/log/messages']
         
@@ -413,38 +514,24 @@ def parse_firewall_logs(limit=10, offset=0, log_type=None):
                 f"{host_log_path}/messages"
             ])
         
-        # Try each log file until we find one that exists
+        # Try each log file until we find one with firewall logs; the reader only
+        # reads the lines of the page (and its rotations, e.g. syslog.1, after it)
         for log_file in log_paths:
             if os.path.exists(log_file):
-                with open(log_file, 'r') as f:
-                    # Read the entire file and filter for firewall related lines
-                    lines = f.readlines()
-                    firewall_lines = [line for line in lines if 'IN=' in line and ('DROP' in line or 'ACCEPT' in line)]
-                    
-                    # Apply log type filter if specified
-                    if log_type:
-                        if log_type.lower() == 'error':
-                            firewall_lines = [line for line in firewall_lines if 'DROP' in line]
-                        elif log_type.lower() == 'info':
-                            firewall_lines = [line for line in firewall_lines if 'ACCEPT' in line]
+                logs = []
+                for i, line in enumerate(syslog_reader.page(log_file, offset, limit, log_type)):
+                    parts = line.split()
+                    timestamp = ' '.join(parts[0:3]) if len(parts) >= 3 else 'Unknown'
                     
-                    # Apply pagination
-                    paginated_lines = firewall_lines[offset:offset+limit]
+                    log_entry = {
+                        'id': offset + i + 1,
+                        'timestamp': timestamp,
+                        'type': 'error' if 'DROP' in line else 'info',
+                        'source': 'firewall',
+                        'message': line.strip()
+                    }
                     
-                    # Parse each line
-                    for i, line in enumerate(paginated_lines):
-                        parts = line.split()
-                        timestamp = ' '.join(parts[0:3]) if len(parts) >= 3 else 'Unknown'
-                        
-                        log_entry = {
-                            'id': offset + i + 1,
-                            'timestamp': timestamp,
-                            'type': 'error' if 'DROP' in line else 'info',
-                            'source': 'firewall',
-                            'message': line.strip()
-                        }
-                        
-                        logs.append(log_entry)
+                    logs.append(log_entry)
                 
                 # If we found logs, return them
                 if logs:
@@ -593,6 +680,20 @@ def get_recent_logs(limit=10, page=1, log_type=None):
     logger.warning("No logs available. Database connection required.")
     return []
 
+def get_log_timeline(hours=24):
+    """Get hourly firewall log counts per action from the log rollups."""
+    start = (datetime.now() - timedelta(hours=hours - 1)).replace(minute=0, second=0, microsecond=0)
+    buckets = [start + timedelta(hours=i) for i in range(hours)]
+    timeline = {'labels': [bucket.strftime('%H:%M') for bucket in buckets], 'actions': {}}
+    
+    if db and hasattr(db, 'get_log_stats'):
+        index = {bucket: i for i, bucket in enumerate(buckets)}
+        for row in db.get_log_stats(since=start, group_by=('action',), by_bucket=True):
+            counts = timeline['actions'].setdefault(row['action'], [0] * hours)
+            if row['bucket'] in index:
+                counts[index[row['bucket']]] = row['count']
+    return timeline
+
 # Routes
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -708,6 +809,13 @@ def dashboard():
             logger.error(f"Error getting logs: {e}")
             recent_logs = []
         
+        # Get hourly log counts for the chart
+        try:
+            log_timeline = get_log_timeline()
+        except Exception as e:
+            logger.error(f"Error getting log timeline: {e}")
+            log_timeline = None
+        
         # Get network stats with error handling
         network_stats = system_status.get('network_stats', {})
         
@@ -816,6 +924,7 @@ def dashboard():
                               status=status,
                               recent_logs=recent_logs,
                               logs=logs,
+                              log_timeline=log_timeline,
                               rule_status=rule_status, 
                               network_stats=network_stats,
                               username=username, 
@@ -994,13 +1103,14 @@ def firewall_rules():
     # Return empty rules list instead of generating mock data
     if not rules:
         logger.warning("No rules found. Database connection required.")
+
     
     # Get username from session with fallback to user_id
     username = session.get('username', session.get('user_id', 'admin'))
     role = session.get('role', 'user')
     
     return render_template('firewall_rules.html', rules=rules, page=page, total_pages=total_pages,
-                          username=username, role=role,
+                          username=username, role=role, rule_analysis=db is not None and RuleAnalyzer is not None,
                           using_mock_data=using_mock_data, current_app=current_app)
 
 @app.route('/content_filter')
@@ -1099,6 +1209,22 @@ def qos():
         using_mock_data = True
         logger.warning("No database connection for QoS")
     
+    # Live statistics are read from the collector's memory, never from tc
+    class_stats = {}
+    bandwidth_usage = 0
+    throttled_traffic = 0
+    collector = get_qos_stats() if enabled else None
+    if collector is not None:
+        class_stats = collector.latest()
+        roots = [stats for stats in class_stats.values()
+                 if stats.get('parent') == 'root' and stats.get('bytes_per_sec') is not None]
+        uplink_mbps = float(db.get_config('qos', 'uplink_speed', '1000')) if db else 1000.0
+        bits_per_sec = sum(stats['bytes_per_sec'] for stats in roots) * 8
+        bandwidth_usage = round(100 * bits_per_sec / (uplink_mbps * 1e6), 1)
+        packets = sum(stats['packets_per_sec'] for stats in roots)
+        if packets:
+            throttled_traffic = round(100 * sum(stats['overlimits_per_sec'] for stats in roots) / packets, 1)
+    
     # Get applications with pagination
     per_page = 10
     page = request.args.get('page', 1, type=int)
@@ -1132,6 +1258,8 @@ def qos():
     
     return render_template('qos.html', enabled=enabled, classes=classes, 
                           applications=apps, page=page, total_pages=total_pages,
+                          class_stats=class_stats, bandwidth_usage=bandwidth_usage,
+                          throttled_traffic=throttled_traffic,
                           current_class=class_id, search=search,
                           username=username, role=role,
                           using_mock_data=using_mock_data, current_app=current_app)
@@ -1143,29 +1271,32 @@ def logs():
     using_mock_data = False
     logs = []
     total_entries = 0
-    log_stats = {
-        'total': 0,
-        'error': 0,
-        'warning': 0,
-        'info': 0
-    }
+    log_stats = {'total': 0}
+    next_cursor = None
     
     per_page = 50
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     log_type = request.args.get('type', 'all')
     
     if db:
         try:
-            logs = get_recent_logs(limit=per_page, page=page, log_type=log_type)
+            # Pages continue after the cursor of the previous one instead of an offset
+            db_logs, next_cursor = db.get_logs_page(log_type=log_type, limit=per_page, cursor=cursor)
+            for log in db_logs:
+                entry = dict(log._mapping)
+                entry['timestamp'] = entry['timestamp'].strftime('%Y-%m-%d %H:%M:%S')
+                logs.append(entry)
             
-            # Count total entries for pagination
-            total_entries = db.count_logs(log_type=log_type if log_type != 'all' else None)
-            log_stats = {
-                'total': total_entries,
-                'error': db.count_logs(log_type='error'),
-                'warning': db.count_logs(log_type='warning'),
-                'info': db.count_logs(log_type='info')
-            }
+            # Count the logs of every action from the hourly rollups instead of the raw
+            # partitions; partitions hold whole days, so the counts cover the same rows
+            log_stats = {}
+            log_days = db.get_log_days()
+            if log_days:
+                since = datetime.datetime.combine(log_days[-1], datetime.time())
+                for row in db.get_log_stats(since=since, group_by=('action',), resolution='hour'):
+                    log_stats[row['action']] = row['count']
+            log_stats['total'] = sum(log_stats.values())
+            total_entries = log_stats['total'] if log_type == 'all' else log_stats.get(log_type, 0)
         except Exception as e:
             logger.error(f"Error getting logs data: {e}")
             using_mock_data = True
@@ -1173,14 +1304,11 @@ def logs():
         using_mock_data = True
         logger.warning("No database connection for logs")
     
-    # Calculate total pages
-    total_pages = (total_entries + per_page - 1) // per_page if total_entries > 0 else 1
-    
     # Get username from session with fallback to user_id
     username = session.get('username', session.get('user_id', 'admin'))
     role = session.get('role', 'user')
     
-    return render_template('logs.html', logs=logs, page=page, total_pages=total_pages, 
+    return render_template('logs.html', logs=logs, cursor=cursor, next_cursor=next_cursor,
                           log_stats=log_stats, log_type=log_type, total_entries=total_entries,
                           username=username, role=role,
                           using_mock_data=using_mock_data, current_app=current_app)
@@ -1266,6 +1394,21 @@ def api_status():
     status = get_system_status()
     return jsonify(status)
 
+@app.route('/api/qos/stats')
+@login_required
+def api_qos_stats():
+    """API endpoint to get live per-class QoS statistics from memory."""
+    collector = get_qos_stats()
+    if collector is None:
+        return jsonify({'error': 'QoS statistics are not available'}), 503
+    
+    result = {'interface': collector.interface, 'classes': collector.latest()}
+    handle = request.args.get('class')
+    if handle:
+        result['history'] = collector.history(handle, request.args.get('resolution', '1s'),
+                                              request.args.get('since', type=float))
+    return jsonify(result)
+
 @app.route('/api/content_filter/toggle', methods=['POST'])
 @login_required
 def api_content_filter_toggle():
@@ -1423,6 +1566,115 @@ def api_content_filter_categories():
         logger.error(f"Error managing categories: {e}")
         return jsonify({'error': str(e)}), 500
 
+def import_blocklist(source, category_id):
+    """Import a blocklist into a content filter category and update its domain count.
+    
+    Args:
+        source: A file path, file object or iterable of lines
+        category_id: ID of the category in the content filter configuration
+    
+    Returns:
+        A Flask response tuple
+    """
+    categories = json.loads(db.get_config('content_filter', 'categories', '[]'))
+    for category in categories:
+        if str(category.get('id')) == str(category_id):
+            break
+    else:
+        return jsonify({'success': False, 'error': 'Category not found'}), 404
+    
+    store = get_content_filter()
+    if store is None:
+        return jsonify({'success': False, 'error': 'Content filter not available'}), 500
+    
+    name = category['name'].lower()
+    stats = store.import_blocklist(source, name)
+    if stats['lines'] == 0 and stats['imported'] == 0:
+        return jsonify({'success': False, 'error': 'No domains could be imported'}), 400
+    
+    category['count'] = store.count_domains(name)
+    db.set_config('content_filter', 'categories', json.dumps(categories))
+    return jsonify({'success': True, 'imported': stats['imported'], 'skipped': stats['skipped'],
+                    'lines': stats['lines']}), 200
+
+@app.route('/api/content_filter/import/file', methods=['POST'])
+@login_required
+def api_content_filter_import_file():
+    """API endpoint to import an uploaded hosts, AdBlock or plain domain list."""
+    if not db:
+        return jsonify({'error': 'Database not connected'}), 500
+    
+    upload = request.files.get('file')
+    if upload is None or not upload.filename:
+        return jsonify({'success': False, 'error': 'No file uploaded'}), 400
+    
+    try:
+        # The upload is streamed line by line, never read into memory
+        return import_blocklist(upload.stream, request.form.get('category_id'))
+    except Exception as e:
+        logger.error(f"Error importing blocklist file: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+# Redirects followed when downloading a blocklist, each checked like the URL itself
+MAX_BLOCKLIST_REDIRECTS = 5
+
+def blocklist_url_error(url):
+    """Check that a blocklist URL is http(s) and only resolves to public addresses.
+    
+    Args:
+        url: The URL to check
+    
+    Returns:
+        An error message, or None if the URL may be downloaded
+    """
+    if not re.match(r'^https?://', url):
+        return 'A http(s) URL is required'
+    try:
+        host = urlparse(url).hostname
+        if not host:
+            return 'The URL has no host'
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, None)}
+    except (ValueError, OSError) as e:
+        return f'Cannot resolve the URL host: {e}'
+    for address in addresses:
+        # Drop the scope of IPv6 link-local addresses ("fe80::1%eth0")
+        ip = ipaddress.ip_address(address.split('%')[0])
+        if not ip.is_global or ip.is_multicast:
+            return f'Downloads from {host} ({ip}) are not allowed: not a public address'
+    return None
+
+@app.route('/api/content_filter/import/url', methods=['POST'])
+@login_required
+def api_content_filter_import_url():
+    """API endpoint to download and import a hosts, AdBlock or plain domain list."""
+    if not db:
+        return jsonify({'error': 'Database not connected'}), 500
+    
+    # The server downloads the URL, so only admins may point it somewhere
+    if session.get('role') != 'admin':
+        return jsonify({'success': False, 'error': 'Access denied'}), 403
+    
+    data = request.json or {}
+    url = data.get('url', '')
+    
+    try:
+        import requests
+        for _ in range(MAX_BLOCKLIST_REDIRECTS + 1):
+            error = blocklist_url_error(url)
+            if error:
+                return jsonify({'success': False, 'error': error}), 400
+            with requests.get(url, stream=True, timeout=30, allow_redirects=False) as response:
+                if response.is_redirect:
+                    url = urljoin(url, response.headers['Location'])
+                    continue
+                response.raise_for_status()
+                response.raw.decode_content = True
+                return import_blocklist(response.raw, data.get('category_id'))
+        return jsonify({'success': False, 'error': 'Too many redirects'}), 400
+    except Exception as e:
+        logger.error(f"Error importing blocklist from {url}: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/api/qos/toggle', methods=['POST'])
 @login_required
 def api_qos_toggle():
@@ -1501,6 +1753,64 @@ def api_get_rule(rule_id):
         logger.error(f"Error getting rule {rule_id} from database: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/rules/simulate', methods=['POST'])
+@login_required
+@csrf_exempt
+def api_simulate_rules():
+    """API endpoint to evaluate flows against the firewall rules without applying anything.
+
+    The request body holds a single flow, or {"flows": [...]}. Each flow has
+    chain, protocol, src_ip, dst_ip, src_port and dst_port. An optional
+    "rules" list evaluates a proposed ruleset instead of the stored one.
+    """
+    if RuleEvaluator is None:
+        return jsonify({'error': 'Rule evaluator not available'}), 500
+
+    try:
+        data = request.json or {}
+        flows = data['flows'] if 'flows' in data else [data]
+        if not isinstance(flows, list):
+            return jsonify({'error': 'flows must be a list'}), 400
+
+        if 'rules' in data:
+            rules = [SimpleNamespace(
+                id=rule.get('id', index + 1),
+                chain=rule.get('chain'),
+                action=rule.get('action'),
+                protocol=rule.get('protocol'),
+                src_ip=rule.get('src_ip'),
+                dst_ip=rule.get('dst_ip'),
+                src_port=rule.get('src_port'),
+                dst_port=rule.get('dst_port'),
+                enabled=rule.get('enabled', True)
+            ) for index, rule in enumerate(data['rules'])]
+        elif db:
+            rules = db.get_rules()
+        else:
+            return jsonify({'error': 'Database connection required'}), 500
+
+        evaluator = RuleEvaluator(rules)
+        results = [verdict._asdict() for verdict in evaluator.evaluate(flows)]
+        return jsonify({'success': True, 'results': results})
+    except Exception as e:
+        logger.error(f"Error simulating rules: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/rules/analysis')
+@login_required
+def api_rules_analysis():
+    """API endpoint listing shadowed, redundant and correlated firewall rules."""
+    if not db:
+        return jsonify({'error': 'Database connection required'}), 500
+    if RuleAnalyzer is None:
+        return jsonify({'error': 'Rule analyzer not available'}), 500
+
+    try:
+        return jsonify(shared_analysis.report(db))
+    except Exception as e:
+        logger.error(f"Error analyzing firewall rules: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/logs')
 @login_required
 def api_logs():
@@ -1961,6 +2271,7 @@ def api_create_rule():
         rule_id = db.add_rule(rule_data)
         
         if rule_id:
+            apply_rule_changes()
             return jsonify({'success': True, 'id': rule_id})
         else:
             return jsonify({'error': 'Failed to create rule'}), 500
@@ -2005,6 +2316,7 @@ def api_update_rule(rule_id):
         success = db.update_rule(rule_id, rule_data)
         
         if success:
+            apply_rule_changes()
             return jsonify({'success': True})
         else:
             return jsonify({'error': 'Rule not found or update failed'}), 404
@@ -2026,6 +2338,7 @@ def api_delete_rule(rule_id):
         success = db.delete_rule(rule_id)
         
         if success:
+            apply_rule_changes()
             return jsonify({'success': True})
         else:
             return jsonify({'error': 'Rule not found or delete failed'}), 404
@@ -2057,6 +2370,7 @@ def api_toggle_rule(rule_id):
         success = db.update_rule(rule_id, {'enabled': new_status})
         
         if success:
+            apply_rule_changes()
             return jsonify({'success': True, 'enabled': new_status})
         else:
             return jsonify({'error': 'Failed to update rule status'}), 500
@@ -0,0 +1,103 @@
+"""
+Tests for the blocklist snapshot module.
+"""
+
+import os
+import random
+import tempfile
+
+import pytest
+
+from charon.src.core.blocklist_snapshot import BlocklistSnapshot, open_snapshot, snapshot_key, write_snapshot
+from charon.src.core.domain_index import DomainIndex
+
+
+def build(path, domains):
+    return write_snapshot(path, sorted(snapshot_key(domain) for domain in domains))
+
+
+def test_lookups_match_domain_index():
+    """Test snapshot lookups against the in-memory index on random names."""
+    rng = random.Random(3)
+    labels = ['a', 'b', 'ads', 'cdn', 'x-1', 'example', 'com', 'net']
+
+    def name(depth):
+        return '.'.join(rng.choice(labels) for _ in range(depth))
+
+    domains = set()
+    for _ in range(300):
+        domain = name(rng.randint(1, 4))
+        domains.add('*.' + domain if rng.random() < 0.3 else domain)
+    index = DomainIndex.from_rows((domain, 'ads', True) for domain in domains)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'test.blocklist')
+        assert build(path, list(domains) + list(domains)[:10]) == len(domains)
+        snapshot = BlocklistSnapshot(path)
+
+        assert sorted(snapshot.domains()) == sorted(domains)
+        for _ in range(3000):
+            query = name(rng.randint(1, 5))
+            assert snapshot.is_blocked(query) == index.is_blocked(query), query
+        assert snapshot.is_blocked('https://www.ADS.example.com/x') == index.is_blocked('ads.example.com')
+
+
+def test_refresh_after_rebuild():
+    """Test that a rebuilt snapshot replaces the file without disturbing readers."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'test.blocklist')
+        build(path, ['old.example.com', '*.tracker.net'])
+        snapshot = BlocklistSnapshot(path)
+        previous = BlocklistSnapshot(path)
+        assert snapshot.refresh() is False
+
+        build(path, ['new.example.com'])
+        assert snapshot.is_blocked('old.example.com') is True
+        assert snapshot.refresh() is True
+        assert snapshot.is_blocked('old.example.com') is False
+        assert snapshot.is_blocked('new.example.com') is True
+        assert len(snapshot) == 1
+
+        # A reader that has not refreshed still sees the file it mapped
+        assert previous.is_blocked('a.tracker.net') is True
+        assert [name for name in os.listdir(temp_dir)] == ['test.blocklist']
+
+
+def test_invalid_files():
+    """Test empty snapshots, missing files and unsorted input."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'test.blocklist')
+        assert open_snapshot(path) is None
+
+        build(path, [])
+        assert BlocklistSnapshot(path).is_blocked('example.com') is False
+
+        with pytest.raises(ValueError):
+            write_snapshot(path, [b'b\x00', b'a\x00'])
+        assert BlocklistSnapshot(path).is_blocked('example.com') is False
+
+        with open(path, 'wb') as f:
+            f.write(b'not a snapshot' * 4)
+        assert open_snapshot(path) is None
+
+
+def test_snapshot_shards():
+    """Test that the manifest selects which category snapshots are used."""
+    from charon.src.core.blocklist_snapshot import SnapshotShards, shard_path, write_manifest
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        with pytest.raises(OSError):
+            SnapshotShards(temp_dir)
+
+        build(shard_path(temp_dir, 'ads'), ['ads.example.com'])
+        build(shard_path(temp_dir, 'odd/name'), ['*.tracker.net'])
+        write_manifest(temp_dir, ['ads'])
+        shards = SnapshotShards(temp_dir)
+        assert shards.is_blocked('ads.example.com') is True
+        assert shards.is_blocked('a.tracker.net') is False
+
+        write_manifest(temp_dir, ['ads', 'odd/name', 'missing'])
+        assert shards.refresh() is True
+        assert shards.is_blocked('a.tracker.net') is True
+        assert len(shards) == 2
+        assert shards.refresh() is False
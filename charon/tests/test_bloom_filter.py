@@ -0,0 +1,45 @@
+"""
+Tests for the Bloom filter module.
+"""
+
+import os
+import tempfile
+
+import pytest
+
+from charon.src.core.bloom_filter import BloomFilter
+
+
+def test_false_positive_rate():
+    """Test that added keys are always found and others rarely."""
+    bloom = BloomFilter(5000, 0.01)
+    keys = [f"blocked{i}.example.com".encode() for i in range(5000)]
+    for key in keys:
+        bloom.add(key)
+
+    assert all(key in bloom for key in keys)
+    false_positives = sum(f"allowed{i}.example.org".encode() in bloom for i in range(20000))
+    assert false_positives / 20000 < 0.02
+
+
+def test_save_and_load():
+    """Test that a saved filter gives the same answers."""
+    bloom = BloomFilter(100, 0.001)
+    bloom.add(b'example.com')
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'test.bloom')
+        bloom.save(path)
+        loaded = BloomFilter.load(path)
+
+        assert (loaded.size, loaded.hashes, loaded.count, loaded.fp_rate) == (bloom.size, bloom.hashes, 1, 0.001)
+        assert b'example.com' in loaded
+        assert loaded.bits == bloom.bits
+
+        with open(path, 'r+b') as f:
+            f.truncate(40)
+        with pytest.raises(ValueError):
+            BloomFilter.load(path)
+
+    with pytest.raises(ValueError):
+        BloomFilter(100, 1.5)
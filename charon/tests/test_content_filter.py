@@ -4,9 +4,13 @@ Tests for the content_filter module.
 
 import pytest
 import os
+import json
 import tempfile
 import platform
+import time
 from unittest.mock import patch, MagicMock
+from charon.src.core.blocklist_snapshot import write_snapshot
+from charon.src.core.bloom_filter import BloomFilter
 from charon.src.core.content_filter import ContentFilter
 
 
@@ -211,6 +215,8 @@ def test_get_domains():
         
         category2_domains = content_filter.get_domains_by_category('Category 2')
         assert len(category2_domains) == 1
+        assert content_filter.count_domains('Category 1') == 2
+        assert content_filter.count_domains('Category 3') == 0
 
 
 def test_is_domain_blocked():
@@ -257,37 +263,30 @@ def test_get_blocked_domains():
         assert 'disabled1.com' not in domains
 
 
-@patch('subprocess.run')
-@patch('platform.system', return_value='Linux')
-def test_apply_to_nftables(mock_platform, mock_run):
+def test_apply_to_nftables():
     """Test applying filters to nftables (Linux)."""
+    from charon.src.core.nft_backend import MockBackend
+
     with tempfile.TemporaryDirectory() as temp_dir:
         db_path = os.path.join(temp_dir, 'test.db')
         content_filter = ContentFilter(db_path)
         
-        # Configure mock
-        mock_run.return_value = MagicMock(returncode=0)
-        
         # Test with empty domains list
         result = content_filter._apply_to_nftables([], 'test-table')
         assert result is False
         
-        # Test with domains
-        domains = ['example1.com', 'example2.com']
-        result = content_filter._apply_to_nftables(domains, 'test-table')
+        # Without a readable set, it is created and filled in one transaction
+        backend = MockBackend()
+        with patch('charon.src.core.packet_filter.get_backend', return_value=backend):
+            result = content_filter._apply_to_nftables(['example1.com', 'example2.com'], 'test-table')
         
-        # Verify result
         assert result is True
-        
-        # Check that subprocess.run was called multiple times
-        assert mock_run.call_count >= 3
-        
-        # Verify command structure for nftables
-        for call in mock_run.call_args_list:
-            args = call[0][0]
-            if len(args) > 3 and args[0] == 'nft':
-                # Should be a valid nftables command
-                assert args[1] in ['add', 'delete']
+        assert backend.commands == [
+            ('cmd', 'list set inet test-table blocked_domains'),
+            ('script', (
+                "add set inet test-table blocked_domains { type string; flags interval; auto-merge; }\n"
+                "flush set inet test-table blocked_domains\n"
+                "add element inet test-table blocked_domains { example1.com, example2.com }\n"))]
 
 
 @patch('subprocess.run')
@@ -388,4 +387,335 @@ def test_get_connection():
             # Should return None for invalid path if directory creation fails
             with patch('os.makedirs', side_effect=PermissionError):
                 conn = content_filter._get_connection()
-                assert conn is None 
\ No newline at end of file
+                assert conn is None 
+
+def test_import_blocklist_formats():
+    """Test importing a mixed hosts, AdBlock and plain blocklist."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = os.path.join(temp_dir, 'test.db')
+        list_path = os.path.join(temp_dir, 'list.txt')
+        with open(list_path, 'w') as f:
+            f.write("# hosts preamble\n"
+                    "127.0.0.1 localhost\n"
+                    "0.0.0.0 ads.example.com tracker.example.com # inline comment\n"
+                    "! AdBlock comment\n"
+                    "||adnet.example.org^$third-party\n"
+                    "@@||allowed.example.org^\n"
+                    "example.net##.banner\n"
+                    "WWW.Plain.Example.COM\n"
+                    "ads.example.com\n"
+                    "not a domain\n")
+        content_filter = ContentFilter(db_path)
+
+        progress = []
+        stats = content_filter.import_blocklist(list_path, "ads", batch_size=4,
+                                                progress=lambda lines, imported: progress.append(lines))
+
+        assert stats['lines'] == 10
+        assert set(content_filter.get_domains_by_category("ads")) == {
+            'ads.example.com', 'tracker.example.com', 'adnet.example.org',
+            '*.adnet.example.org', 'plain.example.com'
+        }
+        assert stats['imported'] == 5
+        assert progress == [4, 8, 10]
+        assert content_filter.is_domain_blocked("cdn.adnet.example.org") is True
+        assert content_filter.is_domain_blocked("localhost") is False
+        assert content_filter.is_domain_blocked("allowed.example.org") is False
+
+
+def test_import_blocklist_stream():
+    """Test importing from a binary stream into a new category."""
+    import io
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = os.path.join(temp_dir, 'test.db')
+        content_filter = ContentFilter(db_path)
+        content_filter.add_domain("one.example.com", "ads")
+
+        stream = io.BytesIO(b"one.example.com\ntwo.example.com\ntwo.example.com\n")
+        stats = content_filter.import_blocklist(stream, "custom")
+
+        # The existing domain moves to the new category; the duplicate is ignored
+        assert stats['imported'] == 2
+        assert sorted(content_filter.get_domains_by_category("custom")) == ['one.example.com', 'two.example.com']
+        assert any(c['name'] == 'custom' and c['enabled'] for c in content_filter.get_categories())
+
+        # Importing the same list again changes nothing
+        stats = content_filter.import_blocklist([b"one.example.com\n", "two.example.com\n"], "custom")
+        assert stats['imported'] == 0
+
+        # A progress callback using the content filter cannot discard the import
+        results = []
+        stats = content_filter.import_blocklist(
+            [b"three.example.com\n"], "custom",
+            progress=lambda lines, imported: results.append(content_filter.add_domain("four.example.com", "ads")))
+        assert stats['imported'] == 1 and results == [False]
+        assert content_filter.count_domains("custom") == 3
+
+
+def test_domain_index_sync():
+    """Test that lookups follow domain and category changes without SQL."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = os.path.join(temp_dir, 'test.db')
+        content_filter = ContentFilter(db_path)
+        content_filter.add_domain('example.com', 'ads')
+        content_filter.add_domain('*.tracker.net', 'ads')
+        content_filter.add_domain('casino.com', 'gambling')
+
+        # The first lookup loads the index; later ones must not touch the database
+        assert content_filter.is_domain_blocked('https://www.Example.com/page') is True
+        with patch.object(content_filter, '_get_connection', side_effect=AssertionError):
+            assert content_filter.is_domain_blocked('a.b.tracker.net') is True
+            assert content_filter.is_domain_blocked('tracker.net') is False
+            assert content_filter.is_domain_blocked('casino.com') is True
+
+        content_filter.enable_category('gambling', False)
+        assert content_filter.is_domain_blocked('casino.com') is False
+
+        # Moving a domain to a disabled category unblocks it
+        content_filter.add_domain('example.com', 'gambling')
+        assert content_filter.is_domain_blocked('example.com') is False
+        content_filter.enable_category('gambling', True)
+        assert content_filter.is_domain_blocked('example.com') is True
+
+        content_filter.remove_domain('*.tracker.net')
+        assert content_filter.is_domain_blocked('a.tracker.net') is False
+
+        # Domains of a category created later are blocked once it exists
+        content_filter.add_domain('new.example.org', 'custom')
+        assert content_filter.is_domain_blocked('new.example.org') is False
+        content_filter.add_category('custom', 'Custom category', True)
+        assert content_filter.is_domain_blocked('new.example.org') is True
+
+        content_filter.import_blocklist(["||imported.example.net^\n"], 'imported')
+        assert content_filter.is_domain_blocked('cdn.imported.example.net') is True
+
+        # A fresh index built from the database agrees
+        content_filter.reload_index()
+        assert content_filter.is_domain_blocked('example.com') is True
+        assert content_filter.is_domain_blocked('a.tracker.net') is False
+        assert content_filter.is_domain_blocked('new.example.org') is True
+
+
+def test_snapshot_lookups():
+    """Test lookups from the memory-mapped snapshot shared between processes."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = os.path.join(temp_dir, 'test.db')
+        writer = ContentFilter(db_path)
+        writer.add_domain('example.com', 'ads')
+        writer.add_domain('*.tracker.net', 'ads')
+        writer.add_domain('casino.com', 'gambling')
+
+        reader = ContentFilter(db_path, use_snapshot=True)
+        assert reader.is_domain_blocked('example.com') is True
+        assert reader.is_domain_blocked('a.tracker.net') is True
+        assert os.path.exists(reader.snapshot_path)
+        assert reader._index is None
+
+        # Changes made by another ContentFilter rebuild the snapshot
+        writer.enable_category('gambling', False)
+        writer.remove_domain('example.com')
+        writer.flush()
+        reader._snapshot_checked = 0.0
+        assert reader.is_domain_blocked('casino.com') is False
+        assert reader.is_domain_blocked('example.com') is False
+        assert reader.is_domain_blocked('a.tracker.net') is True
+
+
+def test_snapshot_write_delay():
+    """Test that a burst of single-domain changes rewrites each snapshot file once."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        content_filter = ContentFilter(os.path.join(temp_dir, 'test.db'), use_snapshot=True)
+        content_filter.WRITE_DELAY = 0.1
+        content_filter.add_domain('example.com', 'ads')
+        assert content_filter.build_snapshot()
+
+        with patch('charon.src.core.content_filter.write_snapshot', wraps=write_snapshot) as mock_write:
+            for i in range(50):
+                content_filter.add_domain(f"host{i}.example.com", 'ads')
+            content_filter.remove_domain('example.com')
+            content_filter.add_domain('casino.com', 'gambling')
+            assert mock_write.call_count == 0
+
+            # Lookups of the same ContentFilter see the changes at once
+            assert content_filter.is_domain_blocked('host49.example.com') is True
+            assert content_filter.is_domain_blocked('example.com') is False
+            assert mock_write.call_count == 2
+
+            # Other processes see them within WRITE_DELAY
+            content_filter.add_domain('late.example.com', 'ads')
+            reader = ContentFilter(content_filter.db_path, use_snapshot=True)
+            assert reader.is_domain_blocked('late.example.com') is False
+            time.sleep(0.5)
+            assert mock_write.call_count == 3
+            reader._snapshot_checked = 0.0
+            assert reader.is_domain_blocked('late.example.com') is True
+        content_filter.close()
+
+
+def test_prefilter():
+    """Test the Bloom filter in front of domain lookups."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = os.path.join(temp_dir, 'test.db')
+        writer = ContentFilter(db_path)
+        writer.import_blocklist([f"host{i}.example.com\n" for i in range(500)] + ["*.tracker.net\n"], 'ads')
+        writer.add_domain('casino.com', 'gambling')
+
+        content_filter = ContentFilter(db_path, prefilter_fp_rate=0.01)
+        assert content_filter.is_domain_blocked('host7.example.com') is True
+        assert os.path.exists(content_filter.prefilter_path)
+        assert content_filter.is_domain_blocked('a.b.tracker.net') is True
+        assert content_filter.is_domain_blocked('casino.com') is True
+        for i in range(1000):
+            assert content_filter.is_domain_blocked(f"other{i}.example.org") is False
+
+        stats = content_filter.get_prefilter_stats()
+        assert stats['hits'] == 3 + stats['false_positives']
+        assert stats['misses'] + stats['false_positives'] == 1000
+        assert stats['false_positives'] < 50
+        assert stats['keys'] == 2 * 502
+
+        # Another process loads the saved filter instead of building it
+        other = ContentFilter(db_path, prefilter_fp_rate=0.01)
+        with patch.object(other, 'build_prefilter') as mock_build:
+            assert other.is_domain_blocked('host8.example.com') is True
+            mock_build.assert_not_called()
+
+        # Writers keep the saved filter free of false negatives, saving it once per burst
+        with patch.object(BloomFilter, 'save', autospec=True, side_effect=BloomFilter.save) as mock_save:
+            writer.add_domain('new.example.org', 'ads')
+            writer.enable_category('social', True)
+            writer.add_domain('friends.example', 'social')
+            assert mock_save.call_count == 0
+            assert writer.flush()
+            assert mock_save.call_count == 1
+        content_filter._prefilter_checked = 0.0
+        assert content_filter._prefilter_may_block('new.example.org') is True
+        assert content_filter._prefilter_may_block('friends.example') is True
+
+        # A single-label wildcard disables the two-label shortcut
+        assert content_filter._prefilter_may_block('a.b.evil') is False
+        content_filter.add_domain('*.evil', 'ads')
+        assert content_filter._prefilter_may_block('a.b.evil') is True
+        content_filter.close()
+        other._prefilter_checked = 0.0
+        assert other._prefilter_may_block('a.b.evil') is True
+
+
+def test_prefilter_stats_of_all_processes():
+    """Test summing the Bloom filter counters saved by the processes doing lookups."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = os.path.join(temp_dir, 'test.db')
+        reader = ContentFilter(db_path)
+        assert reader.read_prefilter_stats()['processes'] == 0
+
+        content_filter = ContentFilter(db_path, prefilter_fp_rate=0.01)
+        content_filter.add_domain('casino.com', 'gambling')
+        assert content_filter.is_domain_blocked('casino.com') is True
+        assert content_filter.is_domain_blocked('example.org') is False
+        assert content_filter.save_prefilter_stats() is True
+
+        # A process that exited left its counters behind
+        with open(os.path.join(content_filter.prefilter_stats_path, '1.json'), 'w') as f:
+            json.dump({'hits': 5, 'misses': 7, 'false_positives': 1, 'updated': 0}, f)
+
+        stats = reader.read_prefilter_stats()
+        own = content_filter.get_prefilter_stats()
+        assert stats['processes'] == 2
+        assert stats['hits'] == own['hits'] + 5
+        assert stats['misses'] == own['misses'] + 7
+        assert (stats['enabled'], stats['fp_rate'], stats['keys']) == (True, 0.01, own['keys'])
+
+
+def test_pin_blocked_addresses():
+    """Test pinning the addresses of blocked domains into nftables sets."""
+    from charon.src.core.domain_pinning import DomainPinner
+    from charon.src.core.nft_backend import MockBackend
+    from charon.src.core.packet_filter import PacketFilter
+
+    async def resolver(domain):
+        return [('192.0.2.1', 600)] if domain == 'ads.example.com' else []
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        content_filter = ContentFilter(os.path.join(temp_dir, 'test.db'))
+        content_filter.add_category('ads', 'Advertising')
+        content_filter.add_domain('ads.example.com', 'ads')
+        content_filter.add_domain('*.tracker.example', 'ads')
+
+        backend = MockBackend()
+        pinner = DomainPinner(PacketFilter('charon', backend), resolver)
+        stats = content_filter.pin_blocked_addresses(pinner=pinner)
+        assert (stats['resolved'], stats['added']) == (1, 1)
+        assert 'add element inet charon blocked_ipv4 { 192.0.2.1 timeout' in backend.commands[-1][1]
+
+
+def test_category_shards():
+    """Test that category changes only rewrite the affected snapshot shards."""
+    from charon.src.core.blocklist_snapshot import shard_path
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = os.path.join(temp_dir, 'test.db')
+        content_filter = ContentFilter(db_path, use_snapshot=True)
+        content_filter.import_blocklist(["ads.example.com\n", "*.tracker.net\n"], 'ads')
+        content_filter.add_domain('casino.com', 'gambling')
+        assert content_filter.is_domain_blocked('a.tracker.net') is True
+
+        def mtimes():
+            shards = (shard_path(content_filter.snapshot_path, category)
+                      for category in ('ads', 'gambling', 'social'))
+            return [os.stat(path).st_mtime_ns if os.path.exists(path) else None for path in shards]
+
+        before = mtimes()
+        content_filter.enable_category('ads', False)
+        assert mtimes() == before
+        assert content_filter.is_domain_blocked('a.tracker.net') is False
+        assert content_filter.is_domain_blocked('casino.com') is True
+        content_filter.enable_category('ads', True)
+        assert content_filter.is_domain_blocked('a.tracker.net') is True
+
+        # Moving a domain rewrites the shards it leaves and joins
+        content_filter.add_domain('casino.com', 'social')
+        content_filter.flush()
+        after = mtimes()
+        assert after[0] == before[0]
+        assert after[1] != before[1] and after[2] is not None
+        assert content_filter.is_domain_blocked('casino.com') is False
+
+        # Another reader sees the same state
+        reader = ContentFilter(db_path, use_snapshot=True)
+        assert reader.is_domain_blocked('ads.example.com') is True
+        assert reader.is_domain_blocked('casino.com') is False
+
+
+def test_apply_to_nftables_delta():
+    """Test that applies only push the domains that differ from the set, in one transaction."""
+    from charon.src.core.nft_backend import MockBackend
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        content_filter = ContentFilter(os.path.join(temp_dir, 'test.db'))
+        
+        # The first apply of a process compares against the live set
+        backend = MockBackend({'list set': json.dumps({'nftables': [
+            {'metainfo': {'json_schema_version': 1}},
+            {'set': {'family': 'inet', 'name': 'blocked_domains', 'table': 'charon',
+                     'type': 'string', 'elem': ['a.com', 'b.com']}}]})})
+        with patch('charon.src.core.packet_filter.get_backend', return_value=backend):
+            assert content_filter._apply_to_nftables(['b.com', 'c.com', 'd.com'], 'charon') is True
+            assert backend.commands[1:] == [('script', (
+                "add element inet charon blocked_domains { c.com, d.com }\n"
+                "delete element inet charon blocked_domains { a.com }\n"))]
+
+            # Later applies compare against what was applied
+            backend.commands.clear()
+            assert content_filter._apply_to_nftables(['b.com', 'c.com', 'd.com'], 'charon') is True
+            assert backend.commands == []
+
+            # A rejected transaction changes nothing, and the next call reads the set again
+            backend.fail_on = 'e.com'
+            assert content_filter._apply_to_nftables(['e.com'], 'charon') is False
+            assert 'charon' not in content_filter._nft_domains
+            backend.fail_on = None
+            backend.commands.clear()
+            assert content_filter._apply_to_nftables(['e.com'], 'charon') is True
+            assert backend.commands[0] == ('cmd', 'list set inet charon blocked_domains')
+            assert 'add element inet charon blocked_domains { e.com }' in backend.commands[1][1]
@@ -162,6 +162,35 @@ def test_get_rules(test_db):
     assert accept_input_rules[0].description == 'Allow SSH'
 
 
+def test_get_rules_page(test_db):
+    """Test paging through firewall rules with a cursor."""
+    for port in range(5):
+        test_db.add_rule({'chain': 'INPUT', 'action': 'ACCEPT', 'protocol': 'TCP', 'dst_port': str(port)})
+    
+    rules, cursor = test_db.get_rules_page(limit=2)
+    assert [rule.dst_port for rule in rules] == ['0', '1']
+    rules, cursor = test_db.get_rules_page(limit=2, cursor=cursor)
+    assert [rule.dst_port for rule in rules] == ['2', '3']
+    rules, cursor = test_db.get_rules_page(limit=2, cursor=cursor)
+    assert [rule.dst_port for rule in rules] == ['4']
+    assert cursor is None
+
+
+def test_get_rules_version(test_db):
+    """Test that the rules version changes with every rule change."""
+    versions = [test_db.get_rules_version()]
+    first = test_db.add_rule({'chain': 'INPUT', 'action': 'ACCEPT', 'dst_port': '22'})
+    versions.append(test_db.get_rules_version())
+    assert test_db.get_rules_version() == versions[-1]
+    second = test_db.add_rule({'chain': 'INPUT', 'action': 'DROP'})
+    versions.append(test_db.get_rules_version())
+    test_db.update_rule(first, {'dst_port': '2222'})
+    versions.append(test_db.get_rules_version())
+    test_db.delete_rule(second)
+    versions.append(test_db.get_rules_version())
+    assert len(set(versions)) == len(versions)
+
+
 def test_add_log(test_db):
     """Test adding a log entry."""
     # Create a test log
@@ -183,8 +212,10 @@ def test_add_log(test_db):
     assert isinstance(log_id, int)
     
     # Query the log
-    log = test_db.session.query(FirewallLog).filter_by(id=log_id).first()
-    assert log is not None
+    logs = test_db.get_logs()
+    assert len(logs) == 1
+    log = logs[0]
+    assert log.id == log_id
     assert log.chain == 'INPUT'
     assert log.action == 'DROP'
     assert log.protocol == 'TCP'
@@ -192,6 +223,10 @@ def test_add_log(test_db):
     assert log.dst_ip == '203.0.113.42'
     assert log.src_port == '45123'
     assert log.dst_port == '80'
+    
+    # Logs of another day go to another partition but get the next ID
+    yesterday = datetime.datetime.now() - datetime.timedelta(days=1)
+    assert test_db.add_log(dict(log_data, timestamp=yesterday)) == log_id + 1
 
 
 def test_get_logs(test_db):
@@ -0,0 +1,258 @@
+"""
+Tests for the DNS sinkhole module.
+"""
+
+import asyncio
+import socket
+import struct
+
+import pytest
+
+from charon.src.core.dns_sinkhole import (
+    BLOCK_ZERO, DNSCache, DNSSinkhole, RCODE_NXDOMAIN, RCODE_SERVFAIL, TYPE_A, TYPE_AAAA,
+    answer_addresses, build_query, parse_question, response_ttls
+)
+
+
+class StaticFilter:
+    """Content filter blocking a fixed set of names."""
+
+    def __init__(self, blocked):
+        self.blocked = set(blocked)
+
+    def is_domain_blocked(self, domain):
+        return domain in self.blocked
+
+
+def make_query(name, qtype=TYPE_A, query_id=0x1234):
+    """Build a recursive query for a name."""
+    question = b''.join(bytes([len(label)]) + label.encode() for label in name.split('.')) + b'\x00'
+    return struct.pack('!HHHHHH', query_id, 0x0100, 1, 0, 0, 0) + question + struct.pack('!HH', qtype, 1)
+
+
+class StubUpstream(asyncio.DatagramProtocol):
+    """Upstream answering every A query with 192.0.2.1 over UDP and TCP.
+
+    Names starting with "big" get a truncated UDP answer and the full answer
+    (many records) over TCP.
+    """
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self.udp_queries = 0
+        self.tcp_queries = 0
+
+    def answer(self, query, records=1):
+        _, question_end = parse_question(query)
+        record = b'\xc0\x0c' + struct.pack('!HHIH', TYPE_A, 1, self.ttl, 4) + bytes([192, 0, 2, 1])
+        header = struct.pack('!HHHHHH', struct.unpack_from('!H', query)[0], 0x8180, 1, records, 0, 0)
+        return header + query[12:question_end] + record * records
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.udp_queries += 1
+        answer = self.answer(data)
+        if parse_question(data)[0][0].startswith(b'big'):
+            _, question_end = parse_question(data)
+            answer = struct.pack('!HHHHHH', struct.unpack_from('!H', data)[0], 0x8380, 1, 0, 0, 0) + \
+                data[12:question_end]
+        self.transport.sendto(answer, addr)
+
+    async def serve_tcp(self, reader, writer):
+        try:
+            while True:
+                length = int.from_bytes(await reader.readexactly(2), 'big')
+                self.tcp_queries += 1
+                answer = self.answer(await reader.readexactly(length), records=40)
+                writer.write(len(answer).to_bytes(2, 'big') + answer)
+                await writer.drain()
+        except asyncio.IncompleteReadError:
+            writer.close()
+
+
+async def start_stub(ttl=60):
+    loop = asyncio.get_running_loop()
+    transport, stub = await loop.create_datagram_endpoint(lambda: StubUpstream(ttl), local_addr=('127.0.0.1', 0))
+    port = transport.get_extra_info('sockname')[1]
+    server = await asyncio.start_server(stub.serve_tcp, '127.0.0.1', port)
+    return stub, (transport, server), ('127.0.0.1', port)
+
+
+async def udp_exchange(address, query):
+    """Send a query over UDP and wait for the answer."""
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    class Client(asyncio.DatagramProtocol):
+        def datagram_received(self, data, addr):
+            if not future.done():
+                future.set_result(data)
+
+    transport, _ = await loop.create_datagram_endpoint(Client, remote_addr=address)
+    try:
+        transport.sendto(query)
+        return await asyncio.wait_for(future, 2)
+    finally:
+        transport.close()
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_blocked_names():
+    """Test that blocked names are answered locally in both block modes."""
+    async def scenario():
+        stub, servers, upstream = await start_stub()
+        nxdomain = DNSSinkhole(StaticFilter({'ads.example.com'}), [upstream])
+        zero = DNSSinkhole(StaticFilter({'ads.example.com'}), [upstream], block_mode=BLOCK_ZERO)
+        try:
+            answer = await nxdomain.resolve(make_query('Ads.Example.com'))
+            assert answer[:2] == b'\x12\x34'
+            assert answer[3] & 0x0F == RCODE_NXDOMAIN
+            assert b'\x03Ads\x07Example' in answer
+
+            answer = await zero.resolve(make_query('ads.example.com'))
+            assert struct.unpack_from('!H', answer, 6)[0] == 1
+            assert answer.endswith(b'\x00\x04\x00\x00\x00\x00')
+            answer = await zero.resolve(make_query('ads.example.com', TYPE_AAAA))
+            assert answer.endswith(b'\x00\x10' + b'\x00' * 16)
+            answer = await zero.resolve(make_query('ads.example.com', 16))
+            assert struct.unpack_from('!H', answer, 6)[0] == 0
+
+            assert stub.udp_queries == 0
+            assert nxdomain.stats['blocked'] == 1
+        finally:
+            servers[0].close()
+            servers[1].close()
+            nxdomain.upstreams.close()
+            zero.upstreams.close()
+
+    run(scenario())
+
+
+def test_forward_and_cache():
+    """Test that allowed names are forwarded once and then served from the cache."""
+    async def scenario():
+        stub, servers, upstream = await start_stub()
+        sinkhole = DNSSinkhole(StaticFilter(()), [upstream])
+        address = await sinkhole.start('127.0.0.1', 0)
+        try:
+            answer = await udp_exchange(address, make_query('www.example.org', query_id=1))
+            assert answer[:2] == b'\x00\x01'
+            assert answer.endswith(bytes([192, 0, 2, 1]))
+
+            # Concurrent identical queries share one upstream query
+            answers = await asyncio.gather(*(sinkhole.resolve(make_query('a.example.org', query_id=i))
+                                             for i in range(5)))
+            assert [a[:2] for a in answers] == [struct.pack('!H', i) for i in range(5)]
+            assert stub.udp_queries == 2
+
+            answer = await udp_exchange(address, make_query('WWW.example.org', query_id=2))
+            assert answer[:2] == b'\x00\x02'
+            assert b'\x03WWW' in answer
+            assert stub.udp_queries == 2
+            assert sinkhole.stats['cached'] == 1
+            # Each client query is counted once, forwarded or not
+            assert sinkhole.stats['queries'] == 7
+            assert sinkhole.stats['forwarded'] == 2
+        finally:
+            await sinkhole.close()
+            servers[0].close()
+            servers[1].close()
+
+    run(scenario())
+
+
+def test_truncated_answer_over_tcp():
+    """Test that truncated upstream answers are fetched over TCP."""
+    async def scenario():
+        stub, servers, upstream = await start_stub()
+        sinkhole = DNSSinkhole(StaticFilter(()), [upstream])
+        address = await sinkhole.start('127.0.0.1', 0)
+        try:
+            for _ in range(2):
+                answer = await sinkhole.resolve(make_query('big.example.org'))
+                assert struct.unpack_from('!H', answer, 6)[0] == 40
+            assert stub.tcp_queries == 1
+
+            # Too large for a client without EDNS: truncated over UDP, full over TCP
+            answer = await udp_exchange(address, make_query('big.example.org'))
+            assert answer[2] & 0x02
+
+            reader, writer = await asyncio.open_connection(*address)
+            query = make_query('big.example.org')
+            writer.write(len(query).to_bytes(2, 'big') + query)
+            length = int.from_bytes(await reader.readexactly(2), 'big')
+            answer = await reader.readexactly(length)
+            writer.close()
+            assert struct.unpack_from('!H', answer, 6)[0] == 40
+        finally:
+            await sinkhole.close()
+            servers[0].close()
+            servers[1].close()
+
+    run(scenario())
+
+
+def test_upstream_failure():
+    """Test that SERVFAIL is returned when no upstream answers."""
+    async def scenario():
+        # A bound socket that never answers
+        silent = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        silent.bind(('127.0.0.1', 0))
+        sinkhole = DNSSinkhole(StaticFilter(()), [silent.getsockname()], timeout=0.2)
+        try:
+            answer = await sinkhole.resolve(make_query('example.net'))
+            assert answer[3] & 0x0F == RCODE_SERVFAIL
+            assert sinkhole.stats['failed'] == 1
+
+            # Queries waiting for a cancelled upstream query are not left hanging
+            sinkhole.upstreams.timeout = 10
+            leader = asyncio.ensure_future(sinkhole.resolve(make_query('example.com')))
+            await asyncio.sleep(0.05)
+            waiter = asyncio.ensure_future(sinkhole.resolve(make_query('example.com')))
+            await asyncio.sleep(0.05)
+            leader.cancel()
+            answer = await asyncio.wait_for(waiter, 1)
+            assert answer[3] & 0x0F == RCODE_SERVFAIL
+            assert not sinkhole._inflight
+        finally:
+            sinkhole.upstreams.close()
+            silent.close()
+
+    run(scenario())
+
+
+def test_cache_ttl_and_eviction():
+    """Test that cached TTLs count down and expired entries are evicted first."""
+    stub = StubUpstream(ttl=60)
+    cache = DNSCache(max_entries=2)
+    query = make_query('a.example.com')
+    key, question_end = parse_question(query)
+    assert cache.put(key, stub.answer(query), now=100.0)
+
+    answer = cache.get(key, query, question_end, now=130.0)
+    assert response_ttls(answer)[0] == 30
+    assert cache.get(key, query, question_end, now=160.0) is None
+
+    short = StubUpstream(ttl=5)
+    queries = [make_query(name) for name in ('b.example.com', 'c.example.com', 'd.example.com')]
+    keys = [parse_question(q)[0] for q in queries]
+    cache.put(keys[0], stub.answer(queries[0]), now=200.0)
+    cache.put(keys[1], short.answer(queries[1]), now=200.0)
+    # keys[1] is the most recently used but has expired, so it goes first
+    cache.put(keys[2], stub.answer(queries[2]), now=210.0)
+    assert len(cache) == 2
+    assert cache.get(keys[0], queries[0], question_end, now=210.0) is not None
+    assert cache.get(keys[1], queries[1], question_end, now=210.0) is None
+
+
+def test_answer_addresses():
+    """Test that addresses and TTLs are read from an upstream answer."""
+    query, question_end = build_query('www.example.org', TYPE_A)
+    assert parse_question(query) == ((b'www.example.org', TYPE_A, 1), question_end)
+    assert answer_addresses(StubUpstream(ttl=42).answer(query, records=2)) == \
+        ([('192.0.2.1', 42), ('192.0.2.1', 42)], 0)
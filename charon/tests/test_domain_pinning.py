@@ -0,0 +1,157 @@
+"""
+Tests for the domain pinning module.
+"""
+
+import asyncio
+
+import pytest
+
+from charon.src.core.domain_pinning import DomainPinner, IPV4_SET, IPV6_SET
+from charon.src.core.nft_backend import MockBackend
+from charon.src.core.packet_filter import PacketFilter
+
+
+class FakeResolver:
+    """Resolver answering from a dict and counting resolutions."""
+
+    def __init__(self, records):
+        self.records = records
+        self.calls = []
+
+    async def __call__(self, domain):
+        self.calls.append(domain)
+        records = self.records[domain]
+        if isinstance(records, Exception):
+            raise records
+        return records
+
+
+def make_pinner(records, backend, **options):
+    options.setdefault('jitter', 0)
+    resolver = FakeResolver(records)
+    return DomainPinner(PacketFilter('charon', backend), resolver, **options), resolver
+
+
+def scripts(backend):
+    return [command for kind, command in backend.commands if kind == 'script']
+
+
+def test_initial_sync():
+    """Test that the first sync creates the sets and pins every address."""
+    backend = MockBackend()
+    pinner, resolver = make_pinner({
+        'ads.example.com': [('192.0.2.1', 600), ('2001:db8::1', 600)],
+        'track.example.net': [('192.0.2.1', 60), ('192.0.2.2', 60)],
+    }, backend)
+
+    stats = asyncio.run(pinner.sync(['ads.example.com', 'track.example.net', '*.wild.example'], now=1000))
+    assert stats == {'resolved': 2, 'failed': 0, 'added': 3, 'refreshed': 0, 'removed': 0}
+    assert sorted(resolver.calls) == ['ads.example.com', 'track.example.net']
+
+    script, = scripts(backend)
+    assert f"add set inet charon {IPV4_SET} {{ type ipv4_addr; flags timeout; }}" in script
+    assert f"add rule inet charon content_filter_forward ip daddr @{IPV4_SET} reject" in script
+    # The 60 s TTL is raised to the 300 s floor; the shared address takes the later expiry
+    assert f"add element inet charon {IPV4_SET} {{ 192.0.2.1 timeout 600s, 192.0.2.2 timeout 300s }}" in script
+    assert f"add element inet charon {IPV6_SET} {{ 2001:db8::1 timeout 600s }}" in script
+
+
+def test_incremental_refresh():
+    """Test that later syncs only resolve and touch expiring entries."""
+    backend = MockBackend()
+    records = {
+        'ads.example.com': [('192.0.2.1', 3600)],
+        'track.example.net': [('192.0.2.2', 300)],
+    }
+    pinner, resolver = make_pinner(records, backend)
+    asyncio.run(pinner.sync(records, now=0))
+
+    # Nothing is close to expiry
+    backend.reset()
+    resolver.calls.clear()
+    stats = asyncio.run(pinner.sync(records, now=100))
+    assert resolver.calls == []
+    assert stats['added'] == stats['refreshed'] == stats['removed'] == 0
+    assert scripts(backend) == []
+
+    # track.example.net is within 20% of its 300 s timeout
+    records['track.example.net'] = [('192.0.2.2', 300), ('192.0.2.3', 300)]
+    stats = asyncio.run(pinner.sync(records, now=250))
+    assert resolver.calls == ['track.example.net']
+    assert (stats['added'], stats['refreshed']) == (1, 1)
+    script, = scripts(backend)
+    assert script.splitlines() == [
+        f"add element inet charon {IPV4_SET} {{ 192.0.2.2 }}",
+        f"delete element inet charon {IPV4_SET} {{ 192.0.2.2 }}",
+        f"add element inet charon {IPV4_SET} {{ 192.0.2.3 timeout 300s, 192.0.2.2 timeout 300s }}",
+    ]
+
+
+def test_removed_and_failed_domains():
+    """Test that unblocked domains are unpinned and failures keep existing pins."""
+    backend = MockBackend()
+    records = {
+        'ads.example.com': [('192.0.2.1', 600)],
+        'track.example.net': [('192.0.2.2', 600)],
+    }
+    pinner, resolver = make_pinner(records, backend)
+    asyncio.run(pinner.sync(records, now=0))
+
+    backend.reset()
+    records['track.example.net'] = OSError("timeout")
+    stats = asyncio.run(pinner.sync(['track.example.net'], now=500))
+    assert (stats['failed'], stats['removed']) == (1, 1)
+    script, = scripts(backend)
+    assert f"delete element inet charon {IPV4_SET} {{ 192.0.2.1 }}" in script
+    assert '192.0.2.2' not in script
+
+
+def test_transaction_failure():
+    """Test that a rejected transaction leaves the state for the next sync."""
+    backend = MockBackend(fail_on='add element')
+    pinner, resolver = make_pinner({'ads.example.com': [('192.0.2.1', 600)]}, backend)
+    assert asyncio.run(pinner.sync(['ads.example.com'], now=0)) == {}
+
+    backend.fail_on = None
+    stats = asyncio.run(pinner.sync(['ads.example.com'], now=1))
+    assert stats['added'] == 1
+    assert 'add set' in scripts(backend)[-1]
+
+
+def test_concurrency_is_bounded():
+    """Test that no more than `concurrency` domains are resolved at once."""
+    state = {'active': 0, 'peak': 0}
+
+    async def resolver(domain):
+        state['active'] += 1
+        state['peak'] = max(state['peak'], state['active'])
+        await asyncio.sleep(0.001)
+        state['active'] -= 1
+        return [('192.0.2.1', 600)]
+
+    pinner = DomainPinner(PacketFilter('charon', MockBackend()), resolver, concurrency=8)
+    stats = asyncio.run(pinner.sync([f"host{i}.example.com" for i in range(100)]))
+    assert stats['resolved'] == 100
+    assert state['peak'] == 8
+
+
+def test_first_sync_replaces_pins_of_earlier_process():
+    """Test that a restarted pinner flushes the sets before pinning, in one transaction."""
+    backend = MockBackend()
+    records = {'ads.example.com': [('192.0.2.1', 600)]}
+    asyncio.run(make_pinner(records, backend)[0].sync(records, now=0))
+
+    backend.reset()
+    restarted, _ = make_pinner(records, backend)
+    stats = asyncio.run(restarted.sync(records, now=100))
+    assert stats['added'] == 1
+
+    script, = scripts(backend)
+    flush = script.index(f"flush set inet charon {IPV4_SET}")
+    assert f"flush set inet charon {IPV6_SET}" in script
+    assert script.index(f"add element inet charon {IPV4_SET} {{ 192.0.2.1 timeout 600s }}") > flush
+
+    # Later syncs of the same process keep the pins
+    backend.reset()
+    asyncio.run(restarted.sync(records, now=200))
+    assert all('flush set' not in script for script in scripts(backend))
@@ -0,0 +1,127 @@
+"""
+Tests for the columnar log archive.
+"""
+
+import datetime
+import os
+
+import pytest
+from sqlalchemy import inspect
+
+pytest.importorskip("pyarrow")
+
+from charon.src.db.database import LogSequence
+from charon.src.db.log_archive import LogArchive
+from charon.src.db.log_store import partition_name
+
+NOW = datetime.datetime(2026, 10, 17, 12, 30, 15)
+
+
+def add_logs(test_db, days=3, per_day=4):
+    """Add logs for several days; every other log is a drop from 10.0.0.1 to port 22."""
+    for day in range(days):
+        for i in range(per_day):
+            test_db.add_log({
+                'timestamp': NOW - datetime.timedelta(days=day, minutes=i),
+                'chain': 'input',
+                'action': 'drop' if i % 2 else 'accept',
+                'protocol': 'tcp',
+                'src_ip': '10.0.0.1' if i % 2 else '10.0.0.2',
+                'dst_ip': '192.168.1.1',
+                'dst_port': '22' if i % 2 else '443',
+            })
+
+
+def read_pages(test_db, limit, **kwargs):
+    """Read all pages of logs."""
+    logs, cursor = test_db.get_logs_page(limit=limit, **kwargs)
+    while cursor:
+        page, cursor = test_db.get_logs_page(limit=limit, cursor=cursor, **kwargs)
+        logs.extend(page)
+    return logs
+
+
+def test_archive_retention(test_db, tmp_path):
+    """Test that retention moves old partitions into the archive and pages span both."""
+    add_logs(test_db)
+    before = [(log.timestamp, log.id) for log in read_pages(test_db, 5)]
+
+    test_db.logs.archive = LogArchive(str(tmp_path))
+    removed = test_db.logs.apply_retention(test_db.session.connection(), raw_days=1, minute_days=None,
+                                           hour_days=None, now=NOW)
+    test_db.session.commit()
+    assert removed == {'partitions': 2, 'indexed': 0, 'minute': 0, 'hour': 0, 'archived': 8, 'archive_files': 0}
+    assert sorted(os.listdir(tmp_path)) == [
+        partition_name((NOW - datetime.timedelta(days=day)).date()) + '.parquet' for day in (2, 1)]
+    assert test_db.count_logs() == 4
+
+    # Pages continue from the partition of today into the archive
+    logs = read_pages(test_db, 5)
+    assert [(log.timestamp, log.id) for log in logs] == before
+    assert logs[-1]._mapping['dst_port'] == '22'
+    drops = read_pages(test_db, 2, log_type='drop', filters={'dst_port': '22'},
+                       since=NOW - datetime.timedelta(days=1, hours=1))
+    assert [log.timestamp for log in drops] == [NOW - datetime.timedelta(days=day, minutes=minutes)
+                                                for day in (0, 1) for minutes in (1, 3)]
+    assert all(log.src_ip == '10.0.0.1' for log in drops)
+
+    # Logs of an archived day that arrive late go to a second file of the day
+    for day in range(3):
+        test_db.add_log({'timestamp': NOW - datetime.timedelta(days=day, seconds=30), 'chain': 'input',
+                         'action': 'accept'})
+    test_db.logs.apply_retention(test_db.session.connection(), raw_days=1, minute_days=None,
+                                 hour_days=None, now=NOW)
+    test_db.session.commit()
+    assert test_db.logs.archive.count() == 10
+    assert len(test_db.logs.archive.days()[(NOW - datetime.timedelta(days=1)).date()]) == 2
+    assert len(read_pages(test_db, 3)) == 15
+
+    removed = test_db.logs.apply_retention(test_db.session.connection(), raw_days=1, minute_days=None,
+                                           hour_days=None, archive_days=2, now=NOW)
+    assert removed['archive_files'] == 2
+    assert partition_name(NOW.date()) in inspect(test_db.engine).get_table_names()
+
+
+def test_late_logs_of_archived_day(test_db, tmp_path):
+    """Test that pages list every log of a day whose late logs share timestamps with its archived ones."""
+    test_db.logs.archive = LogArchive(str(tmp_path))
+    day = NOW - datetime.timedelta(days=1)
+    for _ in range(3):
+        test_db.add_log({'timestamp': day, 'chain': 'input', 'action': 'drop'})
+    test_db.logs.apply_retention(test_db.session.connection(), raw_days=1, minute_days=None,
+                                 hour_days=None, now=NOW)
+    # A new sequence, as after an upgrade, continues after the archived IDs
+    test_db.session.execute(LogSequence.__table__.delete())
+    test_db.session.commit()
+    assert [test_db.add_log({'timestamp': day, 'chain': 'input', 'action': 'accept'})
+            for _ in range(3)] == [4, 5, 6]
+
+    logs = read_pages(test_db, 3)
+    assert [log.id for log in logs] == [6, 5, 4, 3, 2, 1]
+    assert [log.action for log in logs] == ['accept'] * 3 + ['drop'] * 3
+
+
+def test_pushdown(tmp_path):
+    """Test that queries skip row groups outside the time range and read pages newest first."""
+    archive = LogArchive(str(tmp_path), row_group_size=100)
+    day = NOW.date()
+    start = datetime.datetime.combine(day, datetime.time())
+    rows = [(i, start + datetime.timedelta(seconds=i), 'input', 'drop', 'tcp', f"10.0.{i % 4}.1",
+             '192.168.1.1', str(1024 + i), '80' if i % 10 else 'x', None) for i in range(1000)]
+    assert archive.write(day, [rows[:500], rows[500:]]) == 1000
+    paths = archive.days()[day]
+
+    since = start + datetime.timedelta(seconds=250)
+    until = start + datetime.timedelta(seconds=350)
+    logs = archive.read(paths, {'src_ip': '10.0.1.1'}, since=since, until=until)
+    assert [log.id for log in logs] == list(range(349, 249, -4))
+    assert archive.count({'src_port': 1100}) == 1
+    # Ports that are not numbers are not archived
+    assert archive.count({'dst_port': 'x'}) == 0
+    assert archive.count({'dst_port': '80'}) == 900
+
+    page, cursor = archive.query(limit=150)
+    assert [log.id for log in page] == list(range(999, 849, -1))
+    page, cursor = archive.query(limit=900, cursor=cursor)
+    assert [log.id for log in page] == list(range(849, -1, -1)) and cursor is None
+    assert page[0].src_port == '1873'
@@ -0,0 +1,139 @@
+"""
+Tests for the firewall log ingestion module.
+"""
+
+import datetime
+import json
+import os
+import tempfile
+import time
+
+from sqlalchemy import create_engine, text
+
+from charon.src.core.log_ingest import LogIngestor, LogParser
+from charon.src.db.database import Base
+
+KERNEL_LINE = ("Oct 17 05:42:07 gw kernel: [12345.678] charon:42 DROP IN=eth0 OUT= "
+               "MAC=00:11:22:33:44:55 SRC=203.0.113.5 DST=192.168.1.10 LEN=60 TOS=0x00 "
+               "PREC=0x00 TTL=52 ID=0 DF PROTO=TCP SPT=51515 DPT=22 WINDOW=64240 RES=0x00 SYN URGP=0")
+
+
+def make_ingestor(temp_dir, **kwargs):
+    connection_string = f"sqlite:///{os.path.join(temp_dir, 'logs.db')}"
+    Base.metadata.create_all(create_engine(connection_string))
+    return LogIngestor(connection_string, **kwargs)
+
+
+def count_rows(ingestor):
+    with ingestor.engine.connect() as conn:
+        return ingestor.store.count(conn)
+
+
+def test_parse_kernel_line():
+    """Test parsing a LOG target line from the kernel log."""
+    row = LogParser().parse(KERNEL_LINE)
+    assert row["chain"] == "input"
+    assert row["action"] == "drop"
+    assert row["rule_id"] == 42
+    assert (row["protocol"], row["src_ip"], row["dst_ip"]) == ("tcp", "203.0.113.5", "192.168.1.10")
+    assert (row["src_port"], row["dst_port"]) == ("51515", "22")
+    assert (row["timestamp"].month, row["timestamp"].day, row["timestamp"].hour) == (10, 17, 5)
+
+    icmp = LogParser().parse("2026-10-17T05:42:07+00:00 gw kernel: FWD IN=eth1 OUT=eth0 "
+                             "SRC=192.168.1.10 DST=8.8.8.8 LEN=84 PROTO=ICMP TYPE=8 CODE=0")
+    assert icmp["chain"] == "forward"
+    assert icmp["action"] == "log"
+    assert icmp["protocol"] == "icmp"
+    assert icmp["src_port"] is None and icmp["rule_id"] is None
+    assert icmp["timestamp"] == datetime.datetime(2026, 10, 17, 5, 42, 7, tzinfo=datetime.timezone.utc) \
+        .astimezone().replace(tzinfo=None)
+
+    assert LogParser().parse("Oct 17 05:42:07 gw sshd[1]: Accepted publickey for root") is None
+
+
+def test_parse_ulogd_json():
+    """Test parsing a JSON line written by ulogd."""
+    line = json.dumps({"timestamp": "2026-10-17T05:42:07", "oob.prefix": "charon:7 REJECT ",
+                       "oob.in": "", "oob.out": "eth0", "src_ip": "192.168.1.1", "dest_ip": "1.1.1.1",
+                       "ip.protocol": 17, "src_port": 5353, "dest_port": 53})
+    row = LogParser().parse(line)
+    assert row == {"timestamp": datetime.datetime(2026, 10, 17, 5, 42, 7), "chain": "output",
+                   "action": "reject", "protocol": "udp", "src_ip": "192.168.1.1", "dst_ip": "1.1.1.1",
+                   "src_port": "5353", "dst_port": "53", "rule_id": 7}
+    assert LogParser().parse("{not json") is None
+
+
+def test_batched_insert():
+    """Test that buffered lines are written in batches."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        ingestor = make_ingestor(temp_dir, batch_size=100, flush_interval=60)
+        lines = [KERNEL_LINE] * 250 + ["not a firewall line"]
+        assert ingestor.submit(lines) == 251
+        assert ingestor.flush() == 250
+
+        stats = ingestor.stats()
+        assert stats["inserted"] == 250
+        assert stats["batches"] == 3
+        assert stats["skipped"] == 1
+        assert stats["pending"] == 0
+        assert count_rows(ingestor) == 250
+        with ingestor.engine.connect() as conn:
+            assert ingestor.store.stats(conn, group_by=('action', 'dst_ip')) == \
+                [{'action': 'drop', 'dst_ip': '192.168.1.10', 'count': 250}]
+        with ingestor.engine.connect() as conn:
+            assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+
+
+def test_overflow_is_dropped():
+    """Test that lines beyond the buffer are dropped and counted."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        ingestor = make_ingestor(temp_dir, max_pending=10)
+        assert ingestor.submit([KERNEL_LINE] * 8) == 8
+        assert ingestor.submit([KERNEL_LINE] * 8) == 2
+        assert ingestor.stats()["dropped"] == 6
+        assert ingestor.stats()["pending"] == 10
+
+
+def test_writer_flushes_on_interval():
+    """Test that the writer thread writes a partial batch after the flush interval."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        ingestor = make_ingestor(temp_dir, batch_size=1000, flush_interval=0.05)
+        ingestor.start()
+        try:
+            ingestor.submit([KERNEL_LINE] * 3)
+            deadline = time.monotonic() + 5
+            while ingestor.stats()["inserted"] < 3 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            assert ingestor.stats()["inserted"] == 3
+        finally:
+            ingestor.stop()
+
+
+def test_follow_rotated_file():
+    """Test following a log file across rotation."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "kern.log")
+        with open(path, "w") as f:
+            f.write(KERNEL_LINE + "\n")
+        ingestor = make_ingestor(temp_dir, batch_size=10, flush_interval=0.05)
+        ingestor.start()
+        ingestor.follow(path, from_end=True, poll_interval=0.01)
+        try:
+            time.sleep(0.1)
+            with open(path, "a") as f:
+                f.write(KERNEL_LINE + "\n" + KERNEL_LINE[:40])
+            time.sleep(0.1)
+            with open(path, "a") as f:
+                f.write(KERNEL_LINE[40:] + "\n")
+            os.rename(path, path + ".1")
+            with open(path, "w") as f:
+                f.write(KERNEL_LINE + "\n")
+
+            deadline = time.monotonic() + 5
+            while ingestor.stats()["inserted"] < 3 and time.monotonic() < deadline:
+                time.sleep(0.01)
+        finally:
+            ingestor.stop()
+        # The line that was in the file before following started is skipped
+        assert ingestor.stats()["inserted"] == 3
+        assert ingestor.stats()["skipped"] == 0
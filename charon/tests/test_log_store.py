@@ -0,0 +1,160 @@
+"""
+Tests for the partitioned log storage module.
+"""
+
+import datetime
+
+from sqlalchemy import inspect
+
+from charon.src.db.database import FirewallLog
+from charon.src.db.log_store import partition_name
+
+NOW = datetime.datetime(2026, 10, 17, 12, 30, 15)
+
+
+def add_logs(test_db, days=3, per_day=4):
+    """Add logs for several days; every other log is a drop from 10.0.0.1."""
+    for day in range(days):
+        for i in range(per_day):
+            test_db.add_log({
+                'timestamp': NOW - datetime.timedelta(days=day, minutes=i),
+                'chain': 'input',
+                'action': 'drop' if i % 2 else 'accept',
+                'protocol': 'tcp',
+                'src_ip': '10.0.0.1' if i % 2 else '10.0.0.2',
+                'dst_ip': '192.168.1.1',
+                'dst_port': '22',
+            })
+
+
+def test_daily_partitions(test_db):
+    """Test that logs are stored per day and read newest first across days."""
+    add_logs(test_db)
+    tables = inspect(test_db.engine).get_table_names()
+    for day in range(3):
+        assert partition_name((NOW - datetime.timedelta(days=day)).date()) in tables
+
+    logs = test_db.get_logs(limit=None)
+    assert len(logs) == 12
+    # IDs are unique across the partitions
+    assert sorted(log.id for log in logs) == list(range(1, 13))
+    timestamps = [log.timestamp for log in logs]
+    assert timestamps == sorted(timestamps, reverse=True)
+
+    # Pages across partition boundaries
+    page = test_db.get_logs(limit=4, offset=6)
+    assert [log.timestamp for log in page] == timestamps[6:10]
+    assert test_db.get_logs(limit=10, offset=11)[0].timestamp == timestamps[11]
+
+    assert test_db.count_logs() == 12
+    assert test_db.count_logs(log_type='drop') == 6
+    assert test_db.count_logs(since=NOW - datetime.timedelta(hours=1)) == 4
+    assert len(test_db.get_logs(filters={'src_ip': '10.0.0.2'}, since=NOW - datetime.timedelta(days=1))) == 3
+
+
+def test_rollups(test_db):
+    """Test that the rollups count the logs by action, protocol and addresses."""
+    add_logs(test_db)
+    assert test_db.get_log_stats() == [{'action': 'accept', 'count': 6}, {'action': 'drop', 'count': 6}]
+    assert test_db.get_log_stats(group_by=('src_ip',), filters={'action': 'drop'}) == \
+        [{'src_ip': '10.0.0.1', 'count': 6}]
+
+    today = test_db.get_log_stats(since=NOW.replace(hour=0, minute=0), group_by=('action', 'dst_ip'),
+                                  resolution='minute', by_bucket=True)
+    assert [row['bucket'] for row in today] == [NOW.replace(minute=m, second=0) for m in (27, 28, 29, 30)]
+    assert today[0] == {'bucket': NOW.replace(minute=27, second=0), 'action': 'drop',
+                        'dst_ip': '192.168.1.1', 'count': 1}
+
+
+def test_retention(test_db):
+    """Test that retention drops whole partitions and old rollup rows."""
+    add_logs(test_db)
+    removed = test_db.logs.apply_retention(test_db.session.connection(), raw_days=2, minute_days=1,
+                                           hour_days=None, now=NOW)
+    test_db.session.commit()
+    assert removed == {'partitions': 1, 'indexed': 1, 'minute': 8, 'hour': 0}
+    assert partition_name((NOW - datetime.timedelta(days=2)).date()) not in \
+        inspect(test_db.engine).get_table_names()
+    assert test_db.count_logs() == 8
+    assert sum(row['count'] for row in test_db.get_log_stats(resolution='minute')) == 4
+    assert sum(row['count'] for row in test_db.get_log_stats()) == 12
+
+    # A dropped day gets a new partition when logs for it arrive again
+    add_logs(test_db, days=3, per_day=1)
+    assert test_db.count_logs() == 11
+
+
+def test_migrate_unpartitioned_logs(test_db):
+    """Test that logs of the unpartitioned table are moved into the partitions."""
+    test_db.session.add(FirewallLog(timestamp=NOW, chain='input', action='drop', src_ip='10.0.0.1'))
+    test_db.session.add(FirewallLog(timestamp=None, chain='input', action='accept'))
+    test_db.session.commit()
+
+    # Creating the tables leaves them in place
+    assert test_db.create_tables()
+    assert test_db.count_logs() == 0
+
+    assert test_db.migrate_logs() == 2
+    assert test_db.session.query(FirewallLog).count() == 0
+    assert test_db.count_logs() == 2
+    assert test_db.get_log_stats(group_by=('action', 'src_ip'), filters={'action': 'drop'}) == \
+        [{'action': 'drop', 'src_ip': '10.0.0.1', 'count': 1}]
+
+
+def test_keyset_pages(test_db):
+    """Test that cursor pages cover every log once, in order, across partitions."""
+    add_logs(test_db, days=3, per_day=5)
+    expected = [(log.timestamp, log.id) for log in test_db.get_logs(limit=None)]
+
+    seen, cursor = [], None
+    while True:
+        page, cursor = test_db.get_logs_page(limit=4, cursor=cursor)
+        seen.extend((log.timestamp, log.id) for log in page)
+        if cursor is None:
+            break
+    assert seen == expected
+
+    drops, cursor = test_db.get_logs_page(log_type='drop', limit=10)
+    assert len(drops) == 6 and cursor is None
+    assert test_db.get_logs_page(cursor='not a cursor') == ([], None)
+
+
+def test_partition_indexes(test_db):
+    """Test that partitions get the filter indexes once their day has ended."""
+    add_logs(test_db, days=1)
+    name = partition_name(NOW.date())
+
+    def indexed():
+        return sorted(tuple(index['column_names']) for index in inspect(test_db.engine).get_indexes(name))
+
+    assert indexed() == [('timestamp', 'id')]
+    assert test_db.logs.close_partitions(test_db.session.connection(), now=NOW) == 0
+    assert test_db.logs.close_partitions(test_db.session.connection(),
+                                         now=NOW + datetime.timedelta(days=1)) == 1
+    test_db.session.commit()
+    assert indexed() == [('action', 'timestamp'), ('src_ip', 'timestamp'), ('timestamp', 'id')]
+    assert test_db.logs.close_partitions(test_db.session.connection(),
+                                         now=NOW + datetime.timedelta(days=1)) == 0
+
+
+def test_grouped_count(test_db):
+    """Test counting logs per action in one query."""
+    assert test_db.count_logs_by('action') == {}
+    add_logs(test_db)
+    assert test_db.count_logs_by('action') == {'accept': 6, 'drop': 6}
+    assert test_db.count_logs_by('src_ip', filters={'action': 'drop'}) == {'10.0.0.1': 6}
+    assert test_db.count_logs_by('action', since=NOW - datetime.timedelta(hours=1)) == {'accept': 2, 'drop': 2}
+
+
+def test_log_days(test_db):
+    """Test that the partition days bound rollup counts matching the raw rows."""
+    assert test_db.get_log_days() == []
+    add_logs(test_db)
+    days = test_db.get_log_days()
+    assert days == [(NOW - datetime.timedelta(days=day)).date() for day in range(3)]
+
+    # Counts of the rollups from the oldest partition on cover the same rows
+    test_db.logs._drop(test_db.session.connection(), test_db.logs._table(partition_name(days[-1])))
+    since = datetime.datetime.combine(test_db.get_log_days()[-1], datetime.time())
+    stats = {row['action']: row['count'] for row in test_db.get_log_stats(since=since)}
+    assert stats == test_db.count_logs_by('action') == {'accept': 4, 'drop': 4}
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Test suite for the nftables backend layer.
+
+These tests use the mock backend and do not require root privileges.
+"""
+
+import unittest
+import os
+import sys
+import subprocess
+from unittest.mock import patch, MagicMock
+
+# Add the parent directory to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.core import nft_backend
+from src.core.nft_backend import MockBackend, NftError, SubprocessBackend, get_backend
+from src.core.packet_filter import PacketFilter, RuleAction
+
+class TestNftBackend(unittest.TestCase):
+    """Test cases for the nftables backends."""
+    
+    def test_packet_filter_with_mock_backend(self):
+        """Test that packet filter operations are routed through the backend."""
+        backend = MockBackend(responses={"list table": '{"nftables": []}'})
+        pf = PacketFilter("test_table", backend=backend)
+        
+        self.assertTrue(pf.add_rule("input", "tcp dport 22 accept"))
+        self.assertTrue(pf.add_stateful_rule("input", {"protocol": "tcp", "action": RuleAction.DROP}))
+        self.assertTrue(pf.delete_rule("input", 7))
+        self.assertEqual(pf.list_rules(), '{"nftables": []}')
+        self.assertTrue(pf.setup_base_table())
+        
+        kinds = [kind for kind, _ in backend.commands]
+        self.assertEqual(kinds, ["cmd", "cmd", "cmd", "cmd", "script"])
+        self.assertEqual(backend.commands[0][1], "add rule inet test_table input tcp dport 22 accept")
+        self.assertEqual(backend.commands[2][1], "delete rule inet test_table input handle 7")
+    
+    def test_mock_backend_failure(self):
+        """Test that backend errors are reported as failures."""
+        backend = MockBackend(fail_on="bogus")
+        pf = PacketFilter("test_table", backend=backend)
+        
+        self.assertFalse(pf.add_rule("input", "bogus"))
+        txn = pf.transaction().add_rule("input", "tcp dport 22 accept").add_rule("input", "bogus")
+        self.assertFalse(txn.commit())
+        self.assertEqual(backend.commands, [])
+    
+    @patch('subprocess.run')
+    def test_subprocess_backend(self, mock_run):
+        """Test the command lines built by the subprocess backend."""
+        mock_run.return_value = MagicMock(returncode=0, stdout='{"nftables": []}')
+        backend = SubprocessBackend()
+        
+        self.assertEqual(backend.run(["list", "ruleset"], json_output=True, capture=True), '{"nftables": []}')
+        mock_run.assert_called_with(["nft", "--json", "list", "ruleset"], check=True,
+                                    capture_output=True, text=True)
+        
+        self.assertEqual(backend.run_json({"nftables": [{"flush": {"ruleset": None}}]}), {"nftables": []})
+        self.assertEqual(mock_run.call_args[0][0], ["nft", "--json", "-f", "-"])
+        
+        mock_run.side_effect = subprocess.CalledProcessError(1, "nft", stderr="Error: No such file")
+        with self.assertRaises(NftError):
+            backend.run_script("flush ruleset\n")
+    
+    def test_get_backend_fallback(self):
+        """Test that auto selection falls back to the subprocess backend."""
+        with patch.dict(nft_backend._shared_backends, clear=True), \
+                patch('ctypes.util.find_library', return_value=None):
+            self.assertIsInstance(get_backend("auto"), SubprocessBackend)
+            self.assertIs(get_backend("auto"), get_backend("subprocess"))
+            self.assertIsInstance(get_backend("mock"), MockBackend)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -9,12 +9,14 @@ import unittest
 import os
 import sys
 import json
+import subprocess
 from unittest.mock import patch, MagicMock
 
 # Add the parent directory to the Python path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from src.core.packet_filter import PacketFilter
+from src.core.packet_filter import PacketFilter, NATType, RuleAction
+from src.core.nft_backend import SubprocessBackend
 
 class TestPacketFilter(unittest.TestCase):
     """Test cases for the PacketFilter class."""
@@ -26,15 +28,19 @@ class TestPacketFilter(unittest.TestCase):
         mock_run.return_value = MagicMock(returncode=0)
         
         # Create an instance of PacketFilter
-        pf = PacketFilter("test_table")
+        pf = PacketFilter("test_table", backend=SubprocessBackend())
         
         # Call setup_base_table and check the result
         result = pf.setup_base_table()
         self.assertTrue(result)
         
-        # Check if subprocess.run was called the correct number of times
-        # Once for creating the table, three times for creating the chains
-        self.assertEqual(mock_run.call_count, 4)
+        # All tables and chains are created in a single nft transaction
+        self.assertEqual(mock_run.call_count, 1)
+        args, kwargs = mock_run.call_args
+        self.assertEqual(args[0], ["nft", "-f", "-"])
+        self.assertIn("add table inet test_table", kwargs['input'])
+        self.assertIn("add table ip test_table_nat", kwargs['input'])
+        self.assertEqual(kwargs['input'].count("add chain"), 5)
     
     @patch('subprocess.run')
     def test_add_rule(self, mock_run):
@@ -43,7 +49,7 @@ class TestPacketFilter(unittest.TestCase):
         mock_run.return_value = MagicMock(returncode=0)
         
         # Create an instance of PacketFilter
-        pf = PacketFilter("test_table")
+        pf = PacketFilter("test_table", backend=SubprocessBackend())
         
         # Call add_rule and check the result
         result = pf.add_rule("input", "tcp dport 22 accept")
@@ -62,7 +68,7 @@ class TestPacketFilter(unittest.TestCase):
         mock_run.return_value = MagicMock(returncode=0)
         
         # Create an instance of PacketFilter
-        pf = PacketFilter("test_table")
+        pf = PacketFilter("test_table", backend=SubprocessBackend())
         
         # Call delete_rule and check the result
         result = pf.delete_rule("input", 42)
@@ -74,5 +80,67 @@ class TestPacketFilter(unittest.TestCase):
             check=True
         )
 
+    @patch('subprocess.run')
+    def test_transaction_commit(self, mock_run):
+        """Test that a transaction is committed as one nft script."""
+        mock_run.return_value = MagicMock(returncode=0)
+        
+        pf = PacketFilter("test_table", backend=SubprocessBackend())
+        txn = pf.transaction()
+        txn.add_rule("input", "tcp dport 22 accept")
+        txn.add_stateful_rule("input", {
+            "protocol": "tcp",
+            "state": "established,related",
+            "action": RuleAction.ACCEPT
+        })
+        txn.add_nat_rule(NATType.MASQUERADE, {
+            "chain": "postrouting",
+            "source": "10.0.0.0/24"
+        })
+        txn.add_set("blocked", "ipv4_addr", flags=["interval"], elements=["10.1.0.0/16"])
+        self.assertEqual(len(txn), 4)
+        
+        self.assertTrue(txn.commit())
+        self.assertEqual(mock_run.call_count, 1)
+        self.assertEqual(
+            mock_run.call_args[1]['input'].splitlines(),
+            [
+                "add rule inet test_table input tcp dport 22 accept",
+                "add rule inet test_table input protocol tcp ct state established,related accept",
+                "add rule ip test_table_nat postrouting ip saddr 10.0.0.0/24 masquerade",
+                "add set inet test_table blocked { type ipv4_addr; flags interval; elements = { 10.1.0.0/16 }; }",
+            ]
+        )
+        self.assertEqual(len(txn), 0)
+    
+    @patch('subprocess.run')
+    def test_transaction_rollback(self, mock_run):
+        """Test that a rejected transaction reports failure and keeps its commands."""
+        mock_run.side_effect = subprocess.CalledProcessError(1, "nft", stderr="Error: syntax error")
+        
+        pf = PacketFilter("test_table", backend=SubprocessBackend())
+        txn = pf.transaction()
+        txn.add_rule("input", "tcp dport 22 accept")
+        txn.add_rule("input", "bogus")
+        
+        self.assertFalse(txn.commit())
+        self.assertEqual(len(txn), 2)
+    
+    @patch('subprocess.run')
+    def test_transaction_context_manager(self, mock_run):
+        """Test committing on clean exit and discarding on error."""
+        mock_run.return_value = MagicMock(returncode=0)
+        pf = PacketFilter("test_table", backend=SubprocessBackend())
+        
+        with pf.transaction() as txn:
+            txn.add_rule("input", "tcp dport 22 accept")
+        self.assertEqual(mock_run.call_count, 1)
+        
+        with self.assertRaises(ValueError):
+            with pf.transaction() as txn:
+                txn.add_rule("input", "tcp dport 80 accept")
+                raise ValueError("abort")
+        self.assertEqual(mock_run.call_count, 1)
+
 if __name__ == "__main__":
     unittest.main() 
\ No newline at end of file
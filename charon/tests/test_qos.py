@@ -457,8 +457,7 @@ class TestQoS(unittest.TestCase):
         
         # Mock setup_tc_qdisc and other methods to isolate the test
         with mock.patch.object(QoS, 'setup_tc_qdisc', return_value=True) as mock_qdisc, \
-             mock.patch.object(QoS, 'add_traffic_class', return_value=True) as mock_class, \
-             mock.patch.object(QoS, 'add_filter', return_value=True) as mock_filter:
+             mock.patch.object(QoS, 'add_traffic_class', return_value=True) as mock_class:
             
             qos = QoS(interface="eth0")
             result = qos.setup_default_profile()
@@ -466,7 +465,8 @@ class TestQoS(unittest.TestCase):
             self.assertTrue(result)
             mock_qdisc.assert_called_once()
             self.assertEqual(mock_class.call_count, 4)  # 4 traffic classes
-            self.assertEqual(mock_filter.call_count, 6)  # 6 filters
+            script = self.mock_subprocess.call_args[1]["input"].splitlines()
+            self.assertEqual(len(script), 6)  # 6 filters
     
     def test_setup_default_profile_windows(self):
         """Test setting up default profile on Windows."""
@@ -481,6 +481,158 @@ class TestQoS(unittest.TestCase):
             
             self.assertTrue(result)
             mock_apply.assert_called_once()
+    
+    @mock_linux_permissions
+    def test_setup_default_profile_batch(self):
+        """Test that the default profile is applied with a single tc batch."""
+        self.mock_platform.return_value = 'Linux'
+        
+        qos = QoS(interface="eth0", total_bandwidth=100)
+        self.mock_subprocess.reset_mock()
+        self.mock_subprocess.return_value = mock.Mock(stdout="[]", stderr="", returncode=0)
+        self.assertTrue(qos.setup_default_profile())
+        
+        # The qdisc is read once, and there is none yet: the hierarchy is built in one batch
+        self.assertEqual(self.mock_subprocess.call_count, 2)
+        self.assertEqual(self.mock_subprocess.call_args[0][0], ["tc", "-batch", "-"])
+        script = self.mock_subprocess.call_args[1]["input"].splitlines()
+        self.assertEqual(len(script), 2 + 4 * 2 + 6)
+        self.assertEqual(script[0], "qdisc replace dev eth0 root handle 1: htb default 30")
+        self.assertIn("class add dev eth0 parent 1:1 classid 1:10 htb rate 20000kbit ceil 100000kbit prio 0",
+                      script)
+        self.assertIn("filter add dev eth0 protocol ip parent 1:0 prio 1 handle 786454 flower "
+                      "ip_proto tcp dst_port 22 classid 1:10", script)
+    
+    @mock_linux_permissions
+    def test_plan_rollback(self):
+        """Test that a failing plan undoes the commands applied before the failure."""
+        self.mock_platform.return_value = 'Linux'
+        self.mock_subprocess.side_effect = [
+            subprocess.CalledProcessError(1, ["tc"], stderr="Command failed -:4\n"),
+            mock.Mock(returncode=0),
+        ]
+        
+        qos = QoS(interface="eth0")
+        with self.assertLogs('charon.qos', level='ERROR'):
+            with qos.plan() as plan:
+                qos.add_traffic_class(50, rate=2000, parent_id=1, plan=plan)
+                qos.add_filter(50, src_ip="192.168.1.50", priority=5, plan=plan)
+                qos.add_traffic_class(51, rate=2000, parent_id=1, plan=plan)
+        
+        self.assertEqual(self.mock_subprocess.call_count, 2)
+        rollback = self.mock_subprocess.call_args_list[1]
+        self.assertEqual(rollback[0][0], ["tc", "-force", "-batch", "-"])
+        self.assertEqual(rollback[1]["input"].splitlines(), [
+            "filter del dev eth0 parent 1:0 protocol ip prio 5",
+            "qdisc del dev eth0 parent 1:50",
+            "class del dev eth0 classid 1:50",
+        ])
+        
+        # Replaced objects, such as the root qdisc, are kept; only added ones are deleted
+        self.mock_subprocess.side_effect = [
+            mock.Mock(stdout="[]", returncode=0),  # No qdisc yet
+            subprocess.CalledProcessError(1, ["tc"], stderr="Command failed -:5\n"),
+            mock.Mock(returncode=0),
+        ]
+        with self.assertLogs('charon.qos', level='ERROR'):
+            self.assertFalse(qos.setup_default_profile())
+        self.assertEqual(self.mock_subprocess.call_args[1]["input"].splitlines(), [
+            "qdisc del dev eth0 parent 1:10",
+            "class del dev eth0 classid 1:10",
+            "class del dev eth0 classid 1:1",
+        ])
+        
+        # Filters replaced by the plan are not deleted either
+        self.mock_subprocess.side_effect = [
+            subprocess.CalledProcessError(1, ["tc"], stderr="Command failed -:3\n"),
+            mock.Mock(returncode=0),
+        ]
+        with self.assertLogs('charon.qos', level='ERROR'):
+            with qos.plan() as plan:
+                plan.add_filter("1:0", 1, "flower", "ip_proto", "tcp", "dst_port", 22, "classid", "1:20",
+                                handle="786454", replace=True)
+                plan.add_filter("1:0", 1, "flower", "ip_proto", "tcp", "dst_port", 23, "classid", "1:20",
+                                handle="786455")
+                plan.add_class("1:1", "1:60", "htb", "rate", "1000kbit")
+        self.assertEqual(self.mock_subprocess.call_args[1]["input"],
+                         "filter del dev eth0 parent 1:0 protocol ip prio 1 handle 786455 flower\n")
+
+    
+    @mock_linux_permissions
+    def test_classify_hosts_u32(self):
+        """Test that hosts are classified through a two-level u32 hash table."""
+        self.mock_platform.return_value = 'Linux'
+        
+        qos = QoS(interface="eth0")
+        hosts = {f"10.0.{i // 250}.{i % 250 + 1}": 100 + i % 4 for i in range(1000)}
+        self.assertTrue(qos.classify_hosts(hosts, direction="dst"))
+        
+        self.mock_subprocess.assert_called_once()
+        script = self.mock_subprocess.call_args[1]["input"].splitlines()
+        # The top table, one table per third octet, the hosts, the links and the root link
+        self.assertEqual(len(script), 1 + 4 + 1000 + 4 + 1)
+        self.assertEqual(script[0], "filter add dev eth0 protocol ip parent 1:0 prio 10 handle 100: u32 divisor 256")
+        self.assertIn("filter add dev eth0 protocol ip parent 1:0 prio 10 u32 ht 103:1: "
+                      "match ip dst 10.0.2.1/32 flowid 1:100", script)
+        self.assertIn("filter add dev eth0 protocol ip parent 1:0 prio 10 u32 ht 100:2: "
+                      "match u32 0 0 hashkey mask 0x000000ff at 16 link 103:", script)
+        self.assertEqual(script[-1], "filter add dev eth0 protocol ip parent 1:0 prio 10 u32 "
+                                     "match u32 0 0 hashkey mask 0x0000ff00 at 16 link 100:")
+        
+        # Classifying again replaces the previous hosts
+        self.assertTrue(qos.classify_hosts({"10.0.0.1": 100}, direction="dst"))
+        script = self.mock_subprocess.call_args[1]["input"].splitlines()
+        self.assertEqual(script[0], "filter del dev eth0 parent 1:0 prio 10")
+        self.assertEqual(len(script), 1 + 5)
+        
+        with self.assertLogs('charon.qos', level='ERROR'):
+            self.assertFalse(qos.classify_hosts({"2001:db8::1": 100}))
+    
+    @mock_linux_permissions
+    def test_classify_flower(self):
+        """Test that hosts and ports are classified with flower filters."""
+        self.mock_platform.return_value = 'Linux'
+        
+        qos = QoS(interface="eth0")
+        plan = qos.plan()
+        self.assertTrue(qos.classify_hosts({"192.168.1.50": 50, "2001:db8::1": 51},
+                                           mode="flower", plan=plan))
+        self.assertTrue(qos.classify_ports({22: 10, 443: 20}, plan=plan))
+        self.mock_subprocess.assert_not_called()
+        self.assertEqual(plan.render().splitlines(), [
+            "filter add dev eth0 protocol ip parent 1:0 prio 10 flower src_ip 192.168.1.50 classid 1:50",
+            "filter add dev eth0 protocol ipv6 parent 1:0 prio 11 flower src_ip 2001:db8::1 classid 1:51",
+            "filter add dev eth0 protocol ip parent 1:0 prio 20 flower ip_proto tcp dst_port 22 classid 1:10",
+            "filter add dev eth0 protocol ip parent 1:0 prio 20 flower ip_proto tcp dst_port 443 classid 1:20",
+        ])
+    
+    @mock_linux_permissions
+    def test_set_total_bandwidth(self):
+        """Test that the total bandwidth is changed in place with class change commands."""
+        self.mock_platform.return_value = 'Linux'
+        
+        qos = QoS(interface="eth0", total_bandwidth=100)
+        self.assertTrue(qos.setup_default_profile())
+        self.mock_subprocess.reset_mock()
+        self.assertTrue(qos.set_total_bandwidth(50))
+        
+        self.mock_subprocess.assert_called_once()
+        self.assertEqual(self.mock_subprocess.call_args[0][0], ["tc", "-batch", "-"])
+        script = self.mock_subprocess.call_args[1]["input"].splitlines()
+        self.assertEqual(script[:2], [
+            "class change dev eth0 parent 1: classid 1:1 htb rate 50000kbit ceil 50000kbit",
+            "class change dev eth0 parent 1:1 classid 1:10 htb rate 10000kbit ceil 50000kbit prio 0",
+        ])
+        self.assertEqual(len(script), 5)
+        self.assertEqual(qos.total_bandwidth, 50)
+        
+        # A failed change keeps the previous bandwidth
+        self.mock_subprocess.side_effect = subprocess.CalledProcessError(1, ["tc"], stderr="Command failed -:1\n")
+        with self.assertLogs('charon.qos', level='ERROR'):
+            self.assertFalse(qos.set_total_bandwidth(25))
+        self.assertEqual(qos.total_bandwidth, 50)
+        self.assertFalse(qos.set_total_bandwidth(0))
+
 
 if __name__ == '__main__':
     unittest.main() 
\ No newline at end of file
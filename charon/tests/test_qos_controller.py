@@ -0,0 +1,94 @@
+"""
+Tests for the adaptive QoS bandwidth controller.
+"""
+
+import random
+from unittest import mock
+
+from charon.src.core.qos_controller import (
+    BandwidthController, LinkModel, RateController, load_trace, simulate
+)
+
+
+def capacity_drop_trace(seconds=700):
+    """A saturated link whose capacity drops from 100 to 50 Mbps between 120 s and 400 s."""
+    return [{"time": float(t), "capacity": 50.0 if 120 <= t < 400 else 100.0,
+             "offered": 200.0, "base_rtt": 10.0} for t in range(seconds)]
+
+
+def test_capacity_drop():
+    """Test that the rate follows a drop in capacity, bloat clears and the rate recovers."""
+    controller = RateController(95, 5, 95)
+    results = simulate(controller, capacity_drop_trace())
+
+    # Within 10 seconds of the drop the rate is below the new capacity
+    assert results[130]["rate"] < 50
+    # The queue drains and stays small while the capacity is low, apart from rare probes
+    bloated = [r for r in results[130:400] if r["rtt"] > 10 + controller.bloat_threshold]
+    assert len(bloated) <= 6
+    assert min(r["throughput"] for r in results[140:400]) > 35
+    # Once the capacity returns the rate climbs back
+    assert results[-1]["rate"] > 85
+    # The rate does not flap
+    assert controller.changes < 40
+
+
+def test_noise_below_threshold():
+    """Test that RTT jitter below the threshold on an idle link never changes the rate."""
+    controller = RateController(50, 5, 100)
+    rng = random.Random(1)
+    for second in range(600):
+        assert controller.update(float(second), 10.0, 20 + rng.uniform(0, 10)) is None
+    assert controller.rate == 50
+    assert controller.changes == 0
+
+
+def test_hold_off_and_clamping():
+    """Test decreases need consecutive samples, clamp to min_rate and hold off increases."""
+    controller = RateController(50, 20, 100, hold_off=10.0)
+    assert controller.update(0.0, 50, 10.0) is None
+    assert controller.update(1.0, 50, 40.0) is None
+    assert controller.update(2.0, 10, 40.0) == 20
+    # The link is loaded and latency is low again, but the hold-off is running
+    for second in range(3, 12):
+        assert controller.update(float(second), 20, 10.0) is None
+    assert controller.update(12.0, 20, 10.0) == 21
+    assert controller.update(13.0, 20, None) is None
+
+
+def test_load_trace(tmp_path):
+    """Test that a CSV trace is loaded as float rows."""
+    path = tmp_path / "trace.csv"
+    path.write_text("time,capacity,offered,base_rtt\n0,100,80,12.5\n1,90,80,12.5\n")
+    trace = load_trace(str(path))
+    assert trace == [{"time": 0.0, "capacity": 100.0, "offered": 80.0, "base_rtt": 12.5},
+                     {"time": 1.0, "capacity": 90.0, "offered": 80.0, "base_rtt": 12.5}]
+    results = simulate(RateController(100, 10, 100), trace, LinkModel())
+    assert [r["throughput"] for r in results] == [80.0, 80.0]
+
+
+def test_bandwidth_controller_step():
+    """Test that the controller turns counters into throughput and applies new rates."""
+    qos = mock.Mock(interface="eth0", total_bandwidth=100.0)
+    qos.set_total_bandwidth.return_value = True
+    rtts = iter([10.0, 10.0, 50.0, 50.0])
+    controller = BandwidthController(qos, "192.0.2.1", probe=lambda: next(rtts))
+
+    counters = iter([0, 6_250_000, 12_500_000, 18_750_000])  # 50 Mbps
+    with mock.patch('charon.src.core.qos_controller.read_interface_bytes',
+                    side_effect=lambda interface, direction: next(counters)):
+        assert controller.step(now=0.0) is False
+        assert controller.step(now=1.0) is False
+        assert controller.step(now=2.0) is False
+        assert controller.step(now=3.0) is True
+    qos.set_total_bandwidth.assert_called_once_with(45.0)
+
+    # A failed tc change resets the controller to the configured bandwidth
+    qos.set_total_bandwidth.return_value = False
+    controller.rate_controller.rate = 45.0
+    controller._bytes, controller._time = 0, 0.0
+    controller.rate_controller._bloated = 1
+    controller.probe = lambda: 80.0
+    with mock.patch('charon.src.core.qos_controller.read_interface_bytes', return_value=1_250_000):
+        assert controller.step(now=1.0) is False
+    assert controller.rate_controller.rate == 100.0
@@ -0,0 +1,124 @@
+"""
+Tests for the per-host fair share mode of the QoS module.
+"""
+
+import subprocess
+from unittest import mock
+
+import pytest
+
+from charon.src.core.qos import QoS
+from charon.src.core.qos_fairshare import (
+    FIRST_HOST_CLASS, HostFairShare, read_arp_hosts, read_conntrack_hosts
+)
+
+
+@pytest.fixture
+def mock_run():
+    with mock.patch('platform.system', return_value='Linux'), \
+         mock.patch('subprocess.run') as run:
+        run.return_value = mock.Mock(returncode=0, stdout="", stderr="")
+        yield run
+
+
+def batch(mock_run):
+    """The tc batch script of the last call."""
+    assert mock_run.call_args[0][0] == ["tc", "-batch", "-"]
+    return mock_run.call_args[1]["input"].splitlines()
+
+
+def test_hosts_added_and_reclaimed(mock_run):
+    """Test that hosts get a class and filter when they appear and lose them when idle."""
+    qos = QoS(interface="eth1", total_bandwidth=100)
+    fair = HostFairShare(qos, ["192.168.1.0/24", "2001:db8::/64"], idle_timeout=60)
+
+    assert fair.update(["192.168.1.20", "2001:db8::5"], now=0.0)
+    assert batch(mock_run) == [
+        "class add dev eth1 parent 1:2 classid 1:1000 htb rate 1000kbit ceil 100000kbit prio 0",
+        "qdisc add dev eth1 parent 1:1000 handle 1000: sfq perturb 10",
+        "filter add dev eth1 protocol ip parent 1:0 prio 100 handle 1000 flower dst_ip 192.168.1.20 classid 1:1000",
+        "class add dev eth1 parent 1:2 classid 1:1001 htb rate 1000kbit ceil 100000kbit prio 0",
+        "qdisc add dev eth1 parent 1:1001 handle 1001: sfq perturb 10",
+        "filter add dev eth1 protocol ipv6 parent 1:0 prio 101 handle 1001 flower dst_ip 2001:db8::5 classid 1:1001",
+    ]
+    assert fair.hosts == {"192.168.1.20": 1000, "2001:db8::5": 1001}
+
+    # Nothing changed: no tc call at all
+    mock_run.reset_mock()
+    assert fair.update(["192.168.1.20"], now=30.0)
+    mock_run.assert_not_called()
+
+    # The IPv6 host went idle and its class is reused for a new host in the same batch
+    assert fair.update(["192.168.1.20", "192.168.1.30"], now=61.0)
+    assert batch(mock_run) == [
+        "filter del dev eth1 parent 1:0 protocol ipv6 prio 101 handle 1001 flower",
+        "class del dev eth1 classid 1:1001",
+        "class add dev eth1 parent 1:2 classid 1:1001 htb rate 1000kbit ceil 100000kbit prio 0",
+        "qdisc add dev eth1 parent 1:1001 handle 1001: sfq perturb 10",
+        "filter add dev eth1 protocol ip parent 1:0 prio 100 handle 1001 flower dst_ip 192.168.1.30 classid 1:1001",
+    ]
+    assert fair.hosts == {"192.168.1.20": 1000, "192.168.1.30": 1001}
+    assert sorted(qos.classes) == [1000, 1001]
+
+
+def test_failed_update_rolls_back(mock_run):
+    """Test that a rejected batch undoes the new classes and frees their identifiers."""
+    qos = QoS(interface="eth1", total_bandwidth=100)
+    fair = HostFairShare(qos, ["192.168.1.0/24"])
+    mock_run.side_effect = [
+        subprocess.CalledProcessError(1, ["tc"], stderr="Command failed -:6\n"),
+        mock.Mock(returncode=0),
+    ]
+    assert fair.update(["192.168.1.20", "192.168.1.21"], now=0.0) is False
+
+    rollback = mock_run.call_args_list[1]
+    assert rollback[0][0] == ["tc", "-force", "-batch", "-"]
+    assert rollback[1]["input"].splitlines() == [
+        "qdisc del dev eth1 parent 1:1001",
+        "class del dev eth1 classid 1:1001",
+        "filter del dev eth1 parent 1:0 protocol ip prio 100 handle 1000 flower",
+        "qdisc del dev eth1 parent 1:1000",
+        "class del dev eth1 classid 1:1000",
+    ]
+    assert fair.hosts == {} and qos.classes == {}
+
+    # The hosts are retried with the same identifiers
+    mock_run.side_effect = None
+    assert fair.update([], now=1.0)
+    assert sorted(fair.hosts.values()) == [1000, 1001]
+
+
+def test_max_hosts(mock_run):
+    """Test that hosts beyond max_hosts are left unshaped until a class is free."""
+    qos = QoS(interface="eth1")
+    fair = HostFairShare(qos, ["10.0.0.0/8"], max_hosts=2, idle_timeout=10)
+    with mock.patch('charon.src.core.qos_fairshare.logger') as logger:
+        assert fair.update(["10.0.0.1", "10.0.0.2", "10.0.0.3"], now=0.0)
+        logger.warning.assert_called_once()
+    assert set(fair.hosts) == {"10.0.0.1", "10.0.0.2"}
+
+    assert fair.update(["10.0.0.2", "10.0.0.3"], now=11.0)
+    assert fair.hosts == {"10.0.0.2": FIRST_HOST_CLASS + 1, "10.0.0.3": FIRST_HOST_CLASS}
+
+
+def test_discover(tmp_path, mock_run):
+    """Test that hosts are read from ARP and conntrack and limited to the LAN networks."""
+    arp = tmp_path / "arp"
+    arp.write_text("IP address       HW type     Flags       HW address            Mask     Device\n"
+                   "192.168.1.20     0x1         0x2         aa:bb:cc:dd:ee:01     *        eth1\n"
+                   "192.168.1.21     0x1         0x0         00:00:00:00:00:00     *        eth1\n")
+    conntrack = tmp_path / "nf_conntrack"
+    conntrack.write_text("ipv4     2 tcp      6 431999 ESTABLISHED src=192.168.1.30 dst=93.184.216.34 "
+                         "sport=51000 dport=443 src=93.184.216.34 dst=203.0.113.7 sport=443 dport=51000 "
+                         "[ASSURED] mark=0 use=1\n")
+    assert read_arp_hosts(str(arp)) == {"192.168.1.20"}
+    assert read_conntrack_hosts(str(conntrack)) == {"192.168.1.30", "93.184.216.34", "203.0.113.7"}
+
+    fair = HostFairShare(QoS(interface="eth1"), ["192.168.1.0/24"])
+    with mock.patch('charon.src.core.qos_fairshare.read_arp_hosts', lambda: read_arp_hosts(str(arp))), \
+         mock.patch('charon.src.core.qos_fairshare.read_conntrack_hosts', side_effect=OSError("missing")):
+        assert fair.discover() == {"192.168.1.20"}
+    with mock.patch('charon.src.core.qos_fairshare.read_arp_hosts', lambda: read_arp_hosts(str(arp))), \
+         mock.patch('charon.src.core.qos_fairshare.read_conntrack_hosts',
+                    lambda: read_conntrack_hosts(str(conntrack))):
+        assert fair.discover() == {"192.168.1.20", "192.168.1.30"}
@@ -0,0 +1,125 @@
+"""
+Tests for the QoS profile engine.
+"""
+
+import json
+from unittest import mock
+
+import pytest
+
+from charon.src.core.qos import QoS
+from charon.src.core.qos_profiles import (
+    PROFILES, ProfileEngine, ProfileError, filter_handle, list_profiles, validate_profile
+)
+
+
+@pytest.fixture
+def qos():
+    with mock.patch('platform.system', return_value='Linux'), mock.patch('os.geteuid', return_value=0):
+        yield QoS(interface="eth0", total_bandwidth=100)
+
+
+def tc_json(engine, profile_id, root_rate=100000, u32=False):
+    """Build `tc -j` qdisc, class and filter output for a hierarchy running a profile."""
+    compiled = engine.compile(profile_id)
+    qdiscs = [{"kind": "htb", "handle": "1:", "root": True, "options": {"r2q": 10, "default": "0x30"}},
+              *({"kind": "sfq", "handle": f"{c}:", "parent": f"1:{c}"} for c in compiled.classes)]
+    classes = [{"class": "htb", "handle": "1:1", "root": True, "rate": root_rate * 125, "ceil": root_rate * 125}]
+    for class_id, settings in compiled.classes.items():
+        classes.append({"class": "htb", "handle": f"1:{class_id}", "parent": "1:1", "leaf": f"{class_id}:",
+                        "prio": settings["priority"], "rate": settings["rate"] * 125,
+                        "ceil": settings["ceiling"] * 125})
+    filters = [{"protocol": "ip", "pref": 1, "kind": "u32" if u32 else "flower", "chain": 0}]
+    if u32:
+        filters.append({"protocol": "ip", "pref": 1, "kind": "u32", "chain": 0,
+                        "options": {"fh": "800::800", "order": 2048, "flowid": "1:10"}})
+    else:
+        for handle, match in compiled.filters.items():
+            filters.append({"protocol": "ip", "pref": 1, "kind": "flower", "chain": 0, "options": {
+                "handle": hex(handle), "classid": f"1:{match['class_id']}",
+                "keys": {"eth_type": "ipv4", "ip_proto": match["protocol"], "dst_port": match["port"]}}})
+    return json.dumps(qdiscs), json.dumps(classes), json.dumps(filters)
+
+
+def test_builtin_profiles():
+    """Test that the built-in profiles are valid and listed."""
+    for profile in PROFILES.values():
+        validate_profile(profile)
+    assert [p["id"] for p in list_profiles()] == ["default", "gaming", "streaming", "voip", "bulk"]
+
+
+@pytest.mark.parametrize("classes, error", [
+    ([{"id": 10, "rate": 50}], "default class"),
+    ([{"id": 30, "rate": 60}, {"id": 10, "rate": 50}], "add up"),
+    ([{"id": 30, "rate": 50, "ceil": 40}], "rate <= ceil"),
+    ([{"id": 5, "rate": 50}], "identifiers"),
+    ([{"id": 30, "rate": 10, "match": [{"protocol": "tcp", "ports": [22]}]},
+      {"id": 10, "rate": 10, "match": [{"protocol": "tcp", "ports": [22]}]}], "two classes"),
+    ([{"id": 30, "rate": 10, "match": [{"protocol": "icmp", "ports": [1]}]}], "invalid match"),
+])
+def test_invalid_profiles(classes, error):
+    """Test that invalid profile documents are rejected."""
+    with pytest.raises(ProfileError, match=error):
+        validate_profile({"classes": classes})
+
+
+def test_parse_live(qos):
+    """Test that tc JSON output is parsed into the live hierarchy."""
+    engine = ProfileEngine(qos)
+    live = engine.parse_live(*tc_json(engine, "default"))
+    assert live["root_rate"] == 100000
+    assert live["classes"][10] == {"rate": 20000, "ceiling": 100000, "priority": 0}
+    assert live["filters"][filter_handle("tcp", "dst", 22)] == 10
+    assert not live["foreign"]
+
+    assert engine.parse_live("[]", "[]", "[]") is None
+    qdisc = json.dumps([{"kind": "fq_codel", "handle": "0:", "root": True}])
+    assert engine.parse_live(qdisc, "[]", "[]") is None
+
+
+def test_switch_profile_is_a_diff(qos):
+    """Test that switching profiles changes classes in place and keeps the root qdisc."""
+    engine = ProfileEngine(qos)
+    plan = engine.diff(engine.compile("gaming"), engine.parse_live(*tc_json(engine, "default")))
+    script = plan.render().splitlines()
+
+    assert not any(line.startswith("qdisc") for line in script)
+    assert "class change dev eth0 parent 1:1 classid 1:10 htb rate 40000kbit ceil 100000kbit prio 0" in script
+    assert "class change dev eth0 parent 1:1 classid 1:40 htb rate 10000kbit ceil 50000kbit prio 3" in script
+    assert (f"filter add dev eth0 protocol ip parent 1:0 prio 1 handle {filter_handle('udp', 'dst', 3074)} "
+            "flower ip_proto udp dst_port 3074 classid 1:10") in script
+    assert (f"filter del dev eth0 parent 1:0 protocol ip prio 1 handle {filter_handle('udp', 'dst', 5060)} "
+            "flower") in script
+    # Ports that stay in the same class are not touched
+    assert not any("dst_port 22 " in line or "dst_port 6881 " in line for line in script)
+
+    # Class 40 goes away after its port moved to another class
+    script = engine.diff(engine.compile("bulk"), engine.parse_live(*tc_json(engine, "gaming"))).render()
+    script = script.splitlines()
+    assert (f"filter replace dev eth0 protocol ip parent 1:0 prio 1 handle {filter_handle('tcp', 'dst', 6881)} "
+            "flower ip_proto tcp dst_port 6881 classid 1:20") in script
+    assert script[-1] == "class del dev eth0 classid 1:40"
+
+
+def test_apply(qos):
+    """Test that applying the running profile changes nothing and old filters are replaced."""
+    engine = ProfileEngine(qos)
+    outputs = tc_json(engine, "default")
+    with mock.patch('subprocess.run') as run:
+        run.side_effect = [mock.Mock(stdout=output, returncode=0) for output in outputs]
+        assert qos.apply_profile("default")
+        assert run.call_count == 3  # Only reads
+    assert sorted(qos.classes) == [10, 20, 30, 40]
+
+    # u32 filters at the profile priority and a slower link
+    outputs = tc_json(engine, "default", root_rate=50000, u32=True)
+    with mock.patch('subprocess.run') as run:
+        run.side_effect = [*(mock.Mock(stdout=output, returncode=0) for output in outputs),
+                           mock.Mock(returncode=0)]
+        assert qos.apply_profile("default")
+        script = run.call_args[1]["input"].splitlines()
+    assert script[0] == "class change dev eth0 parent 1: classid 1:1 htb rate 100000kbit ceil 100000kbit"
+    assert "filter del dev eth0 parent 1:0 protocol ip prio 1" in script
+    assert sum(line.startswith("filter add") for line in script) == 6
+
+    assert qos.apply_profile("unknown") is False
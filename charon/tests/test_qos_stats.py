@@ -0,0 +1,126 @@
+"""
+Tests for the QoS statistics module.
+"""
+
+import json
+from unittest import mock
+
+import pytest
+
+from charon.src.core.qos_stats import (
+    RESOLUTION_COARSE, QoSStatsCollector, is_host_class, parse_class_stats
+)
+
+
+def tc_output(classes):
+    """Build `tc -s -j class show` output for {handle: (bytes, packets, drops, overlimits, backlog)}."""
+    entries = []
+    for handle, (nbytes, packets, drops, overlimits, backlog) in classes.items():
+        entry = {"class": "htb", "handle": handle, "prio": 0, "rate": 125000,
+                 "stats": {"bytes": nbytes, "packets": packets, "drops": drops,
+                           "overlimits": overlimits, "requeues": 0, "backlog": backlog, "qlen": 0}}
+        if handle == "1:1":
+            entry["root"] = True
+        else:
+            entry["parent"] = "1:1"
+        entries.append(entry)
+    return json.dumps(entries)
+
+
+def test_parse_class_stats():
+    """Test that tc JSON output is parsed into per-class counters."""
+    classes = parse_class_stats(tc_output({"1:1": (1000, 10, 1, 2, 0), "1:10": (600, 6, 0, 1, 300)}))
+    assert classes["1:1"]["parent"] == "root"
+    assert classes["1:10"] == {"kind": "htb", "parent": "1:1", "bytes": 600, "packets": 6, "drops": 0,
+                               "overlimits": 1, "backlog": 300, "qlen": 0}
+    assert parse_class_stats("") == {}
+
+
+def test_rates_and_history():
+    """Test that counter increments become rates in the fine and coarse rings."""
+    collector = QoSStatsCollector("eth0", interval=1, fine_span=4, coarse_interval=3, coarse_span=9)
+    for second in range(7):
+        collector.record(parse_class_stats(tc_output({
+            "1:10": (1000 * second, 10 * second, 0, second // 2, second),
+        })), now=100.0 + second)
+
+    latest = collector.latest()["1:10"]
+    assert latest["bytes"] == 6000 and latest["bytes_per_sec"] == 1000.0
+    assert latest["packets_per_sec"] == 10.0
+
+    # The fine ring keeps the last 4 samples
+    history = collector.history("1:10")
+    assert history["time"] == [103.0, 104.0, 105.0, 106.0]
+    assert history["bytes_per_sec"] == [1000.0] * 4
+    assert history["overlimits_per_sec"] == [0.0, 1.0, 0.0, 1.0]
+    assert history["backlog"] == [3.0, 4.0, 5.0, 6.0]
+    assert collector.history("1:10", since=105)["time"] == [105.0, 106.0]
+
+    coarse = collector.history("1:10", RESOLUTION_COARSE)
+    assert coarse["time"] == [103.0, 106.0]
+    assert coarse["bytes_per_sec"] == [1000.0, 1000.0]
+    assert coarse["overlimits_per_sec"] == pytest.approx([1 / 3, 2 / 3])
+    assert collector.history("1:99") == {}
+
+
+def test_reset_and_missing_classes():
+    """Test counter resets, classes that come and go, and expiry of old classes."""
+    collector = QoSStatsCollector("eth0", interval=1, fine_span=3)
+    collector.record(parse_class_stats(tc_output({"1:10": (5000, 50, 0, 0, 0)})), now=0.0)
+    # The class was recreated: its counters restarted from zero
+    collector.record(parse_class_stats(tc_output({"1:10": (200, 2, 0, 0, 0), "1:20": (0, 0, 0, 0, 0)})),
+                     now=1.0)
+    assert collector.latest()["1:10"]["bytes_per_sec"] == 200.0
+    assert collector.latest()["1:20"]["bytes_per_sec"] is None
+
+    collector.record(parse_class_stats(tc_output({"1:20": (100, 1, 0, 0, 0)})), now=2.0)
+    assert collector.history("1:10")["bytes_per_sec"] == [200.0, None]
+    assert collector.history("1:20")["bytes_per_sec"] == [None, 100.0]
+
+    for now in (3.0, 4.0, 5.0):
+        collector.record(parse_class_stats(tc_output({"1:20": (100, 1, 0, 0, 0)})), now=now)
+    assert collector.history("1:10") == {}
+    assert "1:10" not in collector.latest()
+
+
+def test_history_limits():
+    """Test that per-host classes and classes beyond the limit only keep their latest sample."""
+    assert is_host_class("1:1000") and is_host_class("1:9999")
+    assert not is_host_class("1:10") and not is_host_class("1:10000") and not is_host_class("1:")
+
+    collector = QoSStatsCollector("eth0", interval=1, fine_span=3, coarse_interval=2, max_history_classes=2)
+    handles = ["1:1", "1:1000", "1:10", "1:20"]
+    for second in range(4):
+        collector.record(parse_class_stats(tc_output({
+            handle: (100 * second, second, 0, 0, 0) for handle in handles
+        })), now=float(second))
+
+    assert set(collector.latest()) == set(handles)
+    assert collector.latest()["1:1000"]["bytes_per_sec"] == 100.0
+    assert collector.latest()["1:20"]["bytes_per_sec"] == 100.0
+    assert set(collector.fine.values) == set(collector.coarse.values) == {"1:1", "1:10"}
+    assert collector.history("1:10")["bytes_per_sec"] == [100.0] * 3
+    assert collector.history("1:1000") == {} and collector.history("1:20", RESOLUTION_COARSE) == {}
+
+    # A class that expires makes room for another
+    for second in range(4, 10):
+        collector.record(parse_class_stats(tc_output({
+            handle: (100 * second, second, 0, 0, 0) for handle in ["1:1", "1:20"]
+        })), now=float(second))
+    assert set(collector.fine.values) == {"1:1", "1:20"}
+    assert collector.history("1:20")["bytes_per_sec"] == [None, 100.0, 100.0]
+
+
+@mock.patch('subprocess.run')
+def test_sample(mock_run):
+    """Test that a sample runs tc once and failures are counted."""
+    mock_run.return_value = mock.Mock(stdout=tc_output({"1:1": (0, 0, 0, 0, 0)}), returncode=0)
+    collector = QoSStatsCollector("eth0")
+    assert collector.sample(now=1.0) is True
+    mock_run.assert_called_once()
+    assert mock_run.call_args[0][0] == ["tc", "-s", "-j", "class", "show", "dev", "eth0"]
+
+    mock_run.return_value = mock.Mock(stdout="not json", returncode=0)
+    assert collector.sample(now=2.0) is False
+    assert collector.errors == 1
+    assert list(collector.latest()) == ["1:1"]
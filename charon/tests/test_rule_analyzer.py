@@ -0,0 +1,178 @@
+"""
+Tests for the rule analyzer module.
+"""
+
+import random
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from charon.src.core import rule_analyzer
+from charon.src.core.rule_analyzer import IntervalIndex, RuleAnalysisCache, RuleAnalyzer, RuleAnomaly
+from charon.src.core.rule_match import RuleMatch
+
+
+def make_rule(rule_id, chain='input', action='accept', protocol=None, src_ip=None,
+              dst_ip=None, src_port=None, dst_port=None, enabled=True):
+    """Create an object with the attributes of a FirewallRule row."""
+    return SimpleNamespace(id=rule_id, chain=chain, action=action, protocol=protocol,
+                           src_ip=src_ip, dst_ip=dst_ip, src_port=src_port,
+                           dst_port=dst_port, enabled=enabled)
+
+
+def findings(anomalies):
+    return {(a.kind, a.rule_id, a.related_rule_id) for a in anomalies}
+
+
+def test_interval_index():
+    """Test overlap queries against a brute-force scan."""
+    rng = random.Random(7)
+    intervals = []
+    for item in range(500):
+        start = rng.randrange(10000)
+        intervals.append((start, start + rng.choice([0, 10, 255, 4000]), item))
+    index = IntervalIndex(intervals)
+
+    for _ in range(200):
+        start = rng.randrange(12000)
+        end = start + rng.randrange(300)
+        expected = sorted(item for s, e, item in intervals if s <= end and start <= e)
+        assert sorted(index.query(start, end)) == expected
+        assert index.count(start, end) == len(expected)
+
+
+def test_shadowed_and_redundant():
+    """Test rules fully covered by earlier rules."""
+    rules = [
+        make_rule(1, action='drop', src_ip='10.0.0.0/8'),
+        make_rule(2, protocol='tcp', src_ip='10.1.2.3', dst_port='22'),
+        make_rule(3, action='drop', src_ip='10.2.0.0/16'),
+        make_rule(4, protocol='tcp', src_ip='192.168.1.5', dst_port='22'),
+    ]
+
+    assert findings(RuleAnalyzer().analyze(rules)) == {
+        (RuleAnomaly.SHADOWED, 2, 1),
+        (RuleAnomaly.REDUNDANT, 3, 1),
+    }
+
+
+def test_redundant_by_later_rule():
+    """Test a rule covered by a later rule with the same verdict."""
+    rules = [
+        make_rule(1, protocol='tcp', dst_port='80'),
+        make_rule(2, protocol='udp', dst_port='53'),
+        make_rule(3, protocol='tcp', dst_port='80-443'),
+    ]
+    assert findings(RuleAnalyzer().analyze(rules)) == {(RuleAnomaly.REDUNDANT, 1, 3)}
+
+    # A conflicting rule in between keeps the first rule necessary
+    rules = [
+        make_rule(1, protocol='tcp', dst_port='80'),
+        make_rule(2, action='drop', protocol='tcp', src_ip='10.0.0.1', dst_port='80'),
+        make_rule(3, protocol='tcp', dst_port='80-443'),
+    ]
+    assert findings(RuleAnalyzer().analyze(rules)) == {(RuleAnomaly.SHADOWED, 2, 1)}
+
+
+def test_correlated():
+    """Test partially overlapping rules with different verdicts."""
+    rules = [
+        make_rule(1, protocol='tcp', src_ip='10.0.0.0/24'),
+        make_rule(2, action='drop', protocol='tcp', dst_port='22'),
+        make_rule(3, action='drop', chain='forward', protocol='tcp', dst_port='22'),
+    ]
+    assert findings(RuleAnalyzer().analyze(rules)) == {(RuleAnomaly.CORRELATED, 2, 1)}
+
+
+def test_ignores_disabled_and_other_families():
+    """Test that disabled rules and disjoint address families are skipped."""
+    rules = [
+        make_rule(1, action='drop', enabled=False),
+        make_rule(2, action='drop', src_ip='2001:db8::/32'),
+        make_rule(3, src_ip='10.0.0.1'),
+    ]
+    assert RuleAnalyzer().analyze(rules) == []
+
+
+@pytest.mark.parametrize('prefix_rules, scan_limit', [(1024, 16), (40, 4), (0, 0)])
+def test_matches_pairwise_reference(monkeypatch, prefix_rules, scan_limit):
+    """Test the indexed analysis against a quadratic reference, with and without bitmaps."""
+    monkeypatch.setattr(rule_analyzer, 'PREFIX_RULES', prefix_rules)
+    monkeypatch.setattr(rule_analyzer, 'SCAN_LIMIT', scan_limit)
+    rng = random.Random(3)
+    rules = []
+    for rule_id in range(1, 400):
+        rules.append(make_rule(
+            rule_id, action=rng.choice(['accept', 'drop']), protocol=rng.choice(['tcp', 'udp', None]),
+            src_ip=rng.choice([None, f'10.{rng.randrange(3)}.0.0/16', f'10.{rng.randrange(3)}.0.{rng.randrange(8)}']),
+            dst_port=rng.choice([None, str(rng.randrange(20)), f'{rng.randrange(10)}-{rng.randrange(10, 30)}'])
+        ))
+    matches = [RuleMatch.from_rule(rule) for rule in rules]
+
+    expected = set()
+    for j, match in enumerate(matches):
+        earlier = [m for m in matches[:j] if m.overlaps(match)]
+        cover = next((m for m in earlier if m.covers(match)), None)
+        if cover:
+            kind = RuleAnomaly.REDUNDANT if cover.action == match.action else RuleAnomaly.SHADOWED
+            expected.add((kind, match.rule_id, cover.rule_id))
+            continue
+        expected.update((RuleAnomaly.CORRELATED, match.rule_id, m.rule_id) for m in earlier
+                        if m.action != match.action and not match.covers(m))
+        for later in (m for m in matches[j + 1:] if m.overlaps(match)):
+            if later.action != match.action:
+                break
+            if later.covers(match):
+                expected.add((RuleAnomaly.REDUNDANT, match.rule_id, later.rule_id))
+                break
+
+    assert findings(RuleAnalyzer().analyze(rules)) == expected
+
+
+def test_report():
+    """Test the summary returned to the API."""
+    report = RuleAnalyzer().report([make_rule(1, action='drop'), make_rule(2, dst_port='22')])
+    assert report['rules'] == 2
+    assert report['shadowed'] == [{'kind': 'shadowed', 'rule_id': 2, 'related_rule_id': 1, 'chain': 'input'}]
+    assert report['redundant'] == [] and report['correlated'] == []
+    assert 'elapsed' in report
+
+
+def test_analysis_cache():
+    """Test that reports are reused until the rules version changes."""
+    rules = [make_rule(1, action='drop'), make_rule(2, dst_port='22')]
+    calls = []
+    db = SimpleNamespace(get_rules_version=lambda: (len(rules), rules[-1].id),
+                         get_rules=lambda: calls.append(1) or list(rules))
+    cache = RuleAnalysisCache()
+
+    first = cache.report(db)
+    assert cache.report(db) is first and len(calls) == 1
+    rules.append(make_rule(3, dst_port='80'))
+    assert len(cache.report(db)['shadowed']) == 2 and len(calls) == 2
+
+
+def test_analysis_cache_serves_last_report_while_analyzing():
+    """Test that requests get the previous report while the changed rules are analyzed."""
+    rules = [make_rule(1, action='drop')]
+    started, release = threading.Event(), threading.Event()
+
+    def get_rules():
+        if len(rules) > 1:
+            started.set()
+            release.wait(5)
+        return list(rules)
+
+    db = SimpleNamespace(get_rules_version=lambda: len(rules), get_rules=get_rules)
+    cache = RuleAnalysisCache()
+    first = cache.report(db)
+
+    rules.append(make_rule(2, dst_port='22'))
+    worker = threading.Thread(target=cache.report, args=(db,))
+    worker.start()
+    assert started.wait(5)
+    assert cache.report(db) is first
+    release.set()
+    worker.join(5)
+    assert len(cache.report(db)['shadowed']) == 1
@@ -0,0 +1,104 @@
+"""
+Tests for the rule evaluator module.
+"""
+
+import random
+from types import SimpleNamespace
+
+import pytest
+
+from charon.src.core import rule_evaluator
+from charon.src.core.rule_evaluator import RuleEvaluator, Verdict
+from charon.src.core.rule_match import RuleMatch
+
+
+def make_rule(rule_id, chain='input', action='accept', protocol=None, src_ip=None,
+              dst_ip=None, src_port=None, dst_port=None, enabled=True):
+    """Create an object with the attributes of a FirewallRule row."""
+    return SimpleNamespace(id=rule_id, chain=chain, action=action, protocol=protocol,
+                           src_ip=src_ip, dst_ip=dst_ip, src_port=src_port,
+                           dst_port=dst_port, enabled=enabled)
+
+
+def flow(protocol='tcp', src_ip='192.168.1.10', dst_ip='10.0.0.1', src_port=40000,
+         dst_port=22, chain='input'):
+    return {'chain': chain, 'protocol': protocol, 'src_ip': src_ip, 'dst_ip': dst_ip,
+            'src_port': src_port, 'dst_port': dst_port}
+
+
+RULES = [
+    make_rule(1, action='drop', src_ip='203.0.113.0/24'),
+    make_rule(2, protocol='tcp', src_ip='192.168.1.0/24', dst_port='22'),
+    make_rule(3, protocol='udp', dst_port='53'),
+    make_rule(4, action='reject', dst_port='8000-8100'),
+    make_rule(5, protocol='icmp'),
+    make_rule(6, src_ip='2001:db8::/32'),
+    make_rule(7, action='return', dst_ip='10.0.0.99'),
+    make_rule(8, chain='forward', dst_ip='10.1.0.0/16'),
+    make_rule(9, action='drop', protocol='tcp', dst_port='443', enabled=False),
+]
+
+
+def test_evaluate_one():
+    """Test first-match evaluation of single flows."""
+    evaluator = RuleEvaluator(RULES)
+
+    assert evaluator.evaluate_one(flow()) == Verdict(2, 'accept')
+    assert evaluator.evaluate_one(flow(src_ip='203.0.113.7')) == Verdict(1, 'drop')
+    assert evaluator.evaluate_one(flow(src_ip='192.168.2.1')) == Verdict(None, 'drop')
+    assert evaluator.evaluate_one(flow(protocol='udp', dst_port=53)) == Verdict(3, 'accept')
+    assert evaluator.evaluate_one(flow(protocol='tcp', dst_port=53)) == Verdict(None, 'drop')
+    assert evaluator.evaluate_one(flow(protocol='udp', dst_port=8080)) == Verdict(4, 'reject')
+    assert evaluator.evaluate_one(flow(protocol='icmp', src_port=None, dst_port=None)) == Verdict(5, 'accept')
+    assert evaluator.evaluate_one(flow(src_ip='2001:db8::1', dst_ip='2001:db8::2')) == Verdict(6, 'accept')
+    assert evaluator.evaluate_one(flow(dst_ip='10.0.0.99', dst_port=1)) == Verdict(7, 'drop')
+    assert evaluator.evaluate_one(flow(chain='forward', dst_ip='10.1.2.3')) == Verdict(8, 'accept')
+    assert evaluator.evaluate_one(flow(dst_port=443, src_ip='1.1.1.1')) == Verdict(None, 'drop')
+
+
+def test_evaluate_batch_matches_single():
+    """Test that batch evaluation agrees with single-flow evaluation."""
+    evaluator = RuleEvaluator(RULES, policy='accept')
+    flows = [flow(), flow(src_ip='203.0.113.7'), flow(protocol='udp', dst_port=53),
+             flow(src_ip='2001:db8::1', dst_ip='2001:db8::2'), flow(chain='output'),
+             flow(protocol='icmp', src_port=None, dst_port=None), flow(chain='bogus')]
+
+    assert evaluator.evaluate(flows) == [evaluator.evaluate_one(f) for f in flows]
+
+
+def reference(rules, f):
+    """Evaluate a flow by checking every rule in order."""
+    packet = RuleMatch.from_rule(make_rule(0, protocol=f['protocol'], src_ip=f['src_ip'],
+                                           dst_ip=f['dst_ip'], src_port=str(f['src_port']),
+                                           dst_port=str(f['dst_port'])))
+    for rule in rules:
+        match = RuleMatch.from_rule(rule)
+        if match.chain == f['chain'] and match.covers(packet):
+            return Verdict(rule.id, match.action)
+    return Verdict(None, 'drop')
+
+
+@pytest.mark.parametrize('use_numpy', [True, False])
+def test_evaluate_random(monkeypatch, use_numpy):
+    """Test both evaluation paths against a brute-force reference."""
+    if use_numpy and rule_evaluator.np is None:
+        pytest.skip("NumPy not installed")
+    if not use_numpy:
+        monkeypatch.setattr(rule_evaluator, 'np', None)
+
+    rng = random.Random(42)
+    rules = []
+    for rule_id in range(1, 301):
+        low = rng.randrange(0, 1000)
+        rules.append(make_rule(
+            rule_id, action=rng.choice(['accept', 'drop', 'reject']),
+            protocol=rng.choice(['tcp', 'udp', None]),
+            src_ip=rng.choice([None, f'10.{rng.randrange(4)}.0.0/16', f'10.0.{rng.randrange(4)}.{rng.randrange(256)}']),
+            dst_port=rng.choice([None, str(low), f'{low}-{low + rng.randrange(200)}'])
+        ))
+    flows = [flow(protocol=rng.choice(['tcp', 'udp']),
+                  src_ip=f'10.{rng.randrange(4)}.{rng.randrange(4)}.{rng.randrange(256)}',
+                  dst_port=rng.randrange(0, 1200)) for _ in range(2000)]
+
+    evaluator = RuleEvaluator(rules)
+    assert evaluator.evaluate(flows) == [reference(rules, f) for f in flows]
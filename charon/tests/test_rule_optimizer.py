@@ -0,0 +1,110 @@
+"""
+Tests for the rule optimizer and rule match modules.
+"""
+
+from types import SimpleNamespace
+
+from charon.src.core.rule_match import RuleMatch, format_addresses, parse_addresses, parse_ports
+from charon.src.core.rule_optimizer import RuleOptimizer
+from charon.src.core.ruleset_compiler import RulesetCompiler
+
+
+def make_rule(rule_id, chain='input', action='accept', protocol=None, src_ip=None,
+              dst_ip=None, src_port=None, dst_port=None, enabled=True):
+    """Create an object with the attributes of a FirewallRule row."""
+    return SimpleNamespace(id=rule_id, chain=chain, action=action, protocol=protocol,
+                           src_ip=src_ip, dst_ip=dst_ip, src_port=src_port,
+                           dst_port=dst_port, enabled=enabled)
+
+
+def test_parse_and_format():
+    """Test converting columns to intervals and back."""
+    version, intervals = parse_addresses("10.0.0.0/25, 10.0.0.128/25,10.0.1.1")
+    assert version == 4
+    assert format_addresses(version, intervals) == ["10.0.0.0/24", "10.0.1.1"]
+    assert parse_addresses("any") == (None, None)
+    assert parse_ports("80,81,100-200") == [(80, 81), (100, 200)]
+    assert parse_ports(None) is None
+
+
+def test_rule_match_overlaps_and_covers():
+    """Test comparing the packets matched by two rules."""
+    broad = RuleMatch.from_rule(make_rule(1, protocol='tcp', src_ip='10.0.0.0/8'))
+    narrow = RuleMatch.from_rule(make_rule(2, protocol='tcp', src_ip='10.1.0.0/16', dst_port='22'))
+    other = RuleMatch.from_rule(make_rule(3, protocol='udp', src_ip='10.1.0.0/16'))
+
+    assert broad.overlaps(narrow)
+    assert broad.covers(narrow)
+    assert not narrow.covers(broad)
+    assert not broad.overlaps(other)
+
+
+def test_optimize_groups_sources():
+    """Test collapsing rules that differ only by source address."""
+    rules = [make_rule(i, action='drop', protocol='tcp', src_ip=f'10.0.0.{i}', dst_port='22')
+             for i in range(1, 5)]
+    rules.append(make_rule(5, protocol='tcp', dst_port='443'))
+
+    model, report = RuleOptimizer().optimize(rules)
+
+    assert [rule.expr for rule in model.chains['input']] == [
+        "ip saddr { 10.0.0.1, 10.0.0.2/31, 10.0.0.4 } meta l4proto tcp tcp dport 22 counter drop",
+        "meta l4proto tcp tcp dport 443 counter accept",
+    ]
+    assert model.chains['input'][0].rule_id == 1
+    assert report.input_rules == 5
+    assert report.output_rules == 2
+    assert report.collapsed == 3
+    assert report.groups == [{'chain': 'input', 'field': 'src_ip', 'rule_ids': [1, 2, 3, 4]}]
+
+
+def test_optimize_groups_ports():
+    """Test collapsing rules that differ only by destination port."""
+    rules = [make_rule(1, protocol='tcp', dst_port='80'),
+             make_rule(2, protocol='tcp', dst_port='443'),
+             make_rule(3, protocol='tcp', dst_port='8080-8090')]
+
+    model, report = RuleOptimizer().optimize(rules)
+
+    assert [rule.expr for rule in model.rules()] == [
+        "meta l4proto tcp tcp dport { 80, 443, 8080-8090 } counter accept"
+    ]
+    assert report.collapsed == 2
+
+
+def test_optimize_keeps_first_match_order():
+    """Test that a rule is not moved past an overlapping rule with another verdict."""
+    rules = [make_rule(1, action='drop', protocol='tcp', src_ip='10.0.0.1', dst_port='22'),
+             make_rule(2, action='accept', protocol='tcp', src_ip='10.0.0.0/24', dst_port='22'),
+             make_rule(3, action='drop', protocol='tcp', src_ip='10.0.0.2', dst_port='22')]
+
+    model, report = RuleOptimizer().optimize(rules)
+
+    assert [rule.rule_id for rule in model.chains['input']] == [1, 2, 3]
+    assert report.collapsed == 0
+
+
+def test_optimize_moves_past_disjoint_rule():
+    """Test that a rule may move past a non-overlapping rule with another verdict."""
+    rules = [make_rule(1, action='drop', protocol='tcp', src_ip='10.0.0.1', dst_port='22'),
+             make_rule(2, action='accept', protocol='udp', dst_port='53'),
+             make_rule(3, action='drop', protocol='tcp', src_ip='10.0.0.2', dst_port='22')]
+
+    model, report = RuleOptimizer().optimize(rules)
+
+    assert [rule.rule_id for rule in model.chains['input']] == [1, 2]
+    assert model.chains['input'][0].expr.startswith("ip saddr { 10.0.0.1, 10.0.0.2 }")
+    assert report.collapsed == 1
+
+
+def test_compiler_optimize_flag():
+    """Test that the compiler uses the optimizer when asked to."""
+    rules = [make_rule(1, dst_ip='192.168.1.1'), make_rule(2, dst_ip='192.168.1.2'),
+             make_rule(3, dst_ip='192.168.1.3', enabled=False)]
+
+    assert len(RulesetCompiler().compile(rules)) == 2
+
+    compiler = RulesetCompiler(optimize=True)
+    model = compiler.compile(rules)
+    assert [rule.expr for rule in model.rules()] == ["ip daddr { 192.168.1.1, 192.168.1.2 } counter accept"]
+    assert compiler.last_report.collapsed == 1
@@ -0,0 +1,129 @@
+"""
+Tests for the ruleset compiler module.
+"""
+
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from charon.src.core.nft_backend import MockBackend
+from charon.src.core.packet_filter import PacketFilter
+from charon.src.core.ruleset_compiler import RuleOperation, RulesetCompiler
+
+
+def make_rule(rule_id, chain='input', action='accept', protocol=None, src_ip=None,
+              dst_ip=None, src_port=None, dst_port=None, enabled=True):
+    """Create an object with the attributes of a FirewallRule row."""
+    return SimpleNamespace(id=rule_id, chain=chain, action=action, protocol=protocol,
+                           src_ip=src_ip, dst_ip=dst_ip, src_port=src_port,
+                           dst_port=dst_port, enabled=enabled)
+
+
+def live_json(compiled_rules, extra=()):
+    """Build `nft --json list table` output for the given compiled rules."""
+    items = [{"metainfo": {"json_schema_version": 1}}, {"table": {"family": "inet", "name": "charon"}}]
+    for handle, rule in compiled_rules:
+        items.append({"rule": {"family": "inet", "table": "charon", "chain": rule.chain,
+                               "handle": handle, "comment": rule.comment, "expr": []}})
+    items.extend(extra)
+    return json.dumps({"nftables": items})
+
+
+def test_compile_rule():
+    """Test compiling database rows into nftables syntax."""
+    compiler = RulesetCompiler()
+
+    rule = compiler.compile_rule(make_rule(1, 'INPUT', 'ACCEPT', 'TCP', src_ip='10.0.0.0/24', dst_port='22'))
+    assert rule.chain == 'input'
+    assert rule.expr == "ip saddr 10.0.0.0/24 meta l4proto tcp tcp dport 22 counter accept"
+    assert rule.text().endswith(f'comment "charon:1:{rule.digest}"')
+
+    rule = compiler.compile_rule(make_rule(2, action='drop', dst_ip='2001:db8::1', dst_port='80,443'))
+    assert rule.expr == "ip6 daddr 2001:db8::1 meta l4proto { tcp, udp } th dport { 80, 443 } counter drop"
+
+    # Invalid rows are skipped rather than producing a broken ruleset
+    assert compiler.compile_rule(make_rule(3, src_ip='not-an-ip')) is None
+    assert compiler.compile_rule(make_rule(4, dst_port='22; flush ruleset')) is None
+    assert compiler.compile_rule(make_rule(5, chain='prerouting')) is None
+
+
+def test_compile_skips_disabled_rules():
+    """Test that only enabled rules end up in the model."""
+    model = RulesetCompiler().compile([make_rule(2), make_rule(1), make_rule(3, enabled=False)])
+    assert [rule.rule_id for rule in model.chains['input']] == [1, 2]
+    assert len(model) == 2
+
+
+def test_diff_emits_minimal_operations():
+    """Test that only changed rules produce operations."""
+    compiler = RulesetCompiler()
+    rules = [make_rule(1, dst_port='22'), make_rule(2, dst_port='80'), make_rule(3, dst_port='443')]
+    old = compiler.compile(rules)
+    unmanaged = {"rule": {"family": "inet", "table": "charon", "chain": "input", "handle": 2,
+                          "comment": "Allow established", "expr": []}}
+    live = live_json([(10, old.chains['input'][0]), (11, old.chains['input'][1]),
+                      (12, old.chains['input'][2])], [unmanaged])
+
+    # No changes
+    assert compiler.diff(old, live) == []
+
+    # Change rule 2, delete rule 3, add rule 4
+    rules[1].dst_port = '8080'
+    new = compiler.compile([rules[0], rules[1], make_rule(4, dst_port='53')])
+    operations = compiler.diff(new, live)
+
+    assert [(op.kind, op.handle) for op in operations] == [
+        (RuleOperation.DELETE, 12),
+        (RuleOperation.REPLACE, 11),
+        (RuleOperation.ADD, 11),
+    ]
+    assert operations[2].rule.rule_id == 4
+
+
+def test_diff_keeps_rule_order():
+    """Test that added rules are positioned next to surviving neighbours."""
+    compiler = RulesetCompiler()
+    rules = [make_rule(i, dst_port=str(1000 + i)) for i in range(1, 6)]
+    model = compiler.compile(rules)
+    compiled = {rule.rule_id: rule for rule in model.rules()}
+    live = live_json([(20, compiled[3])])
+
+    operations = compiler.diff(model, live)
+    assert [(op.kind, op.rule.rule_id, op.handle) for op in operations] == [
+        (RuleOperation.INSERT, 1, 20),
+        (RuleOperation.INSERT, 2, 20),
+        # Each "add after 20" lands directly after 20, so they are emitted in reverse
+        (RuleOperation.ADD, 5, 20),
+        (RuleOperation.ADD, 4, 20),
+    ]
+
+
+def test_sync_applies_one_transaction():
+    """Test synchronizing through the packet filter backend."""
+    compiler = RulesetCompiler()
+    rules = [make_rule(1, dst_port='22'), make_rule(2, chain='forward', action='drop')]
+    backend = MockBackend(responses={"list table": live_json([])})
+    pf = PacketFilter("charon", backend=backend)
+
+    success, operations = compiler.sync(pf, rules)
+    assert success is True
+    assert len(operations) == 2
+
+    kind, script = backend.commands[-1]
+    assert kind == "script"
+    lines = sorted(script.splitlines())
+    assert lines[0].startswith("add rule inet charon forward counter drop")
+    assert lines[1].startswith("add rule inet charon input meta l4proto { tcp, udp } th dport 22 counter accept")
+
+
+def test_sync_bootstraps_missing_table():
+    """Test that a missing table is created in the same transaction."""
+    backend = MockBackend(fail_on="list table")
+    pf = PacketFilter("charon", backend=backend)
+
+    success, _ = RulesetCompiler().sync(pf, [make_rule(1)])
+    assert success is True
+    script = backend.commands[-1][1]
+    assert script.startswith("add table inet charon")
+    assert "add rule inet charon input counter accept" in script
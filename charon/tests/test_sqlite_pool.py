@@ -0,0 +1,83 @@
+"""
+Tests for the SQLite connection pool module.
+"""
+
+import os
+import sqlite3
+import tempfile
+import threading
+
+import pytest
+
+from charon.src.core.sqlite_pool import SQLitePool
+
+
+def test_connection_per_thread():
+    """Test that each thread reuses its own tuned connection."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        pool = SQLitePool(os.path.join(temp_dir, 'sub', 'test.db'))
+        conn = pool.connection()
+        assert pool.connection() is conn
+        assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        assert conn.execute('PRAGMA synchronous').fetchone()[0] == 1  # NORMAL
+
+        others = []
+        thread = threading.Thread(target=lambda: others.append(pool.connection()))
+        thread.start()
+        thread.join()
+        assert others[0] is not conn
+        assert pool.stats() == {'connections': 2}
+
+        # The connection of the finished thread is closed by the next new thread
+        thread = threading.Thread(target=pool.connection)
+        thread.start()
+        thread.join()
+        with pytest.raises(sqlite3.ProgrammingError):
+            others[0].execute('SELECT 1')
+
+        pool.close()
+        with pytest.raises(sqlite3.ProgrammingError):
+            conn.execute('SELECT 1')
+        assert pool.connection() is not conn
+        pool.close()
+
+
+def test_stale_transaction_rolled_back():
+    """Test that a transaction left open by a failed call is rolled back."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        pool = SQLitePool(os.path.join(temp_dir, 'test.db'))
+        conn = pool.connection()
+        conn.execute('CREATE TABLE t (x INTEGER)')
+        conn.execute('INSERT INTO t VALUES (1)')
+        assert conn.in_transaction
+
+        conn = pool.connection()
+        assert not conn.in_transaction
+        assert conn.execute('SELECT COUNT(*) FROM t').fetchone()[0] == 0
+        pool.close()
+
+
+def test_transaction():
+    """Test that transactions commit or roll back and are not reset from inside."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        pool = SQLitePool(os.path.join(temp_dir, 'test.db'))
+        with pool.transaction() as conn:
+            conn.execute('CREATE TABLE t (x INTEGER)')
+            conn.execute('INSERT INTO t VALUES (1)')
+        assert not conn.in_transaction and conn.isolation_level == ''
+
+        with pytest.raises(ValueError):
+            with pool.transaction() as conn:
+                conn.execute('INSERT INTO t VALUES (2)')
+                raise ValueError
+        assert conn.execute('SELECT x FROM t').fetchall() == [(1,)]
+
+        # A call made inside the transaction, e.g. by a callback, fails and leaves it open
+        with pool.transaction() as conn:
+            conn.execute('INSERT INTO t VALUES (3)')
+            with pytest.raises(sqlite3.ProgrammingError):
+                pool.connection()
+            assert conn.in_transaction
+        assert conn.execute('SELECT x FROM t').fetchall() == [(1,), (3,)]
+        assert pool.connection() is conn
+        pool.close()
@@ -0,0 +1,80 @@
+"""
+Tests for the streaming syslog reader.
+"""
+
+import json
+import os
+
+from charon.src.core.syslog_reader import SyslogReader
+
+
+def firewall_line(i):
+    """A kernel LOG line; every third one is an accept."""
+    action = 'ACCEPT' if i % 3 == 0 else 'DROP'
+    return (f"Oct 17 10:{i // 60 % 60:02d}:{i % 60:02d} gw kernel: charon {action} "
+            f"IN=eth0 OUT= SRC=10.0.0.{i % 250} n={i}")
+
+
+def write_log(path, start, count, mode='a'):
+    """Write firewall lines start..start+count-1, each followed by an unrelated line."""
+    with open(path, mode) as f:
+        for i in range(start, start + count):
+            f.write(firewall_line(i) + '\n')
+            f.write(f"Oct 17 10:00:00 gw cron[{i}]: job done\n")
+
+
+def expected(start, count, log_type=None):
+    """The firewall lines start..start+count-1, newest first."""
+    lines = [firewall_line(i) for i in reversed(range(start, start + count))]
+    if log_type == 'error':
+        return [line for line in lines if 'DROP' in line]
+    if log_type == 'info':
+        return [line for line in lines if 'ACCEPT' in line]
+    return lines
+
+
+def test_pages(tmp_path):
+    """Test that pages are read newest first, by log type, and deep pages start at checkpoints."""
+    path = str(tmp_path / 'syslog')
+    write_log(path, 0, 500)
+    reader = SyslogReader(str(tmp_path / 'index.json'), block_size=512, checkpoint_every=50)
+
+    assert reader.page(path, 0, 10) == expected(0, 500)[:10]
+    assert reader.page(path, 480, 50) == expected(0, 500)[480:]
+    assert reader.page(path, 600, 10) == []
+    assert reader.page(path, 100, 20, 'info') == expected(0, 500, 'info')[100:120]
+    assert reader.count(path, 'error') == len(expected(0, 500, 'error'))
+
+    # The checkpoints are saved and used after a restart
+    with open(tmp_path / 'index.json') as f:
+        entries = json.load(f)
+    assert len(entries) == 3
+    assert max(len(entry['checkpoints']) for entry in entries.values()) == 9
+    reader = SyslogReader(str(tmp_path / 'index.json'), block_size=512, checkpoint_every=50)
+    assert reader.page(path, 251, 5) == expected(0, 500)[251:256]
+
+
+def test_growth_and_rotation(tmp_path):
+    """Test that appended lines shift the pages and pages continue into rotated files."""
+    path = str(tmp_path / 'syslog')
+    write_log(path, 0, 300)
+    reader = SyslogReader(str(tmp_path / 'index.json'), block_size=256, checkpoint_every=20)
+    assert reader.page(path, 250, 10) == expected(0, 300)[250:260]
+
+    # A partly written line is left for later
+    write_log(path, 300, 40)
+    with open(path, 'a') as f:
+        f.write("Oct 17 11:00:00 gw kernel: charon DROP IN=eth0")
+    assert reader.page(path, 0, 5) == expected(0, 340)[:5]
+    assert reader.page(path, 285, 10) == expected(0, 340)[285:295]
+    assert reader.count(path) == 340
+
+    # Rotation by renaming keeps the index of the old file
+    os.rename(path, path + '.1')
+    write_log(path, 1000, 30, mode='w')
+    assert reader.page(path, 25, 10) == expected(1000, 30)[25:] + expected(0, 340)[:5]
+    assert reader.page(path, 360, 20) == expected(0, 340)[330:]
+
+    # A truncated file is indexed anew
+    write_log(path, 2000, 3, mode='w')
+    assert reader.page(path, 0, 5) == expected(2000, 3) + expected(0, 340)[:2]